@@ -20,6 +20,7 @@ from typing import (
     DefaultDict,
     Deque,
     Dict,
+    Iterable,
     List,
     Optional,
     Sequence,
@@ -29,6 +30,7 @@ from typing import (
 
 import yaml
 from six import binary_type, iteritems, text_type
+from six.moves.urllib.parse import urlparse
 
 from ..config import is_affirmative
 from ..constants import ServiceCheck
@@ -156,6 +158,12 @@ class AgentCheck(object):
     # See https://github.com/DataDog/integrations-core/pull/2093 for more information.
     DEFAULT_METRIC_LIMIT = 0
 
+    # The maximum number of distinct tuples of tags for which normalized tags are kept, see `_normalize_tag_set`
+    TAG_SET_CACHE_SIZE = 1000
+
+    # The maximum number of metric names for which the namespaced name is kept, see `_format_namespace`
+    NAMESPACED_NAME_CACHE_SIZE = 10000
+
     def __init__(self, *args, **kwargs):
         # type: (*Any, **Any) -> None
         """
@@ -255,6 +263,12 @@ class AgentCheck(object):
         # Setup metric limits
         self.metric_limiter = self._get_metric_limiter(self.name, instance=self.instance)
 
+        # Normalized tags and their hash keyed by the identity of the submitted tuple of tags
+        self._tag_set_cache = {}  # type: Dict[int, Tuple[Tuple[Any, ...], List[str], int]]
+
+        # Namespaced metric names keyed by the namespace and then the name
+        self._namespaced_names = {}  # type: Dict[str, Dict[Any, str]]
+
         # Functions that will be called exactly once (if successful) before the first check run
         self.check_initializations = deque([self.send_config_metadata])  # type: Deque[Callable[[], None]]
 
@@ -319,9 +333,20 @@ class AgentCheck(object):
         """
         if not hasattr(self, '_http'):
             self._http = RequestsWrapper(self.instance or {}, self.init_config, self.HTTP_CONFIG_REMAPPER, self.log)
+            if is_affirmative((self.instance or {}).get('telemetry', False)):
+                self._http.request_timing_callback = self._submit_http_request_timing
 
         return self._http
 
+    def _submit_http_request_timing(self, method, url, elapsed):
+        # type: (str, str, float) -> None
+        """
+        Submit the duration of a request sent with `http` when the `telemetry` option is enabled.
+        """
+        tags = ['http_method:{}'.format(method), 'http_host:{}'.format(urlparse(url).hostname)]
+        tags.extend((self.instance or {}).get('tags') or [])
+        self.histogram('telemetry.http.request.duration', elapsed, tags=tags)
+
     def get_tls_context(self, refresh=False, overrides=None):
         # type: (bool, Dict[AnyStr, Any]) -> ssl.SSLContext
         """
@@ -402,9 +427,12 @@ class AgentCheck(object):
         else:
             return sanitizer.sanitize(text)
 
-    def _context_uid(self, mtype, name, tags=None, hostname=None):
-        # type: (int, str, Sequence[str], str) -> str
-        return '{}-{}-{}-{}'.format(mtype, name, tags if tags is None else hash(frozenset(tags)), hostname)
+    def _context_uid(self, mtype, name, tags=None, hostname=None, tags_hash=None):
+        # type: (int, str, Sequence[str], str, int) -> str
+        if tags is not None and tags_hash is None:
+            tags_hash = hash(frozenset(tags))
+
+        return '{}-{}-{}-{}'.format(mtype, name, tags_hash, hostname)
 
     def submit_histogram_bucket(self, name, value, lower_bound, upper_bound, monotonic, hostname, tags, raw=False):
         # type: (str, float, int, int, bool, str, Sequence[str], bool) -> None
@@ -424,7 +452,11 @@ class AgentCheck(object):
             self.warning(err_msg)
             return
 
-        tags = self._normalize_tags_type(tags, metric_name=name)
+        if tags.__class__ is tuple:
+            tags = self._normalize_tag_set(tags, metric_name=name)[0]
+        else:
+            tags = self._normalize_tags_type(tags, metric_name=name)
+
         if hostname is None:
             hostname = ''
 
@@ -448,7 +480,12 @@ class AgentCheck(object):
             # ignore metric sample
             return
 
-        tags = self._normalize_tags_type(tags or [], device_name, name)
+        if device_name is None and tags.__class__ is tuple:
+            tags, tags_hash = self._normalize_tag_set(tags, metric_name=name)
+        else:
+            tags = self._normalize_tags_type(tags or [], device_name, name)
+            tags_hash = None
+
         if hostname is None:
             hostname = ''
 
@@ -459,7 +496,7 @@ class AgentCheck(object):
                     return
             else:
                 # Other metric types have a legit use case for several calls per set of tags, track unique sets of tags
-                context = self._context_uid(mtype, name, tags, hostname)
+                context = self._context_uid(mtype, name, tags, hostname, tags_hash)
                 if self.metric_limiter.is_reached(context):
                     return
 
@@ -478,6 +515,22 @@ class AgentCheck(object):
             self, self.check_id, mtype, self._format_namespace(name, raw), value, tags, hostname, flush_first_value
         )
 
+    def submit_metrics(self, batch, raw=False):
+        # type: (Iterable[Tuple[int, str, float, Sequence[str], str]], bool) -> None
+        """Sample many metrics at once.
+
+        Passing the same tuple of tags for many rows allows for the tags to be normalized only once.
+
+        **Parameters:**
+
+        - **batch** (_Iterable[tuple]_) - rows of `(mtype, name, value, tags, hostname)` where `mtype` is
+            one of the metric types of the `aggregator` module e.g. `aggregator.GAUGE`
+        - **raw** (_bool_) - whether to ignore any defined namespace prefix
+        """
+        submit_metric = self._submit_metric
+        for mtype, name, value, tags, hostname in batch:
+            submit_metric(mtype, name, value, tags=tags, hostname=hostname, raw=raw)
+
     def gauge(self, name, value, tags=None, hostname=None, device_name=None, raw=False):
         # type: (str, float, Sequence[str], str, str, bool) -> None
         """Sample a gauge metric.
@@ -818,7 +871,20 @@ class AgentCheck(object):
     def _format_namespace(self, s, raw=False):
         # type: (str, bool) -> str
         if not raw and self.__NAMESPACE__:
-            return '{}.{}'.format(self.__NAMESPACE__, to_native_string(s))
+            namespace = self.__NAMESPACE__
+            namespaced_names = self._namespaced_names.get(namespace)
+            if namespaced_names is None:
+                namespaced_names = self._namespaced_names[namespace] = {}
+            else:
+                namespaced_name = namespaced_names.get(s)
+                if namespaced_name is not None:
+                    return namespaced_name
+
+            if len(namespaced_names) >= self.NAMESPACED_NAME_CACHE_SIZE:
+                namespaced_names.clear()
+
+            namespaced_name = namespaced_names[s] = '{}.{}'.format(namespace, to_native_string(s))
+            return namespaced_name
 
         return to_native_string(s)
 
@@ -960,6 +1026,26 @@ class AgentCheck(object):
 
         aggregator.submit_event(self, self.check_id, event)
 
+    def _normalize_tag_set(self, tags, metric_name=None):
+        # type: (Tuple[Union[None, str, bytes], ...], str) -> Tuple[List[str], int]
+        """
+        Normalize an immutable set of tags only once per check instance:
+        - returns the normalized tags, which must not be mutated, and their hash
+        - tuples are cached by identity so passing the same tuple is cheap
+        """
+        tag_set_id = id(tags)
+        tag_set = self._tag_set_cache.get(tag_set_id)
+        if tag_set is None:
+            if len(self._tag_set_cache) >= self.TAG_SET_CACHE_SIZE:
+                self._tag_set_cache.clear()
+
+            normalized_tags = self._normalize_tags_type(tags, metric_name=metric_name)
+
+            # Hold a reference to the tuple so that its identity cannot be reused by another object
+            tag_set = self._tag_set_cache[tag_set_id] = (tags, normalized_tags, hash(frozenset(normalized_tags)))
+
+        return tag_set[1], tag_set[2]
+
     def _normalize_tags_type(self, tags, device_name=None, metric_name=None):
         # type: (Sequence[Union[None, str, bytes]], str, str) -> List[str]
         """
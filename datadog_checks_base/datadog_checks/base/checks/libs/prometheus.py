@@ -4,6 +4,13 @@
 
 from prometheus_client.metrics_core import Metric
 from prometheus_client.parser import _parse_sample, _replace_help_escaping
+from prometheus_client.samples import Sample
+from prometheus_client.utils import floatToGoString
+
+from ...utils.prometheus.functions import parse_metric_family_stream
+
+# Indexed by the values of the `MetricType` enum of the protobuf format
+PROTOBUF_METRIC_TYPES = ('counter', 'gauge', 'summary', 'untyped', 'histogram')
 
 
 # This copies most of the code from upstream at that version:
@@ -89,3 +96,76 @@ def text_fd_to_metric_families(fd):
 
     if name != '':
         yield build_metric(name, documentation, typ, samples)
+
+
+def protobuf_fd_to_metric_families(chunks, munge_counters=False):
+    """Parse Prometheus protobuf format from an iterable of binary chunks.
+
+    The metrics have the same samples as if they were parsed from the text format: by `text_fd_to_metric_families`,
+    or by upstream when `munge_counters` is set.
+
+    Yields Metric's.
+    """
+    for message in parse_metric_family_stream(chunks):
+        name = message.name
+        typ = PROTOBUF_METRIC_TYPES[message.type]
+        samples = []
+
+        if typ == 'counter':
+            if munge_counters and name.endswith('_total'):
+                sample_name = name
+                name = name[:-6]
+            else:
+                sample_name = name + '_total' if munge_counters else name
+
+            for metric in message.metric:
+                samples.append(Sample(sample_name, _labels(metric), metric.counter.value, _timestamp(metric)))
+        elif typ == 'gauge':
+            for metric in message.metric:
+                samples.append(Sample(name, _labels(metric), metric.gauge.value, _timestamp(metric)))
+        elif typ == 'untyped':
+            for metric in message.metric:
+                samples.append(Sample(name, _labels(metric), metric.untyped.value, _timestamp(metric)))
+        elif typ == 'summary':
+            for metric in message.metric:
+                timestamp = _timestamp(metric)
+                summary = metric.summary
+                for quantile in summary.quantile:
+                    labels = _labels(metric)
+                    labels['quantile'] = floatToGoString(quantile.quantile)
+                    samples.append(Sample(name, labels, quantile.value, timestamp))
+
+                samples.append(Sample(name + '_sum', _labels(metric), summary.sample_sum, timestamp))
+                samples.append(Sample(name + '_count', _labels(metric), float(summary.sample_count), timestamp))
+        else:
+            for metric in message.metric:
+                timestamp = _timestamp(metric)
+                histogram = metric.histogram
+                upper_bound = None
+                for bucket in histogram.bucket:
+                    upper_bound = floatToGoString(bucket.upper_bound)
+                    labels = _labels(metric)
+                    labels['le'] = upper_bound
+                    samples.append(Sample(name + '_bucket', labels, float(bucket.cumulative_count), timestamp))
+
+                # The `+Inf` bucket is implicit in the protobuf format
+                if upper_bound != '+Inf':
+                    labels = _labels(metric)
+                    labels['le'] = '+Inf'
+                    samples.append(Sample(name + '_bucket', labels, float(histogram.sample_count), timestamp))
+
+                samples.append(Sample(name + '_sum', _labels(metric), histogram.sample_sum, timestamp))
+                samples.append(Sample(name + '_count', _labels(metric), float(histogram.sample_count), timestamp))
+
+        metric = Metric(name, message.help, typ)
+        metric.samples = samples
+        yield metric
+
+
+def _labels(metric):
+    return {label.name: label.value for label in metric.label}
+
+
+def _timestamp(metric):
+    if metric.timestamp_ms:
+        return metric.timestamp_ms / 1000.0
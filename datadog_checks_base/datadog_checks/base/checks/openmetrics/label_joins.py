@@ -0,0 +1,117 @@
+# (C) Datadog, Inc. 2020-present
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+from six import iteritems
+from six.moves import intern
+
+
+class LabelJoinIndex(object):
+    """
+    Labels of the `label_joins` target metrics, indexed by the values of the labels they are matched on.
+
+    Target metrics matched on the same labels share a table: {labels to match: {label values: entry}}, where an
+    entry is `[generation, labels to join]`. Entries are updated in place as the objects are seen again, and
+    entries that weren't stored during the last scrape are evicted, so that their objects stop being joined.
+
+    Label names and values are interned, as the same values (nodes, namespaces...) are joined to many objects.
+    """
+
+    def __init__(self, label_joins):
+        # {target metric: (labels to match, labels to get or None to get all of them)}
+        self.joins = {}
+        self.tables = {}
+        for metric_name, join in iteritems(label_joins):
+            labels_to_match = join.get('labels_to_match') or join.get('label_to_match') or []
+            if not isinstance(labels_to_match, list):
+                labels_to_match = [labels_to_match]
+            if not labels_to_match:
+                continue
+            # A wildcard matches every sample
+            labels_to_match = () if '*' in labels_to_match else tuple(sorted(labels_to_match))
+            labels_to_get = join.get('labels_to_get', [])
+            self.joins[metric_name] = (labels_to_match, None if '*' in labels_to_get else tuple(labels_to_get))
+            self.tables.setdefault(labels_to_match, {})
+        self.table_items = list(iteritems(self.tables))
+        self.generation = 0
+        # Number of entries stored during the current scrape, by table
+        self._stored = dict.fromkeys(self.tables, 0)
+
+    def store(self, metric, sample_labels_index, sample_value_index):
+        labels_to_match, labels_to_get = self.joins[metric.name]
+        table = self.tables[labels_to_match]
+        generation = self.generation
+        stored = 0
+        for sample in metric.samples:
+            # metadata-only metrics that are used for label joins are always equal to 1
+            # this is required for metrics where all combinations of a state are sent
+            # but only the active one is set to 1 (others are set to 0)
+            # example: kube_pod_status_phase in kube-state-metrics
+            if sample[sample_value_index] != 1:
+                continue
+
+            sample_labels = sample[sample_labels_index]
+            key = self._key(labels_to_match, sample_labels)
+            if key is None:
+                continue
+
+            entry = table.get(key)
+            if entry is None:
+                entry = table[tuple(_intern(value) for value in key)] = [generation, {}]
+                stored += 1
+            elif entry[0] != generation:
+                entry[0] = generation
+                stored += 1
+
+            labels = entry[1]
+            if labels_to_get is None:
+                for label_name, label_value in iteritems(sample_labels):
+                    if label_name not in labels_to_match and labels.get(label_name) != label_value:
+                        labels[_intern(label_name)] = _intern(label_value)
+            else:
+                for label_name in labels_to_get:
+                    if label_name in sample_labels:
+                        label_value = sample_labels[label_name]
+                        if labels.get(label_name) != label_value:
+                            labels[_intern(label_name)] = _intern(label_value)
+
+        self._stored[labels_to_match] += stored
+
+    def join(self, metric, sample_labels_index):
+        for sample in metric.samples:
+            sample_labels = sample[sample_labels_index]
+            for labels_to_match, table in self.table_items:
+                key = self._key(labels_to_match, sample_labels)
+                if key is not None:
+                    entry = table.get(key)
+                    if entry is not None:
+                        sample_labels.update(entry[1])
+
+    def evict(self):
+        """Evict the entries that weren't stored during the scrape that just completed, and start a new one."""
+        generation = self.generation
+        for labels_to_match, table in self.table_items:
+            # Only look for stale entries when some entries weren't stored
+            if len(table) != self._stored[labels_to_match]:
+                stale_keys = [key for key, entry in iteritems(table) if entry[0] != generation]
+                for key in stale_keys:
+                    del table[key]
+            self._stored[labels_to_match] = 0
+        self.generation += 1
+
+    @staticmethod
+    def _key(labels_to_match, sample_labels):
+        values = []
+        for label_name in labels_to_match:
+            value = sample_labels.get(label_name)
+            if value is None:
+                return None
+            values.append(value)
+        return tuple(values)
+
+
+def _intern(value):
+    try:
+        return intern(value)
+    except TypeError:
+        # Only native strings can be interned on Python 2
+        return value
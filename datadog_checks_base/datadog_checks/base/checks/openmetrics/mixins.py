@@ -11,14 +11,16 @@ from re import compile
 
 import requests
 from prometheus_client.samples import Sample
-from six import PY3, iteritems, string_types
+from six import PY3, iteritems, itervalues, string_types
 
 from ...config import is_affirmative
 from ...errors import CheckException
 from ...utils.common import to_native_string
-from ...utils.http import RequestsWrapper
+from ...utils.http import RequestsWrapper, count_streamed_bytes
+from ...utils.prometheus.functions import PROTOBUF_ACCEPT_HEADER, is_protobuf_response
 from .. import AgentCheck
-from ..libs.prometheus import text_fd_to_metric_families
+from ..libs.prometheus import protobuf_fd_to_metric_families, text_fd_to_metric_families
+from .label_joins import LabelJoinIndex
 
 if PY3:
     long = int
@@ -140,31 +142,9 @@ class OpenMetricsScraperMixin(object):
         config['label_joins'] = default_instance.get('label_joins', {})
         config['label_joins'].update(instance.get('label_joins', {}))
 
-        # `_label_mapping` holds the additionals label info to add for a specific
-        # label value, example:
-        # self._label_mapping = {
-        #     'pod': {
-        #         'dd-agent-9s1l1': {
-        #             "node": "yolo",
-        #             "host_ip": "yey"
-        #         }
-        #     }
-        # }
-        config['_label_mapping'] = {}
-
-        # `_active_label_mapping` holds a dictionary of label values found during the run
-        # to cleanup the label_mapping of unused values, example:
-        # self._active_label_mapping = {
-        #     'pod': {
-        #         'dd-agent-9s1l1': True
-        #     }
-        # }
-        config['_active_label_mapping'] = {}
-
-        # `_watched_labels` holds the sets of labels to watch for enrichment
-        config['_watched_labels'] = {}
-
-        config['_dry_run'] = True
+        # `_label_join_index` holds the labels of the `label_joins` target metrics, indexed by the values
+        # of the labels they are matched on. It is built from `label_joins` on the first scrape.
+        config['_label_join_index'] = None
 
         # Some metrics are ignored because they are duplicates or introduce a
         # very high cardinality. Metrics included in this list will be silently
@@ -343,6 +323,12 @@ class OpenMetricsScraperMixin(object):
 
         config['telemetry'] = is_affirmative(instance.get('telemetry', default_instance.get('telemetry', False)))
 
+        # Whether or not to ask for the protobuf format, which is faster to parse, endpoints that don't support it
+        # will still answer with the text format
+        config['use_protobuf'] = is_affirmative(
+            instance.get('use_protobuf', default_instance.get('use_protobuf', False))
+        )
+
         # The metric name services use to indicate build information
         config['metadata_metric_name'] = instance.get(
             'metadata_metric_name', default_instance.get('metadata_metric_name')
@@ -393,7 +379,7 @@ class OpenMetricsScraperMixin(object):
         headers.setdefault('accept-encoding', 'gzip')
 
         # Explicitly set the content type we accept
-        headers.setdefault('accept', 'text/plain')
+        headers.setdefault('accept', PROTOBUF_ACCEPT_HEADER if scraper_config['use_protobuf'] else 'text/plain')
 
         return http_handler
 
@@ -407,15 +393,21 @@ class OpenMetricsScraperMixin(object):
     def parse_metric_family(self, response, scraper_config):
         """
         Parse the MetricFamily from a valid `requests.Response` object to provide a MetricFamily object.
-        The text format uses iter_lines() generator.
+        The text format uses iter_lines() generator, the protobuf format is decoded from iter_content() as it is
+        received.
         """
-        if response.encoding is None:
-            response.encoding = 'utf-8'
-        input_gen = response.iter_lines(chunk_size=self.REQUESTS_CHUNK_SIZE, decode_unicode=True)
-        if scraper_config['_text_filter_blacklist']:
-            input_gen = self._text_filter_input(input_gen, scraper_config)
+        if is_protobuf_response(response):
+            metric_families = protobuf_fd_to_metric_families(response.iter_content(chunk_size=self.REQUESTS_CHUNK_SIZE))
+        else:
+            if response.encoding is None:
+                response.encoding = 'utf-8'
+            input_gen = response.iter_lines(chunk_size=self.REQUESTS_CHUNK_SIZE, decode_unicode=True)
+            if scraper_config['_text_filter_blacklist']:
+                input_gen = self._text_filter_input(input_gen, scraper_config)
+
+            metric_families = text_fd_to_metric_families(input_gen)
 
-        for metric in text_fd_to_metric_families(input_gen):
+        for metric in metric_families:
             self._send_telemetry_counter(
                 self.TELEMETRY_COUNTER_METRICS_INPUT_COUNT, len(metric.samples), scraper_config
             )
@@ -461,50 +453,48 @@ class OpenMetricsScraperMixin(object):
         if scraper_config['telemetry']:
             if 'content-length' in response.headers:
                 content_len = int(response.headers['content-length'])
+                self._send_telemetry_gauge(self.TELEMETRY_GAUGE_MESSAGE_SIZE, content_len, scraper_config)
             else:
-                content_len = len(response.content)
-            self._send_telemetry_gauge(self.TELEMETRY_GAUGE_MESSAGE_SIZE, content_len, scraper_config)
+                # Count the bytes as the payload is parsed rather than loading it all at once
+                count_streamed_bytes(
+                    response,
+                    lambda content_len: self._send_telemetry_gauge(
+                        self.TELEMETRY_GAUGE_MESSAGE_SIZE, content_len, scraper_config
+                    ),
+                )
         try:
-            # no dry run if no label joins
-            if not scraper_config['label_joins']:
-                scraper_config['_dry_run'] = False
-            elif not scraper_config['_watched_labels']:
-                watched = scraper_config['_watched_labels']
-                watched['sets'] = {}
-                watched['keys'] = {}
-                watched['singles'] = set()
-                for key, val in iteritems(scraper_config['label_joins']):
-                    labels = []
-                    if 'labels_to_match' in val:
-                        labels = val['labels_to_match']
-                    elif 'label_to_match' in val:
-                        self.log.warning("`label_to_match` is being deprecated, please use `labels_to_match`")
-                        if isinstance(val['label_to_match'], list):
-                            labels = val['label_to_match']
-                        else:
-                            labels = [val['label_to_match']]
-
-                    if labels:
-                        s = frozenset(labels)
-                        watched['sets'][key] = s
-                        watched['keys'][key] = ','.join(s)
-                        if len(labels) == 1:
-                            watched['singles'].add(labels[0])
+            label_join_index = scraper_config['_label_join_index']
+            if label_join_index is None and scraper_config['label_joins']:
+                label_join_index = scraper_config['_label_join_index'] = self._create_label_join_index(scraper_config)
+
+            # On the first scrape, metrics are buffered until the labels of all the target metrics have been
+            # stored, so that they can be joined with the labels of targets that come after them in the payload
+            pending_targets = set()
+            buffered_metrics = []
+            if label_join_index is not None and not label_join_index.generation:
+                pending_targets.update(label_join_index.joins)
 
             for metric in self.parse_metric_family(response, scraper_config):
-                yield metric
-
-            # Set dry run off
-            scraper_config['_dry_run'] = False
-            # Garbage collect unused mapping and reset active labels
-            for metric, mapping in list(iteritems(scraper_config['_label_mapping'])):
-                for key in list(mapping):
-                    if (
-                        metric in scraper_config['_active_label_mapping']
-                        and key not in scraper_config['_active_label_mapping'][metric]
-                    ):
-                        del scraper_config['_label_mapping'][metric][key]
-            scraper_config['_active_label_mapping'] = {}
+                if not pending_targets:
+                    yield metric
+                    continue
+
+                if metric.name in pending_targets:
+                    self._store_labels(metric, scraper_config)
+                    pending_targets.discard(metric.name)
+
+                buffered_metrics.append(metric)
+                if not pending_targets:
+                    for buffered_metric in buffered_metrics:
+                        yield buffered_metric
+                    buffered_metrics = []
+
+            # Some target metrics were missing from the payload
+            for buffered_metric in buffered_metrics:
+                yield buffered_metric
+
+            if label_join_index is not None:
+                label_join_index.evict()
         finally:
             response.close()
 
@@ -563,102 +553,24 @@ class OpenMetricsScraperMixin(object):
                 tags.extend(extra_tags)
             self.count(metric_name_with_namespace, val, tags=tags)
 
-    def _store_labels(self, metric, scraper_config):
-        # If targeted metric, store labels
-        if metric.name not in scraper_config['label_joins']:
-            return
+    def _create_label_join_index(self, scraper_config):
+        for join in itervalues(scraper_config['label_joins']):
+            if 'labels_to_match' not in join and 'label_to_match' in join:
+                self.log.warning("`label_to_match` is being deprecated, please use `labels_to_match`")
 
-        watched = scraper_config['_watched_labels']
-        matching_labels = watched['sets'][metric.name]
-        mapping_key = watched['keys'][metric.name]
+        return LabelJoinIndex(scraper_config['label_joins'])
 
-        labels_to_get = scraper_config['label_joins'][metric.name]['labels_to_get']
-        get_all = '*' in labels_to_get
-        match_all = mapping_key == '*'
-        for sample in metric.samples:
-            # metadata-only metrics that are used for label joins are always equal to 1
-            # this is required for metrics where all combinations of a state are sent
-            # but only the active one is set to 1 (others are set to 0)
-            # example: kube_pod_status_phase in kube-state-metrics
-            if sample[self.SAMPLE_VALUE] != 1:
-                continue
-
-            sample_labels = sample[self.SAMPLE_LABELS]
-            sample_labels_keys = sample_labels.keys()
-
-            if match_all or matching_labels.issubset(sample_labels_keys):
-                label_dict = dict()
-
-                if get_all:
-                    for label_name, label_value in iteritems(sample_labels):
-                        if label_name in matching_labels:
-                            continue
-                        label_dict[label_name] = label_value
-                else:
-                    for label_name in labels_to_get:
-                        if label_name in sample_labels:
-                            label_dict[label_name] = sample_labels[label_name]
-
-                if match_all:
-                    mapping_value = '*'
-                else:
-                    mapping_value = ','.join([sample_labels[l] for l in matching_labels])
-
-                scraper_config['_label_mapping'].setdefault(mapping_key, {}).setdefault(mapping_value, {}).update(
-                    label_dict
-                )
+    def _store_labels(self, metric, scraper_config):
+        # If targeted metric, store labels
+        label_join_index = scraper_config['_label_join_index']
+        if label_join_index is not None and metric.name in label_join_index.joins:
+            label_join_index.store(metric, self.SAMPLE_LABELS, self.SAMPLE_VALUE)
 
     def _join_labels(self, metric, scraper_config):
         # Filter metric to see if we can enrich with joined labels
-        if not scraper_config['label_joins']:
-            return
-
-        label_mapping = scraper_config['_label_mapping']
-        active_label_mapping = scraper_config['_active_label_mapping']
-
-        watched = scraper_config['_watched_labels']
-        sets = watched['sets']
-        keys = watched['keys']
-        singles = watched['singles']
-
-        for sample in metric.samples:
-            sample_labels = sample[self.SAMPLE_LABELS]
-            sample_labels_keys = sample_labels.keys()
-
-            # Match with wildcard label
-            # Label names are [a-zA-Z0-9_]*, so no risk of collision
-            if '*' in singles:
-                active_label_mapping.setdefault('*', {})['*'] = True
-
-                if '*' in label_mapping and '*' in label_mapping['*']:
-                    sample_labels.update(label_mapping['*']['*'])
-
-            # Match with single labels
-            matching_single_labels = singles.intersection(sample_labels_keys)
-            for label in matching_single_labels:
-                mapping_key = label
-                mapping_value = sample_labels[label]
-
-                active_label_mapping.setdefault(mapping_key, {})[mapping_value] = True
-
-                if mapping_key in label_mapping and mapping_value in label_mapping[mapping_key]:
-                    sample_labels.update(label_mapping[mapping_key][mapping_value])
-
-            # Match with tuples of labels
-            for key, mapping_key in iteritems(keys):
-                if mapping_key in matching_single_labels:
-                    continue
-
-                matching_labels = sets[key]
-
-                if matching_labels.issubset(sample_labels_keys):
-                    matching_values = [sample_labels[l] for l in matching_labels]
-                    mapping_value = ','.join(matching_values)
-
-                    active_label_mapping.setdefault(mapping_key, {})[mapping_value] = True
-
-                    if mapping_key in label_mapping and mapping_value in label_mapping[mapping_key]:
-                        sample_labels.update(label_mapping[mapping_key][mapping_value])
+        label_join_index = scraper_config['_label_join_index']
+        if label_join_index is not None and label_join_index.table_items:
+            label_join_index.join(metric, self.SAMPLE_LABELS)
 
     def _ignore_metrics_by_label(self, scraper_config, metric_name, sample):
         ignore_metrics_by_label = scraper_config['ignore_metrics_by_labels']
@@ -718,9 +630,6 @@ class OpenMetricsScraperMixin(object):
         # Filter metric to see if we can enrich with joined labels
         self._join_labels(metric, scraper_config)
 
-        if scraper_config['_dry_run']:
-            return
-
         try:
             self.submit_openmetric(scraper_config['metrics_mapper'][metric.name], metric, scraper_config)
         except KeyError:
@@ -987,65 +896,68 @@ class OpenMetricsScraperMixin(object):
     def _decumulate_histogram_buckets(self, metric):
         """
         Decumulate buckets in a given histogram metric and adds the lower_bound label (le being upper_bound)
+
+        Buckets are grouped by context in a single pass over the samples. Exporters list the buckets of a context
+        in increasing order of upper bound, so they are only sorted when they are not.
         """
-        bucket_values_by_context_upper_bound = {}
-        for sample in metric.samples:
-            if sample[self.SAMPLE_NAME].endswith("_bucket"):
-                context_key = self._compute_bucket_hash(sample[self.SAMPLE_LABELS])
-                if context_key not in bucket_values_by_context_upper_bound:
-                    bucket_values_by_context_upper_bound[context_key] = {}
-                bucket_values_by_context_upper_bound[context_key][float(sample[self.SAMPLE_LABELS]["le"])] = sample[
-                    self.SAMPLE_VALUE
-                ]
-
-        sorted_buckets_by_context = {}
-        for context in bucket_values_by_context_upper_bound:
-            sorted_buckets_by_context[context] = sorted(bucket_values_by_context_upper_bound[context])
-
-        # Tuples (lower_bound, upper_bound, value)
-        bucket_tuples_by_context_upper_bound = {}
-        for context in sorted_buckets_by_context:
-            for i, upper_b in enumerate(sorted_buckets_by_context[context]):
-                if i == 0:
-                    if context not in bucket_tuples_by_context_upper_bound:
-                        bucket_tuples_by_context_upper_bound[context] = {}
-                    if upper_b > 0:
-                        # positive buckets start at zero
-                        bucket_tuples_by_context_upper_bound[context][upper_b] = (
-                            0,
-                            upper_b,
-                            bucket_values_by_context_upper_bound[context][upper_b],
-                        )
-                    else:
-                        # negative buckets start at -inf
-                        bucket_tuples_by_context_upper_bound[context][upper_b] = (
-                            self.MINUS_INF,
-                            upper_b,
-                            bucket_values_by_context_upper_bound[context][upper_b],
-                        )
-                    continue
-                tmp = (
-                    bucket_values_by_context_upper_bound[context][upper_b]
-                    - bucket_values_by_context_upper_bound[context][sorted_buckets_by_context[context][i - 1]]
-                )
-                bucket_tuples_by_context_upper_bound[context][upper_b] = (
-                    sorted_buckets_by_context[context][i - 1],
-                    upper_b,
-                    tmp,
-                )
+        samples = metric.samples
 
-        # modify original metric to inject lower_bound & modified value
-        for i, sample in enumerate(metric.samples):
+        # Tuples (upper_bound, sample index), by context
+        buckets_by_context = {}
+        unsorted_contexts = set()
+        for i, sample in enumerate(samples):
             if not sample[self.SAMPLE_NAME].endswith("_bucket"):
                 continue
 
-            context_key = self._compute_bucket_hash(sample[self.SAMPLE_LABELS])
-            matching_bucket_tuple = bucket_tuples_by_context_upper_bound[context_key][
-                float(sample[self.SAMPLE_LABELS]["le"])
-            ]
-            # Replacing the sample tuple
-            sample[self.SAMPLE_LABELS]["lower_bound"] = str(matching_bucket_tuple[0])
-            metric.samples[i] = Sample(sample[self.SAMPLE_NAME], sample[self.SAMPLE_LABELS], matching_bucket_tuple[2])
+            context = sample[self.SAMPLE_LABELS].copy()
+            upper_bound = float(context.pop("le"))
+            context_key = frozenset(context.items())
+
+            buckets = buckets_by_context.get(context_key)
+            if buckets is None:
+                buckets_by_context[context_key] = [(upper_bound, i)]
+            else:
+                if upper_bound <= buckets[-1][0]:
+                    unsorted_contexts.add(context_key)
+                buckets.append((upper_bound, i))
+
+        for context_key, buckets in iteritems(buckets_by_context):
+            if context_key in unsorted_contexts:
+                # The last value of duplicate buckets wins
+                bucket_values = {}
+                for upper_bound, i in buckets:
+                    bucket_values[upper_bound] = samples[i][self.SAMPLE_VALUE]
+
+                upper_bounds = sorted(bucket_values)
+                decumulated = dict(
+                    zip(upper_bounds, self._decumulate_bucket_values((b, bucket_values[b]) for b in upper_bounds))
+                )
+                bucket_tuples = [decumulated[upper_bound] for upper_bound, _ in buckets]
+            else:
+                bucket_tuples = self._decumulate_bucket_values(
+                    (upper_bound, samples[i][self.SAMPLE_VALUE]) for upper_bound, i in buckets
+                )
+
+            # modify original metric to inject lower_bound & modified value
+            for (_, i), (lower_bound, value) in zip(buckets, bucket_tuples):
+                sample = samples[i]
+                sample[self.SAMPLE_LABELS]["lower_bound"] = str(lower_bound)
+                samples[i] = Sample(sample[self.SAMPLE_NAME], sample[self.SAMPLE_LABELS], value)
+
+    def _decumulate_bucket_values(self, bucket_values):
+        """
+        Yield tuples (lower_bound, value) from tuples (upper_bound, cumulative value) sorted by upper bound
+        """
+        previous_bound = previous_value = None
+        for upper_bound, value in bucket_values:
+            if previous_bound is None:
+                # positive buckets start at zero, negative buckets start at -inf
+                yield (0 if upper_bound > 0 else self.MINUS_INF), value
+            else:
+                yield previous_bound, value - previous_value
+
+            previous_bound = upper_bound
+            previous_value = value
 
     def _submit_sample_histogram_buckets(self, metric_name, sample, scraper_config, hostname=None):
         if "lower_bound" not in sample[self.SAMPLE_LABELS] or "le" not in sample[self.SAMPLE_LABELS]:
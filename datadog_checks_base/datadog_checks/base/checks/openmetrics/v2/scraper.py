@@ -16,7 +16,9 @@ from ....config import is_affirmative
 from ....constants import ServiceCheck
 from ....errors import ConfigurationError
 from ....utils.functions import no_op, return_true
-from ....utils.http import RequestsWrapper
+from ....utils.http import RequestsWrapper, count_streamed_bytes
+from ....utils.prometheus.functions import get_protobuf_accept_header, is_protobuf_response
+from ...libs.prometheus import protobuf_fd_to_metric_families as parse_protobuf_metric_families
 from .labels import LabelAggregator, get_label_normalizer
 from .transform import MetricTransformer
 
@@ -144,6 +146,15 @@ class OpenMetricsScraper:
             if not isinstance(entry, str):
                 raise ConfigurationError(f'Entry #{i} of setting `tags` must be a string')
 
+        tag_cache_size = config.get('tag_cache_size', 50000)
+        if not isinstance(tag_cache_size, int):
+            raise ConfigurationError('Setting `tag_cache_size` must be an integer')
+
+        # Rendered tags keyed by `(label_name, label_value)`, this persists across runs
+        # since most label values are stable over time e.g. pod names and namespaces
+        self.tag_cache = {}
+        self.tag_cache_size = tag_cache_size
+
         # 16 KiB seems optimal, and is also the standard chunk size of the Bittorrent protocol:
         # https://www.bittorrent.org/beps/bep_0003.html
         self.request_size = int(float(config.get('request_size') or 16) * KIBIBYTE)
@@ -173,12 +184,20 @@ class OpenMetricsScraper:
         if is_affirmative(config.get('use_latest_spec', False)):
             self.parse_metric_families = parse_metric_families_strict
             # https://github.com/prometheus/client_python/blob/v0.9.0/prometheus_client/openmetrics/exposition.py#L7
-            self.http.options['headers'].setdefault(
-                'Accept', 'application/openmetrics-text; version=0.0.1; charset=utf-8'
-            )
+            accept_header = 'application/openmetrics-text; version=0.0.1; charset=utf-8'
         else:
             self.parse_metric_families = parse_metric_families
-            self.http.options['headers'].setdefault('Accept', 'text/plain')
+            accept_header = 'text/plain'
+
+        headers = self.http.options['headers']
+        self.use_protobuf = is_affirmative(config.get('use_protobuf', False))
+        if self.use_protobuf:
+            # Endpoints that don't support the protobuf format will still answer with the text format we can parse.
+            # An Accept header configured by the user is kept, but not the default one that accepts anything.
+            if headers.get('Accept', '*/*') == '*/*':
+                headers['Accept'] = get_protobuf_accept_header(accept_header)
+        else:
+            headers.setdefault('Accept', accept_header)
 
         # Used for monotonic counts
         self.has_successfully_executed = False
@@ -210,23 +229,44 @@ class OpenMetricsScraper:
             yield metric
 
     def parse_metrics(self):
-        line_streamer = self.stream_connection_lines()
-        if self.raw_line_filter is not None:
-            line_streamer = self.filter_connection_lines(line_streamer)
+        with self.get_connection() as connection:
+            if is_protobuf_response(connection):
+                # Counters are named like the text parsers do, with the `_total` suffix only on samples
+                metric_parser = parse_protobuf_metric_families(
+                    connection.iter_content(chunk_size=self.request_size), munge_counters=True
+                )
+            else:
+                line_streamer = self.stream_connection_lines(connection)
+                if self.raw_line_filter is not None:
+                    line_streamer = self.filter_connection_lines(line_streamer)
 
-        for metric in self.parse_metric_families(line_streamer):
-            self.submit_telemetry_number_of_total_metric_samples(metric)
+                metric_parser = self.parse_metric_families(line_streamer)
 
-            # It is critical that the prefix is removed immediately so that
-            # all other configuration may reference the trimmed metric name
-            if self.raw_metric_prefix and metric.name.startswith(self.raw_metric_prefix):
-                metric.name = metric.name[len(self.raw_metric_prefix) :]
+            for metric in metric_parser:
+                self.submit_telemetry_number_of_total_metric_samples(metric)
 
-            yield metric
+                # It is critical that the prefix is removed immediately so that
+                # all other configuration may reference the trimmed metric name
+                if self.raw_metric_prefix and metric.name.startswith(self.raw_metric_prefix):
+                    metric.name = metric.name[len(self.raw_metric_prefix) :]
+
+                yield metric
 
     def generate_sample_data(self, metric):
         label_normalizer = get_label_normalizer(metric.type)
 
+        # Bind everything used in the loop to locals as this runs for every sample
+        populate_labels = self.label_aggregator.populate
+        exclude_metrics_by_labels = self.exclude_metrics_by_labels
+        exclude_labels = self.exclude_labels
+        tag_cache = self.tag_cache
+        render_tag = self.render_tag
+        static_tags = self.tags
+        hostname_label = self.hostname_label
+        hostname_formatter = self.hostname_formatter
+        default_hostname = self.hostname
+        processed_samples = 0
+
         for sample in metric.samples:
             value = sample.value
             if isnan(value) or isinf(value):
@@ -236,38 +276,52 @@ class OpenMetricsScraper:
             tags = []
             skip_sample = False
             labels = sample.labels
-            self.label_aggregator.populate(labels)
+            populate_labels(labels)
             label_normalizer(labels)
 
             for label_name, label_value in labels.items():
-                sample_excluder = self.exclude_metrics_by_labels.get(label_name)
+                sample_excluder = exclude_metrics_by_labels.get(label_name)
                 if sample_excluder is not None and sample_excluder(label_value):
                     skip_sample = True
                     break
-                elif label_name in self.exclude_labels:
+                elif label_name in exclude_labels:
                     continue
 
-                label_name = self.rename_labels.get(label_name, label_name)
-                tags.append(f'{label_name}:{label_value}')
+                tag = tag_cache.get((label_name, label_value))
+                if tag is None:
+                    tag = render_tag(label_name, label_value)
+
+                tags.append(tag)
 
             if skip_sample:
                 continue
 
-            tags.extend(self.tags)
+            tags.extend(static_tags)
 
-            hostname = self.hostname
-            if self.hostname_label and self.hostname_label in labels:
-                hostname = labels[self.hostname_label]
-                if self.hostname_formatter is not None:
-                    hostname = self.hostname_formatter(hostname)
+            hostname = default_hostname
+            if hostname_label and hostname_label in labels:
+                hostname = labels[hostname_label]
+                if hostname_formatter is not None:
+                    hostname = hostname_formatter(hostname)
 
-            self.submit_telemetry_number_of_processed_metric_samples()
+            processed_samples += 1
             yield sample, tags, hostname
 
-    def stream_connection_lines(self):
-        with self.get_connection() as connection:
-            for line in connection.iter_lines(chunk_size=self.request_size, decode_unicode=True):
-                yield line
+        if processed_samples:
+            self.submit_telemetry_number_of_processed_metric_samples(processed_samples)
+
+    def render_tag(self, label_name, label_value):
+        if len(self.tag_cache) >= self.tag_cache_size:
+            # Start over rather than track recency, the tags in use will be repopulated on the next samples
+            self.tag_cache.clear()
+
+        tag = f'{self.rename_labels.get(label_name, label_name)}:{label_value}'
+        self.tag_cache[(label_name, label_value)] = tag
+        return tag
+
+    def stream_connection_lines(self, connection):
+        for line in connection.iter_lines(chunk_size=self.request_size, decode_unicode=True):
+            yield line
 
     def filter_connection_lines(self, line_streamer):
         for line in line_streamer:
@@ -316,8 +370,8 @@ class OpenMetricsScraper:
     def submit_telemetry_number_of_ignored_metric_samples(self, metric):
         self.count('telemetry.metrics.ignored.count', len(metric.samples), tags=self.tags)
 
-    def submit_telemetry_number_of_processed_metric_samples(self):
-        self.count('telemetry.metrics.processed.count', 1, tags=self.tags)
+    def submit_telemetry_number_of_processed_metric_samples(self, count):
+        self.count('telemetry.metrics.processed.count', count, tags=self.tags)
 
     def submit_telemetry_number_of_ignored_lines(self):
         self.count('telemetry.metrics.blacklist.count', 1, tags=self.tags)
@@ -325,11 +379,12 @@ class OpenMetricsScraper:
     def submit_telemetry_endpoint_response_size(self, response):
         content_length = response.headers.get('Content-Length')
         if content_length is not None:
-            content_length = int(content_length)
+            self.gauge('telemetry.payload.size', int(content_length), tags=self.tags)
         else:
-            content_length = len(response.content)
-
-        self.gauge('telemetry.payload.size', content_length, tags=self.tags)
+            # Count the bytes as the payload is parsed rather than loading it all at once
+            count_streamed_bytes(
+                response, lambda content_length: self.gauge('telemetry.payload.size', content_length, tags=self.tags)
+            )
 
     def __getattr__(self, name):
         # Forward all unknown attribute lookups to the check instance for access to submission methods, hostname, etc.
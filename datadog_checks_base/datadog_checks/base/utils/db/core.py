@@ -1,13 +1,18 @@
 # (C) Datadog, Inc. 2019-present
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
-from itertools import chain
-from typing import Callable, Iterable, List, Sequence, Union
+import threading
+from itertools import chain, islice, repeat
+from multiprocessing import TimeoutError as PoolTimeoutError
+from multiprocessing.pool import ThreadPool
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Union
 
 from datadog_checks.base import AgentCheck
 
 from ...config import is_affirmative
 from ..containers import iter_unique
+from ..time import get_timestamp
 from .query import Query
 from .transform import COLUMN_TRANSFORMERS, EXTRA_TRANSFORMERS
 from .utils import SUBMISSION_METHODS, create_submission_transformer
@@ -44,6 +49,12 @@ class QueryManager(object):
         queries=None,  # type: List[str]
         tags=None,  # type: List[str]
         error_handler=None,  # type: Callable[[str], str]
+        columnar=False,  # type: bool
+        block_size=1000,  # type: int
+        telemetry=False,  # type: bool
+        workers=0,  # type: int
+        executor_factory=None,  # type: Callable[[], Callable[[str], Union[Sequence, Iterable]]]
+        executor_teardown=None,  # type: Callable[[Callable[[str], Union[Sequence, Iterable]]], None]
     ):  # type: (...) -> QueryManager
         """
         - **check** (_AgentCheck_) - an instance of a Check
@@ -53,11 +64,31 @@ class QueryManager(object):
         - **tags** (_List[str]_) - a list of tags to associate with every submission
         - **error_handler** (_callable_) - a callable accepting a `str` error as its sole argument and returning
           a sanitized string, useful for scrubbing potentially sensitive information libraries emit
+        - **columnar** (_bool_) - whether to process result sets in blocks of rows one column at a time rather
+          than one row at a time, computing tags only once per distinct combination of tag column values
+        - **block_size** (_int_) - the maximum number of rows to process at once in columnar mode, if the executor
+          returns a cursor then rows will be retrieved with its `fetchmany` method
+        - **telemetry** (_bool_) - whether to submit the duration and number of rows of every query
+        - **workers** (_int_) - the number of threads with which to run queries concurrently, by default queries
+          run sequentially on the check's thread. Results are always submitted from the check's thread in the
+          order the queries are defined.
+        - **executor_factory** (_callable_) - a callable with no arguments returning an `executor`, required when
+          using `workers`. Every thread calls it on first use so that each one may use its own connection, and
+          again after a query fails since its connection may be broken.
+        - **executor_teardown** (_callable_) - a callable accepting an executor created by `executor_factory` as
+          its sole argument, used to release it (e.g. close its connection) after a query fails with it and when
+          calling `close`
         """
         self.check = check  # type: AgentCheck
         self.executor = executor  # type:  Callable[[str], Union[Sequence, Iterable]]
         self.tags = tags or []
         self.error_handler = error_handler
+        self.columnar = columnar
+        self.block_size = block_size
+        self.telemetry = telemetry
+        self.workers = workers
+        self.executor_factory = executor_factory
+        self.executor_teardown = executor_teardown
         self.queries = [Query(payload) for payload in queries or []]  # type: List[Query]
         custom_queries = list(self.check.instance.get('custom_queries', []))  # type: List[str]
         use_global_custom_queries = self.check.instance.get('use_global_custom_queries', True)  # type: str
@@ -78,6 +109,19 @@ class QueryManager(object):
             query.query_data.setdefault('name', 'custom query #{}'.format(i))
             self.queries.append(query)
 
+        if self.workers and self.executor_factory is None:
+            raise ValueError('an `executor_factory` is required when using `workers`')
+
+        # Created on first use, this runs queries when using `workers`
+        self._worker_pool = None  # type: ThreadPool
+        self._worker_state = threading.local()
+        # Every executor created by the workers, so that they may be released by `close`
+        self._worker_executors = []  # type: List[Callable[[str], Union[Sequence, Iterable]]]
+        self._worker_executors_lock = threading.Lock()
+
+        # The time at which each query that defines a `collection_interval` was last run
+        self._last_execution_times = {}  # type: Dict[int, float]
+
     def compile_queries(self):
         """This method compiles every `Query` object."""
         column_transformers = COLUMN_TRANSFORMERS.copy()
@@ -95,29 +139,253 @@ class QueryManager(object):
         logger = self.check.log
         global_tags = list(set(self.tags + (extra_tags or [])))
 
+        if self.columnar:
+            execute_query = self.execute_query_blocks
+            process_result = self.process_blocks
+        else:
+            execute_query = self.execute_query
+            process_result = self.process_rows
+
+        queries = self.get_scheduled_queries()
+
+        if self.workers:
+            pool = self.get_worker_pool()
+            pending = [
+                (query, get_timestamp(), pool.apply_async(self._execute_in_worker, (execute_query, query.query)))
+                for query in queries
+            ]
+
+            for query, start_time, async_result in pending:
+                # Time spent waiting for an available worker counts toward the timeout
+                timeout = query.timeout
+                if timeout is not None:
+                    timeout = max(timeout - (get_timestamp() - start_time), 0)
+
+                try:
+                    result = async_result.get(timeout)
+                except PoolTimeoutError:
+                    logger.error('Timed out querying %s after %s seconds', query.name, query.timeout)
+                    continue
+                except Exception as e:
+                    self.log_query_error(query.name, e)
+                    continue
+
+                self.submit_result(query, result, start_time, global_tags, process_result)
+        else:
+            for query in queries:
+                start_time = get_timestamp()
+
+                try:
+                    result = execute_query(query.query)
+                except Exception as e:
+                    self.log_query_error(query.name, e)
+                    continue
+
+                self.submit_result(query, result, start_time, global_tags, process_result)
+
+    def get_scheduled_queries(self):
+        """Return the queries that are due to run, taking into account any `collection_interval`."""
+        now = get_timestamp()
+        queries = []
+
         for query in self.queries:
-            query_name = query.name
-            query_columns = query.columns
-            query_extras = query.extras
-            query_tags = query.tags
-            num_columns = len(query_columns)
-
-            try:
-                rows = self.execute_query(query.query)
-            except Exception as e:
-                if self.error_handler:
-                    logger.error('Error querying %s: %s', query_name, self.error_handler(str(e)))
+            if query.collection_interval is not None:
+                last_execution_time = self._last_execution_times.get(id(query))
+                if last_execution_time is not None and now - last_execution_time < query.collection_interval:
+                    continue
+
+                self._last_execution_times[id(query)] = now
+
+            queries.append(query)
+
+        return queries
+
+    def get_worker_pool(self):
+        if self._worker_pool is None:
+            self._worker_pool = ThreadPool(self.workers)
+
+        return self._worker_pool
+
+    def close(self):
+        """
+        Stop any threads used to run queries and release their executors, this should be called when the check
+        is cancelled.
+        """
+        if self._worker_pool is not None:
+            # Queries cannot be interrupted so there is no point in waiting for them
+            self._worker_pool.terminate()
+            self._worker_pool = None
+
+        with self._worker_executors_lock:
+            executors = self._worker_executors
+            self._worker_executors = []
+
+        for executor in executors:
+            self._teardown_executor(executor)
+
+    def _execute_in_worker(self, execute_query, query):
+        # Errors, including those creating the executor, are raised to `execute` for this query only
+        executor = getattr(self._worker_state, 'executor', None)
+        if executor is None:
+            executor = self._worker_state.executor = self.executor_factory()
+            with self._worker_executors_lock:
+                self._worker_executors.append(executor)
+
+        try:
+            # The entire result set must be retrieved by the worker that owns the connection
+            return list(execute_query(query, executor=executor))
+        except Exception:
+            # Start over with a new executor on the next query
+            self._worker_state.executor = None
+            with self._worker_executors_lock:
+                # It may have already been released by `close`
+                released = not any(executor is e for e in self._worker_executors)
+                self._worker_executors = [e for e in self._worker_executors if e is not executor]
+
+            if not released:
+                self._teardown_executor(executor)
+            raise
+
+    def _teardown_executor(self, executor):
+        if self.executor_teardown is None:
+            return
+
+        try:
+            self.executor_teardown(executor)
+        except Exception as e:
+            self.check.log.debug('Error releasing query executor: %s', e)
+
+    def submit_result(self, query, result, start_time, global_tags, process_result):
+        num_rows = process_result(query, result, global_tags)
+
+        if self.telemetry:
+            self.submit_telemetry(query.name, get_timestamp() - start_time, num_rows, global_tags)
+
+    def log_query_error(self, query_name, error):
+        if self.error_handler:
+            self.check.log.error('Error querying %s: %s', query_name, self.error_handler(str(error)))
+        else:
+            self.check.log.error('Error querying %s: %s', query_name, error)
+
+    def process_rows(self, query, rows, global_tags):
+        """
+        Called by `execute`, this submits everything from the result set one row at a time and
+        returns the number of rows.
+        """
+        logger = self.check.log
+        query_name = query.name
+        query_columns = query.columns
+        query_extras = query.extras
+        query_tags = query.tags
+        num_columns = len(query_columns)
+        num_rows = 0
+
+        for row in rows:
+            num_rows += 1
+
+            if not row:
+                logger.debug('Query %s returned an empty result', query_name)
+                continue
+
+            if num_columns != len(row):
+                logger.error(
+                    'Query %s expected %d column%s, got %d',
+                    query_name,
+                    num_columns,
+                    's' if num_columns > 1 else '',
+                    len(row),
+                )
+                continue
+
+            sources = {}
+            submission_queue = []
+
+            tags = list(global_tags)
+            tags.extend(query_tags)
+
+            for (column_name, transformer), value in zip(query_columns, row):
+                # Columns can be ignored via configuration
+                if not column_name:
+                    continue
+
+                sources[column_name] = value
+
+                column_type, transformer = transformer
+
+                # The transformer can be None for `source` types. Those such columns do not submit
+                # anything but are collected into the row values for other columns to reference.
+                if transformer is None:
+                    continue
+                elif column_type == 'tag':
+                    tags.append(transformer(None, value))
+                elif column_type == 'tag_list':
+                    tags.extend(transformer(None, value))
                 else:
-                    logger.error('Error querying %s: %s', query_name, e)
+                    submission_queue.append((transformer, value))
+
+            for transformer, value in submission_queue:
+                transformer(sources, value, tags=tags)
 
+            for name, transformer in query_extras:
+                try:
+                    result = transformer(sources, tags=tags)
+                except Exception as e:
+                    logger.error('Error transforming %s: %s', name, e)
+                    continue
+                else:
+                    if result is not None:
+                        sources[name] = result
+
+        return num_rows
+
+    def process_blocks(self, query, blocks, global_tags):
+        """
+        Called by `execute` in columnar mode, this submits everything from the result set one block of rows
+        at a time and returns the number of rows. Every block is transposed so transformers are applied
+        to entire columns.
+        """
+        logger = self.check.log
+        query_name = query.name
+        query_extras = query.extras
+        num_columns = len(query.columns)
+        num_rows = 0
+
+        source_columns = []
+        tag_columns = []
+        submission_columns = []
+        for i, (column_name, transformer) in enumerate(query.columns):
+            # Columns can be ignored via configuration
+            if not column_name:
+                continue
+
+            source_columns.append((i, column_name))
+            column_type, transformer = transformer
+
+            # The transformer can be None for `source` types
+            if transformer is None:
                 continue
+            elif column_type in ('tag', 'tag_list'):
+                tag_columns.append((i, column_type, transformer))
+            else:
+                submission_columns.append((i, transformer))
+
+        base_tags = list(global_tags)
+        base_tags.extend(query.tags)
 
-            for row in rows:
+        # Tuples of tags keyed by the values of every tag column, this
+        # also lets the check normalize each distinct set of tags only once
+        tag_sets = {}
+        get_tag_values = itemgetter(*[i for i, _, _ in tag_columns]) if tag_columns else None
+        static_tags = tuple(base_tags)
+
+        for block in blocks:
+            num_rows += len(block)
+
+            rows = []
+            for row in block:
                 if not row:
                     logger.debug('Query %s returned an empty result', query_name)
-                    continue
-
-                if num_columns != len(row):
+                elif num_columns != len(row):
                     logger.error(
                         'Query %s expected %d column%s, got %d',
                         query_name,
@@ -125,38 +393,53 @@ class QueryManager(object):
                         's' if num_columns > 1 else '',
                         len(row),
                     )
-                    continue
+                else:
+                    rows.append(row)
 
-                sources = {}
-                submission_queue = []
+            if not rows:
+                continue
 
-                tags = list(global_tags)
-                tags.extend(query_tags)
+            if get_tag_values is None:
+                row_tags = repeat(static_tags)
+            else:
+                row_tags = []
+                for row in rows:
+                    tag_values = get_tag_values(row)
+                    try:
+                        tags = tag_sets.get(tag_values)
+                    except TypeError:
+                        # Unhashable values, such as arrays used for `tag_list` columns
+                        tag_values = None
+                        tags = None
 
-                for (column_name, transformer), value in zip(query_columns, row):
-                    # Columns can be ignored via configuration
-                    if not column_name:
-                        continue
+                    if tags is None:
+                        tags = list(base_tags)
+                        for i, column_type, transformer in tag_columns:
+                            if column_type == 'tag':
+                                tags.append(transformer(None, row[i]))
+                            else:
+                                tags.extend(transformer(None, row[i]))
 
-                    sources[column_name] = value
+                        tags = tuple(tags)
+                        if tag_values is not None:
+                            tag_sets[tag_values] = tags
 
-                    column_type, transformer = transformer
+                    row_tags.append(tags)
 
-                    # The transformer can be None for `source` types. Those such columns do not submit
-                    # anything but are collected into the row values for other columns to reference.
-                    if transformer is None:
-                        continue
-                    elif column_type == 'tag':
-                        tags.append(transformer(None, value))
-                    elif column_type == 'tag_list':
-                        tags.extend(transformer(None, value))
-                    else:
-                        submission_queue.append((transformer, value))
+            if query.references_sources:
+                row_sources = [{column_name: row[i] for i, column_name in source_columns} for row in rows]
+            else:
+                row_sources = repeat(None)
+
+            # Transpose so that every transformer is applied to a whole column at once
+            columns = list(zip(*rows))
 
-                for transformer, value in submission_queue:
+            for i, transformer in submission_columns:
+                for value, sources, tags in zip(columns[i], row_sources, row_tags):
                     transformer(sources, value, tags=tags)
 
-                for name, transformer in query_extras:
+            for name, transformer in query_extras:
+                for sources, tags in zip(row_sources, row_tags):
                     try:
                         result = transformer(sources, tags=tags)
                     except Exception as e:
@@ -166,12 +449,24 @@ class QueryManager(object):
                         if result is not None:
                             sources[name] = result
 
-    def execute_query(self, query):
+        return num_rows
+
+    def submit_telemetry(self, query_name, duration, num_rows, global_tags):
+        tags = list(global_tags)
+        tags.append('query:{}'.format(query_name))
+
+        self.check.gauge('telemetry.query.duration', duration, tags=tags)
+        self.check.gauge('telemetry.query.rows', num_rows, tags=tags)
+
+    def execute_query(self, query, executor=None):
         """
         Called by `execute`, this triggers query execution to check for errors immediately in a way that is compatible
         with any library. If there are no errors, this is guaranteed to return an iterator over the result set.
         """
-        rows = self.executor(query)
+        if executor is None:
+            executor = self.executor
+
+        rows = executor(query)
         if rows is None:
             return iter([])
         else:
@@ -184,3 +479,43 @@ class QueryManager(object):
             return iter([])
 
         return chain((first_row,), rows)
+
+    def execute_query_blocks(self, query, executor=None):
+        # type: (str, Callable[[str], Union[Sequence, Iterable]]) -> Iterator[Sequence]
+        """
+        Called by `execute` in columnar mode, this is equivalent to `execute_query` except the returned iterator
+        is over lists of at most `block_size` rows.
+        """
+        if executor is None:
+            executor = self.executor
+
+        result = executor(query)
+        if result is None:
+            return iter([])
+
+        fetchmany = getattr(result, 'fetchmany', None)
+        if fetchmany is not None:
+            block_size = self.block_size
+
+            def fetch_block():
+                return fetchmany(block_size)
+
+        else:
+            rows = iter(result)
+
+            def fetch_block():
+                return list(islice(rows, self.block_size))
+
+        # Ensure we trigger query execution
+        first_block = fetch_block()
+        if not first_block:
+            return iter([])
+
+        return self._iter_blocks(first_block, fetch_block)
+
+    @staticmethod
+    def _iter_blocks(block, fetch_block):
+        # Drivers may signal the end of the result set with any empty sequence
+        while block:
+            yield block
+            block = fetch_block()
@@ -27,6 +27,9 @@ class Query(object):
         self.columns = None  # type: List[str]
         self.extras = None  # type: List[Dict[str, str]]
         self.tags = None  # type: List[str]
+        self.references_sources = None  # type: bool
+        self.collection_interval = None  # type: float
+        self.timeout = None  # type: float
 
     def compile(
         self,
@@ -68,6 +71,23 @@ class Query(object):
         # Keep track of all defined names
         sources = {}
 
+        collection_interval = self.query_data.get('collection_interval')
+        if collection_interval is not None:
+            if not isinstance(collection_interval, (int, float)) or isinstance(collection_interval, bool):
+                raise ValueError('field `collection_interval` for {} must be a number'.format(query_name))
+            elif collection_interval <= 0:
+                raise ValueError('field `collection_interval` for {} must be a positive number'.format(query_name))
+
+        timeout = self.query_data.get('timeout')
+        if timeout is not None:
+            if not isinstance(timeout, (int, float)) or isinstance(timeout, bool):
+                raise ValueError('field `timeout` for {} must be a number'.format(query_name))
+            elif timeout <= 0:
+                raise ValueError('field `timeout` for {} must be a positive number'.format(query_name))
+
+        # Whether any transformer reads the values of other columns or extras
+        references_sources = False
+
         column_data = []
         for i, column in enumerate(columns, 1):
             # Columns can be ignored via configuration.
@@ -101,6 +121,8 @@ class Query(object):
                 continue
             elif column_type not in column_transformers:
                 raise ValueError('unknown type `{}` for column {} of {}'.format(column_type, column_name, query_name))
+            elif column_type == 'match':
+                references_sources = True
 
             modifiers = {key: value for key, value in column.items() if key not in ('name', 'type')}
 
@@ -191,4 +213,7 @@ class Query(object):
         self.columns = tuple(column_data)
         self.extras = tuple(extra_data)
         self.tags = tags
+        self.references_sources = references_sources or bool(extra_data)
+        self.collection_interval = collection_interval
+        self.timeout = timeout
         del self.query_data
@@ -4,6 +4,10 @@
 # Licensed under a 3-clause BSD style license (see LICENSE)
 from __future__ import unicode_literals
 
+import threading
+import time
+from collections import OrderedDict
+
 import mmh3
 
 # Unicode character "Arabic Decimal Separator" (U+066B) is a character which looks like an ascii
@@ -11,6 +15,10 @@ import mmh3
 # commas so that tags which have commas in them (such as SQL queries) properly display.
 ARABIC_DECIMAL_SEPARATOR = '，'
 
+# Default bounds of the cache of obfuscated statements shared by all the check instances of the process
+DEFAULT_OBFUSCATION_CACHE_SIZE = 20000
+DEFAULT_OBFUSCATION_CACHE_TTL = 3600
+
 
 def compute_sql_signature(normalized_query):
     """
@@ -40,3 +48,90 @@ def normalize_query_tag(query):
     """
     query = query.replace(', ', '{} '.format(ARABIC_DECIMAL_SEPARATOR)).replace(',', ARABIC_DECIMAL_SEPARATOR)
     return query
+
+
+class ObfuscationCache(object):
+    """
+    A thread-safe cache of obfuscated statements and their signatures.
+
+    The text of a statement tracked by the database statistics tables (identified by a `queryid`, a digest, etc.)
+    almost never changes between check runs, so it only needs to be obfuscated the first time it is seen. Entries are
+    keyed on both the statement identity and a hash of its raw text, so that a statement whose text changes is
+    obfuscated again. They expire after `ttl` seconds, and the least recently used ones are evicted first when more
+    than `max_size` statements are cached.
+
+    The `hits`, `misses` and `evictions` counters can be used to monitor the efficiency of the cache, see
+    `submit_telemetry`.
+    """
+
+    def __init__(self, max_size=DEFAULT_OBFUSCATION_CACHE_SIZE, ttl=DEFAULT_OBFUSCATION_CACHE_TTL):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # The counters as of the last call to `submit_telemetry`
+        self._submitted_counters = (0, 0, 0)
+
+    def get(self, statement_id, query, obfuscate):
+        """
+        Return the obfuscated version of the `query` identified by `statement_id`, and its signature.
+
+        - **statement_id** (_hashable_) - the identity of the statement in the database statistics tables
+        - **query** (_str_) - the raw text of the statement
+        - **obfuscate** (_callable_) - the function obfuscating the statement when it isn't cached,
+          usually `datadog_agent.obfuscate_sql`. Exceptions it raises are propagated and nothing is cached.
+        """
+        key = (statement_id, mmh3.hash128(query))
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > now:
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+
+        obfuscated_query = obfuscate(query)
+        signature = compute_sql_signature(obfuscated_query)
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self._ttl, obfuscated_query, signature)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return obfuscated_query, signature
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def submit_telemetry(self, check, namespace, tags=None):
+        """
+        Submit the size of the cache as the `<namespace>.obfuscation_cache.size` gauge, and the `hits`, `misses` and
+        `evictions` since the previous call as counts of the same namespace.
+
+        The cache is usually shared by all the instances of the process. Every call only submits what the previous
+        ones didn't, whichever instance made them, so `tags` should not identify the instance.
+        """
+        with self._lock:
+            size = len(self._entries)
+            counters = (self.hits, self.misses, self.evictions)
+            deltas = [value - submitted for value, submitted in zip(counters, self._submitted_counters)]
+            self._submitted_counters = counters
+
+        check.gauge('{}.obfuscation_cache.size'.format(namespace), size, tags=tags)
+        for name, value in zip(('hits', 'misses', 'evictions'), deltas):
+            check.count('{}.obfuscation_cache.{}'.format(namespace, name), value, tags=tags)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# The cache shared by the statement metrics collectors of all the check instances
+obfuscation_cache = ObfuscationCache()
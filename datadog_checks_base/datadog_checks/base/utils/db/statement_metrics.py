@@ -1,6 +1,7 @@
 # (C) Datadog, Inc. 2020-present
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
+import heapq
 import logging
 
 logger = logging.getLogger(__name__)
@@ -22,7 +23,10 @@ class StatementMetrics:
     """
 
     def __init__(self):
-        self._previous_statements = {}
+        # The previous run is kept in a columnar layout: an index of the row keys, and one list of values per metric,
+        # so that only the metric values are retained between runs instead of the full rows.
+        self._previous_index = {}
+        self._previous_columns = {}
 
     def compute_derivative_rows(self, rows, metrics, key):
         """
@@ -42,64 +46,87 @@ class StatementMetrics:
         - **metrics** (_List[str]_) - the metrics to compute for each row
         - **key** (_callable_) - function for an ID which uniquely identifies a row across runs
         """
-        result = []
-        new_cache = {}
         metrics = set(metrics)
+        metric_columns = []
 
         if len(rows) > 0:
-            dropped_metrics = metrics - set(rows[0].keys())
+            available_columns = set(rows[0].keys())
+            dropped_metrics = metrics - available_columns
             if dropped_metrics:
                 logger.warning(
                     'Some statement metrics are not available from the table: %s', ','.join(m for m in dropped_metrics)
                 )
+            metric_columns = sorted(metrics & available_columns)
 
-        for row in rows:
+        new_index = {}
+        # Pairs of (position in the current rows, position in the previous run's columns) of the rows seen in both runs
+        matched = []
+        for i, row in enumerate(rows):
             row_key = key(row)
-            if row_key in new_cache:
+            if row_key in new_index:
                 logger.debug(
                     'Collision in cached query metrics. Dropping existing row, row_key=%s new=%s dropped=%s',
                     row_key,
                     row,
-                    new_cache[row_key],
+                    rows[new_index[row_key]],
                 )
 
             # Set the row on the new cache to be checked the next run. This should happen for every row, regardless of
             # whether a metric is submitted for the row during this run or not.
-            new_cache[row_key] = row
-
-            prev = self._previous_statements.get(row_key)
-            if prev is None:
-                continue
-
-            metric_columns = metrics & set(row.keys())
-
-            # Take the diff of all metric values between the current row and the previous run's row.
-            # There are a couple of edge cases to be aware of:
-            #
-            # 1. Table truncation or stats reset: Because the table values are always increasing, a negative value
-            #    suggests truncation or a stats reset. In this case, the row difference is discarded and the row should.
-            #    be tracked from this run forward.
-            #
-            # 2. No changes since the previous run: There is no need to store metrics of 0, since that is implied by
-            #    the absence of metrics. On any given check run, most rows will have no difference so this optimization
-            #    avoids having to send a lot of unnecessary metrics.
-
-            diffed_row = {k: row[k] - prev[k] if k in metric_columns else row[k] for k in row.keys()}
-
-            # Check for negative values, but only in the columns used for metrics
-            if any(diffed_row[k] < 0 for k in metric_columns):
-                # A "break" might be expected here instead of "continue," but there are cases where a subset of rows
-                # are removed. To avoid situations where all results are discarded every check run, we err on the side
-                # of potentially including truncated rows that exceed previous run counts.
-                continue
+            new_index[row_key] = i
+
+            prev = self._previous_index.get(row_key)
+            if prev is not None:
+                matched.append((i, prev))
+
+        new_columns = {column: [row[column] for row in rows] for column in metric_columns}
+
+        # Take the diff of all metric values between the current rows and the previous run's rows, one column at a
+        # time. There are a couple of edge cases to be aware of:
+        #
+        # 1. Table truncation or stats reset: Because the table values are always increasing, a negative value
+        #    suggests truncation or a stats reset. In this case, the row difference is discarded and the row should.
+        #    be tracked from this run forward.
+        #
+        # 2. No changes since the previous run: There is no need to store metrics of 0, since that is implied by
+        #    the absence of metrics. On any given check run, most rows will have no difference so this optimization
+        #    avoids having to send a lot of unnecessary metrics.
+        deltas = {}
+        reset = [False] * len(matched)
+        changed = [False] * len(matched)
+        for column in metric_columns:
+            previous = self._previous_columns.get(column)
+            if previous is None:
+                # The metric was not available during the previous run, there is nothing to compare it to
+                reset = [True] * len(matched)
+                break
+
+            current = new_columns[column]
+            column_deltas = [current[i] - previous[prev] for i, prev in matched]
+            for n, delta in enumerate(column_deltas):
+                if delta < 0:
+                    # A "break" might be expected here instead of "continue," but there are cases where a subset of
+                    # rows are removed. To avoid situations where all results are discarded every check run, we err on
+                    # the side of potentially including truncated rows that exceed previous run counts.
+                    reset[n] = True
+                elif delta:
+                    changed[n] = True
+            deltas[column] = column_deltas
 
+        result = []
+        for n, (i, _) in enumerate(matched):
             # No changes to the query; no metric needed
-            if all(diffed_row[k] == 0 for k in metric_columns):
+            if reset[n] or not changed[n]:
                 continue
 
+            row = rows[i]
+            diffed_row = {k: row[k] for k in row.keys()}
+            for column in metric_columns:
+                diffed_row[column] = deltas[column][n]
             result.append(diffed_row)
 
-        self._previous_statements = new_cache
+        self._previous_index = new_index
+        self._previous_columns = new_columns
 
         return result
 
@@ -200,26 +227,26 @@ def apply_row_limits(rows, metric_limits, tiebreaker_metric, tiebreaker_reverse,
     for metric, (top_k, bottom_k) in metric_limits.items():
         if metric not in available_cols:
             continue
-        # sort_key uses a secondary sort dimension so that if there are a lot of
-        # the same values (like 0), then there will be more overlap in selected rows
-        # over time
-        if tiebreaker_reverse:
 
-            def sort_key(row):
-                return (row[metric], -row[tiebreaker_metric])
+        if top_k + bottom_k >= len(rows):
+            # Every row is either in the top K or in the bottom K, there is no need to rank them
+            for row in rows:
+                limited[key(row)] = row
+            continue
 
+        # The sort key uses a secondary sort dimension so that if there are a lot of
+        # the same values (like 0), then there will be more overlap in selected rows
+        # over time. The position keeps the same rows as a stable sort when both the
+        # metric and the tiebreaker are equal.
+        if tiebreaker_reverse:
+            sort_keys = [(row[metric], -row[tiebreaker_metric], i) for i, row in enumerate(rows)]
         else:
+            sort_keys = [(row[metric], row[tiebreaker_metric], i) for i, row in enumerate(rows)]
 
-            def sort_key(row):
-                return (row[metric], row[tiebreaker_metric])
-
-        sorted_rows = sorted(rows, key=sort_key)
-
-        top = sorted_rows[len(sorted_rows) - top_k :]
-        bottom = sorted_rows[:bottom_k]
-        for row in top:
-            limited[key(row)] = row
-        for row in bottom:
-            limited[key(row)] = row
+        # Only the top K and bottom K rows are needed, so partially select them instead of sorting all the rows
+        for _, _, i in heapq.nlargest(top_k, sort_keys):
+            limited[key(rows[i])] = rows[i]
+        for _, _, i in heapq.nsmallest(bottom_k, sort_keys):
+            limited[key(rows[i])] = rows[i]
 
     return list(limited.values())
@@ -4,14 +4,19 @@
 import logging
 import os
 import re
+import threading
 from contextlib import contextmanager
 from copy import deepcopy
+from functools import partial
 from io import open
 from ipaddress import ip_address, ip_network
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer as timer
 
 import requests
 import requests_unixsocket
 from requests import auth as requests_auth
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
 from requests_toolbelt.adapters import host_header_ssl
 from six import PY2, iteritems, string_types
 from six.moves.urllib.parse import quote, urlparse, urlunparse
@@ -32,6 +37,11 @@ try:
 except ImportError:
     from ..stubs import datadog_agent
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 # Import lazily to reduce memory footprint and ease installation for development
 requests_aws = None
 requests_kerberos = None
@@ -47,6 +57,9 @@ LOGGER = logging.getLogger(__file__)
 # https://tools.ietf.org/html/rfc2988
 DEFAULT_TIMEOUT = 10
 
+# The maximum number of requests `RequestsWrapper.get_many` sends at the same time by default
+DEFAULT_MAX_CONCURRENCY = DEFAULT_POOLSIZE
+
 STANDARD_FIELDS = {
     'auth_token': None,
     'auth_type': 'basic',
@@ -67,8 +80,11 @@ STANDARD_FIELDS = {
     'ntlm_domain': None,
     'password': None,
     'persist_connections': False,
+    'pool_connections': DEFAULT_POOLSIZE,
+    'pool_maxsize': DEFAULT_POOLSIZE,
     'proxy': None,
     'read_timeout': None,
+    'share_connections': False,
     'skip_proxy': False,
     'tls_ca_cert': None,
     'tls_cert': None,
@@ -99,6 +115,10 @@ KERBEROS_STRATEGIES = {}
 
 UDS_SCHEME = 'unix'
 
+# Connection pools shared by all the wrappers that enable `share_connections`, by host and TLS settings
+SHARED_ADAPTERS = {}
+SHARED_ADAPTERS_LOCK = threading.Lock()
+
 
 class RequestsWrapper(object):
     __slots__ = (
@@ -110,7 +130,11 @@ class RequestsWrapper(object):
         'no_proxy_uris',
         'options',
         'persist_connections',
+        'pool_connections',
+        'pool_maxsize',
         'request_hooks',
+        'request_timing_callback',
+        'share_connections',
         'auth_token_handler',
     )
 
@@ -277,6 +301,17 @@ class RequestsWrapper(object):
         self.persist_connections = self.tls_use_host_header or is_affirmative(config['persist_connections'])
         self._session = None
 
+        # The number of hosts and of connections per host to keep alive when persisting connections, see:
+        # https://requests.readthedocs.io/en/master/api/#requests.adapters.HTTPAdapter
+        self.pool_connections = int(config['pool_connections'])
+        self.pool_maxsize = int(config['pool_maxsize'])
+
+        # Whether or not persisted connections are shared with the other instances that connect to the same hosts
+        self.share_connections = is_affirmative(config['share_connections']) and not self.tls_use_host_header
+
+        # Called with the method, URL and duration in seconds of every request, for telemetry
+        self.request_timing_callback = None
+
         # Whether or not to log request information like method and url
         self.log_requests = is_affirmative(config['log_requests'])
 
@@ -315,6 +350,98 @@ class RequestsWrapper(object):
     def options_method(self, url, **options):
         return self._request('options', url, options)
 
+    def get_many(self, urls, max_concurrency=DEFAULT_MAX_CONCURRENCY, **options):
+        """
+        Send a GET request to each of `urls`, with up to `max_concurrency` requests in flight at a time, and return
+        the responses in the order of `urls`. The `options` apply to every request and the first error is raised
+        like for `get()`.
+
+        When persisting connections, `pool_maxsize` should be at least `max_concurrency` so that the connections
+        to a host can all be kept alive.
+        """
+        urls = list(urls)
+        if max_concurrency < 1:
+            raise ValueError('`max_concurrency` must be at least 1')
+
+        if max_concurrency == 1 or len(urls) < 2:
+            return [self.get(url, **options) for url in urls]
+
+        persist = options.get('persist')
+        if persist is None:
+            persist = self.persist_connections
+
+        # Create the session before any thread uses it
+        if persist or any(is_uds_url(url) for url in urls):
+            self.session
+
+        # Mounting adapters reorders those of the session, which must not happen while threads look them up
+        if persist and self.share_connections:
+            request_options = self.populate_options(dict(options))
+            for url in urls:
+                self._mount_shared_adapter(url, request_options)
+
+        pool = ThreadPool(min(max_concurrency, len(urls)))
+        try:
+            return pool.map(lambda url: self.get(url, **options), urls, chunksize=1)
+        finally:
+            pool.terminate()
+
+    def get_json_items(self, url, prefix='item', **options):
+        """
+        Send a GET request to `url` and yield the values found at `prefix` in its JSON body, e.g. `item` for the
+        elements of a top-level array or `foo.item` for the elements of the array at the `foo` key.
+
+        The body is decoded incrementally when `ijson` is installed, so that only one value is held in memory at a
+        time. The request is sent when the iteration starts and errors are raised like for `get().json()`.
+        """
+        with self._stream_json(url, options) as (response, events):
+            if events is None:
+                for value in _select_json_items(response.json(), prefix.split('.') if prefix else []):
+                    yield value
+            else:
+                for value in ijson.items(events, prefix):
+                    yield value
+
+    def get_json_members(self, url, prefixes, **options):
+        """
+        Send a GET request to `url` and yield a `(prefix, key, value)` tuple for every member of the JSON objects
+        found at `prefixes` in its body, `''` being the top-level object.
+
+        Members that are themselves at one of the `prefixes` are not yielded, their own members are instead, which
+        allows to stream e.g. both the top-level fields of a document and the entries of its `nodes` object.
+        """
+        prefixes = frozenset(prefixes)
+        with self._stream_json(url, options) as (response, events):
+            if events is None:
+                for member in _select_json_members(response.json(), '', prefixes):
+                    yield member
+            else:
+                for member in _iter_json_members(events, prefixes):
+                    yield member
+
+    @contextmanager
+    def _stream_json(self, url, options):
+        # Without ijson, the body is decoded all at once and no parsing events are provided
+        if ijson is not None:
+            options.setdefault('stream', True)
+
+        response = self.get(url, **options)
+        try:
+            response.raise_for_status()
+            if ijson is None:
+                yield response, None
+                return
+
+            # Let urllib3 handle the `Content-Encoding` of the body, as `response.json()` would
+            response.raw.decode_content = True
+            try:
+                yield response, ijson.parse(response.raw, use_float=True)
+            except ijson.JSONError as e:
+                # Match the exception raised by `response.json()`
+                raise ValueError('Invalid JSON response from {}: {}'.format(url, e))
+        finally:
+            response.close()
+
     def _request(self, method, url, options):
         if self.log_requests:
             self.logger.debug(u'Sending %s request to %s', method.upper(), url)
@@ -347,10 +474,14 @@ class RequestsWrapper(object):
                 stack.enter_context(hook())
 
             if persist:
+                if self.share_connections:
+                    self._mount_shared_adapter(url, new_options)
                 request_method = getattr(self.session, method)
             else:
                 request_method = getattr(requests, method)
 
+            start_time = timer()
+
             if self.auth_token_handler:
                 try:
                     response = request_method(url, **new_options)
@@ -362,6 +493,12 @@ class RequestsWrapper(object):
             else:
                 response = request_method(url, **new_options)
 
+            elapsed = timer() - start_time
+            if self.log_requests:
+                self.logger.debug(u'Received %s response from %s in %.3f seconds', response.status_code, url, elapsed)
+            if self.request_timing_callback is not None:
+                self.request_timing_callback(method, url, elapsed)
+
             return response
 
     def populate_options(self, options):
@@ -382,8 +519,13 @@ class RequestsWrapper(object):
 
             # Enables HostHeaderSSLAdapter
             # https://toolbelt.readthedocs.io/en/latest/adapters.html#hostheaderssladapter
+            self._session.mount('http://', HTTPAdapter(self.pool_connections, self.pool_maxsize))
             if self.tls_use_host_header:
-                self._session.mount('https://', host_header_ssl.HostHeaderSSLAdapter())
+                self._session.mount(
+                    'https://', host_header_ssl.HostHeaderSSLAdapter(self.pool_connections, self.pool_maxsize)
+                )
+            else:
+                self._session.mount('https://', HTTPAdapter(self.pool_connections, self.pool_maxsize))
 
             # Enable Unix Domain Socket (UDS) support.
             # See: https://github.com/msabramo/requests-unixsocket
@@ -395,6 +537,27 @@ class RequestsWrapper(object):
 
         return self._session
 
+    def _mount_shared_adapter(self, url, options):
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https'):
+            return
+
+        # Prepared URLs always have a path, which prevents e.g. `http://host:80` from matching `http://host:8080`
+        prefix = '{}://{}/'.format(parsed.scheme, parsed.netloc).lower()
+        if prefix in self.session.adapters:
+            return
+
+        # Connections are only reused for the same TLS settings
+        verify = options['verify']
+        cert = options['cert']
+        key = (prefix, verify, tuple(cert) if isinstance(cert, list) else cert, self.pool_maxsize)
+        with SHARED_ADAPTERS_LOCK:
+            adapter = SHARED_ADAPTERS.get(key)
+            if adapter is None:
+                adapter = SHARED_ADAPTERS[key] = SharedHTTPAdapter(key, 1, self.pool_maxsize)
+            adapter.sessions += 1
+            self.session.mount(prefix, adapter)
+
     def handle_auth_token(self, **request):
         if self.auth_token_handler is not None:
             self.auth_token_handler.poll(**request)
@@ -408,6 +571,30 @@ class RequestsWrapper(object):
             pass
 
 
+class SharedHTTPAdapter(HTTPAdapter):
+    """
+    A connection pool mounted on the sessions of several wrappers, which stays open until the last of them is closed.
+    """
+
+    def __init__(self, key, *args, **kwargs):
+        super(SharedHTTPAdapter, self).__init__(*args, **kwargs)
+        self.key = key
+        # The number of sessions this is mounted on
+        self.sessions = 0
+
+    def close(self):
+        # Sessions close all their adapters when they are closed
+        with SHARED_ADAPTERS_LOCK:
+            self.sessions -= 1
+            if self.sessions > 0:
+                return
+
+            if SHARED_ADAPTERS.get(self.key) is self:
+                del SHARED_ADAPTERS[self.key]
+
+        super(SharedHTTPAdapter, self).close()
+
+
 @contextmanager
 def handle_kerberos_keytab(keytab_file):
     # There are no keytab options in any wrapper libs. The env var will be
@@ -443,6 +630,98 @@ def handle_kerberos_cache(cache_file_path):
         os.environ['KRB5CCNAME'] = old_cache_path
 
 
+def count_streamed_bytes(response, callback):
+    """
+    Call `callback` with the size in bytes of the body of a streamed `response` once it has been fully read.
+
+    Unlike `len(response.content)`, this doesn't load the whole body in memory: the bytes are counted as they are
+    iterated over by e.g. `response.iter_lines()`. Like `response.content`, the size is the one of the decoded body.
+    """
+    if getattr(response, 'raw', None) is None:
+        # There is nothing to stream, the body is already loaded
+        callback(len(response.content))
+        return
+
+    response.raw = _ByteCountingRaw(response.raw, callback)
+
+
+class _ByteCountingRaw(object):
+    def __init__(self, raw, callback):
+        self._raw = raw
+        self._callback = callback
+
+    def stream(self, amt, decode_content=None):
+        # This is how `requests` reads the body of responses
+        if hasattr(self._raw, 'stream'):
+            chunks = self._raw.stream(amt, decode_content=decode_content)
+        else:
+            chunks = iter(partial(self._raw.read, amt), b'')
+
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+
+        self._callback(size)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+def _select_json_items(value, path):
+    if not path:
+        yield value
+    elif path[0] == 'item':
+        if isinstance(value, list):
+            for item in value:
+                for selected in _select_json_items(item, path[1:]):
+                    yield selected
+    elif isinstance(value, dict) and path[0] in value:
+        for selected in _select_json_items(value[path[0]], path[1:]):
+            yield selected
+
+
+def _select_json_members(value, prefix, prefixes):
+    if isinstance(value, dict):
+        for key, member in iteritems(value):
+            member_prefix = '{}.{}'.format(prefix, key) if prefix else key
+            if prefix in prefixes and member_prefix not in prefixes:
+                yield prefix, key, member
+            else:
+                for selected in _select_json_members(member, member_prefix, prefixes):
+                    yield selected
+    elif isinstance(value, list):
+        item_prefix = '{}.item'.format(prefix) if prefix else 'item'
+        for item in value:
+            for selected in _select_json_members(item, item_prefix, prefixes):
+                yield selected
+
+
+def _iter_json_members(events, prefixes):
+    for prefix, event, key in events:
+        if event != 'map_key' or prefix not in prefixes:
+            continue
+
+        member_prefix = '{}.{}'.format(prefix, key) if prefix else key
+        if member_prefix in prefixes:
+            continue
+
+        # Build the member's value from the events that follow, up to the end of the value
+        builder = ijson.ObjectBuilder()
+        depth = 0
+        for _, event, value in events:
+            builder.event(event, value)
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+
+            if not depth:
+                break
+
+        yield prefix, key, builder.value
+
+
 def should_bypass_proxy(url, no_proxy_uris):
     # Accepts a URL and a list of no_proxy URIs
     # Returns True if URL should bypass the proxy.
@@ -3,9 +3,29 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 from google.protobuf.internal.decoder import _DecodeVarint32  # pylint: disable=E0611,E0401
+from google.protobuf.message import DecodeError
+from six import PY2
 
 from . import metrics_pb2
 
+# https://prometheus.io/docs/instrumenting/exposition_formats/#protobuf-format
+PROTOBUF_CONTENT_TYPE = 'application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited'
+
+
+def get_protobuf_accept_header(text_content_type='text/plain; version=0.0.4'):
+    """
+    Prefer the protobuf format, but let the endpoint answer with the `text_content_type` text format if it
+    doesn't support it.
+    """
+    return '{}; q=0.7, {}; q=0.3'.format(PROTOBUF_CONTENT_TYPE, text_content_type)
+
+
+PROTOBUF_ACCEPT_HEADER = get_protobuf_accept_header()
+
+
+def is_protobuf_response(response):
+    return 'application/vnd.google.protobuf' in response.headers.get('Content-Type', '')
+
 
 # Deprecated, please use the PrometheusCheck class
 def parse_metric_family(buf):
@@ -26,3 +46,44 @@ def parse_metric_family(buf):
         message = metrics_pb2.MetricFamily()
         message.ParseFromString(msg_buf)
         yield message
+
+
+def parse_metric_family_stream(chunks):
+    """
+    Parse the Prometheus messages of type MetricFamily delimited by a varint32 from an iterable of binary chunks,
+    e.g. `response.iter_content()`, yielding every message as soon as it has been fully received.
+
+    The chunks are appended to a single buffer, and messages are parsed from a `memoryview` over it so that only the
+    bytes of the current incomplete message are kept, and never copied for each message.
+    """
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        view = memoryview(buf)
+        size = len(view)
+        n = 0
+        while n < size:
+            try:
+                msg_len, new_pos = _DecodeVarint32(view, n)
+            except IndexError:
+                # The length of the next message was truncated
+                break
+
+            if new_pos + msg_len > size:
+                break
+
+            msg_buf = view[new_pos : new_pos + msg_len]
+            if PY2:
+                msg_buf = msg_buf.tobytes()
+
+            message = metrics_pb2.MetricFamily()
+            message.ParseFromString(msg_buf)
+            n = new_pos + msg_len
+            yield message
+
+        # The buffer can't be resized while viewed
+        msg_buf = view = None
+        del buf[:n]
+
+    if buf:
+        raise DecodeError('Truncated MetricFamily message of {} bytes at the end of the stream'.format(len(buf)))
@@ -65,6 +65,7 @@ setup(
             'requirements.in',
             exclude=[
                 'kubernetes',
+                'ijson',
                 'mmh3',
                 'orjson',
                 'pysocks',
@@ -88,7 +89,7 @@ setup(
                 'pyjwt',
             ],
         ),
-        'json': get_requirements('requirements.in', only=['orjson']),
+        'json': get_requirements('requirements.in', only=['ijson', 'orjson']),
         'kube': get_requirements('requirements.in', only=['kubernetes']),
     },
 )
@@ -2,10 +2,16 @@
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
 import os
+import tracemalloc
 
 import pytest
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.core import HistogramMetricFamily
+from requests import Response
 
 from datadog_checks.base import OpenMetricsBaseCheck, OpenMetricsBaseCheckV2
+from datadog_checks.base.checks.libs.prometheus import protobuf_fd_to_metric_families
+from datadog_checks.base.utils.prometheus.functions import PROTOBUF_CONTENT_TYPE
 from datadog_checks.dev import get_here
 
 from ..utils import requires_py3
@@ -15,12 +21,88 @@ pytestmark = [requires_py3, pytest.mark.openmetrics, pytest.mark.openmetrics_con
 
 HERE = get_here()
 
+# Large enough for the payload to dwarf everything else the check allocates
+STREAMED_PAYLOAD_SIZE = 32 * 1024 * 1024
+
+
+class StreamedPayload(object):
+    """
+    Body of a chunked response without `Content-Length`, generated as it is read so that the only copies of it in
+    memory are the ones made by the check.
+    """
+
+    # Mostly blank lines, which are cheap to parse
+    BLOCK = b''.join([b'# TYPE go_goroutines gauge\n', b'go_goroutines 42\n'] + [b' ' * 1023 + b'\n'] * 63)
+
+    def __init__(self, size):
+        self.remaining = size
+        self.offset = 0
+
+    def read(self, amt=None):
+        amt = min(amt or self.remaining, self.remaining, len(self.BLOCK) - self.offset)
+        chunk = self.BLOCK[self.offset : self.offset + amt]
+        self.offset = (self.offset + amt) % len(self.BLOCK)
+        self.remaining -= amt
+        return chunk
+
+
+def streamed_response(*args, **kwargs):
+    response = Response()
+    response.status_code = 200
+    response.headers['Content-Type'] = 'text/plain'
+    response.raw = StreamedPayload(STREAMED_PAYLOAD_SIZE)
+    return response
+
+
+def histogram_with_contexts(contexts):
+    """A histogram like the ones of Envoy or Istio, with many contexts of 20 buckets."""
+    histogram = HistogramMetricFamily('request_duration', 'Request duration.', labels=['cluster', 'response_code'])
+    upper_bounds = [0.5, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 300000, 600000]
+    upper_bounds += [1800000, 3600000]
+    for i in range(contexts):
+        buckets = [(str(upper_bound), j * 10) for j, upper_bound in enumerate(upper_bounds)]
+        buckets.append(('+Inf', len(upper_bounds) * 10))
+        histogram.add_metric([str(i), '200'], buckets, 1234)
+
+    return histogram
+
+
+def run_with_peak_memory(func, *args):
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
 
 @pytest.fixture
 def fixture_ksm():
     return os.path.join(os.path.dirname(HERE), 'fixtures', 'prometheus', 'ksm.txt')
 
 
+@pytest.fixture
+def fixture_protobuf():
+    return os.path.join(os.path.dirname(HERE), 'fixtures', 'prometheus', 'protobuf.bin')
+
+
+@pytest.fixture
+def fixture_protobuf_text(tmp_path, fixture_protobuf):
+    """The same metrics as `fixture_protobuf`, in the text format."""
+
+    class Collector(object):
+        def collect(self):
+            with open(fixture_protobuf, 'rb') as f:
+                return list(protobuf_fd_to_metric_families([f.read()], munge_counters=True))
+
+    registry = CollectorRegistry()
+    registry.register(Collector())
+
+    path = tmp_path / 'protobuf.txt'
+    path.write_bytes(generate_latest(registry))
+    return str(path)
+
+
 @pytest.fixture
 def fixture_amazon_msk_jmx_metrics():
     return os.path.join(os.path.dirname(HERE), 'fixtures', 'prometheus', 'amazon_msk_jmx_metrics.txt')
@@ -47,6 +129,50 @@ def test_ksm_old(benchmark, dd_run_check, mock_http_response, fixture_ksm):
     benchmark(c.check, instance)
 
 
+def test_protobuf_new(benchmark, dd_run_check, mock_http_response, fixture_protobuf):
+    mock_http_response(file_path=fixture_protobuf, headers={'Content-Type': PROTOBUF_CONTENT_TYPE})
+    c = OpenMetricsBaseCheckV2(
+        'test', {}, [{'openmetrics_endpoint': 'foo', 'namespace': 'bar', 'metrics': ['.+'], 'use_protobuf': True}]
+    )
+
+    # Run once to get initialization steps out of the way.
+    dd_run_check(c)
+
+    benchmark(c.check, None)
+
+
+def test_protobuf_text_new(benchmark, dd_run_check, mock_http_response, fixture_protobuf_text):
+    mock_http_response(file_path=fixture_protobuf_text)
+    c = OpenMetricsBaseCheckV2('test', {}, [{'openmetrics_endpoint': 'foo', 'namespace': 'bar', 'metrics': ['.+']}])
+
+    # Run once to get initialization steps out of the way.
+    dd_run_check(c)
+
+    benchmark(c.check, None)
+
+
+def test_protobuf_old(benchmark, dd_run_check, mock_http_response, fixture_protobuf):
+    mock_http_response(file_path=fixture_protobuf, headers={'Content-Type': PROTOBUF_CONTENT_TYPE})
+    instance = {'prometheus_url': 'foo', 'namespace': 'bar', 'metrics': ['*'], 'use_protobuf': True}
+    c = OpenMetricsBaseCheck('test', {}, [instance])
+
+    # Run once to get initialization steps out of the way.
+    dd_run_check(c)
+
+    benchmark(c.check, instance)
+
+
+def test_protobuf_text_old(benchmark, dd_run_check, mock_http_response, fixture_protobuf_text):
+    mock_http_response(file_path=fixture_protobuf_text)
+    instance = {'prometheus_url': 'foo', 'namespace': 'bar', 'metrics': ['*']}
+    c = OpenMetricsBaseCheck('test', {}, [instance])
+
+    # Run once to get initialization steps out of the way.
+    dd_run_check(c)
+
+    benchmark(c.check, instance)
+
+
 def test_amazon_msk_jmx_metrics_new(benchmark, dd_run_check, mock_http_response, fixture_amazon_msk_jmx_metrics):
     mock_http_response(file_path=fixture_amazon_msk_jmx_metrics)
 
@@ -66,6 +192,30 @@ def test_amazon_msk_jmx_metrics_new(benchmark, dd_run_check, mock_http_response,
     benchmark(c.check, None)
 
 
+def test_amazon_msk_jmx_metrics_all_new(benchmark, dd_run_check, mock_http_response, fixture_amazon_msk_jmx_metrics):
+    mock_http_response(file_path=fixture_amazon_msk_jmx_metrics)
+    c = OpenMetricsBaseCheckV2('test', {}, [{'openmetrics_endpoint': 'foo', 'namespace': 'bar', 'metrics': ['.+']}])
+
+    # Run once to get initialization steps out of the way.
+    dd_run_check(c)
+
+    benchmark(c.check, None)
+
+
+def test_amazon_msk_jmx_metrics_all_telemetry_new(
+    benchmark, dd_run_check, mock_http_response, fixture_amazon_msk_jmx_metrics
+):
+    mock_http_response(file_path=fixture_amazon_msk_jmx_metrics)
+    c = OpenMetricsBaseCheckV2(
+        'test', {}, [{'openmetrics_endpoint': 'foo', 'namespace': 'bar', 'metrics': ['.+'], 'telemetry': True}]
+    )
+
+    # Run once to get initialization steps out of the way.
+    dd_run_check(c)
+
+    benchmark(c.check, None)
+
+
 def test_amazon_msk_jmx_metrics_old(benchmark, dd_run_check, mock_http_response, fixture_amazon_msk_jmx_metrics):
     mock_http_response(file_path=fixture_amazon_msk_jmx_metrics)
     instance = {
@@ -136,3 +286,40 @@ def test_label_joins_old(benchmark, dd_run_check, mock_http_response, fixture_ks
     dd_run_check(c)
 
     benchmark(c.check, instance)
+
+
+def test_streamed_payload_memory_new(benchmark, dd_run_check, mocker):
+    mocker.patch('requests.get', side_effect=streamed_response)
+    c = OpenMetricsBaseCheckV2(
+        'test', {}, [{'openmetrics_endpoint': 'foo', 'namespace': 'bar', 'metrics': ['.+'], 'telemetry': True}]
+    )
+
+    # Run once to get initialization steps out of the way.
+    dd_run_check(c)
+
+    peak_memory = benchmark.pedantic(run_with_peak_memory, args=(c.check, None), rounds=1)
+    assert peak_memory < STREAMED_PAYLOAD_SIZE / 8
+
+
+def test_streamed_payload_memory_old(benchmark, dd_run_check, mocker):
+    mocker.patch('requests.get', side_effect=streamed_response)
+    instance = {'prometheus_url': 'foo', 'namespace': 'bar', 'metrics': ['*'], 'telemetry': True}
+    c = OpenMetricsBaseCheck('test', {}, [instance])
+
+    # Run once to get initialization steps out of the way.
+    dd_run_check(c)
+
+    peak_memory = benchmark.pedantic(run_with_peak_memory, args=(c.check, instance), rounds=1)
+    assert peak_memory < STREAMED_PAYLOAD_SIZE / 8
+
+
+def test_decumulate_histogram_buckets_old(benchmark):
+    check = OpenMetricsBaseCheck('test', {}, [{'prometheus_url': 'foo', 'namespace': 'bar', 'metrics': ['*']}])
+    histogram = histogram_with_contexts(1000)
+
+    def setup():
+        metric = HistogramMetricFamily(histogram.name, histogram.documentation)
+        metric.samples = [sample._replace(labels=dict(sample.labels)) for sample in histogram.samples]
+        return (metric,), {}
+
+    benchmark.pedantic(check._decumulate_histogram_buckets, setup=setup, rounds=20)
@@ -158,6 +158,14 @@ class TestTags:
             dd_run_check(check, extract_message=True)
 
 
+class TestTagCacheSize:
+    def test_not_integer(self, dd_run_check):
+        check = get_check({'tag_cache_size': '9000'})
+
+        with pytest.raises(Exception, match='^Setting `tag_cache_size` must be an integer$'):
+            dd_run_check(check, extract_message=True)
+
+
 class TestRawLineFilters:
     def test_not_array(self, dd_run_check):
         check = get_check({'raw_line_filters': 9000})
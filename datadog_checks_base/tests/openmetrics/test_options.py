@@ -1,9 +1,12 @@
 # (C) Datadog, Inc. 2020-present
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
+import os
+
 import pytest
 
 from datadog_checks.base.constants import ServiceCheck
+from datadog_checks.base.utils.prometheus.functions import PROTOBUF_CONTENT_TYPE
 
 from ..utils import requires_py3
 from .utils import get_check
@@ -277,6 +280,170 @@ class TestRawLineFilters:
         aggregator.assert_all_metrics_covered()
 
 
+class TestTagCacheSize:
+    def test_reuse(self, aggregator, dd_run_check, mock_http_response):
+        mock_http_response(
+            """
+            # HELP go_memstats_alloc_bytes Number of bytes allocated and still in use.
+            # TYPE go_memstats_alloc_bytes gauge
+            go_memstats_alloc_bytes{foo="baz"} 6.396288e+06
+            """
+        )
+        check = get_check({'metrics': ['.+'], 'rename_labels': {'foo': 'bar'}})
+        dd_run_check(check)
+        dd_run_check(check)
+
+        scraper = check.scrapers['test']
+        assert scraper.tag_cache == {('foo', 'baz'): 'bar:baz'}
+
+        aggregator.assert_metric(
+            'test.go_memstats_alloc_bytes',
+            6396288,
+            metric_type=aggregator.GAUGE,
+            tags=['endpoint:test', 'bar:baz'],
+            count=2,
+        )
+
+        aggregator.assert_all_metrics_covered()
+
+    def test_limit(self, aggregator, dd_run_check, mock_http_response):
+        mock_http_response(
+            """
+            # HELP go_memstats_alloc_bytes Number of bytes allocated and still in use.
+            # TYPE go_memstats_alloc_bytes gauge
+            go_memstats_alloc_bytes{foo="bar",bar="baz",baz="foo"} 6.396288e+06
+            """
+        )
+        check = get_check({'metrics': ['.+'], 'tag_cache_size': 2})
+        dd_run_check(check)
+
+        assert len(check.scrapers['test'].tag_cache) <= 2
+
+        aggregator.assert_metric(
+            'test.go_memstats_alloc_bytes',
+            6396288,
+            metric_type=aggregator.GAUGE,
+            tags=['endpoint:test', 'foo:bar', 'bar:baz', 'baz:foo'],
+        )
+
+        aggregator.assert_all_metrics_covered()
+
+
+class TestTelemetry:
+    def test_processed_samples_per_metric(self, aggregator, dd_run_check, mock_http_response):
+        mock_http_response(
+            """
+            # HELP go_memstats_alloc_bytes Number of bytes allocated and still in use.
+            # TYPE go_memstats_alloc_bytes gauge
+            go_memstats_alloc_bytes{foo="bar"} 6.396288e+06
+            go_memstats_alloc_bytes{foo="baz"} 6.396288e+06
+            go_memstats_alloc_bytes{foo="foo"} 6.396288e+06
+            # HELP go_memstats_gc_sys_bytes Number of bytes used for garbage collection system metadata.
+            # TYPE go_memstats_gc_sys_bytes gauge
+            go_memstats_gc_sys_bytes 901120
+            """
+        )
+        check = get_check({'metrics': ['.+'], 'telemetry': True})
+        dd_run_check(check)
+
+        processed = aggregator.metrics('test.telemetry.metrics.processed.count')
+        assert [metric.value for metric in processed] == [3, 1]
+
+        aggregator.assert_metric('test.telemetry.metrics.input.count', count=2)
+
+    def test_payload_size_streamed(self, aggregator, dd_run_check, mock_http_response):
+        payload = '# TYPE go_memstats_gc_sys_bytes gauge\ngo_memstats_gc_sys_bytes 901120\n'
+        mock_http_response(payload, normalize_content=False)
+        check = get_check({'metrics': ['.+'], 'telemetry': True})
+        dd_run_check(check)
+
+        aggregator.assert_metric('test.telemetry.payload.size', len(payload), tags=['endpoint:test'])
+
+
+class TestUseProtobuf:
+    @pytest.mark.parametrize('use_protobuf', [False, True])
+    def test_accept_header(self, dd_run_check, mock_http_response, use_protobuf):
+        mock_http_response(
+            """
+            # TYPE go_memstats_gc_sys_bytes gauge
+            go_memstats_gc_sys_bytes 901120
+            """
+        )
+        check = get_check({'metrics': ['.+'], 'use_protobuf': use_protobuf})
+        dd_run_check(check)
+
+        accept = check.scrapers['test'].http.options['headers']['Accept']
+        assert accept.startswith(PROTOBUF_CONTENT_TYPE) is use_protobuf
+
+    def test_accept_header_latest_spec(self, dd_run_check, mock_http_response):
+        mock_http_response(
+            """
+            # TYPE go_memstats_gc_sys_bytes gauge
+            go_memstats_gc_sys_bytes 901120
+            # EOF
+            """
+        )
+        check = get_check({'metrics': ['.+'], 'use_protobuf': True, 'use_latest_spec': True})
+        dd_run_check(check)
+
+        # The text format asked for as a fallback is the one that will be parsed
+        accept = check.scrapers['test'].http.options['headers']['Accept']
+        assert accept.startswith(PROTOBUF_CONTENT_TYPE)
+        assert 'application/openmetrics-text' in accept
+        assert 'text/plain' not in accept
+
+    def test_accept_header_configured(self, dd_run_check, mock_http_response):
+        mock_http_response(
+            """
+            # TYPE go_memstats_gc_sys_bytes gauge
+            go_memstats_gc_sys_bytes 901120
+            """
+        )
+        check = get_check({'metrics': ['.+'], 'use_protobuf': True, 'headers': {'Accept': 'text/plain'}})
+        dd_run_check(check)
+
+        assert check.scrapers['test'].http.options['headers']['Accept'] == 'text/plain'
+
+    def test_protobuf_response(self, aggregator, dd_run_check, mock_http_response):
+        mock_http_response(
+            file_path=os.path.join(
+                os.path.dirname(os.path.dirname(__file__)), 'fixtures', 'prometheus', 'protobuf.bin'
+            ),
+            headers={'Content-Type': PROTOBUF_CONTENT_TYPE},
+        )
+        check = get_check(
+            {
+                'metrics': ['go_gc_duration_seconds', 'go_memstats_gc_sys_bytes', 'go_memstats_frees'],
+                'use_protobuf': True,
+            }
+        )
+        dd_run_check(check)
+
+        aggregator.assert_metric(
+            'test.go_memstats_gc_sys_bytes', 538624, metric_type=aggregator.GAUGE, tags=['endpoint:test']
+        )
+        aggregator.assert_metric(
+            'test.go_memstats_frees.count', 293362, metric_type=aggregator.MONOTONIC_COUNT, tags=['endpoint:test']
+        )
+        aggregator.assert_metric(
+            'test.go_gc_duration_seconds.count', 11, metric_type=aggregator.MONOTONIC_COUNT, tags=['endpoint:test']
+        )
+        aggregator.assert_metric(
+            'test.go_gc_duration_seconds.sum',
+            0.0005755570000000001,
+            metric_type=aggregator.MONOTONIC_COUNT,
+            tags=['endpoint:test'],
+        )
+        for quantile in ('0', '0.25', '0.5', '0.75', '1.0'):
+            aggregator.assert_metric(
+                'test.go_gc_duration_seconds.quantile',
+                metric_type=aggregator.GAUGE,
+                tags=['endpoint:test', 'quantile:{}'.format(quantile)],
+            )
+
+        aggregator.assert_all_metrics_covered()
+
+
 class TestMetrics:
     def test_unknown_type_override(self, aggregator, dd_run_check, mock_http_response):
         mock_http_response(
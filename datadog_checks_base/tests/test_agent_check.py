@@ -455,6 +455,38 @@ class TestMetrics:
             check.gauge(metric_name, '85k')
         aggregator.assert_metric(metric_name, count=0)
 
+    def test_namespace_change(self, aggregator):
+        check = AgentCheck()
+        check.__NAMESPACE__ = 'foo'
+        check.gauge('metric', 0)
+
+        check.__NAMESPACE__ = 'bar'
+        check.gauge('metric', 0)
+
+        aggregator.assert_metric('foo.metric', count=1)
+        aggregator.assert_metric('bar.metric', count=1)
+
+    def test_submit_metrics(self, aggregator):
+        check = AgentCheck()
+        check.__NAMESPACE__ = 'test'
+        tags = ('foo:bar', b'bar:baz')
+
+        check.submit_metrics(
+            [
+                (aggregator.GAUGE, 'metric1', 1, tags, None),
+                (aggregator.RATE, 'metric2', 2, tags, 'host'),
+                (aggregator.COUNT, 'metric3', None, tags, None),
+                (aggregator.GAUGE, 'metric4', 4, ['baz:foo'], None),
+            ]
+        )
+
+        aggregator.assert_metric('test.metric1', 1, metric_type=aggregator.GAUGE, tags=['foo:bar', 'bar:baz'])
+        aggregator.assert_metric(
+            'test.metric2', 2, metric_type=aggregator.RATE, tags=['foo:bar', 'bar:baz'], hostname='host'
+        )
+        aggregator.assert_metric('test.metric4', 4, metric_type=aggregator.GAUGE, tags=['baz:foo'])
+        aggregator.assert_all_metrics_covered()
+
 
 class TestEvents:
     def test_valid_event(self, aggregator):
@@ -602,6 +634,28 @@ class TestTags:
         normalized_tags = check._normalize_tags_type(tags, device_name)
         assert len(normalized_tags) == 1
 
+    def test_tuple_cached(self):
+        check = AgentCheck()
+        tags = ('foo:bar', b'bar:baz', None)
+
+        normalized_tags, tags_hash = check._normalize_tag_set(tags)
+        assert normalized_tags == ['foo:bar', 'bar:baz']
+        assert tags_hash == hash(frozenset(normalized_tags))
+
+        # Ensure normalization only happens once
+        with mock.patch.object(check, '_normalize_tags_type') as normalize_tags_type:
+            assert check._normalize_tag_set(tags)[0] is normalized_tags
+            normalize_tags_type.assert_not_called()
+
+    def test_tuple_cache_limit(self):
+        check = AgentCheck()
+        check.TAG_SET_CACHE_SIZE = 2
+
+        for i in range(5):
+            check._normalize_tag_set(('tag:{}'.format(i),))
+
+        assert len(check._tag_set_cache) <= 2
+
     def test_none_value(self, caplog):
         check = AgentCheck()
         tags = [None, 'tag:foo']
@@ -650,6 +704,23 @@ class TestLimits:
         assert uid != check._context_uid(aggregator.GAUGE, "test.metric", ["two"], None)
         assert uid != check._context_uid(aggregator.GAUGE, "test.metric", ["one", "two"], "host")
 
+        # Test precomputed hashes of tags
+        assert uid == check._context_uid(
+            aggregator.GAUGE, "test.metric", ["one", "two"], None, hash(frozenset(["one", "two"]))
+        )
+
+    def test_metric_limit_count_tuple_tags(self, aggregator):
+        check = LimitedCheck()
+
+        for _ in range(0, 20):
+            check.count("metric", 0, tags=("foo:bar",))
+        assert len(check.get_warnings()) == 0
+
+        for i in range(0, 20):
+            check.count("metric", 0, tags=("foo:{}".format(i),))
+        assert len(check.get_warnings()) == 1
+        assert len(aggregator.metrics("metric")) == 29
+
     def test_metric_limit_gauges(self, aggregator):
         check = LimitedCheck()
         assert check.get_warnings() == []
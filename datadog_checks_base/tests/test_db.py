@@ -2,6 +2,8 @@
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
 import logging
+import threading
+import time
 from datetime import datetime, timedelta
 
 import pytest
@@ -121,6 +123,20 @@ class TestQueryCompilation:
         with pytest.raises(ValueError, match='^field `tags` for test query must be a list$'):
             query_manager.compile_queries()
 
+    @pytest.mark.parametrize('field', ['collection_interval', 'timeout'])
+    def test_scheduling_field_not_number(self, field):
+        query_manager = create_query_manager({'name': 'test query', 'query': 'foo', 'columns': [{}], field: '5'})
+
+        with pytest.raises(ValueError, match='^field `{}` for test query must be a number$'.format(field)):
+            query_manager.compile_queries()
+
+    @pytest.mark.parametrize('field', ['collection_interval', 'timeout'])
+    def test_scheduling_field_not_positive(self, field):
+        query_manager = create_query_manager({'name': 'test query', 'query': 'foo', 'columns': [{}], field: 0})
+
+        with pytest.raises(ValueError, match='^field `{}` for test query must be a positive number$'.format(field)):
+            query_manager.compile_queries()
+
     def test_column_not_dict(self):
         query_manager = create_query_manager(
             {'name': 'test query', 'query': 'foo', 'columns': [['column']], 'tags': ['test:bar']}
@@ -1230,6 +1246,413 @@ class TestSubmission:
         aggregator.assert_all_metrics_covered()
 
 
+class TestColumnarExecution:
+    def test_basic(self, aggregator):
+        query_manager = create_query_manager(
+            {
+                'name': 'test query',
+                'query': 'foo',
+                'columns': [{'name': 'level', 'type': 'tag'}, None, {'name': 'test.foo', 'type': 'gauge'}],
+                'tags': ['test:bar'],
+            },
+            executor=mock_executor([['over', 'stuff', 9000]]),
+            tags=['test:foo'],
+            columnar=True,
+        )
+        query_manager.compile_queries()
+        query_manager.execute()
+
+        aggregator.assert_metric(
+            'test.foo', 9000, metric_type=aggregator.GAUGE, tags=['test:foo', 'test:bar', 'level:over']
+        )
+        aggregator.assert_all_metrics_covered()
+
+    def test_blocks(self, aggregator):
+        query_manager = create_query_manager(
+            {
+                'name': 'test query',
+                'query': 'foo',
+                'columns': [
+                    {'name': 'test.foo', 'type': 'count'},
+                    {'name': 'tag', 'type': 'tag'},
+                    {'name': 'test.bar', 'type': 'gauge'},
+                ],
+                'tags': ['test:bar'],
+            },
+            executor=mock_executor([[3, 'tag1', 1], [7, 'tag2', 2], [5, 'tag1', 3]]),
+            tags=['test:foo'],
+            columnar=True,
+            block_size=2,
+        )
+        query_manager.compile_queries()
+        query_manager.execute()
+
+        aggregator.assert_metric('test.foo', 8, metric_type=aggregator.COUNT, tags=['test:foo', 'test:bar', 'tag:tag1'])
+        aggregator.assert_metric('test.foo', 7, metric_type=aggregator.COUNT, tags=['test:foo', 'test:bar', 'tag:tag2'])
+        aggregator.assert_metric('test.bar', 1, metric_type=aggregator.GAUGE, tags=['test:foo', 'test:bar', 'tag:tag1'])
+        aggregator.assert_metric('test.bar', 2, metric_type=aggregator.GAUGE, tags=['test:foo', 'test:bar', 'tag:tag2'])
+        aggregator.assert_metric('test.bar', 3, metric_type=aggregator.GAUGE, tags=['test:foo', 'test:bar', 'tag:tag1'])
+        aggregator.assert_all_metrics_covered()
+
+    def test_fetchmany(self, aggregator):
+        class Cursor(object):
+            def __init__(self, _):
+                self.rows = [(1, 'tag1'), (2, 'tag2'), (3, 'tag3')]
+                self.block_sizes = []
+
+            def fetchmany(self, size):
+                self.block_sizes.append(size)
+                block, self.rows = self.rows[:size], self.rows[size:]
+                return tuple(block)
+
+        cursors = []
+
+        def executor(query):
+            cursor = Cursor(query)
+            cursors.append(cursor)
+            return cursor
+
+        query_manager = create_query_manager(
+            {
+                'name': 'test query',
+                'query': 'foo',
+                'columns': [{'name': 'test.foo', 'type': 'gauge'}, {'name': 'tag', 'type': 'tag'}],
+            },
+            executor=executor,
+            columnar=True,
+            block_size=2,
+        )
+        query_manager.compile_queries()
+        query_manager.execute()
+
+        assert cursors[0].block_sizes == [2, 2, 2]
+
+        aggregator.assert_metric('test.foo', 1, metric_type=aggregator.GAUGE, tags=['tag:tag1'])
+        aggregator.assert_metric('test.foo', 2, metric_type=aggregator.GAUGE, tags=['tag:tag2'])
+        aggregator.assert_metric('test.foo', 3, metric_type=aggregator.GAUGE, tags=['tag:tag3'])
+        aggregator.assert_all_metrics_covered()
+
+    def test_tag_list_unhashable(self, aggregator):
+        query_manager = create_query_manager(
+            {
+                'name': 'test query',
+                'query': 'foo',
+                'columns': [{'name': 'test.foo', 'type': 'gauge'}, {'name': 'role', 'type': 'tag_list'}],
+            },
+            executor=mock_executor([[1, ['primary', 'us']], [2, ['replica', 'eu']]]),
+            columnar=True,
+        )
+        query_manager.compile_queries()
+        query_manager.execute()
+
+        aggregator.assert_metric('test.foo', 1, metric_type=aggregator.GAUGE, tags=['role:primary', 'role:us'])
+        aggregator.assert_metric('test.foo', 2, metric_type=aggregator.GAUGE, tags=['role:replica', 'role:eu'])
+        aggregator.assert_all_metrics_covered()
+
+    def test_sources(self, aggregator):
+        query_manager = create_query_manager(
+            {
+                'name': 'test query',
+                'query': 'foo',
+                'columns': [
+                    {'name': 'value', 'type': 'source'},
+                    {'name': 'tag', 'type': 'tag'},
+                    {
+                        'name': 'metric',
+                        'type': 'match',
+                        'source': 'value',
+                        'items': {'foo': {'name': 'test.foo', 'type': 'gauge'}},
+                    },
+                ],
+                'extras': [{'name': 'test.bar', 'expression': 'value * 2', 'submit_type': 'gauge'}],
+            },
+            executor=mock_executor([[1, 'tag1', 'foo'], [2, 'tag2', 'bar']]),
+            columnar=True,
+        )
+        query_manager.compile_queries()
+        query_manager.execute()
+
+        aggregator.assert_metric('test.foo', 1, metric_type=aggregator.GAUGE, tags=['tag:tag1'])
+        aggregator.assert_metric('test.bar', 2, metric_type=aggregator.GAUGE, tags=['tag:tag1'])
+        aggregator.assert_metric('test.bar', 4, metric_type=aggregator.GAUGE, tags=['tag:tag2'])
+        aggregator.assert_all_metrics_covered()
+
+    def test_query_execution_error(self, caplog, aggregator):
+        class Result(object):
+            def __init__(self, _):
+                pass
+
+            def __iter__(self):
+                raise ValueError('no result set')
+
+        query_manager = create_query_manager(
+            {'name': 'test query', 'query': 'foo', 'columns': [{'name': 'test.foo', 'type': 'gauge'}]},
+            executor=Result,
+            columnar=True,
+        )
+        query_manager.compile_queries()
+        query_manager.execute()
+
+        expected_message = 'Error querying test query: no result set'
+        matches = [level for _, level, message in caplog.record_tuples if message == expected_message]
+
+        assert len(matches) == 1, 'Expected log with message: {}'.format(expected_message)
+        assert matches[0] == logging.ERROR
+
+        aggregator.assert_all_metrics_covered()
+
+    def test_result_length_mismatch(self, caplog, aggregator):
+        query_manager = create_query_manager(
+            {
+                'name': 'test query',
+                'query': 'foo',
+                'columns': [{'name': 'test.foo', 'type': 'gauge'}, {'name': 'test.bar', 'type': 'gauge'}],
+            },
+            executor=mock_executor([[1, 2, 3], [4, 5]]),
+            columnar=True,
+        )
+        query_manager.compile_queries()
+        query_manager.execute()
+
+        expected_message = 'Query test query expected 2 columns, got 3'
+        matches = [level for _, level, message in caplog.record_tuples if message == expected_message]
+
+        assert len(matches) == 1, 'Expected log with message: {}'.format(expected_message)
+        assert matches[0] == logging.ERROR
+
+        aggregator.assert_metric('test.foo', 4, metric_type=aggregator.GAUGE, tags=[])
+        aggregator.assert_metric('test.bar', 5, metric_type=aggregator.GAUGE, tags=[])
+        aggregator.assert_all_metrics_covered()
+
+
+class TestTelemetry:
+    @pytest.mark.parametrize('columnar', [False, True], ids=['rows', 'columns'])
+    def test_query_telemetry(self, columnar, aggregator):
+        query_manager = create_query_manager(
+            {
+                'name': 'test query',
+                'query': 'foo',
+                'columns': [{'name': 'test.foo', 'type': 'gauge'}, {'name': 'tag', 'type': 'tag'}],
+            },
+            executor=mock_executor([[1, 'tag1'], [2, 'tag2'], [3, 'tag3']]),
+            tags=['test:foo'],
+            columnar=columnar,
+            telemetry=True,
+        )
+        query_manager.compile_queries()
+        query_manager.execute()
+
+        aggregator.assert_metric(
+            'telemetry.query.rows', 3, metric_type=aggregator.GAUGE, tags=['test:foo', 'query:test query']
+        )
+        aggregator.assert_metric(
+            'telemetry.query.duration', metric_type=aggregator.GAUGE, tags=['test:foo', 'query:test query']
+        )
+
+    def test_disabled(self, aggregator):
+        query_manager = create_query_manager(
+            {'name': 'test query', 'query': 'foo', 'columns': [{'name': 'test.foo', 'type': 'gauge'}]},
+            executor=mock_executor([[1]]),
+        )
+        query_manager.compile_queries()
+        query_manager.execute()
+
+        aggregator.assert_metric('test.foo', 1)
+        aggregator.assert_all_metrics_covered()
+
+
+class TestScheduling:
+    def test_collection_interval(self, aggregator, mocker):
+        query_manager = create_query_manager(
+            {'name': 'query1', 'query': 'foo', 'columns': [{'name': 'test.foo', 'type': 'gauge'}]},
+            {
+                'name': 'query2',
+                'query': 'foo',
+                'columns': [{'name': 'test.bar', 'type': 'gauge'}],
+                'collection_interval': 60,
+            },
+            executor=mock_executor([[1]]),
+        )
+        query_manager.compile_queries()
+
+        get_timestamp = mocker.patch('datadog_checks.base.utils.db.core.get_timestamp')
+        for timestamp in (0, 30, 60):
+            get_timestamp.return_value = timestamp
+            query_manager.execute()
+
+        aggregator.assert_metric('test.foo', 1, count=3)
+        aggregator.assert_metric('test.bar', 1, count=2)
+        aggregator.assert_all_metrics_covered()
+
+    def test_workers_require_executor_factory(self):
+        with pytest.raises(ValueError, match='^an `executor_factory` is required when using `workers`$'):
+            create_query_manager(workers=2)
+
+    @pytest.mark.parametrize('columnar', [False, True], ids=['rows', 'columns'])
+    def test_workers(self, columnar, aggregator):
+        thread_ids = set()
+        connections = []
+
+        def executor_factory():
+            connection = []
+            connections.append(connection)
+
+            def executor(query):
+                thread_ids.add(threading.current_thread().ident)
+                connection.append(query)
+                time.sleep(0.1 if query == 'query1' else 0)
+                return [[int(query[-1]), query]]
+
+            return executor
+
+        query_manager = create_query_manager(
+            *[
+                {
+                    'name': 'query{}'.format(i),
+                    'query': 'query{}'.format(i),
+                    'columns': [{'name': 'test.foo', 'type': 'gauge'}, {'name': 'query', 'type': 'tag'}],
+                }
+                for i in range(1, 5)
+            ],
+            executor=mock_executor(None),
+            executor_factory=executor_factory,
+            workers=2,
+            columnar=columnar,
+        )
+        query_manager.compile_queries()
+
+        try:
+            query_manager.execute()
+        finally:
+            query_manager.close()
+
+        # Every worker uses its own executor from the main thread
+        assert len(connections) == 2
+        assert sorted(query for connection in connections for query in connection) == [
+            'query1',
+            'query2',
+            'query3',
+            'query4',
+        ]
+        assert threading.current_thread().ident not in thread_ids
+
+        # Results are submitted in the order that queries are defined
+        assert [metric.value for metric in aggregator.metrics('test.foo')] == [1, 2, 3, 4]
+        for i in range(1, 5):
+            aggregator.assert_metric('test.foo', i, tags=['query:query{}'.format(i)])
+
+        aggregator.assert_all_metrics_covered()
+
+    def test_workers_timeout(self, caplog, aggregator):
+        def executor_factory():
+            def executor(query):
+                if query == 'slow':
+                    time.sleep(0.5)
+
+                return [[1]]
+
+            return executor
+
+        query_manager = create_query_manager(
+            {'name': 'slow query', 'query': 'slow', 'columns': [{'name': 'test.foo', 'type': 'gauge'}], 'timeout': 0.1},
+            {'name': 'fast query', 'query': 'fast', 'columns': [{'name': 'test.bar', 'type': 'gauge'}]},
+            executor_factory=executor_factory,
+            workers=2,
+        )
+        query_manager.compile_queries()
+
+        try:
+            query_manager.execute()
+        finally:
+            query_manager.close()
+
+        expected_message = 'Timed out querying slow query after 0.1 seconds'
+        matches = [level for _, level, message in caplog.record_tuples if message == expected_message]
+
+        assert len(matches) == 1, 'Expected log with message: {}'.format(expected_message)
+        assert matches[0] == logging.ERROR
+
+        aggregator.assert_metric('test.bar', 1)
+        aggregator.assert_all_metrics_covered()
+
+    def test_workers_query_error(self, caplog, aggregator):
+        def executor_factory():
+            def executor(query):
+                raise ValueError('no result set')
+
+            return executor
+
+        query_manager = create_query_manager(
+            {'name': 'test query', 'query': 'foo', 'columns': [{'name': 'test.foo', 'type': 'gauge'}]},
+            executor_factory=executor_factory,
+            workers=1,
+        )
+        query_manager.compile_queries()
+
+        try:
+            query_manager.execute()
+        finally:
+            query_manager.close()
+
+        expected_message = 'Error querying test query: no result set'
+        matches = [level for _, level, message in caplog.record_tuples if message == expected_message]
+
+        assert len(matches) == 1, 'Expected log with message: {}'.format(expected_message)
+        assert matches[0] == logging.ERROR
+
+        aggregator.assert_all_metrics_covered()
+
+    def test_workers_executor_error(self, caplog, aggregator):
+        executors = []
+
+        def executor_factory():
+            if not executors:
+                executors.append(None)
+                raise ValueError('unable to connect')
+
+            def executor(query):
+                if len(executors) == 2:
+                    raise ValueError('connection lost')
+
+                return [[len(executors)]]
+
+            executors.append(executor)
+            return executor
+
+        released = []
+
+        query_manager = create_query_manager(
+            {'name': 'test query', 'query': 'foo', 'columns': [{'name': 'test.foo', 'type': 'gauge'}]},
+            executor_factory=executor_factory,
+            executor_teardown=released.append,
+            workers=1,
+        )
+        query_manager.compile_queries()
+
+        try:
+            # Every error is reported for its query and the next query gets a new executor
+            for _ in range(3):
+                query_manager.execute()
+
+            # The executor that failed was released
+            assert released == [executors[1]]
+        finally:
+            query_manager.close()
+
+        # The remaining executor is released when closing
+        assert released == [executors[1], executors[2]]
+
+        query_manager.close()
+        assert len(released) == 2
+
+        messages = [message for _, _, message in caplog.record_tuples]
+        assert 'Error querying test query: unable to connect' in messages
+        assert 'Error querying test query: connection lost' in messages
+
+        aggregator.assert_metric('test.foo', 3, count=1)
+        aggregator.assert_all_metrics_covered()
+
+
 class TestColumnTransformers:
     def test_tag_boolean(self, aggregator):
         query_manager = create_query_manager(
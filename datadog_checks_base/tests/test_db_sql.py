@@ -4,9 +4,11 @@
 # Licensed under a 3-clause BSD style license (see LICENSE)
 from __future__ import unicode_literals
 
+import mock
 import pytest
 
-from datadog_checks.base.utils.db.sql import compute_sql_signature, normalize_query_tag
+from datadog_checks.base import AgentCheck
+from datadog_checks.base.utils.db.sql import ObfuscationCache, compute_sql_signature, normalize_query_tag
 
 
 class TestSQL:
@@ -40,3 +42,84 @@ class TestSQL:
     )
     def test_normalize_query_tag(self, arg, expected):
         assert expected == normalize_query_tag(arg)
+
+
+class TestObfuscationCache:
+    def test_get(self):
+        cache = ObfuscationCache()
+        obfuscate = mock.MagicMock(side_effect=lambda query: query.replace('1', '?'))
+
+        assert ('select ?', compute_sql_signature('select ?')) == cache.get('a', 'select 1', obfuscate)
+        assert ('select ?', compute_sql_signature('select ?')) == cache.get('a', 'select 1', obfuscate)
+        assert obfuscate.call_count == 1
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # A different text for the same statement is obfuscated again
+        assert ('select ? + ?', compute_sql_signature('select ? + ?')) == cache.get('a', 'select 1 + 1', obfuscate)
+        # And so is the same text for a different statement
+        cache.get('b', 'select 1', obfuscate)
+        assert obfuscate.call_count == 3
+        assert (cache.hits, cache.misses) == (1, 3)
+
+    def test_get_error(self):
+        cache = ObfuscationCache()
+        obfuscate = mock.MagicMock(side_effect=Exception('failed'))
+
+        with pytest.raises(Exception, match='failed'):
+            cache.get('a', 'select 1', obfuscate)
+        assert len(cache) == 0
+
+    def test_lru_eviction(self):
+        cache = ObfuscationCache(max_size=2)
+        obfuscate = mock.MagicMock(side_effect=lambda query: query)
+
+        cache.get('a', 'select 1', obfuscate)
+        cache.get('b', 'select 2', obfuscate)
+        cache.get('a', 'select 1', obfuscate)
+        cache.get('c', 'select 3', obfuscate)
+        assert len(cache) == 2
+        assert cache.evictions == 1
+
+        # 'b' was the least recently used statement
+        cache.get('a', 'select 1', obfuscate)
+        cache.get('b', 'select 2', obfuscate)
+        assert obfuscate.call_count == 4
+
+    def test_ttl(self):
+        cache = ObfuscationCache(ttl=10)
+        obfuscate = mock.MagicMock(side_effect=lambda query: query)
+
+        with mock.patch('datadog_checks.base.utils.db.sql.time.time', return_value=1000):
+            cache.get('a', 'select 1', obfuscate)
+        with mock.patch('datadog_checks.base.utils.db.sql.time.time', return_value=1009):
+            cache.get('a', 'select 1', obfuscate)
+        assert obfuscate.call_count == 1
+        with mock.patch('datadog_checks.base.utils.db.sql.time.time', return_value=1010):
+            cache.get('a', 'select 1', obfuscate)
+        assert obfuscate.call_count == 2
+
+    def test_submit_telemetry(self, aggregator):
+        check = AgentCheck('test', {}, [{}])
+        cache = ObfuscationCache(max_size=1)
+        obfuscate = mock.MagicMock(side_effect=lambda query: query)
+
+        cache.get('a', 'select 1', obfuscate)
+        cache.get('a', 'select 1', obfuscate)
+        cache.get('b', 'select 2', obfuscate)
+        cache.submit_telemetry(check, 'dd.test', tags=['foo:bar'])
+
+        aggregator.assert_metric('dd.test.obfuscation_cache.size', 1, metric_type=aggregator.GAUGE, tags=['foo:bar'])
+        for name, value in (('hits', 1), ('misses', 2), ('evictions', 1)):
+            aggregator.assert_metric(
+                'dd.test.obfuscation_cache.{}'.format(name), value, metric_type=aggregator.COUNT, tags=['foo:bar']
+            )
+
+        # The cache is shared, another instance only submits what happened since the previous submission
+        aggregator.reset()
+        cache.get('b', 'select 2', obfuscate)
+        cache.submit_telemetry(AgentCheck('test', {}, [{}]), 'dd.test', tags=['foo:bar'])
+
+        for name, value in (('hits', 1), ('misses', 0), ('evictions', 0)):
+            aggregator.assert_metric(
+                'dd.test.obfuscation_cache.{}'.format(name), value, metric_type=aggregator.COUNT, tags=['foo:bar']
+            )
@@ -169,3 +169,81 @@ class TestStatementMetrics:
             rows,
             apply_row_limits(rows, {'count': (20, 20), 'time': (12, 5)}, 'time', False, key=lambda row: row['_']),
         )
+
+    def test_compute_derivative_rows_new_metric(self):
+        sm = StatementMetrics()
+
+        def key(row):
+            return row['query']
+
+        rows1 = [{'count': 1, 'query': 'COMMIT'}]
+        rows2 = [{'count': 2, 'time': 10, 'query': 'COMMIT'}]
+        rows3 = [{'count': 3, 'time': 15, 'query': 'COMMIT'}]
+
+        assert [] == sm.compute_derivative_rows(rows1, ['count', 'time'], key=key)
+        # The 'time' metric can't be computed without a previous value
+        assert [] == sm.compute_derivative_rows(rows2, ['count', 'time'], key=key)
+        assert [{'count': 1, 'time': 5, 'query': 'COMMIT'}] == sm.compute_derivative_rows(
+            rows3, ['count', 'time'], key=key
+        )
+
+    def test_apply_row_limits_ties(self):
+        rows = [{'_': i, 'count': 1, 'time': 1} for i in range(10)]
+
+        # Ties are resolved like a stable sort: the last rows are the top ones, the first rows the bottom ones
+        assert [0, 1, 7, 8, 9] == sorted(
+            row['_'] for row in apply_row_limits(rows, {'count': (3, 2)}, 'time', True, key=lambda row: row['_'])
+        )
+
+    def test_apply_row_limits_all_rows(self):
+        rows = [
+            {'_': 0, 'count': 1, 'time': 30},
+            {'_': 1, 'count': 2, 'time': 20},
+            {'_': 0, 'count': 3, 'time': 10},
+        ]
+
+        # Rows are still deduplicated by key when the limits select every row
+        assert [{'_': 0, 'count': 3, 'time': 10}, {'_': 1, 'count': 2, 'time': 20}] == apply_row_limits(
+            rows, {'count': (2, 1)}, 'time', True, key=lambda row: row['_']
+        )
+
+
+def _statement_rows(count, run):
+    return [
+        {
+            'query': 'SELECT * FROM table_{}'.format(i),
+            'db': 'puppies',
+            'user': 'dog',
+            'count': run * (i % 7),
+            'time': run * (i % 11) * 1000.5,
+            'rows': run * (i % 3),
+            'errors': 0,
+        }
+        for i in range(count)
+    ]
+
+
+@pytest.mark.parametrize('statements', [50000])
+def test_compute_derivative_rows_bench(benchmark, statements):
+    def key(row):
+        return (row['query'], row['db'], row['user'])
+
+    metrics = ['count', 'time', 'rows', 'errors']
+    runs = [_statement_rows(statements, run) for run in range(1, 3)]
+    sm = StatementMetrics()
+    sm.compute_derivative_rows(runs[0], metrics, key=key)
+
+    def compute():
+        # Alternate between two snapshots, so that every run finds a previous value for every statement
+        runs.reverse()
+        return sm.compute_derivative_rows(runs[0], metrics, key=key)
+
+    benchmark(compute)
+
+
+@pytest.mark.parametrize('statements', [50000])
+def test_apply_row_limits_bench(benchmark, statements):
+    rows = _statement_rows(statements, 1)
+    metric_limits = {'count': (200, 50), 'time': (200, 100), 'rows': (100, 0), 'errors': (50, 50)}
+
+    benchmark(apply_row_limits, rows, metric_limits, 'count', True, lambda row: row['query'])
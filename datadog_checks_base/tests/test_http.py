@@ -1,9 +1,12 @@
 # (C) Datadog, Inc. 2019-present
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
+import io
 import logging
 import os
 import re
+import threading
+import time
 from collections import OrderedDict
 
 import jwt
@@ -19,6 +22,7 @@ from requests.exceptions import ConnectTimeout, ProxyError
 from six import iteritems
 
 from datadog_checks.base import AgentCheck, ConfigurationError
+from datadog_checks.base.utils import http as http_module
 from datadog_checks.base.utils.headers import headers as agent_headers
 from datadog_checks.base.utils.http import STANDARD_FIELDS, RequestsWrapper, is_uds_url, quote_uds_url
 from datadog_checks.base.utils.time import get_timestamp
@@ -1646,6 +1650,58 @@ class TestSession:
             assert hasattr(http.session, key)
             assert getattr(http.session, key) == value
 
+    def test_pool_size(self):
+        instance = {'pool_connections': 2, 'pool_maxsize': 20}
+        init_config = {}
+        http = RequestsWrapper(instance, init_config)
+
+        adapter = http.session.get_adapter('https://www.google.com')
+        assert adapter._pool_connections == 2
+        assert adapter._pool_maxsize == 20
+
+    def test_shared_connections(self):
+        instance = {'persist_connections': True, 'share_connections': True}
+        init_config = {}
+        http1 = RequestsWrapper(instance, init_config)
+        http2 = RequestsWrapper(instance, init_config)
+
+        with mock.patch.dict(http_module.SHARED_ADAPTERS, clear=True), mock.patch('requests.Session.get'):
+            http1.get('https://www.google.com/search')
+            http2.get('https://www.google.com/maps')
+            http2.get('https://www.google.com:8443/maps')
+            http3 = RequestsWrapper(dict(instance, tls_verify=False), init_config)
+            http3.get('https://www.google.com/search')
+
+            assert len(http_module.SHARED_ADAPTERS) == 3
+
+            adapter = http1.session.get_adapter('https://www.google.com/')
+            assert isinstance(adapter, http_module.SharedHTTPAdapter)
+            assert http2.session.get_adapter('https://www.google.com/') is adapter
+            assert http2.session.get_adapter('https://www.google.com:8443/') is not adapter
+
+            # Closing an instance doesn't close the connections of the others
+            with mock.patch.object(adapter.poolmanager, 'clear') as clear:
+                http1.session.close()
+                clear.assert_not_called()
+            assert adapter.key in http_module.SHARED_ADAPTERS
+
+            # The connections are closed along with the last instance using them
+            with mock.patch.object(adapter.poolmanager, 'clear') as clear:
+                http2.session.close()
+                clear.assert_called_once_with()
+            assert adapter.key not in http_module.SHARED_ADAPTERS
+            assert list(http_module.SHARED_ADAPTERS.values()) == [http3.session.get_adapter('https://www.google.com/')]
+
+    def test_shared_connections_not_persisted(self):
+        instance = {'share_connections': True}
+        init_config = {}
+        http = RequestsWrapper(instance, init_config)
+
+        with mock.patch.dict(http_module.SHARED_ADAPTERS, clear=True), mock.patch('requests.get'):
+            http.get('https://www.google.com')
+
+            assert not http_module.SHARED_ADAPTERS
+
 
 class TestRemapper:
     def test_legacy_no_proxy(self):
@@ -1980,6 +2036,165 @@ class TestAPI:
             http.options_method('https://www.google.com', persist=True, auth=options['auth'])
             http.session.options.assert_called_once_with('https://www.google.com', **options)
 
+    def test_get_many(self):
+        http = RequestsWrapper({}, {})
+        urls = ['https://www.google.com/{}'.format(i) for i in range(20)]
+
+        with mock.patch('requests.get', side_effect=lambda url, **options: url) as get:
+            assert http.get_many(urls, max_concurrency=4, auth=('user', 'pass')) == urls
+
+        assert get.call_count == 20
+        for call in get.call_args_list:
+            assert call[1]['auth'] == ('user', 'pass')
+
+    def test_get_many_max_concurrency(self):
+        http = RequestsWrapper({}, {})
+        lock = threading.Lock()
+        in_flight = []
+        max_in_flight = []
+
+        def get(url, **options):
+            with lock:
+                in_flight.append(url)
+                max_in_flight.append(len(in_flight))
+            time.sleep(0.01)
+            with lock:
+                in_flight.remove(url)
+            return url
+
+        with mock.patch('requests.get', side_effect=get):
+            http.get_many(['https://www.google.com/{}'.format(i) for i in range(12)], max_concurrency=3)
+
+        assert max(max_in_flight) == 3
+
+    def test_get_many_shared_connections(self):
+        http = RequestsWrapper({'persist_connections': True, 'share_connections': True}, {})
+        urls = ['https://www.google.com/search', 'https://www.google.com/maps', 'https://www.google.com:8443/maps']
+        mount_threads = []
+        mount = http.session.mount
+
+        def record_mount(prefix, adapter):
+            mount_threads.append(threading.current_thread())
+            mount(prefix, adapter)
+
+        with mock.patch.dict(http_module.SHARED_ADAPTERS, clear=True), mock.patch(
+            'requests.Session.get', side_effect=lambda url, **options: url
+        ), mock.patch.object(http.session, 'mount', side_effect=record_mount):
+            assert http.get_many(urls, max_concurrency=3) == urls
+
+        # The adapters are mounted before the requests are sent concurrently
+        assert mount_threads == [threading.current_thread()] * 2
+
+    def test_get_many_error(self):
+        http = RequestsWrapper({}, {})
+
+        with mock.patch('requests.get', side_effect=[mock.MagicMock(), ConnectTimeout]):
+            with pytest.raises(ConnectTimeout):
+                http.get_many(['https://www.google.com', 'https://www.google.com'], max_concurrency=1)
+
+        with pytest.raises(ValueError):
+            http.get_many(['https://www.google.com'], max_concurrency=0)
+
+    def test_request_timing_callback(self):
+        http = RequestsWrapper({}, {})
+        http.request_timing_callback = mock.MagicMock()
+
+        with mock.patch('requests.get'):
+            http.get('https://www.google.com')
+
+        http.request_timing_callback.assert_called_once_with('get', 'https://www.google.com', mock.ANY)
+        assert http.request_timing_callback.call_args[0][2] >= 0
+
+    def test_request_timing_telemetry(self, aggregator):
+        check = AgentCheck('test', {}, [{'telemetry': True, 'tags': ['foo:bar']}])
+
+        with mock.patch('requests.get'):
+            check.http.get('https://www.google.com/search')
+
+        aggregator.assert_metric(
+            'telemetry.http.request.duration',
+            metric_type=aggregator.HISTOGRAM,
+            tags=['http_method:get', 'http_host:www.google.com', 'foo:bar'],
+            count=1,
+        )
+
+    def test_request_timing_telemetry_disabled(self):
+        check = AgentCheck('test', {}, [{}])
+
+        assert check.http.request_timing_callback is None
+
+
+def json_response(body, status_code=200):
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = io.BytesIO(body)
+    return response
+
+
+@pytest.fixture(params=['ijson', 'stdlib'])
+def json_streaming(request):
+    if request.param == 'ijson':
+        pytest.importorskip('ijson')
+        yield
+    else:
+        with mock.patch('datadog_checks.base.utils.http.ijson', None):
+            yield
+
+
+@pytest.mark.usefixtures('json_streaming')
+class TestStreamingJSON:
+    def test_items(self):
+        http = RequestsWrapper({}, {})
+
+        with mock.patch('requests.get', return_value=json_response(b'[{"name": "q1", "rate": 0.5}, {"name": "q2"}]')):
+            items = list(http.get_json_items('http://localhost/api/queues'))
+
+        assert items == [{'name': 'q1', 'rate': 0.5}, {'name': 'q2'}]
+        assert isinstance(items[0]['rate'], float)
+
+    def test_items_prefix(self):
+        http = RequestsWrapper({}, {})
+        body = b'{"total": 2, "apps": {"app": [{"id": 1}, {"id": 2}]}}'
+
+        with mock.patch('requests.get', return_value=json_response(body)):
+            assert list(http.get_json_items('http://localhost/ws/v1/apps', 'apps.app.item')) == [{'id': 1}, {'id': 2}]
+
+    def test_items_streamed(self):
+        http = RequestsWrapper({}, {})
+
+        with mock.patch('requests.get', return_value=json_response(b'[]')) as get:
+            list(http.get_json_items('http://localhost/api/queues'))
+
+        # The body must not be fetched up front unless it is decoded at once
+        assert get.call_args[1].get('stream', False) is (http_module.ijson is not None)
+
+    def test_members(self):
+        http = RequestsWrapper({}, {})
+        body = b'{"cluster_name": "es", "nodes": {"n1": {"name": "a", "jvm": {"heap": [1, 2]}}, "n2": {"name": "b"}}}'
+
+        with mock.patch('requests.get', return_value=json_response(body)):
+            members = list(http.get_json_members('http://localhost/_nodes/stats', ('', 'nodes')))
+
+        assert members == [
+            ('', 'cluster_name', 'es'),
+            ('nodes', 'n1', {'name': 'a', 'jvm': {'heap': [1, 2]}}),
+            ('nodes', 'n2', {'name': 'b'}),
+        ]
+
+    def test_http_error(self):
+        http = RequestsWrapper({}, {})
+
+        with mock.patch('requests.get', return_value=json_response(b'', status_code=500)):
+            with pytest.raises(requests.exceptions.HTTPError):
+                list(http.get_json_items('http://localhost/api/queues'))
+
+    def test_invalid_json(self):
+        http = RequestsWrapper({}, {})
+
+        with mock.patch('requests.get', return_value=json_response(b'[{"name": "q1"}, {"na')):
+            with pytest.raises(ValueError):
+                list(http.get_json_items('http://localhost/api/queues'))
+
 
 class TestIntegration:
     def test_session_timeout(self):
@@ -9,15 +9,21 @@ import logging
 import math
 import os
 import re
+from collections import namedtuple
 
 import mock
 import pytest
 import requests
+from google.protobuf.internal.encoder import _VarintBytes  # pylint: disable=E0611,E0401
+from google.protobuf.message import DecodeError
 from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily, SummaryMetricFamily
 from prometheus_client.samples import Sample
-from six import iteritems
+from six import itervalues
 
 from datadog_checks.base import ensure_bytes
+from datadog_checks.base.checks.openmetrics.label_joins import LabelJoinIndex
+from datadog_checks.base.utils.prometheus import metrics_pb2
+from datadog_checks.base.utils.prometheus.functions import PROTOBUF_CONTENT_TYPE, parse_metric_family_stream
 from datadog_checks.checks.openmetrics import OpenMetricsBaseCheck
 from datadog_checks.dev import get_here
 
@@ -207,6 +213,104 @@ def test_poll_octet_stream(mocked_prometheus_check, mocked_prometheus_scraper_co
         assert len(messages) == 40
 
 
+def protobuf_response(messages):
+    payload = b''.join(_VarintBytes(message.ByteSize()) + message.SerializeToString() for message in messages)
+
+    response = requests.Response()
+    response.raw = io.BytesIO(payload)
+    response.status_code = 200
+    response.headers = {'Content-Type': PROTOBUF_CONTENT_TYPE}
+    return response
+
+
+@pytest.fixture
+def protobuf_messages():
+    counter = metrics_pb2.MetricFamily(name='http_requests_total', help='Total requests.', type=metrics_pb2.COUNTER)
+    metric = counter.metric.add(timestamp_ms=1600000000500)
+    metric.label.add(name='code', value='200')
+    metric.counter.value = 1027
+
+    gauge = metrics_pb2.MetricFamily(name='process_open_fds', help='Open fds.', type=metrics_pb2.GAUGE)
+    gauge.metric.add().gauge.value = 12
+
+    histogram = metrics_pb2.MetricFamily(name='request_duration_seconds', help='Latency.', type=metrics_pb2.HISTOGRAM)
+    metric = histogram.metric.add()
+    metric.label.add(name='handler', value='/')
+    metric.histogram.sample_count = 7
+    metric.histogram.sample_sum = 3.5
+    metric.histogram.bucket.add(upper_bound=0.5, cumulative_count=4)
+    metric.histogram.bucket.add(upper_bound=2.5, cumulative_count=6)
+
+    summary = metrics_pb2.MetricFamily(name='gc_duration_seconds', help='GC pauses.', type=metrics_pb2.SUMMARY)
+    metric = summary.metric.add()
+    metric.summary.sample_count = 9
+    metric.summary.sample_sum = 0.25
+    metric.summary.quantile.add(quantile=0.5, value=0.01)
+    metric.summary.quantile.add(quantile=0.99, value=0.1)
+
+    return [counter, gauge, histogram, summary]
+
+
+def test_parse_metric_family_protobuf(p_check, mocked_prometheus_scraper_config, protobuf_messages):
+    """The protobuf format gives the same metrics as the text format"""
+    text_data = (
+        "# HELP http_requests_total Total requests.\n"
+        "# TYPE http_requests_total counter\n"
+        "http_requests_total{code=\"200\"} 1027 1600000000500\n"
+        "# HELP process_open_fds Open fds.\n"
+        "# TYPE process_open_fds gauge\n"
+        "process_open_fds 12\n"
+        "# HELP request_duration_seconds Latency.\n"
+        "# TYPE request_duration_seconds histogram\n"
+        "request_duration_seconds_bucket{handler=\"/\",le=\"0.5\"} 4\n"
+        "request_duration_seconds_bucket{handler=\"/\",le=\"2.5\"} 6\n"
+        "request_duration_seconds_bucket{handler=\"/\",le=\"+Inf\"} 7\n"
+        "request_duration_seconds_sum{handler=\"/\"} 3.5\n"
+        "request_duration_seconds_count{handler=\"/\"} 7\n"
+        "# HELP gc_duration_seconds GC pauses.\n"
+        "# TYPE gc_duration_seconds summary\n"
+        "gc_duration_seconds{quantile=\"0.5\"} 0.01\n"
+        "gc_duration_seconds{quantile=\"0.99\"} 0.1\n"
+        "gc_duration_seconds_sum 0.25\n"
+        "gc_duration_seconds_count 9\n"
+    )
+    text_response = MockResponse(text_data, text_content_type)
+    expected = list(p_check.parse_metric_family(text_response, mocked_prometheus_scraper_config))
+
+    metrics = list(p_check.parse_metric_family(protobuf_response(protobuf_messages), mocked_prometheus_scraper_config))
+
+    assert metrics == expected
+
+
+def test_parse_metric_family_stream(protobuf_messages):
+    payload = b''.join(_VarintBytes(message.ByteSize()) + message.SerializeToString() for message in protobuf_messages)
+
+    # Messages and their lengths are split across chunks
+    chunks = [payload[i : i + 3] for i in range(0, len(payload), 3)]
+    assert list(parse_metric_family_stream(chunks)) == protobuf_messages
+
+    with pytest.raises(DecodeError):
+        list(parse_metric_family_stream([payload[:-1]]))
+
+
+def test_process_protobuf(aggregator, mocked_prometheus_check, protobuf_messages):
+    check = mocked_prometheus_check
+    instance = copy.deepcopy(PROMETHEUS_CHECK_INSTANCE)
+    instance['metrics'] = [{'http_requests_total': 'requests', 'request_duration_seconds': 'request.duration'}]
+    instance['use_protobuf'] = True
+    config = check.get_scraper_config(instance)
+    check.poll = mock.MagicMock(return_value=protobuf_response(protobuf_messages))
+
+    check.process(config)
+
+    aggregator.assert_metric('prometheus.requests', 1027, tags=['code:200'])
+    aggregator.assert_metric('prometheus.request.duration.count', 7, tags=['handler:/', 'upper_bound:none'])
+    aggregator.assert_metric('prometheus.request.duration.count', 4, tags=['handler:/', 'upper_bound:0.5'])
+    aggregator.assert_metric('prometheus.request.duration.count', 6, tags=['handler:/', 'upper_bound:2.5'])
+    aggregator.assert_metric('prometheus.request.duration.sum', 3.5, tags=['handler:/'])
+    aggregator.assert_all_metrics_covered()
+
+
 def test_submit_gauge_with_labels(aggregator, mocked_prometheus_check, mocked_prometheus_scraper_config):
     """ submitting metrics that contain labels should result in tags on the gauge call """
     ref_gauge = GaugeMetricFamily(
@@ -1330,6 +1434,38 @@ def test_decumulate_histogram_buckets_multiple_contexts(p_check, mocked_promethe
     assert sorted(expected_metric.samples, key=lambda i: i[0]) == sorted(current_metric.samples, key=lambda i: i[0])
 
 
+def test_decumulate_histogram_buckets_unsorted(p_check, mocked_prometheus_scraper_config):
+    text_data = (
+        '# HELP random_histogram Nonsense histogram.\n'
+        '# TYPE random_histogram histogram\n'
+        'random_histogram_bucket{verb="GET",le="+Inf"} 300\n'
+        'random_histogram_bucket{verb="POST",le="1"} 50\n'
+        'random_histogram_bucket{verb="GET",le="1"} 100\n'
+        'random_histogram_bucket{verb="POST",le="+Inf"} 150\n'
+        'random_histogram_bucket{verb="GET",le="2"} 200\n'
+        'random_histogram_bucket{verb="GET",le="2"} 250\n'
+        'random_histogram_sum{verb="GET"} 256\n'
+        'random_histogram_count{verb="GET"} 300\n'
+    )
+
+    response = MockResponse(text_data, text_content_type)
+    check = p_check
+    current_metric = next(check.parse_metric_family(response, mocked_prometheus_scraper_config))
+    check._decumulate_histogram_buckets(current_metric)
+
+    # The last of duplicate buckets wins
+    assert current_metric.samples == [
+        Sample('random_histogram_bucket', {'verb': 'GET', 'le': '+Inf', 'lower_bound': '2.0'}, 50.0),
+        Sample('random_histogram_bucket', {'verb': 'POST', 'le': '1', 'lower_bound': '0'}, 50.0),
+        Sample('random_histogram_bucket', {'verb': 'GET', 'le': '1', 'lower_bound': '0'}, 100.0),
+        Sample('random_histogram_bucket', {'verb': 'POST', 'le': '+Inf', 'lower_bound': '1.0'}, 100.0),
+        Sample('random_histogram_bucket', {'verb': 'GET', 'le': '2', 'lower_bound': '1.0'}, 150.0),
+        Sample('random_histogram_bucket', {'verb': 'GET', 'le': '2', 'lower_bound': '1.0'}, 150.0),
+        Sample('random_histogram_sum', {'verb': 'GET'}, 256.0),
+        Sample('random_histogram_count', {'verb': 'GET'}, 300.0),
+    ]
+
+
 def test_decumulate_histogram_buckets_negative_buckets(p_check, mocked_prometheus_scraper_config):
     text_data = (
         '# HELP random_histogram Nonsense histogram.\n'
@@ -1883,10 +2019,6 @@ def test_label_joins(aggregator, mocked_prometheus_check, mocked_prometheus_scra
         'kube_deployment_status_replicas': 'deploy.replicas.available',
     }
 
-    # dry run to build mapping
-    check.process(mocked_prometheus_scraper_config)
-
-    # run with submit
     check.process(mocked_prometheus_scraper_config)
 
     # check a bunch of metrics
@@ -2257,9 +2389,6 @@ def test_label_joins_gc(aggregator, mocked_prometheus_check, mocked_prometheus_s
         },
     }
     mocked_prometheus_scraper_config['metrics_mapper'] = {'kube_pod_status_ready': 'pod.ready'}
-    # dry run to build mapping
-    check.process(mocked_prometheus_scraper_config)
-    # run with submit
     check.process(mocked_prometheus_scraper_config)
 
     # check a bunch of metrics
@@ -2288,7 +2417,8 @@ def test_label_joins_gc(aggregator, mocked_prometheus_check, mocked_prometheus_s
         count=1,
     )
 
-    assert 15 == len(mocked_prometheus_scraper_config['_label_mapping']['pod'])
+    pods = mocked_prometheus_scraper_config['_label_join_index'].tables[('pod',)]
+    assert 15 == len(pods)
     text_data = mock_get.replace('dd-agent-62bgh', 'dd-agent-1337')
     pvc_replace = re.compile(r'^kube_persistentvolumeclaim_.*\n', re.MULTILINE)
     text_data = pvc_replace.sub('', text_data)
@@ -2298,9 +2428,9 @@ def test_label_joins_gc(aggregator, mocked_prometheus_check, mocked_prometheus_s
     )
     with mock.patch('requests.get', return_value=mock_response, __name__="get"):
         check.process(mocked_prometheus_scraper_config)
-        assert 'dd-agent-1337' in mocked_prometheus_scraper_config['_label_mapping']['pod']
-        assert 'dd-agent-62bgh' not in mocked_prometheus_scraper_config['_label_mapping']['pod']
-        assert 15 == len(mocked_prometheus_scraper_config['_label_mapping']['pod'])
+        assert ('dd-agent-1337',) in pods
+        assert ('dd-agent-62bgh',) not in pods
+        assert 15 == len(pods)
 
 
 def test_label_joins_missconfigured(aggregator, mocked_prometheus_check, mocked_prometheus_scraper_config, mock_get):
@@ -2312,9 +2442,6 @@ def test_label_joins_missconfigured(aggregator, mocked_prometheus_check, mocked_
     }
     mocked_prometheus_scraper_config['metrics_mapper'] = {'kube_pod_status_ready': 'pod.ready'}
 
-    # dry run to build mapping
-    check.process(mocked_prometheus_scraper_config)
-    # run with submit
     check.process(mocked_prometheus_scraper_config)
 
     # check a bunch of metrics
@@ -2350,9 +2477,6 @@ def test_label_join_not_existing(aggregator, mocked_prometheus_check, mocked_pro
         'kube_pod_info': {'label_to_match': 'not_existing', 'labels_to_get': ['node', 'pod_ip']}
     }
     mocked_prometheus_scraper_config['metrics_mapper'] = {'kube_pod_status_ready': 'pod.ready'}
-    # dry run to build mapping
-    check.process(mocked_prometheus_scraper_config)
-    # run with submit
     check.process(mocked_prometheus_scraper_config)
     # check a bunch of metrics
     aggregator.assert_metric(
@@ -2373,9 +2497,6 @@ def test_label_join_metric_not_existing(
         'not_existing': {'label_to_match': 'pod', 'labels_to_get': ['node', 'pod_ip']}
     }
     mocked_prometheus_scraper_config['metrics_mapper'] = {'kube_pod_status_ready': 'pod.ready'}
-    # dry run to build mapping
-    check.process(mocked_prometheus_scraper_config)
-    # run with submit
     check.process(mocked_prometheus_scraper_config)
     # check a bunch of metrics
     aggregator.assert_metric(
@@ -2395,9 +2516,6 @@ def test_label_join_with_hostname(aggregator, mocked_prometheus_check, mocked_pr
     }
     mocked_prometheus_scraper_config['label_to_hostname'] = 'node'
     mocked_prometheus_scraper_config['metrics_mapper'] = {'kube_pod_status_ready': 'pod.ready'}
-    # dry run to build mapping
-    check.process(mocked_prometheus_scraper_config)
-    # run with submit
     check.process(mocked_prometheus_scraper_config)
     # check a bunch of metrics
     aggregator.assert_metric(
@@ -2438,15 +2556,13 @@ def test_label_join_state_change(aggregator, mocked_prometheus_check, mocked_pro
         'kube_pod_status_phase': {'label_to_match': 'pod', 'labels_to_get': ['phase']},
     }
     mocked_prometheus_scraper_config['metrics_mapper'] = {'kube_pod_status_ready': 'pod.ready'}
-    # dry run to build mapping
-    check.process(mocked_prometheus_scraper_config)
-    # run with submit
     check.process(mocked_prometheus_scraper_config)
 
     # check that 15 pods are in phase:Running
-    assert 15 == len(mocked_prometheus_scraper_config['_label_mapping']['pod'])
-    for _, tags in iteritems(mocked_prometheus_scraper_config['_label_mapping']['pod']):
-        assert tags.get('phase') == 'Running'
+    pods = mocked_prometheus_scraper_config['_label_join_index'].tables[('pod',)]
+    assert 15 == len(pods)
+    for _, labels in itervalues(pods):
+        assert labels.get('phase') == 'Running'
 
     text_data = mock_get.replace(
         'kube_pod_status_phase{namespace="default",phase="Running",pod="dd-agent-62bgh"} 1',
@@ -2458,8 +2574,92 @@ def test_label_join_state_change(aggregator, mocked_prometheus_check, mocked_pro
     )
     with mock.patch('requests.get', return_value=mock_response, __name__="get"):
         check.process(mocked_prometheus_scraper_config)
-        assert 15 == len(mocked_prometheus_scraper_config['_label_mapping']['pod'])
-        assert mocked_prometheus_scraper_config['_label_mapping']['pod']['dd-agent-62bgh']['phase'] == 'Test'
+        assert 15 == len(pods)
+        assert pods[('dd-agent-62bgh',)][1]['phase'] == 'Test'
+
+
+def test_label_joins_first_scrape(aggregator, mocked_prometheus_check, mocked_prometheus_scraper_config):
+    """Metrics that come before their target metric are joined on the first scrape"""
+    text_data = (
+        '# TYPE kube_deployment_status_replicas gauge\n'
+        'kube_deployment_status_replicas{deployment="api",namespace="default"} 3\n'
+        '# TYPE kube_pod_container_status_ready gauge\n'
+        'kube_pod_container_status_ready{container="app",pod="api-1"} 1\n'
+        'kube_pod_container_status_ready{container="app",pod="api-2"} 0\n'
+        '# TYPE kube_pod_info gauge\n'
+        'kube_pod_info{node="node-1",pod="api-1"} 1\n'
+        'kube_pod_info{node="node-2",pod="api-2"} 1\n'
+        '# TYPE kube_pod_status_ready gauge\n'
+        'kube_pod_status_ready{pod="api-1"} 1\n'
+    )
+    check = mocked_prometheus_check
+    mocked_prometheus_scraper_config['namespace'] = 'ksm'
+    mocked_prometheus_scraper_config['label_joins'] = {
+        'kube_pod_info': {'labels_to_match': ['pod'], 'labels_to_get': ['node']},
+        'kube_deployment_labels': {'labels_to_match': ['deployment'], 'labels_to_get': ['label_app']},
+    }
+    mocked_prometheus_scraper_config['metrics_mapper'] = {
+        'kube_deployment_status_replicas': 'deployment.replicas',
+        'kube_pod_container_status_ready': 'container.ready',
+        'kube_pod_info': 'pod.info',
+        'kube_pod_status_ready': 'pod.ready',
+    }
+    check.poll = mock.MagicMock(return_value=MockResponse(text_data, text_content_type))
+
+    check.process(mocked_prometheus_scraper_config)
+
+    # `kube_deployment_labels` is missing, the buffered metrics are still submitted
+    aggregator.assert_metric('ksm.deployment.replicas', 3, tags=['deployment:api', 'namespace:default'], count=1)
+    aggregator.assert_metric('ksm.container.ready', 1, tags=['container:app', 'pod:api-1', 'node:node-1'], count=1)
+    aggregator.assert_metric('ksm.container.ready', 0, tags=['container:app', 'pod:api-2', 'node:node-2'], count=1)
+    aggregator.assert_metric('ksm.pod.info', 1, tags=['pod:api-1', 'node:node-1'], count=1)
+    aggregator.assert_metric('ksm.pod.info', 1, tags=['pod:api-2', 'node:node-2'], count=1)
+    aggregator.assert_metric('ksm.pod.ready', 1, tags=['pod:api-1', 'node:node-1'], count=1)
+    aggregator.assert_all_metrics_covered()
+
+    # Pods that are gone stop being joined
+    aggregator.reset()
+    check.poll.return_value = MockResponse(text_data.replace('pod="api-2"', 'pod="api-3"'), text_content_type)
+
+    check.process(mocked_prometheus_scraper_config)
+
+    assert set(mocked_prometheus_scraper_config['_label_join_index'].tables[('pod',)]) == {('api-1',), ('api-3',)}
+    aggregator.assert_metric('ksm.container.ready', 1, tags=['container:app', 'pod:api-1', 'node:node-1'], count=1)
+
+
+def test_label_join_index():
+    Metric = namedtuple('Metric', 'name samples')
+    index = LabelJoinIndex(
+        {
+            'kube_pod_info': {'labels_to_match': ['pod', 'namespace'], 'labels_to_get': ['node']},
+            'kube_pod_labels': {'labels_to_match': ['namespace', 'pod'], 'labels_to_get': ['*']},
+        }
+    )
+    # Both target metrics are matched on the same labels, so they share a table
+    assert list(index.tables) == [('namespace', 'pod')]
+
+    def scrape(pods):
+        pod_info = [('kube_pod_info', {'pod': p, 'namespace': 'ns', 'node': 'n-' + p}, 1) for p in pods]
+        index.store(Metric('kube_pod_info', pod_info), 1, 2)
+        pod_labels = [('kube_pod_labels', {'pod': 'p1', 'namespace': 'ns', 'app': 'a'}, 1)]
+        index.store(Metric('kube_pod_labels', pod_labels), 1, 2)
+        samples = [('kube_pod_ready', {'pod': p, 'namespace': 'ns'}, 1) for p in ('p1', 'p2')]
+        index.join(Metric('kube_pod_ready', samples), 1)
+        index.evict()
+        return [sample[1] for sample in samples]
+
+    assert scrape(['p1', 'p2']) == [
+        {'pod': 'p1', 'namespace': 'ns', 'node': 'n-p1', 'app': 'a'},
+        {'pod': 'p2', 'namespace': 'ns', 'node': 'n-p2'},
+    ]
+    # p2 disappeared from kube_pod_info during the previous scrape: it is still joined during the scrape it
+    # disappeared from, since target metrics may come after the metrics they are joined to, then evicted.
+    assert scrape(['p1']) == [
+        {'pod': 'p1', 'namespace': 'ns', 'node': 'n-p1', 'app': 'a'},
+        {'pod': 'p2', 'namespace': 'ns', 'node': 'n-p2'},
+    ]
+    assert list(index.tables[('namespace', 'pod')]) == [('ns', 'p1')]
+    assert scrape(['p1'])[1] == {'pod': 'p2', 'namespace': 'ns'}
 
 
 def test_label_to_match_single(benchmark, mocked_prometheus_check, mocked_prometheus_scraper_config, mock_get):
@@ -2483,9 +2683,6 @@ def test_label_to_match_single(benchmark, mocked_prometheus_check, mocked_promet
 
     @benchmark
     def run_check():
-        # dry run to build mapping
-        check.process(mocked_prometheus_scraper_config)
-        # run with submit
         check.process(mocked_prometheus_scraper_config)
 
 
@@ -2510,9 +2707,6 @@ def test_label_to_match_multiple(benchmark, mocked_prometheus_check, mocked_prom
 
     @benchmark
     def run_check():
-        # dry run to build mapping
-        check.process(mocked_prometheus_scraper_config)
-        # run with submit
         check.process(mocked_prometheus_scraper_config)
 
 
@@ -2550,6 +2744,21 @@ def test_health_service_check_failing(aggregator, mocked_prometheus_check, mocke
     )
 
 
+def test_telemetry_payload_size_streamed(
+    aggregator, mocked_prometheus_check, mocked_prometheus_scraper_config, mock_http_response
+):
+    """ Tests the payload size is counted while parsing when the endpoint doesn't send a content length """
+    check = mocked_prometheus_check
+    f_name = os.path.join(os.path.dirname(__file__), 'fixtures', 'prometheus', 'metrics.txt')
+    mock_http_response(file_path=f_name)
+
+    mocked_prometheus_scraper_config['namespace'] = 'prometheus'
+    mocked_prometheus_scraper_config['telemetry'] = True
+    check.process(mocked_prometheus_scraper_config)
+
+    aggregator.assert_metric('prometheus.telemetry.payload.size', value=14494, count=1)
+
+
 def test_text_filter_input(mocked_prometheus_check, mocked_prometheus_scraper_config):
     check = mocked_prometheus_check
     mocked_prometheus_scraper_config['_text_filter_blacklist'] = ["string1", "string2"]
@@ -2612,9 +2821,6 @@ def test_filter_metrics(
         'kube_pod_container_status_restarts': 'pod.restart',
         'kube_pod_container_status_restarts_old': 'pod.restart_old',
     }
-    # dry run to build mapping
-    check.process(mocked_filter_openmetrics_check_scraper_config)
-    # run with submit
     check.process(mocked_filter_openmetrics_check_scraper_config)
     # check a bunch of metrics
     aggregator.assert_metric(
@@ -2719,6 +2925,24 @@ def test_http_handler(mocked_openmetrics_check_factory):
     assert http_handler.options['headers']['accept'] == 'text/plain'
 
 
+def test_http_handler_protobuf(mocked_openmetrics_check_factory):
+    instance = dict(
+        {
+            'prometheus_url': 'https://www.example.com',
+            'metrics': [{'foo': 'bar'}],
+            'namespace': 'openmetrics',
+            'use_protobuf': True,
+        }
+    )
+    check = mocked_openmetrics_check_factory(instance)
+    scraper_config = check.get_scraper_config(instance)
+
+    http_handler = check.get_http_handler(scraper_config)
+
+    assert http_handler.options['headers']['accept'].startswith(PROTOBUF_CONTENT_TYPE)
+    assert 'text/plain' in http_handler.options['headers']['accept']
+
+
 def test_simple_type_overrides(aggregator, mocked_prometheus_check, text_data):
     """
     Test that metric type is overridden correctly.
@@ -8,7 +8,7 @@ from requests import Response
 
 
 class MockResponse(Response):
-    def __init__(self, content='', file_path=None, status_code=200, normalize_content=True):
+    def __init__(self, content='', file_path=None, status_code=200, normalize_content=True, headers=None):
         super(MockResponse, self).__init__()
 
         if file_path is not None:
@@ -25,3 +25,5 @@ class MockResponse(Response):
 
         # Add new keyword arguments to set as needed
         self.status_code = status_code
+        if headers:
+            self.headers.update(headers)
@@ -6,6 +6,11 @@ from __future__ import division
 import os
 import platform
 import re
+import threading
+import time
+from collections import namedtuple
+from multiprocessing import TimeoutError as PoolTimeoutError
+from multiprocessing.pool import ThreadPool
 from xml.etree import ElementTree as ET
 
 import psutil
@@ -14,7 +19,13 @@ from six import iteritems, string_types
 from datadog_checks.base import AgentCheck, ConfigurationError, is_affirmative
 from datadog_checks.base.utils.platform import Platform
 from datadog_checks.base.utils.subprocess_output import SubprocessOutputEmptyError, get_subprocess_output
-from datadog_checks.base.utils.timeout import TimeoutException, timeout
+from datadog_checks.base.utils.timeout import TimeoutException
+
+try:
+    from select import POLLERR, POLLPRI, poll
+except ImportError:
+    # Windows
+    poll = None
 
 if platform.system() == 'Windows':
     import win32wnet
@@ -33,6 +44,138 @@ else:
         return os.path.basename(device)
 
 
+# Number of threads probing the usage of the mount points
+MOUNT_PROBE_WORKERS = 4
+
+DiskUsage = namedtuple('DiskUsage', ['total', 'used', 'free', 'percent'])
+
+
+def _disk_usage_from_statvfs(st):
+    """
+    Compute the disk usage of a mount point like `psutil.disk_usage` does, from the result of `os.statvfs`.
+    """
+    total = st.f_blocks * st.f_frsize
+    avail_to_root = st.f_bfree * st.f_frsize
+    avail_to_user = st.f_bavail * st.f_frsize
+    used = total - avail_to_root
+    total_user = used + avail_to_user
+    percent = round(used / total_user * 100, 1) if total_user else 0.0
+    return DiskUsage(total=total, used=used, free=avail_to_user, percent=percent)
+
+
+class MountTableWatcher(object):
+    """
+    Detect changes of the mount table without reading it: the kernel flags `/proc/self/mountinfo` with
+    POLLPRI and POLLERR whenever a file system is mounted or unmounted in the mount namespace.
+    """
+
+    PATH = '/proc/self/mountinfo'
+
+    def __init__(self):
+        self._file = open(self.PATH, 'rb')
+        self._poller = poll()
+        self._poller.register(self._file.fileno(), POLLPRI | POLLERR)
+        self._changed = True
+
+    def changed(self):
+        """Return whether the mount table changed since the last call."""
+        changed = self._changed or bool(self._poller.poll(0))
+        self._changed = False
+        return changed
+
+
+class MountProber(object):
+    """
+    Call `func` on mount points concurrently, on a pool of threads, giving each mount point `timeout` seconds from
+    the time its call starts.
+
+    A call that times out keeps running in the background: the mount point isn't probed again until it completes,
+    and the pool is replaced if all its threads are stuck on hung mount points. Calls still waiting for a thread
+    when they time out are cancelled instead, and made again on the next run.
+    """
+
+    def __init__(self, func, timeout, workers=MOUNT_PROBE_WORKERS):
+        self._func = func
+        self.timeout = timeout
+        self._workers = workers
+        self._pool = None
+        # Probes that timed out during a previous run after they started, by mount point
+        self._hung = {}
+        self._lock = threading.Lock()
+
+    def probe(self, mountpoints):
+        """
+        Yield `(mountpoint, result, exception)` for each mount point, in order.
+        """
+        self._hung = {mountpoint: probe for mountpoint, probe in iteritems(self._hung) if not probe.result.ready()}
+        if self._pool is None or len(self._hung) >= self._workers:
+            if self._pool is not None:
+                self._pool.close()
+            self._pool = ThreadPool(self._workers)
+
+        run_start = time.time()
+        probes = []
+        for mountpoint in mountpoints:
+            probe = self._hung.pop(mountpoint, None)
+            if probe is None:
+                probe = _MountProbe()
+                probe.result = self._pool.apply_async(self._run, (probe, mountpoint))
+            probes.append((mountpoint, probe))
+
+        # Set once a call never got a thread within its timeout, meaning that all of them are stuck
+        pool_stuck = False
+        for mountpoint, probe in probes:
+            try:
+                yield mountpoint, self._get_result(probe, run_start, pool_stuck), None
+            except PoolTimeoutError:
+                if probe.cancelled:
+                    pool_stuck = True
+                else:
+                    self._hung[mountpoint] = probe
+                yield mountpoint, None, TimeoutException()
+            except Exception as e:
+                yield mountpoint, None, e
+
+    def _run(self, probe, mountpoint):
+        with self._lock:
+            if probe.cancelled:
+                return
+            probe.started = time.time()
+
+        return self._func(mountpoint)
+
+    def _get_result(self, probe, run_start, pool_stuck):
+        # A call that hasn't started yet gets `timeout` seconds to start, unless no thread is available
+        deadline = time.time() + (0 if pool_stuck else self.timeout)
+        while True:
+            started = probe.started
+            if started is not None:
+                # Hung calls from previous runs get a new timeout
+                deadline = max(started, run_start) + self.timeout
+
+            try:
+                return probe.result.get(max(deadline - time.time(), 0))
+            except PoolTimeoutError:
+                with self._lock:
+                    if probe.started is None:
+                        probe.cancelled = True
+                        raise
+
+                # Wait for the rest of the timeout of a call that started in the meantime
+                if started is None:
+                    continue
+                raise
+
+
+class _MountProbe(object):
+    __slots__ = ('result', 'started', 'cancelled')
+
+    def __init__(self):
+        self.result = None
+        self.started = None
+        self.cancelled = False
+
+
 class Disk(AgentCheck):
     """ Collects metrics about the machine's disks. """
 
@@ -66,6 +209,17 @@ class Disk(AgentCheck):
         self._compile_pattern_filters(instance)
         self._compile_tag_re()
         self._blkid_label_re = re.compile('LABEL=\"(.*?)\"', re.I)
+        self._mount_prober = MountProber(self._get_usage, self._timeout)
+        self._mount_table_watcher = None
+        if poll is not None and Platform.is_linux():
+            try:
+                self._mount_table_watcher = MountTableWatcher()
+            except (IOError, OSError) as e:
+                self.log.debug('Unable to watch the mount table, partitions are listed on every run: %s', e)
+        # Partitions passing the filters, listed again when the mount table changes
+        self._partitions = None
+        # Filter decisions, by (device, file system, mount point)
+        self._excluded_partitions = {}
 
         if platform.system() == 'Windows':
             self._manual_mounts = instance.get('create_mounts', [])
@@ -108,19 +262,16 @@ class Disk(AgentCheck):
 
     def check(self, instance):
         """Get disk space/inode stats"""
-        if self._tag_by_label and Platform.is_linux():
-            self.devices_label = self._get_devices_label()
+        if self._partitions is None or self._mount_table_watcher is None or self._mount_table_watcher.changed():
+            if self._tag_by_label and Platform.is_linux():
+                self.devices_label = self._get_devices_label()
+            self._partitions = self._list_partitions()
 
         self._valid_disks = {}
-        for part in psutil.disk_partitions(all=self._include_all_devices):
-            # we check all exclude conditions
-            if self.exclude_disk(part):
-                continue
-
+        usages = self._mount_prober.probe([part.mountpoint for part in self._partitions])
+        for part, (_, usage, error) in zip(self._partitions, usages):
             # Get disk metrics here to be able to exclude on total usage
-            try:
-                disk_usage = timeout(self._timeout)(psutil.disk_usage)(part.mountpoint)
-            except TimeoutException:
+            if isinstance(error, TimeoutException):
                 self.log.warning(
                     u'Timeout after %d seconds while retrieving the disk usage of `%s` mountpoint. '
                     u'You might want to change the timeout length in the settings.',
@@ -128,15 +279,17 @@ class Disk(AgentCheck):
                     part.mountpoint,
                 )
                 continue
-            except Exception as e:
+            elif error is not None:
                 self.log.warning(
                     u'Unable to get disk metrics for %s: %s. '
                     u'You can exclude this mountpoint in the settings if it is invalid.',
                     part.mountpoint,
-                    e,
+                    error,
                 )
                 continue
 
+            disk_usage, inodes = usage
+
             # Exclude disks with size less than min_disk_size
             if disk_usage.total <= self._min_disk_size:
                 if disk_usage.total > 0:
@@ -166,7 +319,7 @@ class Disk(AgentCheck):
 
             tags.append('device:{}'.format(device_name))
             tags.append('device_name:{}'.format(_base_device_name(part.device)))
-            for metric_name, metric_value in iteritems(self._collect_part_metrics(part, disk_usage)):
+            for metric_name, metric_value in iteritems(self._collect_part_metrics(disk_usage, inodes)):
                 self.gauge(metric_name, metric_value, tags=tags)
 
             # Add in a disk read write or read only check
@@ -181,13 +334,49 @@ class Disk(AgentCheck):
 
         self.collect_latency_metrics()
 
-    def exclude_disk(self, part):
+    def _list_partitions(self):
+        """
+        Return the partitions that pass the filters. Filter decisions are kept for the partitions still mounted.
+        """
+        partitions = []
+        excluded_partitions = {}
+        for part in psutil.disk_partitions(all=self._include_all_devices):
+            key = (part.device, part.fstype, part.mountpoint)
+            excluded = self._excluded_partitions.get(key)
+            if excluded is None:
+                # we check all exclude conditions
+                excluded = self._exclude_disk(part.device, part.fstype, part.mountpoint)
+            excluded_partitions[key] = excluded
+
+            if not excluded and not self._skip_win(part):
+                partitions.append(part)
+
+        self._excluded_partitions = excluded_partitions
+        return partitions
+
+    def _get_usage(self, mountpoint):
+        """
+        Return the disk usage of a mount point, and on Unix its `os.statvfs` result for the inodes metrics.
+        On Linux, both come from a single `os.statvfs` call.
+        """
+        if Platform.is_linux():
+            inodes = os.statvfs(mountpoint)
+            return _disk_usage_from_statvfs(inodes), inodes
+
+        disk_usage = psutil.disk_usage(mountpoint)
+        inodes = os.statvfs(mountpoint) if Platform.is_unix() else None
+        return disk_usage, inodes
+
+    @staticmethod
+    def _skip_win(part):
         # skip cd-rom drives with no disk in it; they may raise
         # ENOENT, pop-up a Windows GUI error for a non-ready
         # partition or just hang;
-        # and all the other excluded disks
-        skip_win = Platform.is_win32() and ('cdrom' in part.opts or part.fstype == '')
-        return skip_win or self._exclude_disk(part.device, part.fstype, part.mountpoint)
+        # the other excluded disks are checked by `_exclude_disk`
+        return Platform.is_win32() and ('cdrom' in part.opts or part.fstype == '')
+
+    def exclude_disk(self, part):
+        return self._skip_win(part) or self._exclude_disk(part.device, part.fstype, part.mountpoint)
 
     def _exclude_disk(self, device, file_system, mount_point):
         """
@@ -261,7 +450,7 @@ class Disk(AgentCheck):
 
         return not not self._mount_point_exclude.match(mount_point)
 
-    def _collect_part_metrics(self, part, usage):
+    def _collect_part_metrics(self, usage, inodes):
         metrics = {}
 
         for name in ['total', 'used', 'free']:
@@ -271,33 +460,13 @@ class Disk(AgentCheck):
         # FIXME: 8.x, use percent, a lot more logical than in_use
         metrics[self.METRIC_DISK.format('in_use')] = usage.percent / 100
 
-        if Platform.is_unix():
-            metrics.update(self._collect_inodes_metrics(part.mountpoint))
+        if inodes is not None:
+            metrics.update(self._collect_inodes_metrics(inodes))
 
         return metrics
 
-    def _collect_inodes_metrics(self, mountpoint):
+    def _collect_inodes_metrics(self, inodes):
         metrics = {}
-        # we need to timeout this, too.
-        try:
-            inodes = timeout(self._timeout)(os.statvfs)(mountpoint)
-        except TimeoutException:
-            self.log.warning(
-                u'Timeout after %d seconds while retrieving the disk usage of `%s` mountpoint. '
-                u'You might want to change the timeout length in the settings.',
-                self._timeout,
-                mountpoint,
-            )
-            return metrics
-        except Exception as e:
-            self.log.warning(
-                u'Unable to get disk metrics for %s: %s. '
-                u'You can exclude this mountpoint in the settings if it is invalid.',
-                mountpoint,
-                e,
-            )
-            return metrics
-
         if inodes.f_files != 0:
             total = inodes.f_files
             free = inodes.f_ffree
@@ -51,6 +51,17 @@ class MockDiskIOMetrics(dict):
 class MockInodesMetrics(object):
     f_files = 10
     f_ffree = 9
+    # Same disk usage as MockDiskMetrics
+    f_frsize = 1024
+    f_blocks = 5
+    f_bfree = 1
+    f_bavail = 1
+
+
+class MockEmptyInodesMetrics(MockInodesMetrics):
+    f_blocks = 0
+    f_bfree = 0
+    f_bavail = 0
 
 
 class MockIoCountersMetrics(object):
@@ -2,6 +2,8 @@
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
 import re
+import threading
+import time
 from itertools import chain
 
 import mock
@@ -11,10 +13,10 @@ from six import iteritems
 from datadog_checks.base.utils.platform import Platform
 from datadog_checks.base.utils.timeout import TimeoutException
 from datadog_checks.disk import Disk
-from datadog_checks.disk.disk import IGNORE_CASE
+from datadog_checks.disk.disk import IGNORE_CASE, MountProber
 
 from .common import DEFAULT_DEVICE_BASE_NAME, DEFAULT_DEVICE_NAME, DEFAULT_FILE_SYSTEM, DEFAULT_MOUNT_POINT
-from .mocks import MockDiskMetrics, MockPart, mock_blkid_output
+from .mocks import MockDiskMetrics, MockEmptyInodesMetrics, MockInodesMetrics, MockPart, mock_blkid_output
 
 
 def test_default_options():
@@ -179,7 +181,9 @@ def test_min_disk_size(aggregator, gauge_metrics, rate_metrics):
 
     m = MockDiskMetrics()
     m.total = 0
-    with mock.patch('psutil.disk_usage', return_value=m, __name__='disk_usage'):
+    with mock.patch('psutil.disk_usage', return_value=m, __name__='disk_usage'), mock.patch(
+        'os.statvfs', return_value=MockEmptyInodesMetrics(), __name__='statvfs'
+    ):
         c.check(instance)
 
     for name in gauge_metrics:
@@ -220,8 +224,7 @@ def test_blkid_cache_file_contains_no_labels(
         aggregator.assert_metric(metric, tags=['device:/dev/sda1', 'device_name:sda1'])
 
 
-@pytest.mark.usefixtures('psutil_mocks')
-def test_timeout_config(aggregator, gauge_metrics, rate_metrics):
+def test_timeout_config():
     """Test timeout configuration value is used on every timeout on the check."""
 
     # Arbitrary value
@@ -229,41 +232,33 @@ def test_timeout_config(aggregator, gauge_metrics, rate_metrics):
     instance = {'timeout': TIMEOUT_VALUE}
     c = Disk('disk', {}, [instance])
 
-    # Mock timeout version
-    def no_timeout(fun):
-        return lambda *args: fun(args)
+    assert c._mount_prober.timeout == TIMEOUT_VALUE
 
-    with mock.patch('psutil.disk_partitions', return_value=[MockPart()]), mock.patch(
-        'datadog_checks.disk.disk.timeout', return_value=no_timeout
-    ) as mock_timeout:
-        c.check(instance)
 
-    mock_timeout.assert_called_with(TIMEOUT_VALUE)
+def hang_on_mountpoints(result, mountpoints, release):
+    def f(mountpoint):
+        if mountpoint in mountpoints:
+            release.wait()
+        return result
+
+    return f
 
 
 @pytest.mark.usefixtures('psutil_mocks')
 def test_timeout_warning(aggregator, gauge_metrics, rate_metrics):
     """Test a warning is raised when there is a Timeout exception."""
-
-    # Raise exception for "/faulty" mountpoint
-    def faulty_timeout(fun):
-        def f(mountpoint):
-            if mountpoint == "/faulty":
-                raise TimeoutException
-            else:
-                return fun(mountpoint)
-
-        return f
-
-    c = Disk('disk', {}, [{}])
+    c = Disk('disk', {}, [{'timeout': 0.1}])
     c.log = mock.MagicMock()
     m = MockDiskMetrics()
     m.total = 0
 
+    # Hang for "/faulty" mountpoint
+    release = threading.Event()
     with mock.patch('psutil.disk_partitions', return_value=[MockPart(), MockPart(mountpoint="/faulty")]), mock.patch(
-        'psutil.disk_usage', return_value=m, __name__='disk_usage'
-    ), mock.patch('datadog_checks.disk.disk.timeout', return_value=faulty_timeout):
+        'psutil.disk_usage', side_effect=hang_on_mountpoints(m, {"/faulty"}, release)
+    ), mock.patch('os.statvfs', side_effect=hang_on_mountpoints(MockEmptyInodesMetrics(), {"/faulty"}, release)):
         c.check({})
+    release.set()
 
     # Check that the warning is called once for the faulty disk
     c.log.warning.assert_called_once()
@@ -278,6 +273,87 @@ def test_timeout_warning(aggregator, gauge_metrics, rate_metrics):
     aggregator.assert_all_metrics_covered()
 
 
+@pytest.mark.usefixtures('psutil_mocks')
+def test_hung_mountpoints_probed_concurrently(aggregator):
+    c = Disk('disk', {}, [{'timeout': 0.5}])
+    c.log = mock.MagicMock()
+    parts = [MockPart(mountpoint='/hung{}'.format(i)) for i in range(3)] + [MockPart()]
+
+    release = threading.Event()
+    hung = {part.mountpoint for part in parts[:3]}
+    with mock.patch('psutil.disk_partitions', return_value=parts), mock.patch(
+        'psutil.disk_usage', side_effect=hang_on_mountpoints(MockDiskMetrics(), hung, release)
+    ), mock.patch('os.statvfs', side_effect=hang_on_mountpoints(MockInodesMetrics(), hung, release)):
+        start = time.time()
+        c.check({})
+        # The hung mount points share the same timeout instead of adding up
+        assert time.time() - start < 1.5
+        assert c.log.warning.call_count == 3
+
+        # Hung probes are waited for again instead of being started again
+        c.check({})
+        assert len(c._mount_prober._hung) == 3
+    release.set()
+
+    aggregator.assert_metric('system.disk.total', tags=['device:{}'.format(DEFAULT_DEVICE_NAME), 'device_name:sda1'])
+
+
+def test_mount_prober_queued_probes_not_hung():
+    release = threading.Event()
+    prober = MountProber(hang_on_mountpoints('ok', {'/hung1', '/hung2'}, release), 0.2, workers=2)
+    mountpoints = ['/hung1', '/hung2', '/ok1', '/ok2']
+
+    try:
+        # The healthy mount points wait for the threads stuck on hung mount points during the first run only
+        for _ in range(3):
+            results = {mountpoint: (result, error) for mountpoint, result, error in prober.probe(mountpoints)}
+            assert isinstance(results['/hung1'][1], TimeoutException)
+            assert isinstance(results['/hung2'][1], TimeoutException)
+        assert results['/ok1'] == ('ok', None)
+        assert results['/ok2'] == ('ok', None)
+        assert sorted(prober._hung) == ['/hung1', '/hung2']
+    finally:
+        release.set()
+
+
+def test_mount_prober_timeout_per_mountpoint():
+    def probe(mountpoint):
+        time.sleep(0.15)
+        return mountpoint
+
+    # Every mount point gets its own timeout from the time its probe starts
+    prober = MountProber(probe, 0.2, workers=1)
+    assert [(mountpoint, result, error) for mountpoint, result, error in prober.probe(['/a', '/b', '/c'])] == [
+        ('/a', '/a', None),
+        ('/b', '/b', None),
+        ('/c', '/c', None),
+    ]
+
+
+@pytest.mark.skipif(not Platform.is_linux(), reason='the mount table is only watched on Linux')
+@pytest.mark.usefixtures('psutil_mocks')
+def test_partitions_listed_on_mount_table_changes(aggregator):
+    c = Disk('disk', {}, [{'tag_by_label': False}])
+    c._mount_table_watcher = mock.MagicMock()
+    c._mount_table_watcher.changed.return_value = False
+
+    with mock.patch('psutil.disk_partitions', return_value=[MockPart()]) as disk_partitions, mock.patch.object(
+        c, '_exclude_disk', wraps=c._exclude_disk
+    ) as exclude_disk:
+        c.check({})
+        c.check({})
+        assert disk_partitions.call_count == 1
+
+        # Filter decisions are kept for the partitions still mounted
+        c._mount_table_watcher.changed.return_value = True
+        disk_partitions.return_value = [MockPart(), MockPart(mountpoint='/other')]
+        c.check({})
+        assert disk_partitions.call_count == 2
+        assert exclude_disk.call_count == 2
+
+    aggregator.assert_metric('system.disk.total', count=4)
+
+
 @pytest.mark.usefixtures('psutil_mocks')
 def test_include_all_devices(aggregator, gauge_metrics, rate_metrics):
     c = Disk('disk', {}, [{}])
@@ -76,16 +76,9 @@ class ESCheck(AgentCheck):
         # This must happen before other URL processing as the cluster name
         # is retrieved here, and added to the tag list.
         stats_url = self._join_url(stats_url, admin_forwarder)
-        stats_data = self._get_data(stats_url)
-        if stats_data.get('cluster_name'):
-            # retrieve the cluster name from the data, and append it to the
-            # master tag list.
-            cluster_tags = ["elastic_cluster:{}".format(stats_data['cluster_name'])]
-            if not is_affirmative(self.instance.get('disable_legacy_cluster_tag', False)):
-                cluster_tags.append("cluster_name:{}".format(stats_data['cluster_name']))
-            base_tags.extend(cluster_tags)
-            service_check_tags.extend(cluster_tags)
-        self._process_stats_data(stats_data, stats_metrics, base_tags)
+        # The nodes are streamed from the response, as it grows with the size of the cluster
+        stats_members = self._get_data_members(stats_url, ('', 'nodes'))
+        self._process_stats_data(stats_members, stats_metrics, base_tags, service_check_tags)
 
         # Load cluster-wise data
         # Note: this is a cluster-wide query, might TO.
@@ -231,23 +224,38 @@ class ESCheck(AgentCheck):
             resp = self.http.get(url)
             resp.raise_for_status()
         except Exception as e:
-            # this means we've hit a particular kind of auth error that means the config is broken
-            if resp and resp.status_code == 400:
-                raise AuthenticationError("The ElasticSearch credentials are incorrect")
-
-            if send_sc:
-                self.service_check(
-                    self.SERVICE_CHECK_CONNECT_NAME,
-                    AgentCheck.CRITICAL,
-                    message="Error {} when hitting {}".format(e, url),
-                    tags=self.config.service_check_tags,
-                )
+            self._handle_request_error(url, e, resp, send_sc)
             raise
 
         self.log.debug("request to url %s returned: %s", url, resp)
 
         return resp.json()
 
+    def _get_data_members(self, url, prefixes):
+        """
+        Hit a given URL and yield the `(prefix, key, value)` members of the json objects at `prefixes`, as they are
+        parsed
+        """
+        try:
+            for member in self.http.get_json_members(url, prefixes):
+                yield member
+        except Exception as e:
+            self._handle_request_error(url, e, getattr(e, 'response', None), True)
+            raise
+
+    def _handle_request_error(self, url, error, resp, send_sc):
+        # this means we've hit a particular kind of auth error that means the config is broken
+        if resp and resp.status_code == 400:
+            raise AuthenticationError("The ElasticSearch credentials are incorrect")
+
+        if send_sc:
+            self.service_check(
+                self.SERVICE_CHECK_CONNECT_NAME,
+                AgentCheck.CRITICAL,
+                message="Error {} when hitting {}".format(error, url),
+                tags=self.config.service_check_tags,
+            )
+
     def _process_pending_tasks_data(self, data, base_tags):
         p_tasks = defaultdict(int)
         average_time_in_queue = 0
@@ -270,28 +278,56 @@ class ESCheck(AgentCheck):
             desc = CLUSTER_PENDING_TASKS[metric]
             self._process_metric(node_data, metric, *desc, tags=base_tags)
 
-    def _process_stats_data(self, data, stats_metrics, base_tags):
-        for node_data in itervalues(data.get('nodes', {})):
-            metric_hostname = None
-            metrics_tags = list(base_tags)
-
-            # Resolve the node's name
-            node_name = node_data.get('name')
+    def _process_stats_data(self, stats_members, stats_metrics, base_tags, service_check_tags):
+        # The cluster name is sent before the nodes by Elasticsearch, nodes read before it are only buffered in case
+        # another implementation doesn't
+        cluster_name_read = False
+        pending_nodes = []
+        for prefix, key, value in stats_members:
+            if prefix == 'nodes':
+                if cluster_name_read:
+                    self._process_node_stats_data(value, stats_metrics, base_tags)
+                else:
+                    pending_nodes.append(value)
+            elif key == 'cluster_name':
+                cluster_name_read = True
+                if value:
+                    # retrieve the cluster name from the data, and append it to the
+                    # master tag list.
+                    cluster_tags = ["elastic_cluster:{}".format(value)]
+                    if not is_affirmative(self.instance.get('disable_legacy_cluster_tag', False)):
+                        cluster_tags.append("cluster_name:{}".format(value))
+                    base_tags.extend(cluster_tags)
+                    service_check_tags.extend(cluster_tags)
+
+                for node_data in pending_nodes:
+                    self._process_node_stats_data(node_data, stats_metrics, base_tags)
+                pending_nodes = []
+
+        for node_data in pending_nodes:
+            self._process_node_stats_data(node_data, stats_metrics, base_tags)
+
+    def _process_node_stats_data(self, node_data, stats_metrics, base_tags):
+        metric_hostname = None
+        metrics_tags = list(base_tags)
+
+        # Resolve the node's name
+        node_name = node_data.get('name')
+        if node_name:
+            metrics_tags.append('node_name:{}'.format(node_name))
+
+        # Resolve the node's hostname
+        if self.config.node_name_as_host:
             if node_name:
-                metrics_tags.append('node_name:{}'.format(node_name))
-
-            # Resolve the node's hostname
-            if self.config.node_name_as_host:
-                if node_name:
-                    metric_hostname = node_name
-            elif self.config.cluster_stats:
-                for k in ['hostname', 'host']:
-                    if k in node_data:
-                        metric_hostname = node_data[k]
-                        break
-
-            for metric, desc in iteritems(stats_metrics):
-                self._process_metric(node_data, metric, *desc, tags=metrics_tags, hostname=metric_hostname)
+                metric_hostname = node_name
+        elif self.config.cluster_stats:
+            for k in ['hostname', 'host']:
+                if k in node_data:
+                    metric_hostname = node_data[k]
+                    break
+
+        for metric, desc in iteritems(stats_metrics):
+            self._process_metric(node_data, metric, *desc, tags=metrics_tags, hostname=metric_hostname)
 
     def _process_pshard_stats_data(self, data, pshard_stats_metrics, base_tags):
         for metric, desc in iteritems(pshard_stats_metrics):
@@ -42,6 +42,26 @@ def test__join_url():
     assert joined_url == "https://localhost:9444/stats"
 
 
+@pytest.mark.unit
+@pytest.mark.parametrize('cluster_name_first', [True, False])
+def test__process_stats_data(aggregator, instance, cluster_name_first):
+    elastic_check = ESCheck('elastic', {}, instances=[instance])
+    stats_metrics = {'elasticsearch.docs.count': ('gauge', 'indices.docs.count')}
+    stats_members = [
+        ('', 'cluster_name', 'test-cluster'),
+        ('nodes', 'node-id', {'name': 'node1', 'indices': {'docs': {'count': 5}}}),
+    ]
+    if not cluster_name_first:
+        stats_members.reverse()
+    base_tags = []
+    service_check_tags = []
+
+    elastic_check._process_stats_data(iter(stats_members), stats_metrics, base_tags, service_check_tags)
+
+    assert base_tags == service_check_tags == ['elastic_cluster:test-cluster', 'cluster_name:test-cluster']
+    aggregator.assert_metric('elasticsearch.docs.count', 5, tags=base_tags + ['node_name:node1'], count=1)
+
+
 @pytest.mark.parametrize(
     'instance, url_fix',
     [
@@ -1,7 +1,7 @@
 # (C) Datadog, Inc. 2019-present
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
-from collections import defaultdict
+from collections import defaultdict, deque
 from time import time
 
 from kafka import KafkaAdminClient, KafkaClient
@@ -68,8 +68,18 @@ class KafkaCheck(AgentCheck):
         )
         self._consumer_groups = self.instance.get('consumer_groups', {})
         self._broker_requests_batch_size = self.instance.get('broker_requests_batch_size', BROKER_REQUESTS_BATCH_SIZE)
+        self._telemetry = is_affirmative(self.instance.get('telemetry', False))
         self._kafka_client = None
 
+        # Caches kept until the cluster metadata changes
+        self._group_coordinators = {}  # Expected format: {consumer_group: coordinator_id}
+        self._highwater_requests = None  # Expected format: (topic partitions filter, [(broker_id, OffsetRequest)])
+        self._known_brokers = set()
+
+        # Tags of the contexts reported by the previous run, reused while their partitions keep being reported
+        self._broker_tags = {}  # Expected format: {(topic, partition): tags}
+        self._consumer_group_tags = {}  # Expected format: {(consumer_group, topic, partition): tags}
+
     @property
     def kafka_client(self):
         if self._kafka_client is None:
@@ -81,8 +91,22 @@ class KafkaCheck(AgentCheck):
                 kafka_version = tuple(map(int, kafka_version.split(".")))
 
             self._kafka_client = self._create_kafka_admin_client(api_version=kafka_version)
+            self._on_metadata_update(self._kafka_client._client.cluster)
+            self._kafka_client._client.cluster.add_listener(self._on_metadata_update)
         return self._kafka_client
 
+    def _on_metadata_update(self, cluster):
+        """Listener invalidating the caches derived from the cluster metadata every time it is refreshed."""
+        # The partition leaders may have changed
+        self._highwater_requests = None
+
+        # Group coordinators only move when brokers join or leave the cluster, otherwise they are invalidated by
+        # the errors of the OffsetFetchRequests sent to them.
+        brokers = {broker.nodeId for broker in cluster.brokers()}
+        if brokers != self._known_brokers:
+            self._known_brokers = brokers
+            self._group_coordinators.clear()
+
     def check(self, instance):
         """The main entrypoint of the check."""
         self._consumer_offsets = {}  # Expected format: {(consumer_group, topic, partition): offset}
@@ -95,13 +119,16 @@ class KafkaCheck(AgentCheck):
         # negative consumer lag, which just creates confusion because it's theoretically impossible.
 
         # Fetch Kafka consumer offsets
+        start_time = time()
         try:
             self._get_consumer_offsets()
         except Exception:
             self.log.exception("There was a problem collecting consumer offsets from Kafka.")
             # don't raise because we might get valid broker offsets
+        self._submit_phase_duration('consumer_offsets', start_time)
 
         # Fetch the broker highwater offsets
+        start_time = time()
         try:
             if len(self._consumer_offsets) < self._context_limit:
                 self._get_highwater_offsets()
@@ -111,6 +138,7 @@ class KafkaCheck(AgentCheck):
             self.log.exception("There was a problem collecting the highwater mark offsets.")
             # Unlike consumer offsets, fail immediately because we can't calculate consumer lag w/o highwater_offsets
             raise
+        self._submit_phase_duration('highwater_offsets', start_time)
 
         total_contexts = len(self._consumer_offsets) + len(self._highwater_offsets)
         if total_contexts >= self._context_limit:
@@ -123,11 +151,19 @@ class KafkaCheck(AgentCheck):
             )
 
         # Report the metrics
+        start_time = time()
         self._report_highwater_offsets(self._context_limit)
         self._report_consumer_offsets_and_lag(self._context_limit - len(self._highwater_offsets))
+        self._submit_phase_duration('report', start_time)
 
         self._collect_broker_metadata()
 
+    def _submit_phase_duration(self, phase, start_time):
+        """Submit the duration of a phase of the check run, if telemetry is enabled."""
+        if self._telemetry:
+            tags = self._custom_tags + ['phase:{}'.format(phase)]
+            self.gauge('telemetry.collection.duration', time() - start_time, tags=tags)
+
     def _create_kafka_admin_client(self, api_version):
         """Return a KafkaAdminClient."""
         kafka_connect_str = self.instance.get('kafka_connect_str')
@@ -182,49 +218,83 @@ class KafkaCheck(AgentCheck):
         https://cwiki.apache.org/confluence/display/KAFKA/A+Guide+To+The+Kafka+Protocol#AGuideToTheKafkaProtocol-OffsetAPI(AKAListOffset)
 
         For speed, all the brokers are queried in parallel using callbacks. The callback flow is:
-            1. Issue an OffsetRequest to every broker
+            1. Issue an OffsetRequest to every broker, keeping up to `broker_requests_batch_size` requests in flight
             2. Attach a callback to each OffsetResponse that parses the response and saves the highwater offsets.
-        """
-        highwater_futures = []  # No need to store on object because the callbacks don't create additional futures
 
+        The OffsetRequests only depend on the partition leaders, so they are reused until the cluster metadata changes.
+        """
         # If we aren't fetching all broker highwater offsets, then construct the unique set of topic partitions for
         # which this run of the check has at least once saved consumer offset. This is later used as a filter for
         # excluding partitions.
-        if not self._monitor_all_broker_highwatermarks:
-            tps_with_consumer_offset = {(topic, partition) for (_, topic, partition) in self._consumer_offsets}
+        if self._monitor_all_broker_highwatermarks:
+            tps_with_consumer_offset = None
+        else:
+            tps_with_consumer_offset = frozenset((topic, partition) for (_, topic, partition) in self._consumer_offsets)
 
-        for batch in self.batchify(self.kafka_client._client.cluster.brokers(), self._broker_requests_batch_size):
-            for broker in batch:
-                broker_led_partitions = self.kafka_client._client.cluster.partitions_for_broker(broker.nodeId)
-                if broker_led_partitions is None:
-                    continue
+        if self._highwater_requests is None or self._highwater_requests[0] != tps_with_consumer_offset:
+            self._highwater_requests = (
+                tps_with_consumer_offset,
+                self._build_highwater_requests(tps_with_consumer_offset),
+            )
 
-                # Take the partitions for which this broker is the leader and group them by topic in order to construct
-                # the OffsetRequest while simultaneously filtering out partitions we want to exclude
-                partitions_grouped_by_topic = defaultdict(list)
-                for topic, partition in broker_led_partitions:
-                    # No sense fetching highwater offsets for internal topics
-                    if topic not in KAFKA_INTERNAL_TOPICS and (
-                        self._monitor_all_broker_highwatermarks or (topic, partition) in tps_with_consumer_offset
-                    ):
-                        partitions_grouped_by_topic[topic].append(partition)
-
-                # Construct the OffsetRequest
-                max_offsets = 1
-                request = OffsetRequest[0](
-                    replica_id=-1,
-                    topics=[
-                        (topic, [(partition, OffsetResetStrategy.LATEST, max_offsets) for partition in partitions])
-                        for topic, partitions in partitions_grouped_by_topic.items()
-                    ],
-                )
+        self._send_pipelined_requests(self._highwater_requests[1], self._highwater_offsets_callback)
+
+    def _build_highwater_requests(self, tps_with_consumer_offset):
+        """Build the OffsetRequest of every broker, for the partitions it leads."""
+        requests = []
+        for broker in self.kafka_client._client.cluster.brokers():
+            broker_led_partitions = self.kafka_client._client.cluster.partitions_for_broker(broker.nodeId)
+            if broker_led_partitions is None:
+                continue
+
+            # Take the partitions for which this broker is the leader and group them by topic in order to construct
+            # the OffsetRequest while simultaneously filtering out partitions we want to exclude
+            partitions_grouped_by_topic = defaultdict(list)
+            for topic, partition in broker_led_partitions:
+                # No sense fetching highwater offsets for internal topics
+                if topic not in KAFKA_INTERNAL_TOPICS and (
+                    tps_with_consumer_offset is None or (topic, partition) in tps_with_consumer_offset
+                ):
+                    partitions_grouped_by_topic[topic].append(partition)
+
+            if not partitions_grouped_by_topic:
+                continue
+
+            # Construct the OffsetRequest
+            max_offsets = 1
+            request = OffsetRequest[0](
+                replica_id=-1,
+                topics=[
+                    (topic, [(partition, OffsetResetStrategy.LATEST, max_offsets) for partition in partitions])
+                    for topic, partitions in partitions_grouped_by_topic.items()
+                ],
+            )
+            requests.append((broker.nodeId, request))
 
-                highwater_future = self.kafka_client._send_request_to_node(node_id=broker.nodeId, request=request)
-                highwater_future.add_callback(self._highwater_offsets_callback)
-                highwater_futures.append(highwater_future)
+        return requests
 
-            # Loop until all futures resolved.
-            self.kafka_client._wait_for_futures(highwater_futures)
+    def _send_pipelined_requests(self, requests, callback):
+        """Send (node_id, request) pairs and wait for all their responses, which are passed to `callback`.
+
+        Up to `broker_requests_batch_size` requests are in flight at the same time, and a new request is sent as soon as
+        any response is received rather than after the whole batch completes.
+        """
+        pending = deque(requests)
+        in_flight = []
+        while pending or in_flight:
+            while pending and len(in_flight) < self._broker_requests_batch_size:
+                node_id, request = pending.popleft()
+                future = self.kafka_client._send_request_to_node(node_id=node_id, request=request)
+                future.add_callback(callback)
+                in_flight.append(future)
+
+            # Without a future, poll() returns as soon as some responses have been processed
+            self.kafka_client._client.poll()
+
+            for future in in_flight:
+                if future.failed():
+                    raise future.exception
+            in_flight = [future for future in in_flight if not future.is_done]
 
     def _highwater_offsets_callback(self, response):
         """Callback that parses an OffsetFetchResponse and saves it to the highwater_offsets dict."""
@@ -265,9 +335,16 @@ class KafkaCheck(AgentCheck):
     def _report_highwater_offsets(self, contexts_limit):
         """Report the broker highwater offsets."""
         reported_contexts = 0
-        for (topic, partition), highwater_offset in self._highwater_offsets.items():
-            broker_tags = ['topic:%s' % topic, 'partition:%s' % partition]
-            broker_tags.extend(self._custom_tags)
+        previous_tags = self._broker_tags
+        self._broker_tags = {}
+        for key, highwater_offset in self._highwater_offsets.items():
+            broker_tags = previous_tags.get(key)
+            if broker_tags is None:
+                topic, partition = key
+                broker_tags = ['topic:%s' % topic, 'partition:%s' % partition]
+                broker_tags.extend(self._custom_tags)
+            self._broker_tags[key] = broker_tags
+
             self.gauge('broker_offset', highwater_offset, tags=broker_tags)
             reported_contexts += 1
             if reported_contexts == contexts_limit:
@@ -276,11 +353,21 @@ class KafkaCheck(AgentCheck):
     def _report_consumer_offsets_and_lag(self, contexts_limit):
         """Report the consumer offsets and consumer lag."""
         reported_contexts = 0
-        for (consumer_group, topic, partition), consumer_offset in self._consumer_offsets.items():
+        previous_tags = self._consumer_group_tags
+        self._consumer_group_tags = {}
+        for key, consumer_offset in self._consumer_offsets.items():
             if reported_contexts >= contexts_limit:
                 return
-            consumer_group_tags = ['topic:%s' % topic, 'partition:%s' % partition, 'consumer_group:%s' % consumer_group]
-            consumer_group_tags.extend(self._custom_tags)
+            consumer_group, topic, partition = key
+            consumer_group_tags = previous_tags.get(key)
+            if consumer_group_tags is None:
+                consumer_group_tags = [
+                    'topic:%s' % topic,
+                    'partition:%s' % partition,
+                    'consumer_group:%s' % consumer_group,
+                ]
+                consumer_group_tags.extend(self._custom_tags)
+            self._consumer_group_tags[key] = consumer_group_tags
             if partition in self.kafka_client._client.cluster.partitions_for_topic(topic):
                 # report consumer offset if the partition is valid because even if leaderless the consumer offset will
                 # be valid once the leader failover completes
@@ -337,7 +424,8 @@ class KafkaCheck(AgentCheck):
                    Note: Because a broker only returns groups for which it is the coordinator, as an optimization we
                    skip the FindCoordinatorRequest
             B: When fetching only listed groups:
-                1. Issue a FindCoordintorRequest for each group
+                1. Issue a FindCoordintorRequest for each group whose coordinator isn't cached yet, and directly an
+                   OffsetFetchRequest for the others
                 2. Attach a callback to each FindCoordinatorResponse that issues OffsetFetchRequests for that group
             Both:
                 3. Attach a callback to each OffsetFetchRequest that parses the response
@@ -355,6 +443,11 @@ class KafkaCheck(AgentCheck):
         elif self._consumer_groups:
             self._validate_listed_consumer_groups()
             for consumer_group in self._consumer_groups:
+                coordinator_id = self._group_coordinators.get(consumer_group)
+                if coordinator_id is not None:
+                    self._send_single_group_offsets_request(consumer_group, coordinator_id)
+                    continue
+
                 find_coordinator_future = self.kafka_client._find_coordinator_id_send_request(consumer_group)
                 find_coordinator_future.add_callback(self._find_coordinator_callback, consumer_group)
                 self._consumer_futures.append(find_coordinator_future)
@@ -396,6 +489,11 @@ class KafkaCheck(AgentCheck):
         are unspecified for a topic listed in the config, offsets are fetched for all the partitions within that topic.
         """
         coordinator_id = self.kafka_client._find_coordinator_id_process_response(response)
+        self._group_coordinators[consumer_group] = coordinator_id
+        self._send_single_group_offsets_request(consumer_group, coordinator_id)
+
+    def _send_single_group_offsets_request(self, consumer_group, coordinator_id):
+        """Issue an OffsetFetchRequest for a listed consumer group to its coordinator."""
         topics = self._consumer_groups[consumer_group]
         if not topics:
             topic_partitions = None  # None signals to fetch all known offsets for the consumer group
@@ -410,6 +508,7 @@ class KafkaCheck(AgentCheck):
             group_id=consumer_group, group_coordinator_id=coordinator_id, partitions=topic_partitions
         )
         single_group_offsets_future.add_callback(self._single_group_offsets_callback, consumer_group)
+        single_group_offsets_future.add_errback(self._single_group_offsets_errback, consumer_group)
         self._consumer_futures.append(single_group_offsets_future)
 
     def _single_group_offsets_callback(self, consumer_group, response):
@@ -418,7 +517,12 @@ class KafkaCheck(AgentCheck):
         consumer_group must be manually passed in because it is not present in the response, but we need it in order to
         associate these offsets to the proper consumer group.
         """
-        single_group_offsets = self.kafka_client._list_consumer_group_offsets_process_response(response)
+        try:
+            single_group_offsets = self.kafka_client._list_consumer_group_offsets_process_response(response)
+        except Exception:
+            # The group may have moved to another coordinator, look it up again on the next run
+            self._group_coordinators.pop(consumer_group, None)
+            raise
         for (topic, partition), (offset, _metadata) in single_group_offsets.items():
             # If the OffsetFetchRequest explicitly specified partitions, the offset could returned as -1, meaning there
             # is no recorded offset for that partition... for example, if the partition doesn't exist in the cluster.
@@ -429,6 +533,10 @@ class KafkaCheck(AgentCheck):
             key = (consumer_group, topic, partition)
             self._consumer_offsets[key] = offset
 
+    def _single_group_offsets_errback(self, consumer_group, exception):
+        """Errback forgetting the coordinator of a consumer group when its OffsetFetchRequest fails."""
+        self._group_coordinators.pop(consumer_group, None)
+
     # TODO since this is used to validate the config interface, ideally this would be shared between new and legacy
     # versions of the check to make sure the interface they accept doesn't diverge if someone updates one but forgets
     # to update the other copy.
@@ -509,8 +617,3 @@ class KafkaCheck(AgentCheck):
             # have multiple sections of code instantiating clients
             kafka_client.close()
         return kafka_version
-
-    @staticmethod
-    def batchify(iterable, batch_size):
-        iterable = list(iterable)
-        return (iterable[i : i + batch_size] for i in range(0, len(iterable), batch_size))
@@ -63,6 +63,31 @@ def assert_check_kafka(aggregator, consumer_groups):
     aggregator.assert_all_metrics_covered()
 
 
+@pytest.mark.integration
+@pytest.mark.usefixtures('dd_environment')
+def test_check_kafka_cached_requests(aggregator, kafka_instance):
+    instance = dict(kafka_instance, telemetry=True)
+    kafka_consumer_check = KafkaCheck('kafka_consumer', {}, [instance])
+
+    if is_legacy_check(kafka_consumer_check):
+        pytest.skip("This test does not apply to legacy check")
+
+    kafka_consumer_check.check(instance)
+    assert 'my_consumer' in kafka_consumer_check._group_coordinators
+    assert kafka_consumer_check._highwater_requests is not None
+    aggregator.reset()
+
+    # The second run reuses the group coordinators and the OffsetRequests
+    kafka_consumer_check.check(instance)
+
+    for phase in ('consumer_offsets', 'highwater_offsets', 'report'):
+        aggregator.assert_metric(
+            'kafka.telemetry.collection.duration', tags=['optional:tag1', 'phase:{}'.format(phase)], count=1
+        )
+    aggregator.assert_metric('kafka.telemetry.collection.duration', count=3)
+    assert_check_kafka(aggregator, instance['consumer_groups'])
+
+
 @pytest.mark.integration
 @pytest.mark.usefixtures('dd_environment')
 def test_consumer_config_error(caplog):
@@ -69,6 +69,8 @@ class KubernetesState(OpenMetricsBaseCheck):
                 self.current_run_max_ts = max(self.current_run_max_ts, job_ts)
 
     DEFAULT_METRIC_LIMIT = 0
+    # Maximum number of label values whose tags are kept for each scrape
+    LABEL_TAGS_CACHE_SIZE = 50000
 
     def __init__(self, name, init_config, instances):
         # We do not support more than one instance of kube-state-metrics
@@ -140,11 +142,20 @@ class KubernetesState(OpenMetricsBaseCheck):
         self.job_succeeded_count = defaultdict(int)
         self.job_failed_count = defaultdict(int)
 
+        # Tags built from labels, kept for the labels seen during the current and the previous scrape:
+        # {(label name, label value): tags}
+        self._label_tags_cache = {}
+        self._previous_label_tags_cache = {}
+
     def check(self, instance):
         endpoint = instance.get('kube_state_url')
 
         scraper_config = self.config_map[endpoint]
-        self.process(scraper_config, metric_transformers=self.METRIC_TRANSFORMERS)
+        try:
+            self.process(scraper_config, metric_transformers=self.METRIC_TRANSFORMERS)
+        finally:
+            self._previous_label_tags_cache = self._label_tags_cache
+            self._label_tags_cache = {}
 
         # Logic for Cron Jobs
         for job_tags, job in iteritems(self.failed_cron_job_counts):
@@ -573,17 +584,23 @@ class KubernetesState(OpenMetricsBaseCheck):
     def kube_pod_status_phase(self, metric, scraper_config):
         """ Phase a pod is in. """
         metric_name = scraper_config['namespace'] + '.pod.status_phase'
-        status_phase_counter = Counter()
+        values_counter = Counter()
 
         for sample in metric.samples:
             # Counts aggregated cluster-wide to avoid no-data issues on pod churn,
             # pod granularity available in the service checks
+            labels = sample[self.SAMPLE_LABELS]
+            values_counter[labels.get('namespace'), labels.get('phase')] += sample[self.SAMPLE_VALUE]
+
+        # Tags are only built once per distinct namespace and phase
+        status_phase_counter = Counter()
+        for (namespace, phase), count in iteritems(values_counter):
             tags = (
-                self._label_to_tags('namespace', sample[self.SAMPLE_LABELS], scraper_config)
-                + self._label_to_tags('phase', sample[self.SAMPLE_LABELS], scraper_config)
+                self._label_to_tags('namespace', {'namespace': namespace}, scraper_config)
+                + self._label_to_tags('phase', {'phase': phase}, scraper_config)
                 + scraper_config['custom_tags']
             )
-            status_phase_counter[tuple(sorted(tags))] += sample[self.SAMPLE_VALUE]
+            status_phase_counter[tuple(sorted(tags))] += count
 
         for tags, count in iteritems(status_phase_counter):
             self.gauge(metric_name, count, tags=list(tags))
@@ -870,37 +887,43 @@ class KubernetesState(OpenMetricsBaseCheck):
     def sum_values_by_tags(self, metric, scraper_config):
         """ Sum values by allowed tags and submit counts as gauges. """
         config = self.object_count_params[metric.name]
-        metric_name = "{}.{}".format(scraper_config['namespace'], config['metric_name'])
-        object_counter = Counter()
+        allowed_labels = config['allowed_labels']
+        values_counter = Counter()
 
         for sample in metric.samples:
-            tags = []
-            for l in config['allowed_labels']:
-                tag = self._label_to_tag(l, sample[self.SAMPLE_LABELS], scraper_config)
-                if tag is None:
-                    tag = self._format_tag(l, "unknown", scraper_config)
-                tags.append(tag)
-            tags += scraper_config['custom_tags']
-            object_counter[tuple(sorted(tags))] += sample[self.SAMPLE_VALUE]
+            labels = sample[self.SAMPLE_LABELS]
+            values_counter[tuple(labels.get(l) for l in allowed_labels)] += sample[self.SAMPLE_VALUE]
 
-        for tags, count in iteritems(object_counter):
-            self.gauge(metric_name, count, tags=list(tags))
+        self._submit_counts_by_label_values(metric, values_counter, scraper_config)
 
     def count_objects_by_tags(self, metric, scraper_config):
         """ Count objects by allowed tags and submit counts as gauges. """
         config = self.object_count_params[metric.name]
+        allowed_labels = config['allowed_labels']
+        values_counter = Counter()
+
+        for sample in metric.samples:
+            labels = sample[self.SAMPLE_LABELS]
+            values_counter[tuple(labels.get(l) for l in allowed_labels)] += 1
+
+        self._submit_counts_by_label_values(metric, values_counter, scraper_config)
+
+    def _submit_counts_by_label_values(self, metric, values_counter, scraper_config):
+        """
+        Submit the counts aggregated by the values of the allowed labels as gauges.
+        Tags are only built once per distinct combination of values, missing values are tagged as unknown.
+        """
+        config = self.object_count_params[metric.name]
         metric_name = "{}.{}".format(scraper_config['namespace'], config['metric_name'])
         object_counter = Counter()
 
-        for sample in metric.samples:
-            tags = []
-            for l in config['allowed_labels']:
-                tag = self._label_to_tag(l, sample[self.SAMPLE_LABELS], scraper_config)
-                if tag is None:
-                    tag = self._format_tag(l, "unknown", scraper_config)
-                tags.append(tag)
+        for values, count in iteritems(values_counter):
+            tags = [
+                self._format_tag(l, value if value else "unknown", scraper_config)
+                for l, value in zip(config['allowed_labels'], values)
+            ]
             tags += scraper_config['custom_tags']
-            object_counter[tuple(sorted(tags))] += 1
+            object_counter[tuple(sorted(tags))] += count
 
         for tags, count in iteritems(object_counter):
             self.gauge(metric_name, count, tags=list(tags))
@@ -910,16 +933,24 @@ class KubernetesState(OpenMetricsBaseCheck):
         Build a list of formatted tags from `label_name` parameter. It also depend of the
         check configuration ('keep_ksm_labels' parameter)
         """
-        tags = []
-        # first use the labels_mapper
-        tag_name = scraper_config['labels_mapper'].get(label_name, label_name)
-        # then try to use the kube_labels_mapper
-        kube_tag_name = kube_labels_mapper.get(tag_name, tag_name)
-        label_value = to_string(label_value).lower()
-        tags.append('{}:{}'.format(to_string(kube_tag_name), label_value))
-        if self.keep_ksm_labels and (kube_tag_name != tag_name):
-            tags.append('{}:{}'.format(to_string(tag_name), label_value))
-        return tags
+        key = (label_name, label_value)
+        tags = self._label_tags_cache.get(key)
+        if tags is None:
+            tags = self._previous_label_tags_cache.get(key)
+            if tags is None:
+                tags = []
+                # first use the labels_mapper
+                tag_name = scraper_config['labels_mapper'].get(label_name, label_name)
+                # then try to use the kube_labels_mapper
+                kube_tag_name = kube_labels_mapper.get(tag_name, tag_name)
+                label_value = to_string(label_value).lower()
+                tags.append('{}:{}'.format(to_string(kube_tag_name), label_value))
+                if self.keep_ksm_labels and (kube_tag_name != tag_name):
+                    tags.append('{}:{}'.format(to_string(tag_name), label_value))
+                tags = tuple(tags)
+            if len(self._label_tags_cache) < self.LABEL_TAGS_CACHE_SIZE:
+                self._label_tags_cache[key] = tags
+        return list(tags)
 
     def _metric_tags(self, metric_name, val, sample, scraper_config, hostname=None):
         """
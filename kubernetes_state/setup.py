@@ -27,7 +27,7 @@ def get_dependencies():
         return f.readlines()
 
 
-CHECKS_BASE_REQ = 'datadog-checks-base>=11.8.0'
+CHECKS_BASE_REQ = 'datadog-checks-base>=16.5.0'
 
 setup(
     name='datadog-kubernetes_state',
@@ -267,7 +267,7 @@ def assert_not_all_zeroes(aggregator, metric_name):
 
 
 def resourcequota_was_collected(aggregator):
-    """ The metric name is created dynamically so we just check some exist. """
+    """The metric name is created dynamically so we just check some exist."""
     for m in aggregator.metric_names:
         if '.resourcequota.' in m:
             return True
@@ -675,6 +675,56 @@ def test_pod_phase_gauges(aggregator, instance, check):
     )
 
 
+def _submitted_gauges(aggregator):
+    return sorted(
+        (metric.name, metric.value, sorted(metric.tags), metric.hostname)
+        for name in aggregator.metric_names
+        for metric in aggregator.metrics(name)
+        if metric.type == aggregator.GAUGE
+    )
+
+
+def test_tags_across_scrapes(aggregator, instance):
+    payload = mock_from_file("prometheus.txt")
+    # Objects move to another namespace and a persistent volume changes phase between the scrapes
+    changed_payload = payload.replace(b'namespace="default"', b'namespace="staging"').replace(
+        b'kube_persistentvolume_status_phase{persistentvolume="local-pv-103fef5d",phase="Bound"} 1',
+        b'kube_persistentvolume_status_phase{persistentvolume="local-pv-103fef5d",phase="Bound"} 0',
+    )
+
+    def run_scrapes(check):
+        results = []
+        for content in (payload, changed_payload):
+            check.poll = mock.MagicMock(return_value=MockResponse(content, 'text/plain'))
+            check.check(instance)
+            results.append(_submitted_gauges(aggregator))
+            aggregator.reset()
+        return results
+
+    # Tags are always built from the labels when they aren't cached
+    uncached_check = KubernetesState(CHECK_NAME, {}, [instance])
+    uncached_check.LABEL_TAGS_CACHE_SIZE = 0
+    expected = run_scrapes(uncached_check)
+
+    check = KubernetesState(CHECK_NAME, {}, [instance])
+    assert run_scrapes(check) == expected
+    assert check._previous_label_tags_cache
+    assert not uncached_check._previous_label_tags_cache
+
+    assert any('namespace:default' in tags for _, _, tags, _ in expected[0])
+    assert not any('namespace:default' in tags for _, _, tags, _ in expected[1])
+    # Counts aggregated by tags follow the changes
+    by_phase = (NAMESPACE + '.persistentvolumes.by_phase', ['optional:tag1', 'phase:bound', 'storageclass:local-data'])
+    assert (by_phase[0], 2, by_phase[1], '') in expected[0]
+    assert (by_phase[0], 1, by_phase[1], '') in expected[1]
+    assert (
+        NAMESPACE + '.service.count',
+        3,
+        ['namespace:staging', 'optional:tag1', 'type:clusterip'],
+        '',
+    ) in expected[1]
+
+
 def test_extract_timestamp(check):
     job_name = "hello2-1509998340"
     job_name2 = "hello-2-1509998340"
@@ -14,6 +14,7 @@ from six import PY3, iteritems, itervalues
 
 from datadog_checks.base import AgentCheck, is_affirmative
 from datadog_checks.base.utils.db import QueryManager
+from datadog_checks.base.utils.db.sql import obfuscation_cache
 
 from .collection_utils import collect_all_scalars, collect_scalar, collect_string, collect_type
 from .config import MySQLConfig
@@ -372,6 +373,8 @@ class MySql(AgentCheck):
         metrics = self._statement_metrics.collect_per_statement_metrics(db)
         for metric_name, metric_value, metric_tags in metrics:
             self.count(metric_name, metric_value, tags=list(set(tags + metric_tags)))
+        # The cache is shared by all the instances, so its telemetry isn't tagged by instance
+        obfuscation_cache.submit_telemetry(self, 'dd.mysql')
 
     def _is_source_host(self, replicas, results):
         # type: (float, Dict[str, Any]) -> bool
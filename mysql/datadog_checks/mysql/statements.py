@@ -8,7 +8,7 @@ from typing import Any, Callable, Dict, List, Tuple
 import pymysql
 
 from datadog_checks.base.log import get_check_logger
-from datadog_checks.base.utils.db.sql import compute_sql_signature, normalize_query_tag
+from datadog_checks.base.utils.db.sql import normalize_query_tag, obfuscation_cache
 from datadog_checks.base.utils.db.statement_metrics import StatementMetrics, apply_row_limits
 
 from .config import MySQLConfig
@@ -53,6 +53,7 @@ class MySQLStatementMetrics(object):
         self.config = config
         self.log = get_check_logger()
         self._state = StatementMetrics()
+        self._obfuscation_cache = obfuscation_cache
 
     def collect_per_statement_metrics(self, db):
         # type: (pymysql.connections.Connection) -> List[Metric]
@@ -87,17 +88,26 @@ class MySQLStatementMetrics(object):
                 tags.append('schema:' + row['schema'])
 
             try:
-                obfuscated_statement = datadog_agent.obfuscate_sql(row['query'])
+                obfuscated_statement, query_signature = self._obfuscation_cache.get(
+                    keyfunc(row), row['query'], datadog_agent.obfuscate_sql
+                )
             except Exception as e:
                 self.log.warning("Failed to obfuscate query '%s': %s", row['query'], e)
                 continue
-            tags.append('query_signature:' + compute_sql_signature(obfuscated_statement))
+            tags.append('query_signature:' + query_signature)
             tags.append('query:' + normalize_query_tag(obfuscated_statement).strip())
 
             for col, name in STATEMENT_METRICS.items():
                 value = row[col]
                 metrics.append((name, value, tags))
 
+        self.log.debug(
+            'Obfuscation cache: size=%s hits=%s misses=%s evictions=%s',
+            len(self._obfuscation_cache),
+            self._obfuscation_cache.hits,
+            self._obfuscation_cache.misses,
+            self._obfuscation_cache.evictions,
+        )
         return metrics
 
     @staticmethod
@@ -57,7 +57,9 @@ def test_e2e(dd_agent_check, instance_complex):
     aggregator = dd_agent_check(instance_complex)
 
     _assert_complex_config(aggregator)
-    aggregator.assert_metrics_using_metadata(get_metadata_metrics(), exclude=['alice.age', 'bob.age'])
+    aggregator.assert_metrics_using_metadata(
+        get_metadata_metrics(), exclude=['alice.age', 'bob.age'] + variables.OBFUSCATION_CACHE_METRICS
+    )
 
 
 def _assert_complex_config(aggregator):
@@ -77,6 +79,10 @@ def _assert_complex_config(aggregator):
     if MYSQL_VERSION_PARSED >= parse_version('5.6'):
         testable_metrics.extend(variables.PERFORMANCE_VARS)
 
+    # Test obfuscation cache telemetry of the statement metrics
+    for mname in variables.OBFUSCATION_CACHE_METRICS:
+        aggregator.assert_metric(mname, at_least=1)
+
     # Test metrics
     for mname in testable_metrics:
         # These two are currently not guaranteed outside of a Linux
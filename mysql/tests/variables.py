@@ -230,3 +230,10 @@ PERFORMANCE_VARS = ['mysql.performance.query_run_time.avg', 'mysql.performance.d
 SCHEMA_VARS = ['mysql.info.schema.size']
 
 SYNTHETIC_VARS = ['mysql.performance.qcache.utilization', 'mysql.performance.qcache.utilization.instant']
+
+OBFUSCATION_CACHE_METRICS = [
+    'dd.mysql.obfuscation_cache.size',
+    'dd.mysql.obfuscation_cache.hits',
+    'dd.mysql.obfuscation_cache.misses',
+    'dd.mysql.obfuscation_cache.evictions',
+]
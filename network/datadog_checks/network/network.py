@@ -67,6 +67,22 @@ ENA_METRIC_NAMES = [
     "pps_allowance_exceeded",
 ]
 
+# Connection states of the `st` column of /proc/net/tcp and /proc/net/tcp6, by their `netstat` name
+# https://github.com/torvalds/linux/blob/master/include/net/tcp_states.h
+PROC_NET_TCP_STATES = {
+    '01': 'ESTABLISHED',
+    '02': 'SYN_SENT',
+    '03': 'SYN_RECV',
+    '04': 'FIN_WAIT1',
+    '05': 'FIN_WAIT2',
+    '06': 'TIME_WAIT',
+    '07': 'CLOSE',
+    '08': 'CLOSE_WAIT',
+    '09': 'LAST_ACK',
+    '0A': 'LISTEN',
+    '0B': 'CLOSING',
+}
+
 
 class Network(AgentCheck):
 
@@ -88,6 +104,7 @@ class Network(AgentCheck):
 
         self._collect_cx_state = instance.get('collect_connection_state', False)
         self._collect_cx_queues = instance.get('collect_connection_queues', False)
+        self._collect_cx_state_from_procfs = is_affirmative(instance.get('collect_connection_state_from_procfs', True))
         self._collect_rate_metrics = instance.get('collect_rate_metrics', True)
         self._collect_count_metrics = instance.get('collect_count_metrics', False)
         self._collect_ena_metrics = instance.get('collect_aws_ena_metrics', False)
@@ -351,7 +368,11 @@ class Network(AgentCheck):
 
         net_proc_base_location = self._get_net_proc_base_location(proc_location)
 
-        if self._is_collect_cx_state_runnable(net_proc_base_location):
+        cx_state_collected = False
+        if self._collect_cx_state and self._collect_cx_state_from_procfs:
+            cx_state_collected = self._check_linux_cx_state_procfs(net_proc_base_location, custom_tags)
+
+        if not cx_state_collected and self._is_collect_cx_state_runnable(net_proc_base_location):
             try:
                 self.log.debug("Using `ss` to collect connection state")
                 # Try using `ss` for increased performance over `netstat`
@@ -598,6 +619,80 @@ class Network(AgentCheck):
         except SubprocessOutputEmptyError:
             self.log.debug("Couldn't use %s to get conntrack stats", conntrack_path)
 
+    def _check_linux_cx_state_procfs(self, net_proc_base_location, custom_tags):
+        """
+        Collect the connection states from the socket tables of /proc/net, without running `ss` or `netstat`.
+
+        Each table is streamed line by line and aggregated in a single pass: connections are counted by state and,
+        if `collect_connection_queues` is enabled, by state and queue sizes. The queue histograms are submitted once
+        all tables are read, decoding each distinct queue size only once.
+        Return False if the tables can't be read, in which case nothing has been submitted.
+        """
+        tables = []
+        try:
+            for table in ('tcp', 'tcp6', 'udp', 'udp6'):
+                path = "{}/net/{}".format(net_proc_base_location, table)
+                tables.append((table, open(path, 'r')))
+        except IOError as e:
+            self.log.debug("Unable to read the socket tables of %s/net: %s", net_proc_base_location, e)
+            for _, f in tables:
+                f.close()
+            return False
+
+        self.log.debug("Using %s/net to collect connection state", net_proc_base_location)
+        tcp_states = self.tcp_states['netstat']
+        queue_tags = {state: custom_tags + ["state:" + state] for state in set(itervalues(tcp_states))}
+        metrics = self._get_metrics()
+        # Number of TCP connections by raw state and `tx_queue:rx_queue`, most of them have empty queues
+        queue_counts = defaultdict(int)
+        try:
+            for table, f in tables:
+                proto = table if table.endswith('6') else table + '4'
+                # Skip the header
+                next(f, None)
+
+                if proto.startswith('udp'):
+                    metrics[self.cx_state_gauge[proto, 'connections']] += sum(1 for _ in f)
+                    continue
+
+                counts = defaultdict(int)
+                #   sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid ...
+                #    0: 0100007F:0CEA 00000000:0000 0A 00000000:00000000 00:00000000 00000000  1000 ...
+                if self._collect_cx_queues:
+                    for line in f:
+                        fields = line.split(None, 5)
+                        counts[fields[3]] += 1
+                        queue_counts[fields[3], fields[4]] += 1
+                else:
+                    for line in f:
+                        counts[line.split(None, 4)[3]] += 1
+
+                for st, count in iteritems(counts):
+                    state = tcp_states.get(PROC_NET_TCP_STATES.get(st))
+                    if state is not None:
+                        metrics[self.cx_state_gauge[proto, state]] += count
+        finally:
+            for _, f in tables:
+                f.close()
+
+        for metric, value in iteritems(metrics):
+            self.gauge(metric, value, tags=custom_tags)
+
+        for (st, queues), count in iteritems(queue_counts):
+            state = tcp_states.get(PROC_NET_TCP_STATES.get(st))
+            if state is None:
+                continue
+            sendq, recvq = queues.split(':')
+            sendq = int(sendq, 16)
+            recvq = int(recvq, 16)
+            tags = queue_tags[state]
+            # Every connection is a sample of the histograms
+            for _ in range(count):
+                self.histogram('system.net.tcp.recv_q', recvq, tags)
+                self.histogram('system.net.tcp.send_q', sendq, tags)
+
+        return True
+
     def _get_metrics(self):
         return {val: 0 for val in itervalues(self.cx_state_gauge)}
 
@@ -91,7 +91,7 @@ def netstat_subprocess_mock(*args, **kwargs):
 
 @pytest.mark.skipif(platform.system() != 'Linux', reason="Only runs on Unix systems")
 def test_cx_state(aggregator, check):
-    instance = {'collect_connection_state': True}
+    instance = {'collect_connection_state': True, 'collect_connection_state_from_procfs': False}
     with mock.patch('datadog_checks.network.network.get_subprocess_output') as out:
         out.side_effect = ss_subprocess_mock
         check._collect_cx_state = True
@@ -108,7 +108,7 @@ def test_cx_state(aggregator, check):
 
 @mock.patch('datadog_checks.network.network.Platform.is_linux', return_value=True)
 def test_cx_state_mocked(is_linux, aggregator, check):
-    instance = {'collect_connection_state': True}
+    instance = {'collect_connection_state': True, 'collect_connection_state_from_procfs': False}
     with mock.patch('datadog_checks.network.network.get_subprocess_output') as out:
         out.side_effect = ss_subprocess_mock
         check._collect_cx_state = True
@@ -125,6 +125,36 @@ def test_cx_state_mocked(is_linux, aggregator, check):
             aggregator.assert_metric(metric, value=value)
 
 
+@mock.patch('datadog_checks.network.network.Platform.is_linux', return_value=True)
+def test_cx_state_procfs(is_linux, aggregator, check):
+    instance = {'collect_connection_state': True, 'collect_connection_queues': True}
+    with mock.patch('datadog_checks.network.network.get_subprocess_output') as out:
+        check._get_net_proc_base_location = lambda x: FIXTURE_DIR
+        check.check(instance)
+        out.assert_not_called()
+
+    for metric, value in iteritems(CX_STATE_GAUGES_VALUES):
+        aggregator.assert_metric(metric, value=value)
+    aggregator.assert_metric('system.net.tcp.recv_q', value=2, count=1, tags=['state:listening'])
+    aggregator.assert_metric('system.net.tcp.recv_q', value=16, count=1, tags=['state:closing'])
+    aggregator.assert_metric('system.net.tcp.send_q', value=36, count=1, tags=['state:established'])
+    aggregator.assert_metric('system.net.tcp.send_q', count=13)
+
+
+@mock.patch('datadog_checks.network.network.Platform.is_linux', return_value=True)
+def test_cx_state_procfs_fallback(is_linux, aggregator, check):
+    instance = {'collect_connection_state': True}
+    with mock.patch('datadog_checks.network.network.get_subprocess_output') as out:
+        out.side_effect = ss_subprocess_mock
+        check._is_collect_cx_state_runnable = lambda x: True
+        check._get_net_proc_base_location = lambda x: os.path.join(FIXTURE_DIR, 'missing')
+        check.check(instance)
+        assert out.called
+
+    for metric, value in iteritems(CX_STATE_GAUGES_VALUES):
+        aggregator.assert_metric(metric, value=value)
+
+
 def test_add_conntrack_stats_metrics(aggregator, check):
     mocked_conntrack_stats = (
         "cpu=0 found=27644 invalid=19060 ignore=485633411 insert=0 insert_failed=1 "
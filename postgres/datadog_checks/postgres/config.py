@@ -2,6 +2,8 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 # https://www.postgresql.org/docs/current/libpq-connect.html#LIBPQ-PARAMKEYWORDS
+import re
+
 from six import PY2, PY3, iteritems
 
 from datadog_checks.base import AgentCheck, ConfigurationError, is_affirmative
@@ -58,6 +60,10 @@ class PostgresConfig:
         self.service_check_tags = self._get_service_check_tags()
         self.custom_metrics = self._get_custom_metrics(instance.get('custom_metrics', []))
         self.max_relations = int(instance.get('max_relations', 300))
+        self.database_autodiscovery = self._get_database_autodiscovery(instance.get('database_autodiscovery', {}))
+        self.max_connections = int(instance.get('max_connections', 10))
+        if self.max_connections < 1:
+            raise ConfigurationError('`max_connections` must be a positive number.')
 
         # Deep Database monitoring adds additional telemetry for statement metrics
         self.deep_database_monitoring = is_affirmative(instance.get('deep_database_monitoring', False))
@@ -93,6 +99,25 @@ class PostgresConfig:
         service_check_tags = list(set(service_check_tags))
         return service_check_tags
 
+    @staticmethod
+    def _get_database_autodiscovery(config):
+        if not is_affirmative(config.get('enabled', False)):
+            return None
+
+        try:
+            include = [re.compile(pattern) for pattern in config.get('include', ['.*'])]
+            exclude = [re.compile(pattern) for pattern in config.get('exclude', [])]
+        except re.error as e:
+            raise ConfigurationError('Invalid `database_autodiscovery` pattern: {}'.format(e))
+
+        return {'include': include, 'exclude': exclude}
+
+    def is_database_discovered(self, dbname):
+        """Whether the database `dbname` is selected by the `database_autodiscovery` option."""
+        return any(pattern.match(dbname) for pattern in self.database_autodiscovery['include']) and not any(
+            pattern.match(dbname) for pattern in self.database_autodiscovery['exclude']
+        )
+
     @staticmethod
     def _get_custom_metrics(custom_metrics):
         # Otherwise pre-process custom metrics and verify definition
@@ -0,0 +1,101 @@
+# (C) Datadog, Inc. 2020-present
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import psycopg2
+
+
+class MultiDatabaseConnectionPool(object):
+    """
+    Manages connections to the databases of a single Postgres server.
+
+    A Postgres connection is bound to a database, so connections are kept per database. At most `max_connections`
+    connections are opened at the same time: when a connection to another database is needed and the pool is full,
+    the least recently used idle connection is closed.
+    """
+
+    def __init__(self, connect, max_connections):
+        self._connect = connect
+        self._max_connections = max_connections
+        # Idle connections, by database, in least recently used order
+        self._idle = OrderedDict()
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+    @contextmanager
+    def get_connection(self, dbname):
+        """
+        Get a connection to the database `dbname`, waiting for one to be released if all of them are in use.
+        """
+        conn = self._acquire(dbname)
+        try:
+            yield conn
+        except Exception:
+            self._release(dbname, conn, reusable=False)
+            raise
+        else:
+            self._release(dbname, conn, reusable=True)
+
+    def _acquire(self, dbname):
+        with self._available:
+            while self._in_use >= self._max_connections:
+                self._available.wait()
+
+            conn = self._idle.pop(dbname, None)
+            if conn is None and self._in_use + len(self._idle) >= self._max_connections:
+                # Make room for the new connection
+                _, evicted = self._idle.popitem(last=False)
+                self._close(evicted)
+            self._in_use += 1
+
+        try:
+            if conn is not None and conn.closed:
+                conn = None
+            if conn is None:
+                conn = self._connect(dbname)
+            elif conn.status != psycopg2.extensions.STATUS_READY:
+                # Some transaction went wrong and the connection is in an unhealthy state. Let's fix that
+                conn.rollback()
+        except Exception:
+            with self._available:
+                self._in_use -= 1
+                self._available.notify()
+            raise
+
+        return conn
+
+    def _release(self, dbname, conn, reusable):
+        if reusable:
+            try:
+                # Close the transaction of the queries run, so that it doesn't stay open while the connection is idle
+                conn.commit()
+            except Exception:
+                reusable = False
+
+        with self._available:
+            self._in_use -= 1
+            if reusable:
+                self._idle[dbname] = conn
+            self._available.notify()
+
+        if not reusable:
+            self._close(conn)
+
+    def close_all(self):
+        with self._lock:
+            connections = list(self._idle.values())
+            self._idle.clear()
+
+        for conn in connections:
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
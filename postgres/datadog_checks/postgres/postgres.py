@@ -2,16 +2,19 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 import copy
-from contextlib import closing
+import itertools
+from contextlib import closing, contextmanager
+from multiprocessing.pool import ThreadPool
 
 import psycopg2
-from six import iteritems
 
 from datadog_checks.base import AgentCheck
+from datadog_checks.base.utils.db.sql import obfuscation_cache
 from datadog_checks.postgres.metrics_cache import PostgresMetricsCache
 from datadog_checks.postgres.statements import PostgresStatementMetrics
 
 from .config import PostgresConfig
+from .connections import MultiDatabaseConnectionPool
 from .util import (
     ALL_SCHEMAS,
     CONNECTION_METRICS,
@@ -29,6 +32,7 @@ from .util import (
 from .version_utils import V9, get_raw_version, is_aurora, parse_version, transform_version
 
 MAX_CUSTOM_RESULTS = 100
+SERVER_SIDE_CURSOR_NAME = 'datadog_postgres_scope'
 
 
 class PostgreSql(AgentCheck):
@@ -52,8 +56,18 @@ class PostgreSql(AgentCheck):
         self.config = PostgresConfig(self.instance)
         self.metrics_cache = PostgresMetricsCache(self.config)
         self.statement_metrics = PostgresStatementMetrics(self.config)
+        # Connections and threads used to collect the metrics of the databases discovered on the server
+        self._db_pool = MultiDatabaseConnectionPool(self._new_connection, self.config.max_connections)
+        self._worker_pool = None
         self._clean_state()
 
+    def cancel(self):
+        """Close the connections and threads used to collect the metrics of the discovered databases."""
+        if self._worker_pool is not None:
+            self._worker_pool.terminate()
+            self._worker_pool = None
+        self._db_pool.close_all()
+
     def _clean_state(self):
         self._version = None
         self._is_aurora = None
@@ -111,7 +125,16 @@ class PostgreSql(AgentCheck):
                 self.log.warning('Unhandled relations config type: %s', element)
         return config
 
-    def _run_query_scope(self, cursor, scope, is_custom_metrics, relations_config, cols, descriptors, is_relations):
+    def _run_query_scope(
+        self, cursor, scope, is_custom_metrics, relations_config, cols, descriptors, is_relations, errors=None
+    ):
+        """
+        Run the query of a scope and return its rows, or None when it failed or returned nothing. Query errors are
+        added to `errors` when it is set, to be handled by the check's thread.
+
+        The results of the relation and custom metrics scopes can be large, only up to their limit of rows is fetched.
+        Relation rows are streamed from a server-side cursor instead of being loaded in memory all at once.
+        """
         if scope is None:
             return None
         if scope == REPLICATION_METRICS or not self.version >= V9:
@@ -119,59 +142,109 @@ class PostgreSql(AgentCheck):
         else:
             log_func = self.log.warning
 
-        results = None
+        limit = None
+        if is_custom_metrics:
+            limit = MAX_CUSTOM_RESULTS
+        if is_relations:
+            limit = min(limit or self.config.max_relations, self.config.max_relations)
+
+        query = fmt.format(scope['query'], metrics_columns=", ".join(cols))
+        # if this is a relation-specific query, we need to list all relations last
+        if is_relations:
+            schema_field = get_schema_field(descriptors)
+            relations_filter = build_relations_filter(relations_config, schema_field)
+            self.log.debug("Running query: %s with relations matching: %s", str(query), relations_filter)
+            query = query.format(relations=relations_filter)
+        else:
+            self.log.debug("Running query: %s", str(query))
+            query = query.replace(r'%', r'%%')
+
+        if limit is None:
+            results = None
+            with self._handle_query_errors(cursor.connection, log_func, errors):
+                cursor.execute(query)
+                results = cursor.fetchall()
+            return results
+
+        if is_custom_metrics:
+            # Custom queries aren't necessarily plain SELECT statements, which server-side cursors are limited to
+            results = None
+            with self._handle_query_errors(cursor.connection, log_func, errors):
+                cursor.execute(query)
+                results = cursor.fetchmany(limit)
+                if cursor.rowcount > limit:
+                    self._warn_truncated_results(query, limit, cursor.rowcount)
+            return results
+
+        rows = self._stream_query(cursor.connection, query, log_func, limit, errors)
+        try:
+            first_row = next(rows)
+        except StopIteration:
+            return None
+
+        return itertools.chain([first_row], rows)
+
+    def _stream_query(self, db, query, log_func, limit, errors):
+        with self._handle_query_errors(db, log_func, errors):
+            # The server-side cursor is closed before the transaction it was declared in is rolled back on errors
+            with closing(db.cursor(name=SERVER_SIDE_CURSOR_NAME)) as cursor:
+                # Fetch one more row than the limit at first, to know whether results are truncated
+                cursor.itersize = limit + 1
+                cursor.execute(query)
+                for num_rows, row in enumerate(cursor, 1):
+                    if num_rows > limit:
+                        # Count the remaining rows without fetching them
+                        with closing(db.cursor()) as move_cursor:
+                            move_cursor.execute('MOVE FORWARD ALL IN {}'.format(SERVER_SIDE_CURSOR_NAME))
+                            self._warn_truncated_results(query, limit, num_rows + move_cursor.rowcount)
+                        break
+                    yield row
+
+    @contextmanager
+    def _handle_query_errors(self, db, log_func, errors=None):
         try:
-            query = fmt.format(scope['query'], metrics_columns=", ".join(cols))
-            # if this is a relation-specific query, we need to list all relations last
-            if is_relations:
-                schema_field = get_schema_field(descriptors)
-                relations_filter = build_relations_filter(relations_config, schema_field)
-                self.log.debug("Running query: %s with relations matching: %s", str(query), relations_filter)
-                cursor.execute(query.format(relations=relations_filter))
+            yield
+        except (
+            psycopg2.errors.FeatureNotSupported,
+            psycopg2.errors.UndefinedFunction,
+            psycopg2.ProgrammingError,
+            psycopg2.errors.QueryCanceled,
+        ) as e:
+            db.rollback()
+            if errors is None:
+                self._handle_query_error(e, log_func)
             else:
-                self.log.debug("Running query: %s", str(query))
-                cursor.execute(query.replace(r'%', r'%%'))
+                errors.append((e, log_func))
 
-            results = cursor.fetchall()
-        except psycopg2.errors.FeatureNotSupported as e:
+    def _handle_query_error(self, e, log_func):
+        # This resets the state of the check, it must only be called from the check's thread
+        if isinstance(e, psycopg2.errors.FeatureNotSupported):
             # This happens for example when trying to get replication metrics from readers in Aurora. Let's ignore it.
             log_func(e)
-            self.db.rollback()
             self._is_aurora = None
-        except psycopg2.errors.UndefinedFunction as e:
+        elif isinstance(e, psycopg2.errors.UndefinedFunction):
             log_func(e)
             log_func(
                 "It seems the PG version has been incorrectly identified as %s. "
                 "A reattempt to identify the right version will happen on next agent run." % self._version
             )
             self._clean_state()
-            self.db.rollback()
-        except (psycopg2.ProgrammingError, psycopg2.errors.QueryCanceled) as e:
+        else:
             log_func("Not all metrics may be available: %s" % str(e))
-            self.db.rollback()
-
-        if not results:
-            return None
-
-        if is_custom_metrics and len(results) > MAX_CUSTOM_RESULTS:
-            self.warning(
-                "Query: %s returned more than %s results (%s). Truncating", query, MAX_CUSTOM_RESULTS, len(results)
-            )
-            results = results[:MAX_CUSTOM_RESULTS]
 
-        if is_relations and len(results) > self.config.max_relations:
+    def _warn_truncated_results(self, query, limit, num_results):
+        if limit == self.config.max_relations:
             self.warning(
                 "Query: %s returned more than %s results (%s). "
                 "Truncating. You can edit this limit by setting the `max_relations` config option",
                 query,
-                self.config.max_relations,
-                len(results),
+                limit,
+                num_results,
             )
-            results = results[: self.config.max_relations]
-
-        return results
+        else:
+            self.warning("Query: %s returned more than %s results (%s). Truncating", query, limit, num_results)
 
-    def _query_scope(self, cursor, scope, instance_tags, is_custom_metrics, relations_config):
+    def _query_scope(self, cursor, scope, instance_tags, is_custom_metrics, relations_config, errors=None):
         if scope is None:
             return None
         # build query
@@ -184,13 +257,28 @@ class PostgreSql(AgentCheck):
         is_relations = scope['relation'] and len(relations_config) > 0
 
         results = self._run_query_scope(
-            cursor, scope, is_custom_metrics, relations_config, cols, descriptors, is_relations
+            cursor, scope, is_custom_metrics, relations_config, cols, descriptors, is_relations, errors
         )
         if not results:
             return None
 
         # Parse and submit results.
 
+        # Add tags from the instance.
+        # Special-case the "db" tag, which overrides the one that is passed as instance_tag
+        # The reason is that pg_stat_database returns all databases regardless of the
+        # connection.
+        if not scope['relation'] and not scope.get('use_global_db_tag', False):
+            base_tags = [t for t in instance_tags if not t.startswith("db:")]
+        else:
+            base_tags = instance_tags
+
+        tag_names = [name for _, name in descriptors]
+        metrics = [scope['metrics'][column] for column in cols]
+        expected_number_of_columns = len(descriptors) + len(cols)
+        # Descriptor values (schemas, tables, etc.) are repeated across rows, reuse the tags built for them
+        descriptor_tags = {}
+
         num_results = 0
 
         for row in results:
@@ -198,7 +286,6 @@ class PostgreSql(AgentCheck):
             # metric values on the right (used as values for metrics).
             # E.g.: (descriptor, descriptor, ..., value, value, value, value, ...)
 
-            expected_number_of_columns = len(descriptors) + len(cols)
             if len(row) != expected_number_of_columns:
                 raise RuntimeError(
                     'Row does not contain enough values: '
@@ -207,30 +294,17 @@ class PostgreSql(AgentCheck):
                     )
                 )
 
-            descriptor_values = row[: len(descriptors)]
-            column_values = row[len(descriptors) :]
-
-            # build a map of descriptors and their values
-            desc_map = {name: value for (_, name), value in zip(descriptors, descriptor_values)}
-
-            # Build tags.
-
-            # Add tags from the instance.
-            # Special-case the "db" tag, which overrides the one that is passed as instance_tag
-            # The reason is that pg_stat_database returns all databases regardless of the
-            # connection.
-            if not scope['relation'] and not scope.get('use_global_db_tag', False):
-                tags = [t for t in instance_tags if not t.startswith("db:")]
-            else:
-                tags = copy.copy(instance_tags)
-
-            # Add tags from descriptors.
-            tags += [("%s:%s" % (k, v)) for (k, v) in iteritems(desc_map)]
+            # Build tags, once for all the metrics of the row.
+            tags = set(base_tags)
+            for name, value in zip(tag_names, row):
+                tag = descriptor_tags.get((name, value))
+                if tag is None:
+                    tag = descriptor_tags[(name, value)] = "%s:%s" % (name, value)
+                tags.add(tag)
 
             # Submit metrics to the Agent.
-            for column, value in zip(cols, column_values):
-                name, submit_metric = scope['metrics'][column]
-                submit_metric(self, name, value, tags=set(tags))
+            for (name, submit_metric), value in zip(metrics, row[len(descriptors) :]):
+                submit_metric(self, name, value, tags=tags)
 
             num_results += 1
 
@@ -248,15 +322,17 @@ class PostgreSql(AgentCheck):
 
         metric_scope = [CONNECTION_METRICS]
 
+        # Scopes whose metrics only cover the database the check is connected to
+        database_scope = []
         if self.config.collect_function_metrics:
-            metric_scope.append(FUNCTION_METRICS)
+            database_scope.append(FUNCTION_METRICS)
         if self.config.collect_count_metrics:
-            metric_scope.append(self.metrics_cache.get_count_metrics())
+            database_scope.append(self.metrics_cache.get_count_metrics())
 
         # Do we need relation-specific metrics?
         relations_config = {}
         if self.config.relations:
-            metric_scope += [LOCK_METRICS, REL_METRICS, IDX_METRICS, SIZE_METRICS, STATIO_METRICS]
+            database_scope += [LOCK_METRICS, REL_METRICS, IDX_METRICS, SIZE_METRICS, STATIO_METRICS]
             relations_config = self._build_relations_config(self.config.relations)
 
         replication_metrics = self.metrics_cache.get_replication_metrics(self.version, self.is_aurora)
@@ -281,11 +357,51 @@ class PostgreSql(AgentCheck):
             activity_metrics = self.metrics_cache.get_activity_metrics(self.version)
             self._query_scope(cursor, activity_metrics, instance_tags, False, relations_config)
 
+        if self.config.database_autodiscovery:
+            self._collect_databases_stats(cursor, database_scope, instance_tags, relations_config)
+        else:
+            metric_scope += database_scope
+
         for scope in list(metric_scope) + self.config.custom_metrics:
             self._query_scope(cursor, scope, instance_tags, scope in self.config.custom_metrics, relations_config)
 
         cursor.close()
 
+    def _discover_databases(self, cursor):
+        cursor.execute('SELECT datname FROM pg_database WHERE datistemplate = false AND datallowconn = true')
+        return [dbname for dbname, in cursor.fetchall() if self.config.is_database_discovered(dbname)]
+
+    def _collect_databases_stats(self, cursor, database_scope, instance_tags, relations_config):
+        """
+        Collect the per-database scopes of every database discovered on the server, concurrently, using connections
+        from the pool.
+        """
+        databases = self._discover_databases(cursor)
+        self.log.debug("Collecting metrics from %s discovered databases: %s", len(databases), databases)
+
+        # The metrics of each database are tagged with the database they come from
+        server_tags = [t for t in instance_tags if not t.startswith("db:")]
+        database_scope = [dict(scope, use_global_db_tag=True) for scope in database_scope]
+
+        def collect(dbname):
+            tags = server_tags + ['db:{}'.format(dbname)]
+            # Query errors may reset the state of the check, they are handled once all databases are collected
+            errors = []
+            try:
+                with self._db_pool.get_connection(dbname) as db:
+                    with closing(db.cursor()) as database_cursor:
+                        for scope in database_scope:
+                            self._query_scope(database_cursor, scope, tags, False, relations_config, errors)
+            except Exception as e:
+                self.log.warning("Unable to collect metrics from database %s: %s", dbname, e)
+            return errors
+
+        if self._worker_pool is None:
+            self._worker_pool = ThreadPool(self.config.max_connections)
+        for errors in self._worker_pool.map(collect, databases):
+            for e, log_func in errors:
+                self._handle_query_error(e, log_func)
+
     def _connect(self):
         """Get and memoize connections to instances"""
         if self.db and self.db.closed:
@@ -297,30 +413,33 @@ class PostgreSql(AgentCheck):
                 # Some transaction went wrong and the connection is in an unhealthy state. Let's fix that
                 self.db.rollback()
         else:
-            if self.config.host == 'localhost' and self.config.password == '':
-                # Use ident method
-                connection_string = "user=%s dbname=%s application_name=%s" % (
-                    self.config.user,
-                    self.config.dbname,
-                    self.config.application_name,
-                )
-                if self.config.query_timeout:
-                    connection_string += " options='-c statement_timeout=%s'" % self.config.query_timeout
-                self.db = psycopg2.connect(connection_string)
-            else:
-                args = {
-                    'host': self.config.host,
-                    'user': self.config.user,
-                    'password': self.config.password,
-                    'database': self.config.dbname,
-                    'sslmode': self.config.ssl_mode,
-                    'application_name': self.config.application_name,
-                }
-                if self.config.port:
-                    args['port'] = self.config.port
-                if self.config.query_timeout:
-                    args['options'] = '-c statement_timeout=%s' % self.config.query_timeout
-                self.db = psycopg2.connect(**args)
+            self.db = self._new_connection(self.config.dbname)
+
+    def _new_connection(self, dbname):
+        if self.config.host == 'localhost' and self.config.password == '':
+            # Use ident method
+            connection_string = "user=%s dbname=%s application_name=%s" % (
+                self.config.user,
+                dbname,
+                self.config.application_name,
+            )
+            if self.config.query_timeout:
+                connection_string += " options='-c statement_timeout=%s'" % self.config.query_timeout
+            return psycopg2.connect(connection_string)
+        else:
+            args = {
+                'host': self.config.host,
+                'user': self.config.user,
+                'password': self.config.password,
+                'database': dbname,
+                'sslmode': self.config.ssl_mode,
+                'application_name': self.config.application_name,
+            }
+            if self.config.port:
+                args['port'] = self.config.port
+            if self.config.query_timeout:
+                args['options'] = '-c statement_timeout=%s' % self.config.query_timeout
+            return psycopg2.connect(**args)
 
     def _collect_custom_queries(self, tags):
         """
@@ -422,6 +541,8 @@ class PostgreSql(AgentCheck):
         metrics = self.statement_metrics.collect_per_statement_metrics(self.db)
         for metric_name, metric_value, metrics_tags in metrics:
             self.count(metric_name, metric_value, tags=list(set(metrics_tags + tags)))
+        # The cache is shared by all the instances, so its telemetry isn't tagged by instance
+        obfuscation_cache.submit_telemetry(self, 'dd.postgres')
 
     def check(self, _):
         tags = copy.copy(self.config.tags)
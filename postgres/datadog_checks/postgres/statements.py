@@ -7,7 +7,7 @@ import psycopg2
 import psycopg2.extras
 
 from datadog_checks.base.log import get_check_logger
-from datadog_checks.base.utils.db.sql import compute_sql_signature, normalize_query_tag
+from datadog_checks.base.utils.db.sql import normalize_query_tag, obfuscation_cache
 from datadog_checks.base.utils.db.statement_metrics import StatementMetrics, apply_row_limits
 
 from .util import milliseconds_to_nanoseconds
@@ -71,6 +71,7 @@ class PostgresStatementMetrics(object):
         self.config = config
         self.log = get_check_logger()
         self._state = StatementMetrics()
+        self._obfuscation_cache = obfuscation_cache
 
     def _execute_query(self, cursor, query, params=()):
         try:
@@ -147,7 +148,9 @@ class PostgresStatementMetrics(object):
 
         for row in rows:
             try:
-                normalized_query = datadog_agent.obfuscate_sql(row['query'])
+                normalized_query, query_signature = self._obfuscation_cache.get(
+                    row_keyfunc(row), row['query'], datadog_agent.obfuscate_sql
+                )
                 if not normalized_query:
                     self.log.warning("Obfuscation of query '%s' resulted in empty query", row['query'])
                     continue
@@ -157,8 +160,6 @@ class PostgresStatementMetrics(object):
                 self.log.warning("Failed to obfuscate query '%s': %s", row['query'], e)
                 continue
 
-            query_signature = compute_sql_signature(normalized_query)
-
             # All "Deep Database Monitoring" statement-level metrics are tagged with a `query_signature`
             # which uniquely identifies the normalized query family. Where possible, this hash should
             # match the hash of APM "resources" (https://docs.datadoghq.com/tracing/visualization/resource/)
@@ -186,4 +187,11 @@ class PostgresStatementMetrics(object):
                     value = milliseconds_to_nanoseconds(value)
                 metrics.append((metric_name, value, tags))
 
+        self.log.debug(
+            'Obfuscation cache: size=%s hits=%s misses=%s evictions=%s',
+            len(self._obfuscation_cache),
+            self._obfuscation_cache.hits,
+            self._obfuscation_cache.misses,
+            self._obfuscation_cache.evictions,
+        )
         return metrics
@@ -264,6 +264,9 @@ def test_statement_metrics(aggregator, integration_check, pg_instance):
     for name in STATEMENT_METRICS:
         aggregator.assert_metric(name, count=1, tags=expected_tags)
 
+    for name in ('size', 'hits', 'misses', 'evictions'):
+        aggregator.assert_metric('dd.postgres.obfuscation_cache.{}'.format(name), at_least=1)
+
 
 def assert_state_clean(check):
     assert check.metrics_cache.instance_metrics is None
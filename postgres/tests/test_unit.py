@@ -1,6 +1,8 @@
 # (C) Datadog, Inc. 2018-present
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
+from threading import current_thread
+
 import mock
 import psycopg2
 import pytest
@@ -9,7 +11,9 @@ from pytest import fail
 from semver import VersionInfo
 from six import iteritems
 
-from datadog_checks.postgres import util
+from datadog_checks.base import AgentCheck
+from datadog_checks.postgres import PostgreSql, util
+from datadog_checks.postgres.connections import MultiDatabaseConnectionPool
 
 from .common import SCHEMA_NAME
 
@@ -213,6 +217,44 @@ def test_version_metadata(check, test_case, params):
         m.assert_any_call('test:123', 'version.raw', test_case)
 
 
+def test_relations_scope_streaming(aggregator, check):
+    check.config.max_relations = 2
+    check.warning = MagicMock()
+    db = MagicMock()
+    server_cursor = db.cursor.return_value
+    server_cursor.rowcount = 4
+    server_cursor.__iter__.return_value = iter(
+        [['breed', 'public', 1, 2], ['kennel', 'public', 3, 4], ['dogs', 'public', 5, 6]]
+    )
+    scope = {
+        'descriptors': [('relname', 'table'), ('schemaname', 'schema')],
+        'metrics': {
+            'seq_scan': ('postgresql.seq_scans', AgentCheck.gauge),
+            'n_live_tup': ('postgresql.live_rows', AgentCheck.gauge),
+        },
+        'query': 'SELECT relname, schemaname, {metrics_columns} FROM pg_stat_user_tables WHERE {relations}',
+        'relation': True,
+    }
+    relations_config = {'.*': {'relation_regex': '.*', 'schemas': [util.ALL_SCHEMAS]}}
+
+    assert check._query_scope(MagicMock(connection=db), scope, ['foo:bar'], False, relations_config) == 2
+
+    # Results are streamed from a server-side cursor, without fetching more than one row past the limit
+    db.cursor.assert_any_call(name='datadog_postgres_scope')
+    assert server_cursor.itersize == 3
+    (query,), _ = server_cursor.execute.call_args_list[0]
+    assert query.startswith('SELECT relname, schemaname, seq_scan, n_live_tup FROM pg_stat_user_tables WHERE')
+    # The rows left are counted without being fetched
+    server_cursor.execute.assert_called_with('MOVE FORWARD ALL IN datadog_postgres_scope')
+    check.warning.assert_called_once_with(mock.ANY, query, 2, 7)
+
+    for table, values in (('breed', (1, 2)), ('kennel', (3, 4))):
+        tags = ['foo:bar', 'table:{}'.format(table), 'schema:public']
+        aggregator.assert_metric('postgresql.seq_scans', values[0], tags=tags)
+        aggregator.assert_metric('postgresql.live_rows', values[1], tags=tags)
+    aggregator.assert_all_metrics_covered()
+
+
 @pytest.mark.usefixtures('mock_cursor_for_replica_stats')
 def test_replication_stats(aggregator, integration_check, pg_instance):
     check = integration_check(pg_instance)
@@ -260,3 +302,115 @@ def test_query_timeout_connection_string(aggregator, integration_check, pg_insta
     except psycopg2.OperationalError:
         # could not connect to server because there is no server running
         pass
+
+
+def test_connection_pool():
+    connections = []
+
+    def connect(dbname):
+        conn = MagicMock(closed=False, status=psycopg2.extensions.STATUS_READY, dbname=dbname)
+        connections.append(conn)
+        return conn
+
+    pool = MultiDatabaseConnectionPool(connect, 2)
+
+    with pool.get_connection('dogs') as conn:
+        assert conn.dbname == 'dogs'
+    with pool.get_connection('dogs') as conn:
+        assert conn is connections[0]
+    with pool.get_connection('cats') as conn:
+        assert conn.dbname == 'cats'
+    assert len(connections) == 2
+
+    # The pool is full, the least recently used connection is closed
+    with pool.get_connection('birds'):
+        pass
+    connections[0].close.assert_called_once_with()
+    connections[1].close.assert_not_called()
+
+    # Connections failing during a query are not reused
+    with pytest.raises(Exception):
+        with pool.get_connection('birds'):
+            raise Exception('error')
+    connections[2].close.assert_called_once_with()
+    with pool.get_connection('birds') as conn:
+        assert conn is connections[3]
+
+    pool.close_all()
+    connections[1].close.assert_called_once_with()
+    connections[3].close.assert_called_once_with()
+
+
+def test_database_autodiscovery(aggregator, pg_instance):
+    pg_instance['database_autodiscovery'] = {'enabled': True, 'exclude': ['postgres$']}
+    check = PostgreSql('postgres', {}, [pg_instance])
+    check._version = VersionInfo(9, 2, 0)
+
+    cursor = MagicMock()
+    cursor.fetchall.return_value = [('postgres',), ('dogs',), ('cats',)]
+    databases = {}
+
+    def connect(dbname):
+        db = MagicMock(closed=False, status=psycopg2.extensions.STATUS_READY)
+        db.cursor.return_value.fetchall.return_value = [('public', 'bark', 1, 2, 3)]
+        databases[dbname] = db
+        return db
+
+    check._db_pool = MultiDatabaseConnectionPool(connect, 2)
+    check._collect_databases_stats(cursor, [util.FUNCTION_METRICS], ['foo:bar', 'db:postgres'], {})
+
+    assert sorted(databases) == ['cats', 'dogs']
+    for dbname in ('cats', 'dogs'):
+        tags = ['foo:bar', 'db:{}'.format(dbname), 'schema:public', 'function:bark']
+        aggregator.assert_metric('postgresql.function.calls', 1, tags=tags)
+        aggregator.assert_metric('postgresql.function.total_time', 2, tags=tags)
+        aggregator.assert_metric('postgresql.function.self_time', 3, tags=tags)
+    aggregator.assert_all_metrics_covered()
+
+
+def test_database_autodiscovery_query_errors(pg_instance):
+    pg_instance['database_autodiscovery'] = {'enabled': True}
+    check = PostgreSql('postgres', {}, [pg_instance])
+    check._version = VersionInfo(9, 2, 0)
+
+    cursor = MagicMock()
+    cursor.fetchall.return_value = [('dogs',), ('cats',)]
+
+    def connect(dbname):
+        db = MagicMock(closed=False, status=psycopg2.extensions.STATUS_READY)
+        db.cursor.return_value.execute.side_effect = psycopg2.errors.UndefinedFunction('no such function')
+        return db
+
+    check._db_pool = MultiDatabaseConnectionPool(connect, 2)
+    clean_state_threads = []
+    with mock.patch.object(check, '_clean_state', side_effect=lambda: clean_state_threads.append(current_thread())):
+        check._collect_databases_stats(cursor, [util.FUNCTION_METRICS], ['db:postgres'], {})
+
+    # The state of the check is only reset from its own thread
+    assert clean_state_threads == [current_thread()] * 2
+
+
+def test_cancel(pg_instance):
+    check = PostgreSql('postgres', {}, [pg_instance])
+    check._db_pool = MagicMock()
+    worker_pool = check._worker_pool = MagicMock()
+
+    check.cancel()
+
+    worker_pool.terminate.assert_called_once_with()
+    check._db_pool.close_all.assert_called_once_with()
+    assert check._worker_pool is None
+
+
+def test_custom_metrics_truncated(pg_instance):
+    check = PostgreSql('postgres', {}, [pg_instance])
+    check._version = VersionInfo(9, 2, 0)
+    cursor = MagicMock(rowcount=150)
+    cursor.fetchmany.return_value = [('max_connections', 100)]
+    scope = {'query': 'SHOW ALL', 'metrics': {}, 'descriptors': [], 'relation': False}
+
+    assert check._run_query_scope(cursor, scope, True, {}, [], [], False) == [('max_connections', 100)]
+
+    cursor.execute.assert_called_once_with('SHOW ALL')
+    cursor.fetchmany.assert_called_once_with(100)
+    assert check.warnings == ['Query: SHOW ALL returned more than 100 results (150). Truncating']
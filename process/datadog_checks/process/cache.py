@@ -1,23 +1,44 @@
 # (C) Datadog, Inc. 2020-present
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
+import os
+import threading
 import time
+from collections import defaultdict
 
 import psutil
 
 from .lock import ReadWriteLock
 
 DEFAULT_SHARED_PROCESS_LIST_CACHE_DURATION = 120
+DEFAULT_SHARED_PROCESS_STATS_CACHE_DURATION = 10
+# Processes whose stats weren't requested for that long are forgotten
+PROCESS_STATS_EXPIRATION = 300
+
+
+def normalize_process_string(string):
+    """Process names and command lines are matched case-insensitively on Windows."""
+    if os.name == 'nt':
+        return string.lower()
+    return string
 
 
 class ProcessListCache(object):
     """Process list to be shared among all instances."""
 
     elements = []
+    # Index of the names of the processes, normalized with `normalize_process_string`
+    pids_by_name = {}
+    # Processes whose name couldn't be read when the list was refreshed
+    unnamed_processes = []
     lock = ReadWriteLock()
     last_ts = 0
     cache_duration = DEFAULT_SHARED_PROCESS_LIST_CACHE_DURATION
 
+    def __init__(self):
+        self._cmdlines = None
+        self._cmdlines_lock = threading.Lock()
+
     def read_lock(self):
         return self.lock.read_lock()
 
@@ -37,12 +58,107 @@ class ProcessListCache(object):
         # threads getting a `yes` result at once
         with self.write_lock():
             if self._should_refresh():
-                self.elements = [proc for proc in psutil.process_iter(attrs=['pid', 'name'])]
+                elements = []
+                pids_by_name = defaultdict(set)
+                unnamed_processes = []
+                for proc in psutil.process_iter():
+                    try:
+                        pids_by_name[normalize_process_string(proc.name())].add(proc.pid)
+                    except psutil.NoSuchProcess:
+                        continue
+                    except psutil.AccessDenied:
+                        unnamed_processes.append(proc)
+                    elements.append(proc)
+
+                self.elements = elements
+                self.pids_by_name = pids_by_name
+                self.unnamed_processes = unnamed_processes
+                self._cmdlines = None
                 self.last_ts = time.time()
                 return True
             else:
                 return False
 
+    def get_cmdlines(self):
+        """
+        Return a list of tuples of each process and its command line, normalized with `normalize_process_string`.
+
+        The command line is None for processes that couldn't be read. Command lines are only read the first time
+        they're needed after each refresh, as they are only used to match processes with regular expressions.
+        The read lock must be held.
+        """
+        with self._cmdlines_lock:
+            if self._cmdlines is None:
+                cmdlines = []
+                for proc in self.elements:
+                    try:
+                        cmdlines.append((proc, normalize_process_string(' '.join(proc.cmdline()))))
+                    except psutil.NoSuchProcess:
+                        continue
+                    except psutil.AccessDenied:
+                        cmdlines.append((proc, None))
+                self._cmdlines = cmdlines
+            return self._cmdlines
+
     def reset(self):
         """Resets the cache."""
         self.last_ts = 0
+
+
+class ProcessStatsCache(object):
+    """
+    Stats of the monitored processes to be shared among all instances.
+
+    The stats of a process read for an instance are reused by the other instances matching the same process, as long
+    as they are not older than `cache_duration`. A reading is never returned twice to the same instance, so that each
+    of its runs sees fresh values. The lock must be held while using the cache.
+    """
+
+    processes = {}
+    entries = {}
+    lock = threading.Lock()
+    cache_duration = DEFAULT_SHARED_PROCESS_STATS_CACHE_DURATION
+
+    def get_process(self, pid):
+        """
+        Return the `psutil.Process` for `pid`, and whether it was just created.
+        Raises `psutil.NoSuchProcess` if the process doesn't exist anymore.
+        """
+        process = self.processes.get(pid)
+        if process is not None and process.is_running():
+            return process, False
+
+        process = self.processes[pid] = psutil.Process(pid)
+        return process, True
+
+    def get_stats(self, pid, try_sudo, consumer):
+        entry = self.entries.get((pid, try_sudo))
+        if entry is None:
+            return None
+
+        timestamp, stats, consumers = entry
+        if consumer in consumers or time.time() - timestamp > self.cache_duration:
+            return None
+
+        consumers.add(consumer)
+        return stats
+
+    def set_stats(self, pid, try_sudo, consumer, stats):
+        self.entries[(pid, try_sudo)] = (time.time(), stats, {consumer})
+
+    def prune(self):
+        """Forget the processes whose stats weren't requested recently."""
+        now = time.time()
+        for key, (timestamp, _, _) in list(self.entries.items()):
+            if now - timestamp > PROCESS_STATS_EXPIRATION:
+                del self.entries[key]
+
+        active_pids = {pid for pid, _ in self.entries}
+        for pid in list(self.processes):
+            if pid not in active_pids:
+                del self.processes[pid]
+
+    def reset(self):
+        """Resets the cache."""
+        self.processes = {}
+        self.entries = {}
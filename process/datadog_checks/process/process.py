@@ -3,7 +3,6 @@
 # Licensed under a 3-clause BSD style license (see LICENSE)
 from __future__ import division
 
-import os
 import re
 import subprocess
 import time
@@ -16,7 +15,13 @@ from datadog_checks.base import AgentCheck
 from datadog_checks.base.config import _is_affirmative
 from datadog_checks.base.utils.platform import Platform
 
-from .cache import DEFAULT_SHARED_PROCESS_LIST_CACHE_DURATION, ProcessListCache
+from .cache import (
+    DEFAULT_SHARED_PROCESS_LIST_CACHE_DURATION,
+    DEFAULT_SHARED_PROCESS_STATS_CACHE_DURATION,
+    ProcessListCache,
+    ProcessStatsCache,
+    normalize_process_string,
+)
 
 try:
     import datadog_agent
@@ -61,9 +66,50 @@ ATTR_TO_METRIC_RATE = {
 }
 
 
+# Patterns which can't be combined with others: numbered backreferences would refer to other groups, group names
+# may be used by several patterns and inline flags would apply to all of them
+UNCOMBINABLE_PATTERN = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?[aiLmsux-]+[:)]')
+
+# Compiled `search_string` regular expressions, shared among all instances
+search_patterns = {}
+
+
+class PatternList(object):
+    """Match a string against several regular expressions, one after the other."""
+
+    def __init__(self, patterns):
+        self._patterns = [re.compile(pattern) for pattern in patterns]
+
+    def search(self, string):
+        return any(pattern.search(string) for pattern in self._patterns)
+
+
+def compile_search_patterns(search_string):
+    """
+    Compile the `search_string` regular expressions into a single one, matching when any of them matches.
+    """
+    key = tuple(search_string)
+    pattern = search_patterns.get(key)
+    if pattern is None:
+        patterns = [normalize_process_string(string) for string in search_string]
+        pattern = None
+        if not any(UNCOMBINABLE_PATTERN.search(string) for string in patterns):
+            try:
+                pattern = re.compile('|'.join('(?:{})'.format(string) for string in patterns))
+            except re.error:
+                pass
+        if pattern is None:
+            pattern = PatternList(patterns)
+        search_patterns[key] = pattern
+
+    return pattern
+
+
 class ProcessCheck(AgentCheck):
     # Shared process list
     process_list_cache = ProcessListCache()
+    # Shared stats of the processes
+    process_stats_cache = ProcessStatsCache()
 
     def __init__(self, name, init_config, instances=None):
         super(ProcessCheck, self).__init__(name, init_config, instances)
@@ -96,12 +142,12 @@ class ProcessCheck(AgentCheck):
                     self._deprecated_init_procfs = True
                     psutil.PROCFS_PATH = procfs_path
 
-        # Process cache, indexed by instance
-        self.process_cache = defaultdict(dict)
-
         self.process_list_cache.cache_duration = int(
             init_config.get('shared_process_list_cache_duration', DEFAULT_SHARED_PROCESS_LIST_CACHE_DURATION)
         )
+        self.process_stats_cache.cache_duration = int(
+            init_config.get('shared_process_stats_cache_duration', DEFAULT_SHARED_PROCESS_STATS_CACHE_DURATION)
+        )
 
     def should_refresh_ad_cache(self, name):
         now = time.time()
@@ -125,8 +171,6 @@ class ProcessCheck(AgentCheck):
 
         refresh_ad_cache = self.should_refresh_ad_cache(name)
 
-        matching_pids = set()
-
         self.log.debug("Refreshing process list")
 
         # If refresh returns True, then the cache has been refreshed.
@@ -137,65 +181,31 @@ class ProcessCheck(AgentCheck):
             self.log.debug("Using process list cache")
 
         with self.process_list_cache.read_lock():
-            for proc in self.process_list_cache.elements:
-                # Skip access denied processes
-                if not refresh_ad_cache and proc.pid in self.ad_cache:
-                    continue
+            # FIXME 8.x: All has been deprecated
+            # from the doc, should be removed
+            if 'All' in search_string:
+                matching_pids = {proc.pid for proc in self.process_list_cache.elements}
+                # Processes are not read
+                ad_pids = set(self.ad_cache)
+            elif exact_match:
+                matching_pids, ad_pids = self._match_names(search_string, refresh_ad_cache, ad_error_logger, ignore_ad)
+            else:
+                matching_pids, ad_pids = self._match_cmdlines(
+                    search_string, refresh_ad_cache, ad_error_logger, ignore_ad
+                )
 
-                found = False
-                for string in search_string:
-                    try:
-                        # FIXME 8.x: All has been deprecated
-                        # from the doc, should be removed
-                        if string == 'All':
-                            found = True
-                        if exact_match:
-                            if os.name == 'nt':
-                                if proc.name().lower() == string.lower():
-                                    found = True
-                            else:
-                                if proc.name() == string:
-                                    found = True
-
-                        else:
-                            cmdline = proc.cmdline()
-                            if os.name == 'nt':
-                                lstring = string.lower()
-                                if re.search(lstring, ' '.join(cmdline).lower()):
-                                    found = True
-                            else:
-                                if re.search(string, ' '.join(cmdline)):
-                                    found = True
-                    except psutil.NoSuchProcess:
-                        # As the process list isn't necessarily scanned right after it's created
-                        # (since we're using a shared cache), there can be cases where processes
-                        # in the list are dead when an instance of the check tries to scan them.
-                        self.log.debug('Process disappeared while scanning')
-                    except psutil.AccessDenied as e:
-                        ad_error_logger('Access denied to process with PID {}'.format(proc.pid))
-                        ad_error_logger('Error: {}'.format(e))
-                        if refresh_ad_cache:
-                            self.ad_cache.add(proc.pid)
-                        if not ignore_ad:
-                            raise
-                    else:
-                        if refresh_ad_cache:
-                            self.ad_cache.discard(proc.pid)
-                        if found:
-                            matching_pids.add(proc.pid)
-                            break
+            if not refresh_ad_cache:
+                # Skip access denied processes
+                matching_pids -= self.ad_cache
+            else:
+                self.ad_cache = ad_pids
 
             if not matching_pids:
                 # Allow debug logging while preserving warning check state.
-                # Uncaught psutil exceptions trigger an Error state
-                try:
-                    processes = sorted(proc.name() for proc in self.process_list_cache.elements)
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                    pass
-                else:
-                    self.log.debug(
-                        "Unable to find process named %s among processes: %s", search_string, ', '.join(processes)
-                    )
+                processes = sorted(self.process_list_cache.pids_by_name)
+                self.log.debug(
+                    "Unable to find process named %s among processes: %s", search_string, ', '.join(processes)
+                )
 
         self.pid_cache[name] = matching_pids
         self.last_pid_cache_ts[name] = time.time()
@@ -203,6 +213,67 @@ class ProcessCheck(AgentCheck):
             self.last_ad_cache_ts[name] = time.time()
         return matching_pids
 
+    def _match_names(self, search_string, refresh_ad_cache, ad_error_logger, ignore_ad):
+        """
+        Return the pids of the processes named after one of the `search_string`, and the pids of the processes
+        that couldn't be read.
+        """
+        matching_pids = set()
+        for string in search_string:
+            matching_pids.update(self.process_list_cache.pids_by_name.get(normalize_process_string(string), ()))
+
+        # The name of some processes couldn't be read when the process list was refreshed, try again
+        ad_pids = set()
+        names = {normalize_process_string(string) for string in search_string}
+        for proc in self.process_list_cache.unnamed_processes:
+            if not refresh_ad_cache and proc.pid in self.ad_cache:
+                continue
+            try:
+                if normalize_process_string(proc.name()) in names:
+                    matching_pids.add(proc.pid)
+            except psutil.NoSuchProcess:
+                self.log.debug('Process disappeared while scanning')
+            except psutil.AccessDenied as e:
+                self._handle_access_denied(proc, e, ad_pids, ad_error_logger, ignore_ad)
+
+        return matching_pids, ad_pids
+
+    def _match_cmdlines(self, search_string, refresh_ad_cache, ad_error_logger, ignore_ad):
+        """
+        Return the pids of the processes whose command line matches one of the `search_string` regular expressions,
+        and the pids of the processes that couldn't be read.
+        """
+        pattern = compile_search_patterns(search_string)
+
+        matching_pids = set()
+        ad_pids = set()
+        for proc, cmdline in self.process_list_cache.get_cmdlines():
+            if cmdline is None:
+                # The command line couldn't be read when the process list was read, try again
+                if not refresh_ad_cache and proc.pid in self.ad_cache:
+                    continue
+                try:
+                    cmdline = normalize_process_string(' '.join(proc.cmdline()))
+                except psutil.NoSuchProcess:
+                    self.log.debug('Process disappeared while scanning')
+                    continue
+                except psutil.AccessDenied as e:
+                    self._handle_access_denied(proc, e, ad_pids, ad_error_logger, ignore_ad)
+                    continue
+
+            if pattern.search(cmdline):
+                matching_pids.add(proc.pid)
+
+        return matching_pids, ad_pids
+
+    def _handle_access_denied(self, proc, error, ad_pids, ad_error_logger, ignore_ad):
+        ad_error_logger('Access denied to process with PID {}'.format(proc.pid))
+        ad_error_logger('Error: {}'.format(error))
+        ad_pids.add(proc.pid)
+        if not ignore_ad:
+            self.ad_cache.update(ad_pids)
+            raise error
+
     def psutil_wrapper(self, process, method, accessors, try_sudo, *args, **kwargs):
         """
         A psutil wrapper that is calling
@@ -259,94 +330,101 @@ class ProcessCheck(AgentCheck):
 
     def get_process_state(self, name, pids, try_sudo):
         st = defaultdict(list)
+        cpu_count = psutil.cpu_count()
 
-        # Remove from cache the processes that are not in `pids`
-        cached_pids = set(self.process_cache[name].keys())
-        pids_to_remove = cached_pids - pids
-        for pid in pids_to_remove:
-            del self.process_cache[name][pid]
+        process_stats_cache = self.process_stats_cache
+        with process_stats_cache.lock:
+            process_stats_cache.prune()
 
+        # The lock is only held to access the cache, so that instances read the stats of their processes concurrently
         for pid in pids:
             st['pids'].append(pid)
 
-            new_process = False
-            # If the pid's process is not cached, retrieve it
-            if pid not in self.process_cache[name] or not self.process_cache[name][pid].is_running():
-                new_process = True
-                try:
-                    self.process_cache[name][pid] = psutil.Process(pid)
-                    self.log.debug('New process in cache: %s', pid)
-                # Skip processes dead in the meantime
-                except psutil.NoSuchProcess:
-                    self.warning('Process %s disappeared while scanning', pid)
-                    # reset the process caches now, something changed
-                    self.last_pid_cache_ts[name] = 0
-                    self.process_list_cache.reset()
+            # The stats read for another instance matching the same process are reused
+            with process_stats_cache.lock:
+                stats = process_stats_cache.get_stats(pid, try_sudo, (id(self), name))
+            if stats is None:
+                stats = self._read_process_stats(name, pid, try_sudo, cpu_count)
+                if stats is None:
                     continue
+                with process_stats_cache.lock:
+                    process_stats_cache.set_stats(pid, try_sudo, (id(self), name), stats)
+
+            for attr, value in iteritems(stats):
+                st[attr].append(value)
+
+        return st
+
+    def _read_process_stats(self, name, pid, try_sudo, cpu_count):
+        try:
+            with self.process_stats_cache.lock:
+                p, new_process = self.process_stats_cache.get_process(pid)
+        # Skip processes dead in the meantime
+        except psutil.NoSuchProcess:
+            self.warning('Process %s disappeared while scanning', pid)
+            # reset the process caches now, something changed
+            self.last_pid_cache_ts[name] = 0
+            self.process_list_cache.reset()
+            return None
 
-            p = self.process_cache[name][pid]
+        if new_process:
+            self.log.debug('New process in cache: %s', pid)
 
-            meminfo = self.psutil_wrapper(p, 'memory_info', ['rss', 'vms'], try_sudo)
-            st['rss'].append(meminfo.get('rss'))
-            st['vms'].append(meminfo.get('vms'))
+        st = {}
+        # Read all the stats at once, instead of reading the same `/proc` files again for each of them
+        with p.oneshot():
+            meminfo = self.psutil_wrapper(p, 'memory_info', ['rss', 'vms', 'shared'], try_sudo)
+            st['rss'] = meminfo.get('rss')
+            st['vms'] = meminfo.get('vms')
 
-            mem_percent = self.psutil_wrapper(p, 'memory_percent', None, try_sudo)
-            st['mem_pct'].append(mem_percent)
+            st['mem_pct'] = self.psutil_wrapper(p, 'memory_percent', None, try_sudo)
 
             # will fail on win32 and solaris
-            shared_mem = self.psutil_wrapper(p, 'memory_info', ['shared'], try_sudo).get('shared')
+            shared_mem = meminfo.get('shared')
             if shared_mem is not None and meminfo.get('rss') is not None:
-                st['real'].append(meminfo['rss'] - shared_mem)
+                st['real'] = meminfo['rss'] - shared_mem
             else:
-                st['real'].append(None)
+                st['real'] = None
 
             ctxinfo = self.psutil_wrapper(p, 'num_ctx_switches', ['voluntary', 'involuntary'], try_sudo)
-            st['ctx_swtch_vol'].append(ctxinfo.get('voluntary'))
-            st['ctx_swtch_invol'].append(ctxinfo.get('involuntary'))
+            st['ctx_swtch_vol'] = ctxinfo.get('voluntary')
+            st['ctx_swtch_invol'] = ctxinfo.get('involuntary')
 
-            st['thr'].append(self.psutil_wrapper(p, 'num_threads', None, try_sudo))
+            st['thr'] = self.psutil_wrapper(p, 'num_threads', None, try_sudo)
 
             cpu_percent = self.psutil_wrapper(p, 'cpu_percent', None, try_sudo)
-            cpu_count = psutil.cpu_count()
             if not new_process:
                 # psutil returns `0.` for `cpu_percent` the
                 # first time it's sampled on a process,
                 # so save the value only on non-new processes
-                st['cpu'].append(cpu_percent)
+                st['cpu'] = cpu_percent
                 if cpu_count > 0 and cpu_percent is not None:
-                    st['cpu_norm'].append(cpu_percent / cpu_count)
+                    st['cpu_norm'] = cpu_percent / cpu_count
                 else:
                     self.log.debug('could not calculate the normalized cpu pct, cpu_count: %s', cpu_count)
-            st['open_fd'].append(self.psutil_wrapper(p, 'num_fds', None, try_sudo))
-            st['open_handle'].append(self.psutil_wrapper(p, 'num_handles', None, try_sudo))
+            st['open_fd'] = self.psutil_wrapper(p, 'num_fds', None, try_sudo)
+            st['open_handle'] = self.psutil_wrapper(p, 'num_handles', None, try_sudo)
 
             ioinfo = self.psutil_wrapper(
                 p, 'io_counters', ['read_count', 'write_count', 'read_bytes', 'write_bytes'], try_sudo
             )
-            st['r_count'].append(ioinfo.get('read_count'))
-            st['w_count'].append(ioinfo.get('write_count'))
-            st['r_bytes'].append(ioinfo.get('read_bytes'))
-            st['w_bytes'].append(ioinfo.get('write_bytes'))
+            st['r_count'] = ioinfo.get('read_count')
+            st['w_count'] = ioinfo.get('write_count')
+            st['r_bytes'] = ioinfo.get('read_bytes')
+            st['w_bytes'] = ioinfo.get('write_bytes')
 
             pagefault_stats = self.get_pagefault_stats(pid)
             if pagefault_stats is not None:
-                (minflt, cminflt, majflt, cmajflt) = pagefault_stats
-                st['minflt'].append(minflt)
-                st['cminflt'].append(cminflt)
-                st['majflt'].append(majflt)
-                st['cmajflt'].append(cmajflt)
+                (st['minflt'], st['cminflt'], st['majflt'], st['cmajflt']) = pagefault_stats
             else:
-                st['minflt'].append(None)
-                st['cminflt'].append(None)
-                st['majflt'].append(None)
-                st['cmajflt'].append(None)
+                st['minflt'] = st['cminflt'] = st['majflt'] = st['cmajflt'] = None
 
             # calculate process run time
             create_time = self.psutil_wrapper(p, 'create_time', None, try_sudo)
             if create_time is not None:
                 now = time.time()
                 run_time = now - create_time
-                st['run_time'].append(run_time)
+                st['run_time'] = run_time
 
         return st
 
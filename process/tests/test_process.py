@@ -3,6 +3,7 @@
 # Licensed under a 3-clause BSD style license (see LICENSE)
 import logging
 import os
+from contextlib import contextmanager
 
 import psutil
 import pytest
@@ -10,6 +11,7 @@ from mock import patch
 from six import iteritems
 
 from datadog_checks.process import ProcessCheck
+from datadog_checks.process.process import compile_search_patterns
 
 from . import common
 
@@ -33,6 +35,7 @@ except Exception:
 def reset_process_list_cache():
     # Force process list cache flush in the next test
     ProcessCheck.process_list_cache.reset()
+    ProcessCheck.process_stats_cache.reset()
 
 
 class MockProcess(object):
@@ -42,6 +45,10 @@ class MockProcess(object):
     def is_running(self):
         return True
 
+    @contextmanager
+    def oneshot(self):
+        yield
+
     def children(self, recursive=False):
         return []
 
@@ -389,3 +396,64 @@ def test_process_service_check(aggregator):
     aggregator.assert_service_check('process.up', count=1, tags=['process:warning'], status=process.WARNING)
     aggregator.assert_service_check('process.up', count=1, tags=['process:no_top_ok'], status=process.OK)
     aggregator.assert_service_check('process.up', count=1, tags=['process:no_top_critical'], status=process.CRITICAL)
+
+
+def test_compile_search_patterns():
+    pattern = compile_search_patterns(['foo', r'ba(r|z)\d'])
+    assert pattern.search('/usr/bin/foo --flag')
+    assert pattern.search('/usr/bin/baz1')
+    assert not pattern.search('/usr/bin/bar')
+    assert compile_search_patterns(['foo', r'ba(r|z)\d']) is pattern
+
+    # Patterns with backreferences can't be combined
+    pattern = compile_search_patterns(['foo', r'(a)b\1'])
+    assert pattern.search('aba')
+    assert pattern.search('foo')
+    assert not pattern.search('abb')
+
+    # Inline flags only apply to their own pattern
+    pattern = compile_search_patterns(['(?i)java', 'nginx'])
+    assert pattern.search('/usr/bin/JAVA')
+    assert pattern.search('nginx: worker')
+    assert not pattern.search('NGINX: worker')
+
+    # Group names may be used by several patterns
+    pattern = compile_search_patterns(['(?P<x>foo)', '(?P<x>bar)'])
+    assert pattern.search('/usr/bin/bar')
+
+
+def test_find_pids_snapshot(aggregator):
+    process = ProcessCheck(common.CHECK_NAME, {}, {})
+    procs = [NamedMockProcess('foo'), NamedMockProcess('bar'), NamedMockProcess('foo')]
+    for pid, proc in enumerate(procs):
+        proc.pid = pid
+
+    with patch('psutil.process_iter', return_value=procs):
+        assert process.find_pids('foo', ['foo', 'baz'], True) == {0, 2}
+        # The process list is only read once for all instances
+        with patch.object(NamedMockProcess, 'name', side_effect=Exception('unexpected')):
+            assert process.find_pids('bar', ['bar'], True) == {1}
+
+
+@patch('psutil.Process', return_value=MockProcess())
+def test_process_stats_shared(mock_process, aggregator):
+    instance1 = {'name': 'foo', 'pid': 1}
+    instance2 = {'name': 'bar', 'pid': 1}
+    process1 = ProcessCheck(common.CHECK_NAME, {}, [instance1])
+    process2 = ProcessCheck(common.CHECK_NAME, {}, [instance2])
+
+    with patch.object(ProcessCheck, 'psutil_wrapper', side_effect=mock_psutil_wrapper) as psutil_wrapper:
+        process1.check(instance1)
+        calls = psutil_wrapper.call_count
+        assert calls > 0
+
+        # The stats read for the first instance are reused for the second one
+        process2.check(instance2)
+        assert psutil_wrapper.call_count == calls
+
+        # But are read again on the next run of the first instance
+        process1.check(instance1)
+        assert psutil_wrapper.call_count == 2 * calls
+
+    aggregator.assert_metric('system.processes.threads', value=0, count=2, tags=generate_expected_tags(instance1))
+    aggregator.assert_metric('system.processes.threads', value=0, count=1, tags=generate_expected_tags(instance2))
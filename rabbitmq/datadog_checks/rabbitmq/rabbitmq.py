@@ -315,42 +315,48 @@ class RabbitMQ(AgentCheck):
         except ValueError as e:
             raise RabbitMQException('Cannot parse JSON response from API url: {} {}'.format(url, str(e)))
 
+    def _iter_data(self, url):
+        """
+        Yield the items of the list returned by an API url one at a time, without loading the whole response.
+        """
+        try:
+            for item in self.http.get_json_items(url):
+                yield item
+        except RequestException as e:
+            raise RabbitMQException('Cannot open RabbitMQ API url: {} {}'.format(url, str(e)))
+        except ValueError as e:
+            raise RabbitMQException('Cannot parse JSON response from API url: {} {}'.format(url, str(e)))
+
     def _filter_list(self, data, explicit_filters, regex_filters, object_type, tag_families):
-        if explicit_filters or regex_filters:
-            matching_lines = []
+        if not explicit_filters and not regex_filters:
             for data_line in data:
-                name = data_line.get("name")
-                if name in explicit_filters:
-                    matching_lines.append(data_line)
-                    explicit_filters.remove(name)
-                    continue
-
-                match_found = self._append_match_lines(
-                    regex_filters, name, tag_families, data_line, object_type, matching_lines
-                )
-
-                if match_found:
-                    continue
-
-                # Absolute names work only for queues and exchanges
-                if object_type != QUEUE_TYPE and object_type != EXCHANGE_TYPE:
-                    continue
-                absolute_name = '{}/{}'.format(data_line.get("vhost"), name)
-                if absolute_name in explicit_filters:
-                    matching_lines.append(data_line)
-                    explicit_filters.remove(absolute_name)
-                    continue
-
-                match_found = self._append_match_lines(
-                    regex_filters, absolute_name, tag_families, data_line, object_type, matching_lines
-                )
-                if match_found:
-                    continue
-            return matching_lines
-        return data
+                yield data_line
+            return
 
-    def _append_match_lines(self, regex_filters, name, tag_families, data_line, object_type, matching_lines):
-        result = False
+        for data_line in data:
+            name = data_line.get("name")
+            if name in explicit_filters:
+                explicit_filters.remove(name)
+                yield data_line
+                continue
+
+            if self._match_line(regex_filters, name, tag_families, data_line, object_type):
+                yield data_line
+                continue
+
+            # Absolute names work only for queues and exchanges
+            if object_type != QUEUE_TYPE and object_type != EXCHANGE_TYPE:
+                continue
+            absolute_name = '{}/{}'.format(data_line.get("vhost"), name)
+            if absolute_name in explicit_filters:
+                explicit_filters.remove(absolute_name)
+                yield data_line
+                continue
+
+            if self._match_line(regex_filters, absolute_name, tag_families, data_line, object_type):
+                yield data_line
+
+    def _match_line(self, regex_filters, name, tag_families, data_line, object_type):
         object_tag_name = "queue_family"
         if object_type == EXCHANGE_TYPE:
             object_tag_name = "exchange_family"
@@ -366,10 +372,8 @@ class RabbitMQ(AgentCheck):
                             TAGS_MAP[object_type][key] = key_name
                     else:
                         data_line[object_tag_name] = match.groups()[0]
-                matching_lines.append(data_line)
-                result = True
-                break
-        return result
+                return True
+        return False
 
     def _get_tags(self, data, object_type, custom_tags):
         tags = []
@@ -382,7 +386,7 @@ class RabbitMQ(AgentCheck):
         return tags + custom_tags
 
     def _get_object_data(self, instance, base_url, object_type, limit_vhosts):
-        """data is a list of nodes or queues:
+        """Yield the nodes or queues one at a time, as they are read from the API. The full data is a list:
         data = [
             {
                 'status': 'running',
@@ -482,20 +486,19 @@ class RabbitMQ(AgentCheck):
             ...
         ]
         """
-        data = []
-
         # only do this if vhosts were specified,
         # otherwise it'll just be making more queries for the same data
         if self._limit_vhosts(instance) and object_type == QUEUE_TYPE:
             for vhost in limit_vhosts:
                 url = '{}/{}'.format(object_type, quote_plus(vhost))
                 try:
-                    data += self._get_data(urljoin(base_url, url))
+                    for data_line in self._iter_data(urljoin(base_url, url)):
+                        yield data_line
                 except Exception as e:
                     self.log.debug("Couldn't grab queue data from vhost, %s: %s", vhost, e)
         else:
-            data = self._get_data(urljoin(base_url, object_type))
-        return data
+            for data_line in self._iter_data(urljoin(base_url, object_type)):
+                yield data_line
 
     def get_stats(self, instance, base_url, object_type, max_detailed, filters, limit_vhosts, custom_tags):
         """
@@ -521,13 +524,20 @@ class RabbitMQ(AgentCheck):
             data, explicit_filters, regex_filters, object_type, instance.get("tag_families", False)
         )
 
-        # if no filters are specified, check everything according to the limits
-        if len(data) > ALERT_THRESHOLD * max_detailed:
-            # Post a message on the dogweb stream to warn
-            self.alert(base_url, max_detailed, len(data), object_type, custom_tags)
-
+        # The data is streamed: only keep what's needed to count the objects and query their bindings
+        data_count = 0
         data_lines_sent = 0
+        truncated = False
+        queues = []
         for data_line in data:
+            data_count += 1
+            if object_type is QUEUE_TYPE:
+                queues.append(
+                    (data_line['vhost'], data_line['name'], self._get_tags(data_line, object_type, custom_tags))
+                )
+
+            if truncated:
+                continue
             if data_lines_sent >= max_detailed:
                 # Display a warning in the info page
                 msg = (
@@ -536,16 +546,23 @@ class RabbitMQ(AgentCheck):
                     "file or get in touch with Datadog support"
                 ).format(object_type)
                 self.warning(msg)
-                break
-            # We truncate the list if it's above the limit
+                # We truncate the list if it's above the limit
+                truncated = True
+                continue
+
             metrics_sent = self._get_metrics(data_line, object_type, custom_tags)
             if metrics_sent >= 1:
                 data_lines_sent += 1
 
+        # if no filters are specified, check everything according to the limits
+        if data_count > ALERT_THRESHOLD * max_detailed:
+            # Post a message on the dogweb stream to warn
+            self.alert(base_url, max_detailed, data_count, object_type, custom_tags)
+
         # get a list of the number of bindings on a given queue
         # /api/queues/vhost/name/bindings
         if object_type is QUEUE_TYPE:
-            self._get_queue_bindings_metrics(base_url, custom_tags, data, object_type)
+            self._get_queue_bindings_metrics(base_url, queues)
 
     def get_overview_stats(self, base_url, custom_tags):
         data = self._get_data(urljoin(base_url, "overview"))
@@ -582,11 +599,9 @@ class RabbitMQ(AgentCheck):
                     )
         return metrics_sent
 
-    def _get_queue_bindings_metrics(self, base_url, custom_tags, data, object_type):
-        for item in data:
-            vhost = item['vhost']
-            tags = self._get_tags(item, object_type, custom_tags)
-            url = '{}/{}/{}/bindings'.format(QUEUE_TYPE, quote_plus(vhost), quote_plus(item['name']))
+    def _get_queue_bindings_metrics(self, base_url, queues):
+        for vhost, name, tags in queues:
+            url = '{}/{}/{}/bindings'.format(QUEUE_TYPE, quote_plus(vhost), quote_plus(name))
             bindings_count = len(self._get_data(urljoin(base_url, url)))
 
             self.gauge('rabbitmq.queue.bindings.count', bindings_count, tags)
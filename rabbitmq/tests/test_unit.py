@@ -9,7 +9,7 @@ from tests.common import EXCHANGE_MESSAGE_STATS
 
 import datadog_checks.base
 from datadog_checks.rabbitmq import RabbitMQ
-from datadog_checks.rabbitmq.rabbitmq import EXCHANGE_TYPE, NODE_TYPE, OVERVIEW_TYPE, RabbitMQException
+from datadog_checks.rabbitmq.rabbitmq import EXCHANGE_TYPE, NODE_TYPE, OVERVIEW_TYPE, QUEUE_TYPE, RabbitMQException
 
 from . import common, metrics
 
@@ -58,6 +58,7 @@ def test_status_check(check, aggregator):
 
     aggregator.reset()
     check._get_data = mock.MagicMock()
+    check._iter_data = mock.MagicMock()
     check.check({"rabbitmq_api_url": "http://example.com"})
     assert len(aggregator._service_checks) == 1
     scs = aggregator.service_checks('rabbitmq.status')
@@ -118,6 +119,24 @@ def test_get_stats_empty_exchanges(mock__get_object_data, instance, check, aggre
     aggregator.assert_metric('rabbitmq.exchange.messages.ack.count', tags=['rabbitmq_exchange:ex4'])
 
 
+@pytest.mark.unit
+@mock.patch.object(datadog_checks.rabbitmq.RabbitMQ, '_get_object_data')
+def test_get_stats_streamed_queues(mock__get_object_data, instance, check, aggregator):
+    mock__get_object_data.return_value = iter(
+        [{'name': 'q{}'.format(i), 'vhost': '/', 'messages': i} for i in range(3)]
+    )
+    check._get_data = mock.MagicMock(return_value=[{}, {}])
+
+    check.get_stats(instance, 'http://localhost/api/', QUEUE_TYPE, 2, {'explicit': [], 'regexes': []}, [], [])
+
+    aggregator.assert_metric('rabbitmq.queue.messages', count=2)
+    for i in range(3):
+        tags = ['rabbitmq_queue:q{}'.format(i), 'rabbitmq_vhost:/']
+        aggregator.assert_metric('rabbitmq.queue.bindings.count', value=2, tags=tags)
+    assert len(check.warnings) == 1
+    assert '3 queues are present' in aggregator.events[0]['msg_text']
+
+
 @pytest.mark.parametrize(
     'test_case, extra_config, expected_http_kwargs',
     [
@@ -135,6 +154,7 @@ def test_config(check, test_case, extra_config, expected_http_kwargs):
     config = {'rabbitmq_api_url': common.URL, 'queues': ['test1'], 'tags': ["tag1:1", "tag2"], 'exchanges': ['test1']}
     config.update(extra_config)
     check = RabbitMQ('rabbitmq', {}, instances=[config])
+    check._iter_data = mock.MagicMock()
 
     with mock.patch('datadog_checks.base.utils.http.requests') as r:
         r.get.return_value = mock.MagicMock(status_code=200)
@@ -0,0 +1,477 @@
+# (C) Datadog, Inc. 2020-present
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+"""
+Collect OIDs from many devices at once, on a single PySNMP dispatcher loop.
+"""
+import math
+import time
+from collections import deque
+from logging import Logger
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from pyasn1.type.univ import Null
+from pysnmp.entity.rfc3413 import cmdgen
+from pysnmp.hlapi.asyncore.cmdgen import vbProcessor
+from pysnmp.proto import errind
+from pysnmp.proto.rfc1905 import endOfMibView
+
+from .config import InstanceConfig
+from .exceptions import PySnmpError
+from .mibs import MIBLoader
+from .pysnmp_types import ObjectIdentity, ObjectType, SnmpEngine
+from .tuning import TOO_BIG, BulkTuning
+from .utils import batches, register_device_target, reply_invalid
+
+GET = 'get'
+GETNEXT = 'getnext'
+GETBULK = 'getbulk'
+
+
+class HostTimings(object):
+    """
+    Estimate the round-trip time of a device to adapt its timeout and retries.
+
+    The timeout follows the retransmission timeout estimation of TCP (RFC 6298), bounded by the configured timeout,
+    and a device that stopped responding is only retried once until it answers again.
+    """
+
+    ALPHA = 0.125
+    BETA = 0.25
+    K = 4
+    MIN_TIMEOUT = 1.0
+    # Timeouts are rounded up to this resolution, which bounds the number of targets registered per device.
+    RESOLUTION = 0.5
+
+    def __init__(self, timeout, retries):
+        # type: (float, int) -> None
+        self.max_timeout = float(timeout)
+        self.max_retries = retries
+        self.srtt = None  # type: Optional[float]
+        self.rttvar = 0.0
+        self.failures = 0
+
+    @property
+    def timeout(self):
+        # type: () -> float
+        if self.srtt is None:
+            return self.max_timeout
+        timeout = math.ceil((self.srtt + self.K * self.rttvar) / self.RESOLUTION) * self.RESOLUTION
+        return min(max(timeout, self.MIN_TIMEOUT), self.max_timeout)
+
+    @property
+    def retries(self):
+        # type: () -> int
+        if self.failures:
+            return min(1, self.max_retries)
+        return self.max_retries
+
+    def observe(self, rtt, timeout):
+        # type: (float, float) -> None
+        """
+        Record a successful response received after `rtt` seconds, for a request sent with the given `timeout`.
+        """
+        self.failures = 0
+
+        if rtt > timeout:
+            # The request was retransmitted, so we can't tell which one was answered (Karn's algorithm).
+            return
+
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+
+    def record_failure(self):
+        # type: () -> None
+        self.failures += 1
+
+
+class _Request(object):
+    """
+    An SNMP command sent to a device. Walks (GETNEXT and GETBULK) are re-sent until they leave their subtree.
+    """
+
+    def __init__(self, kind, slot, var_binds):
+        # type: (str, Tuple[int, int], List[Any]) -> None
+        self.kind = kind
+        self.slot = slot
+        self.var_binds = var_binds
+        self.initial_vars = []  # type: List[Any]
+        self.sent_at = 0.0
+        self.timeout = 0.0
+        self.max_repetitions = 0
+
+
+class _DeviceFetch(object):
+    """
+    The state of a single device during a collection.
+    """
+
+    def __init__(self, host, config, timings, oid_batch_size, bulk_tuning=None):
+        # type: (str, InstanceConfig, HostTimings, int, Optional[BulkTuning]) -> None
+        self.host = host
+        self.config = config
+        self.timings = timings
+        self.oid_batch_size = oid_batch_size
+        self.bulk_tuning = bulk_tuning
+        self.pending = deque()  # type: Deque[_Request]
+        self.in_flight = 0
+        self.scheduled = False
+        self.binds = {}  # type: Dict[Tuple[int, int], List[Any]]
+        self.errors = []  # type: List[str]
+        self.missing = []  # type: List[Any]
+        self.gets_left = 0
+        self.next_slot = 0
+
+    def result(self):
+        # type: () -> Tuple[List[Any], List[str]]
+        all_binds = []  # type: List[Any]
+        for slot in sorted(self.binds):
+            all_binds.extend(self.binds[slot])
+        return all_binds, self.errors
+
+
+class AsyncCollectionEngine(object):
+    """
+    Fetch the OIDs of many devices concurrently, using a single PySNMP engine and UDP socket.
+
+    Instead of blocking a thread per device on each request, requests of all devices are kept in flight at once
+    and driven by callbacks on one dispatcher loop. At most `requests_per_host` requests are sent to the same device
+    at a time, and at most `max_in_flight` requests overall.
+
+    The PySNMP engine must only be used from a single thread, so `fetch()` must not be called concurrently.
+    """
+
+    MAX_IN_FLIGHT = 500
+
+    def __init__(
+        self,
+        loader,  # type: MIBLoader
+        mibs_path=None,  # type: str
+        max_in_flight=MAX_IN_FLIGHT,  # type: int
+        logger=None,  # type: Optional[Logger]
+    ):
+        # type: (...) -> None
+        self._loader = loader
+        self._mibs_path = mibs_path
+        self.max_in_flight = max_in_flight
+        self.log = logger
+        self.timings = {}  # type: Dict[str, HostTimings]
+
+        self._snmp_engine = None  # type: Optional[SnmpEngine]
+        self._ready = deque()  # type: Deque[_DeviceFetch]
+        self._in_flight = 0
+        self._requests_sent = 0
+        self._ignore_nonincreasing_oid = False
+        self._non_repeaters = 0
+        self._max_repetitions = 0
+
+        # Command generators are stateless and can be shared across requests.
+        self._generators = {
+            GET: cmdgen.GetCommandGenerator(),
+            GETNEXT: cmdgen.NextCommandGenerator(),
+            GETBULK: cmdgen.BulkCommandGenerator(),
+        }  # type: Dict[str, Any]
+
+    def _get_snmp_engine(self):
+        # type: () -> SnmpEngine
+        if self._snmp_engine is None:
+            self._snmp_engine = self._loader.create_snmp_engine(self._mibs_path)
+        return self._snmp_engine
+
+    def close(self):
+        # type: () -> None
+        """
+        Close the dispatcher and its socket. A new engine is created on the next fetch.
+        """
+        if self._snmp_engine is not None:
+            dispatcher = self._snmp_engine.transportDispatcher
+            if dispatcher is not None:
+                dispatcher.closeDispatcher()
+            self._snmp_engine = None
+
+    def fetch(
+        self,
+        devices,  # type: Dict[str, InstanceConfig]
+        oid_batch_size,  # type: int
+        ignore_nonincreasing_oid,  # type: bool
+        non_repeaters,  # type: int
+        max_repetitions,  # type: int
+        bulk_tunings=None,  # type: Dict[str, Optional[BulkTuning]]
+    ):
+        # type: (...) -> Dict[str, Tuple[List[Any], List[str]]]
+        """
+        Fetch the OIDs of every device and return the var binds and error messages collected for each of them.
+
+        GETBULK requests use `max_repetitions`, unless a tuning is given for the device in `bulk_tunings`.
+        """
+        bulk_tunings = {} if bulk_tunings is None else bulk_tunings
+        self._ignore_nonincreasing_oid = ignore_nonincreasing_oid
+        self._non_repeaters = non_repeaters
+        self._max_repetitions = max_repetitions
+        self._ready.clear()
+        self._in_flight = 0
+        self._requests_sent = 0
+
+        start_time = time.time()
+        fetches = []
+        for host, config in devices.items():
+            timings = self.timings.get(host)
+            if timings is None or (timings.max_timeout, timings.max_retries) != (config.timeout, config.retries):
+                timings = self.timings[host] = HostTimings(config.timeout, config.retries)
+            fetch = _DeviceFetch(host, config, timings, oid_batch_size, bulk_tunings.get(host))
+            fetches.append(fetch)
+
+            try:
+                self._prepare(fetch)
+            except Exception as e:
+                fetch.errors.append(str(e))
+
+        # Forget about devices that are no longer collected.
+        for host in set(self.timings) - set(devices):
+            del self.timings[host]
+
+        self._pump()
+        if self._in_flight:
+            try:
+                self._get_snmp_engine().transportDispatcher.runDispatcher()
+            except Exception as e:
+                # Don't reuse a dispatcher that may still have pending requests.
+                self.close()
+                for fetch in fetches:
+                    if fetch.in_flight or fetch.pending:
+                        fetch.errors.append(str(e))
+
+        if self.log is not None:
+            self.log.debug(
+                'Sent %d SNMP requests to %d devices in %.2fs',
+                self._requests_sent,
+                len(fetches),
+                time.time() - start_time,
+            )
+
+        return {fetch.host: fetch.result() for fetch in fetches}
+
+    def _prepare(self, fetch):
+        # type: (_DeviceFetch) -> None
+        oid_config = fetch.config.oid_config
+        snmp_engine = self._get_snmp_engine()
+
+        scalar_oids = [oid.as_object_type() for oid in oid_config.scalar_oids]
+        fetch.missing = [oid.as_object_type() for oid in oid_config.next_oids]
+
+        for oids_batch in batches(scalar_oids, size=fetch.oid_batch_size):
+            var_binds = vbProcessor.makeVarBinds(snmp_engine, oids_batch)
+            self._queue(fetch, _Request(GET, (0, fetch.next_slot), var_binds))
+            fetch.next_slot += 1
+            fetch.gets_left += 1
+
+        for oid in oid_config.bulk_oids:
+            var_binds = vbProcessor.makeVarBinds(snmp_engine, [oid.as_object_type()])
+            request = _Request(GETBULK, (2, fetch.next_slot), var_binds)
+            request.initial_vars = [var_binds[0][0]]
+            self._queue(fetch, request)
+            fetch.next_slot += 1
+
+        if not fetch.gets_left:
+            self._queue_getnext(fetch)
+
+    def _queue_getnext(self, fetch):
+        # type: (_DeviceFetch) -> None
+        # GETNEXT requests also retry OIDs that could not be fetched with a GET, so they're sent once all GETs are done.
+        snmp_engine = self._get_snmp_engine()
+        for oids_batch in batches(fetch.missing, size=fetch.oid_batch_size):
+            var_binds = vbProcessor.makeVarBinds(snmp_engine, oids_batch)
+            request = _Request(GETNEXT, (1, fetch.next_slot), var_binds)
+            request.initial_vars = [var_bind[0] for var_bind in var_binds]
+            self._queue(fetch, request)
+            fetch.next_slot += 1
+        fetch.missing = []
+
+    def _queue(self, fetch, request):
+        # type: (_DeviceFetch, _Request) -> None
+        fetch.pending.append(request)
+        if not fetch.scheduled:
+            fetch.scheduled = True
+            self._ready.append(fetch)
+
+    def _pump(self):
+        # type: () -> None
+        """
+        Send pending requests in a round-robin fashion across devices, within the concurrency limits.
+        """
+        while self._ready and self._in_flight < self.max_in_flight:
+            fetch = self._ready.popleft()
+            if fetch.pending and fetch.in_flight < fetch.config.async_requests_per_host:
+                self._send(fetch, fetch.pending.popleft())
+
+            if fetch.pending and fetch.in_flight < fetch.config.async_requests_per_host:
+                self._ready.append(fetch)
+            else:
+                fetch.scheduled = False
+
+    def _target(self, fetch):
+        # type: (_DeviceFetch) -> str
+        config = fetch.config
+        if config.device is None:
+            raise RuntimeError('No device set')  # pragma: no cover
+
+        return register_device_target(
+            config.device.ip,
+            config.device.port,
+            timeout=fetch.timings.timeout,
+            retries=fetch.timings.retries,
+            engine=self._get_snmp_engine(),
+            auth_data=config._auth_data,
+            context_data=config._context_data,
+        )
+
+    def _send(self, fetch, request):
+        # type: (_DeviceFetch, _Request) -> None
+        snmp_engine = self._get_snmp_engine()
+        context_data = fetch.config._context_data
+
+        try:
+            target = self._target(fetch)
+            if request.kind == GETBULK:
+                if fetch.bulk_tuning is not None:
+                    request.max_repetitions = fetch.bulk_tuning.max_repetitions
+                else:
+                    request.max_repetitions = self._max_repetitions
+                self._generators[GETBULK].sendVarBinds(
+                    snmp_engine,
+                    target,
+                    context_data.contextEngineId,
+                    context_data.contextName,
+                    self._non_repeaters,
+                    request.max_repetitions,
+                    request.var_binds,
+                    self._on_response,
+                    (fetch, request),
+                )
+            else:
+                self._generators[request.kind].sendVarBinds(
+                    snmp_engine,
+                    target,
+                    context_data.contextEngineId,
+                    context_data.contextName,
+                    request.var_binds,
+                    self._on_response,
+                    (fetch, request),
+                )
+        except PySnmpError as e:
+            self._fail(fetch, request, str(e))
+            return
+
+        request.sent_at = time.time()
+        request.timeout = fetch.timings.timeout
+        fetch.in_flight += 1
+        self._in_flight += 1
+        self._requests_sent += 1
+
+    def _on_response(  # type: ignore
+        self, snmpEngine, sendRequestHandle, errorIndication, errorStatus, errorIndex, varBinds, cbCtx
+    ):
+        fetch, request = cbCtx  # type: _DeviceFetch, _Request
+        fetch.in_flight -= 1
+        self._in_flight -= 1
+
+        try:
+            self._process_response(snmpEngine, fetch, request, errorIndication, errorStatus, varBinds)
+        except Exception as e:
+            self._fail(fetch, request, str(e))
+
+        if fetch.pending and not fetch.scheduled:
+            fetch.scheduled = True
+            self._ready.append(fetch)
+        self._pump()
+
+    def _process_response(self, snmp_engine, fetch, request, error_indication, error_status, var_binds):
+        # type: (SnmpEngine, _DeviceFetch, _Request, Any, Any, Any) -> None
+        lookup_mib = fetch.config.enforce_constraints
+
+        if request.kind == GETBULK and fetch.bulk_tuning is not None:
+            if int(error_status) == TOO_BIG:
+                fetch.bulk_tuning.record_too_big()
+                if request.max_repetitions > fetch.bulk_tuning.max_repetitions:
+                    # Ask again for fewer rows.
+                    fetch.pending.appendleft(request)
+                    return
+            elif isinstance(error_indication, errind.RequestTimedOut):
+                fetch.bulk_tuning.record_error()
+            elif not error_indication:
+                fetch.bulk_tuning.observe(
+                    request.max_repetitions,
+                    len(var_binds),
+                    time.time() - request.sent_at,
+                    end_of_mib_view=bool(var_binds) and endOfMibView.isSameTypeWith(var_binds[-1][0][1]),
+                )
+
+        if self._ignore_nonincreasing_oid and request.kind != GET:
+            if isinstance(error_indication, errind.OidNotIncreasing):
+                error_indication = None
+
+        if error_indication:
+            if isinstance(error_indication, errind.RequestTimedOut):
+                fetch.timings.record_failure()
+            self._fail(fetch, request, '{} for device {}'.format(error_indication, fetch.config.device))
+            return
+
+        fetch.timings.observe(time.time() - request.sent_at, request.timeout)
+
+        if request.kind == GET:
+            binds = fetch.binds.setdefault(request.slot, [])
+            for var in vbProcessor.unmakeVarBinds(snmp_engine, var_binds, lookup_mib):
+                result_oid, value = var
+                if reply_invalid(value):
+                    fetch.missing.append(ObjectType(ObjectIdentity(result_oid.asTuple())))
+                else:
+                    binds.append(var)
+            self._on_get_done(fetch)
+
+        elif request.kind == GETNEXT:
+            var_bind_table = [vbProcessor.unmakeVarBinds(snmp_engine, row, lookup_mib) for row in var_binds]
+            row = var_bind_table[0] if var_bind_table else []
+            next_var_binds = []
+            new_initial_vars = []
+            for col, var_bind in enumerate(row):
+                name, val = var_bind
+                if not isinstance(val, Null) and request.initial_vars[col].isPrefixOf(name):
+                    next_var_binds.append(var_bind)
+                    new_initial_vars.append(request.initial_vars[col])
+            if next_var_binds:
+                fetch.binds.setdefault(request.slot, []).extend(next_var_binds)
+                request.var_binds = next_var_binds
+                request.initial_vars = new_initial_vars
+                fetch.pending.appendleft(request)
+
+        else:
+            var_bind_table = [vbProcessor.unmakeVarBinds(snmp_engine, row, lookup_mib) for row in var_binds]
+            binds = fetch.binds.setdefault(request.slot, [])
+            initial_var = request.initial_vars[0]
+            for row in var_bind_table:
+                name, value = row[0]
+                if endOfMibView.isSameTypeWith(value) or not initial_var.isPrefixOf(name):
+                    return
+                binds.append(row[0])
+            if var_bind_table:
+                request.var_binds = vbProcessor.makeVarBinds(snmp_engine, [var_bind_table[-1][0]])
+                fetch.pending.appendleft(request)
+
+    def _on_get_done(self, fetch):
+        # type: (_DeviceFetch) -> None
+        fetch.gets_left -= 1
+        if not fetch.gets_left:
+            self._queue_getnext(fetch)
+
+    def _fail(self, fetch, request, message):
+        # type: (_DeviceFetch, _Request, str) -> None
+        fetch.errors.append(message)
+        if request.kind == GETNEXT:
+            # Like the synchronous walk, a failed GETNEXT batch doesn't report partial results.
+            fetch.binds.pop(request.slot, None)
+        elif request.kind == GET:
+            self._on_get_done(fetch)
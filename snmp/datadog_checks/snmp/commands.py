@@ -1,7 +1,8 @@
 # (C) Datadog, Inc. 2020-present
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
-from typing import Any, Dict, Generator
+import time
+from typing import Any, Dict, Generator, Optional
 
 from pyasn1.type.univ import Null
 from pysnmp import hlapi
@@ -13,6 +14,7 @@ from pysnmp.proto.rfc1905 import endOfMibView
 from datadog_checks.base.errors import CheckException
 
 from .config import InstanceConfig
+from .tuning import TOO_BIG, BulkTuning
 
 
 def _handle_error(ctx, config):
@@ -112,9 +114,13 @@ def snmp_getnext(config, oids, lookup_mib, ignore_nonincreasing_oid):
         initial_vars = new_initial_vars
 
 
-def snmp_bulk(config, oid, non_repeaters, max_repetitions, lookup_mib, ignore_nonincreasing_oid):
-    # type: (InstanceConfig, hlapi.ObjectType, int, int, bool, bool) -> Generator
-    """Call SNMP GETBULK on an oid."""
+def snmp_bulk(config, oid, non_repeaters, max_repetitions, lookup_mib, ignore_nonincreasing_oid, tuning=None):
+    # type: (InstanceConfig, hlapi.ObjectType, int, int, bool, bool, Optional[BulkTuning]) -> Generator
+    """Call SNMP GETBULK on an oid.
+
+    If `tuning` is given, the number of rows requested adapts to the responses of the device instead of
+    being `max_repetitions`.
+    """
 
     if config.device is None:
         raise RuntimeError('No device set')  # pragma: no cover
@@ -126,6 +132,7 @@ def snmp_bulk(config, oid, non_repeaters, max_repetitions, lookup_mib, ignore_no
         if ignore_nonincreasing_oid and errorIndication and isinstance(errorIndication, errind.OidNotIncreasing):
             errorIndication = None
         cbCtx['error'] = errorIndication
+        cbCtx['error_status'] = errorStatus
         cbCtx['var_bind_table'] = var_bind_table
 
     ctx = {}  # type: Dict[str, Any]
@@ -136,6 +143,10 @@ def snmp_bulk(config, oid, non_repeaters, max_repetitions, lookup_mib, ignore_no
     gen = cmdgen.BulkCommandGenerator()
 
     while True:
+        if tuning is not None:
+            max_repetitions = tuning.max_repetitions
+        sent_at = time.time()
+
         gen.sendVarBinds(
             config._snmp_engine,
             config.device.target,
@@ -150,6 +161,23 @@ def snmp_bulk(config, oid, non_repeaters, max_repetitions, lookup_mib, ignore_no
 
         config._snmp_engine.transportDispatcher.runDispatcher()
 
+        if tuning is not None:
+            var_bind_table = ctx['var_bind_table']
+            if int(ctx['error_status']) == TOO_BIG:
+                tuning.record_too_big()
+                if max_repetitions > tuning.max_repetitions:
+                    # Ask again for fewer rows.
+                    continue
+            elif isinstance(ctx['error'], errind.RequestTimedOut):
+                tuning.record_error()
+            elif not ctx['error']:
+                tuning.observe(
+                    max_repetitions,
+                    len(var_bind_table),
+                    time.time() - sent_at,
+                    end_of_mib_view=bool(var_bind_table) and endOfMibView.isSameTypeWith(var_bind_table[-1][0][1]),
+                )
+
         _handle_error(ctx, config)
 
         for var_binds in ctx['var_bind_table']:
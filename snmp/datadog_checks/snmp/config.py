@@ -22,7 +22,7 @@ from .pysnmp_types import (
     usmDESPrivProtocol,
     usmHMACMD5AuthProtocol,
 )
-from .resolver import OIDResolver
+from .resolver import OIDRegistry, OIDResolver
 from .types import OIDMatch
 from .utils import register_device_target
 
@@ -39,6 +39,9 @@ class InstanceConfig:
     DEFAULT_ALLOWED_FAILURES = 3
     DEFAULT_BULK_THRESHOLD = 0
     DEFAULT_WORKERS = 5
+    DEFAULT_DISCOVERY_WORKERS = 1
+    DEFAULT_DISCOVERY_MAX_BACKOFF = 4 * 3600
+    DEFAULT_ASYNC_REQUESTS_PER_HOST = 2
     DEFAULT_REFRESH_OIDS_CACHE_INTERVAL = 0  # `0` means disabled
 
     AUTH_PROTOCOL_MAPPING = {
@@ -106,14 +109,28 @@ class InstanceConfig:
         self.failing_instances = defaultdict(int)  # type: DefaultDict[str, int]
         self.allowed_failures = int(instance.get('discovery_allowed_failures', self.DEFAULT_ALLOWED_FAILURES))
         self.workers = int(instance.get('workers', self.DEFAULT_WORKERS))
+        self.discovery_workers = int(instance.get('discovery_workers', self.DEFAULT_DISCOVERY_WORKERS))
+        if self.discovery_workers < 1:
+            raise ConfigurationError('discovery_workers must be greater than 0')
+        self.discovery_probes_per_second = float(instance.get('discovery_probes_per_second', 0))
+        self.discovery_max_backoff = float(instance.get('discovery_max_backoff', self.DEFAULT_DISCOVERY_MAX_BACKOFF))
+        if self.discovery_max_backoff < 0:
+            raise ConfigurationError('discovery_max_backoff must be greater than or equal to 0')
+        self.async_collection = is_affirmative(instance.get('async_collection', False))
+        self.async_requests_per_host = int(
+            instance.get('async_requests_per_host', self.DEFAULT_ASYNC_REQUESTS_PER_HOST)
+        )
+        if self.async_requests_per_host < 1:
+            raise ConfigurationError('async_requests_per_host must be greater than 0')
 
         self.bulk_threshold = int(instance.get('bulk_threshold', self.DEFAULT_BULK_THRESHOLD))
+        self.adaptive_bulk = is_affirmative(instance.get('adaptive_bulk', False))
 
         self._auth_data = self.get_auth_data(instance)
         self._context_data = ContextData(*self.get_context_data(instance))
 
-        timeout = int(instance.get('timeout', self.DEFAULT_TIMEOUT))
-        retries = int(instance.get('retries', self.DEFAULT_RETRIES))
+        self.timeout = int(instance.get('timeout', self.DEFAULT_TIMEOUT))
+        self.retries = int(instance.get('retries', self.DEFAULT_RETRIES))
 
         ip_address = instance.get('ip_address')
         network_address = instance.get('network_address')
@@ -130,8 +147,8 @@ class InstanceConfig:
             target = register_device_target(
                 ip_address,
                 port,
-                timeout=timeout,
-                retries=retries,
+                timeout=self.timeout,
+                retries=self.retries,
                 engine=self._snmp_engine,
                 auth_data=self._auth_data,
                 context_data=self._context_data,
@@ -180,11 +197,19 @@ class InstanceConfig:
 
     def refresh_with_profile(self, profile):
         # type: (Dict[str, Any]) -> None
+        # OIDs defined by the profile are resolved using an index shared by all the instances using it.
+        registry = OIDRegistry()
+
         metrics = profile['definition'].get('metrics', [])
-        scalar_oids, next_oids, bulk_oids, parsed_metrics = self.parse_metrics(metrics)
+        scalar_oids, next_oids, bulk_oids, parsed_metrics = self.parse_metrics(metrics, resolver=registry)
 
         metric_tags = profile['definition'].get('metric_tags', [])
-        tag_oids, parsed_metric_tags = self.parse_metric_tags(metric_tags)
+        tag_oids, parsed_metric_tags = self.parse_metric_tags(metric_tags, resolver=registry)
+
+        oid_index = profile.get('oid_index')
+        if oid_index is None:
+            oid_index = profile['oid_index'] = registry.compile()
+        self._resolver.add_index(oid_index)
 
         device = profile['definition'].get('device', {})
         self.add_device_tags(device)
@@ -294,18 +319,22 @@ class InstanceConfig:
 
             yield host
 
-    def parse_metrics(self, metrics):
-        # type: (list) -> Tuple[List[OID], List[OID], List[OID], List[ParsedMetric]]
+    def parse_metrics(self, metrics, resolver=None):
+        # type: (list, OIDRegistry) -> Tuple[List[OID], List[OID], List[OID], List[ParsedMetric]]
         """Parse configuration and returns data to be used for SNMP queries."""
+        if resolver is None:
+            resolver = self._resolver
         # Use bulk for SNMP version > 1 only.
         bulk_threshold = self.bulk_threshold if self._auth_data.mpModel else 0
-        result = parse_metrics(metrics, resolver=self._resolver, logger=self.logger(), bulk_threshold=bulk_threshold)
+        result = parse_metrics(metrics, resolver=resolver, logger=self.logger(), bulk_threshold=bulk_threshold)
         return result['oids'], result['next_oids'], result['bulk_oids'], result['parsed_metrics']
 
-    def parse_metric_tags(self, metric_tags):
-        # type: (list) -> Tuple[List[OID], List[SymbolTag]]
+    def parse_metric_tags(self, metric_tags, resolver=None):
+        # type: (list, OIDRegistry) -> Tuple[List[OID], List[SymbolTag]]
         """Parse configuration for global metric_tags."""
-        result = parse_symbol_metric_tags(metric_tags, resolver=self._resolver)
+        if resolver is None:
+            resolver = self._resolver
+        result = parse_symbol_metric_tags(metric_tags, resolver=resolver)
         return result['oids'], result['parsed_symbol_tags']
 
     def add_uptime_metric(self):
@@ -2,10 +2,13 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 
+import functools
 import json
+import threading
 import time
 import weakref
-from typing import TYPE_CHECKING
+from concurrent import futures
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
 
 from datadog_checks.base import ConfigurationError
 
@@ -15,6 +18,105 @@ from .config import InstanceConfig
 if TYPE_CHECKING:
     from .snmp import SnmpCheck
 
+# Minimum delay between two writes of the discovered hosts to the persistent cache during a discovery pass.
+CACHE_WRITE_INTERVAL = 60
+
+
+class RateLimiter(object):
+    """
+    Space out calls to `wait()` so that they don't happen more than `rate` times per second.
+
+    A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate):
+        # type: (float) -> None
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_time = 0.0
+
+    def wait(self):
+        # type: () -> None
+        if not self._interval:
+            return
+
+        now = time.time()
+        if self._next_time > now:
+            time.sleep(self._next_time - now)
+            now = self._next_time
+        self._next_time = now + self._interval
+
+
+class HostBackoff(object):
+    """
+    Skip hosts that didn't answer discovery probes for an exponentially increasing number of passes.
+
+    Hosts are probed again at the first pass starting `max_backoff` seconds after their last failure at the latest,
+    however long passes are.
+    """
+
+    MAX_SKIPPED_PASSES = 64
+
+    def __init__(self, max_backoff):
+        # type: (float) -> None
+        self._max_backoff = max_backoff
+        self._pass = 0
+        self._pass_start_time = 0.0
+        # {host: (failures, first pass to probe it again, time after which to probe it again)}
+        self._failures = {}  # type: Dict[str, Tuple[int, int, float]]
+
+    def start_pass(self):
+        # type: () -> None
+        self._pass += 1
+        self._pass_start_time = time.time()
+
+    def should_probe(self, host):
+        # type: (str) -> bool
+        entry = self._failures.get(host)
+        return entry is None or self._pass >= entry[1] or self._pass_start_time >= entry[2]
+
+    def record_failure(self, host):
+        # type: (str) -> None
+        failures = self._failures.get(host, (0, 0, 0.0))[0] + 1
+        skipped_passes = min(2 ** (failures - 1), self.MAX_SKIPPED_PASSES)
+        self._failures[host] = (failures, self._pass + skipped_passes + 1, time.time() + self._max_backoff)
+
+    def record_success(self, host):
+        # type: (str) -> None
+        self._failures.pop(host, None)
+
+
+def _probe_host(config, host, check_ref):
+    # type: (InstanceConfig, str, weakref.ref[SnmpCheck]) -> Optional[bool]
+    """
+    Query the sysObjectID of a host and add it to the discovered instances if it matches a profile.
+
+    Return whether the host answered, or None if the check is not running anymore.
+    """
+    check = check_ref()
+    if check is None or not check._running:
+        return None
+
+    host_config = check._build_autodiscovery_config(config.instance, host)
+
+    try:
+        sys_object_oid = check.fetch_sysobject_oid(host_config)
+    except Exception as e:
+        check.log.debug("Error scanning host %s: %s", host, e)
+        return False
+
+    try:
+        profile = check._profile_for_sysobject_oid(sys_object_oid)
+    except ConfigurationError:
+        if not host_config.oid_config.has_oids():
+            check.log.warning("Host %s didn't match a profile for sysObjectID %s", host, sys_object_oid)
+            return True
+    else:
+        host_config.refresh_with_profile(check.profiles[profile])
+        host_config.add_profile_tag(profile)
+
+    config.discovered_instances[host] = host_config
+    return True
+
 
 def discover_instances(config, interval, check_ref):
     # type: (InstanceConfig, float, weakref.ref[SnmpCheck]) -> None
@@ -24,44 +126,61 @@ def discover_instances(config, interval, check_ref):
     the check instance. This way if the agent unschedules the check and deletes
     the reference to the instance, the check is garbage collected properly and
     that function can stop.
+
+    Up to `discovery_workers` hosts are probed concurrently, at most `discovery_probes_per_second` times per second.
+    Hosts that don't answer are skipped for the next passes, with an exponential backoff capped at
+    `discovery_max_backoff` seconds.
     """
+    backoff = HostBackoff(config.discovery_max_backoff)
+    rate_limiter = RateLimiter(config.discovery_probes_per_second)
+    slots = threading.BoundedSemaphore(config.discovery_workers)
+    lock = threading.Lock()
+
+    def on_probe_done(host, future):
+        # type: (str, futures.Future) -> None
+        slots.release()
+        answered = False if future.exception() else future.result()
+        with lock:
+            if answered:
+                backoff.record_success(host)
+            elif answered is not None:
+                backoff.record_failure(host)
 
     while True:
         start_time = time.time()
-        for host in config.network_hosts():
-            check = check_ref()
-            if check is None or not check._running:
-                return
+        last_write_time = start_time
+        written_hosts = list(config.discovered_instances)
+        backoff.start_pass()
 
-            host_config = check._build_autodiscovery_config(config.instance, host)
+        with futures.ThreadPoolExecutor(max_workers=config.discovery_workers) as executor:
+            for host in config.network_hosts():
+                with lock:
+                    if not backoff.should_probe(host):
+                        continue
 
-            try:
-                sys_object_oid = check.fetch_sysobject_oid(host_config)
-            except Exception as e:
-                check.log.debug("Error scanning host %s: %s", host, e)
-                del check
-                continue
+                slots.acquire()
 
-            try:
-                profile = check._profile_for_sysobject_oid(sys_object_oid)
-            except ConfigurationError:
-                if not host_config.oid_config.has_oids():
-                    check.log.warning("Host %s didn't match a profile for sysObjectID %s", host, sys_object_oid)
-                    del check
-                    continue
-            else:
-                host_config.refresh_with_profile(check.profiles[profile])
-                host_config.add_profile_tag(profile)
+                check = check_ref()
+                if check is None or not check._running:
+                    slots.release()
+                    return
 
-            config.discovered_instances[host] = host_config
+                # Batch cache writes instead of rewriting the cache after every discovered host.
+                hosts = list(config.discovered_instances)
+                if hosts != written_hosts and time.time() - last_write_time >= CACHE_WRITE_INTERVAL:
+                    write_persistent_cache(check.check_id, json.dumps(hosts))
+                    written_hosts = hosts
+                    last_write_time = time.time()
+                del check
 
-            write_persistent_cache(check.check_id, json.dumps(list(config.discovered_instances)))
-            del check
+                rate_limiter.wait()
+                future = executor.submit(_probe_host, config, host, check_ref)
+                future.add_done_callback(functools.partial(on_probe_done, host))
 
         check = check_ref()
         if check is None:
             return
-        # Write again at the end of the loop, in case some host have been removed since last
+        # Write again at the end of the loop, in case some host have been added or removed since last write
         write_persistent_cache(check.check_id, json.dumps(list(config.discovered_instances)))
         del check
 
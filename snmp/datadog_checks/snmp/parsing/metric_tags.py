@@ -11,7 +11,7 @@ from datadog_checks.base import ConfigurationError
 
 from ..models import OID
 from ..pysnmp_types import ObjectIdentity
-from ..resolver import OIDResolver
+from ..resolver import OIDRegistry
 from .parsed_metrics import ParsedMatchMetricTag, ParsedMetricTag, ParsedSimpleMetricTag
 
 SymbolTag = NamedTuple('SymbolTag', [('parsed_metric_tag', ParsedMetricTag), ('symbol', str)])
@@ -20,7 +20,7 @@ ParsedSymbolTagsResult = TypedDict('ParsedSymbolTagsResult', {'oids': List[OID],
 
 
 def parse_symbol_metric_tags(metric_tags, resolver):
-    # type: (List[MetricTag], OIDResolver) -> ParsedSymbolTagsResult
+    # type: (List[MetricTag], OIDRegistry) -> ParsedSymbolTagsResult
     """
     Parse the symbol based `metric_tags` section of a config file, and return OIDs to fetch and metric tags to submit.
     """
@@ -13,7 +13,7 @@ from datadog_checks.base import ConfigurationError
 
 from ..models import OID
 from ..pysnmp_types import ObjectIdentity
-from ..resolver import OIDResolver
+from ..resolver import OIDRegistry
 from .metric_tags import MetricTag, parse_metric_tag
 from .metrics_types import (
     ColumnTableMetricTag,
@@ -34,7 +34,7 @@ ParseMetricsResult = TypedDict(
 
 
 def parse_metrics(metrics, resolver, logger, bulk_threshold=0):
-    # type: (List[Metric], OIDResolver, Optional[Logger], int) -> ParseMetricsResult
+    # type: (List[Metric], OIDRegistry, Optional[Logger], int) -> ParseMetricsResult
     """
     Parse the `metrics` section of a config file, and return OIDs to fetch and metrics to submit.
     """
@@ -2,60 +2,151 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 
-from collections import defaultdict
-from typing import DefaultDict, Dict, List, Optional, Tuple
+import bisect
+import threading
+import weakref
+from collections import OrderedDict, defaultdict
+from typing import Any, DefaultDict, Dict, List, Optional, Tuple
 
 from .models import OID
 from .pysnmp_types import MibViewController
 from .types import OIDMatch
 
+# Maximum number of OIDs resolved using MIBs that are remembered, per MIB view controller.
+MIB_CACHE_SIZE = 10000
 
-class OIDTreeNode(object):
+_mib_caches = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary[MibViewController, LRUCache]
+_mib_caches_lock = threading.Lock()
 
-    __slots__ = ('name', 'children')
 
-    def __init__(self):
-        # type: () -> None
-        self.name = None  # type: Optional[str]
-        self.children = defaultdict(OIDTreeNode)  # type: DefaultDict[int, OIDTreeNode]
+class LRUCache(object):
+    """
+    A thread-safe mapping holding at most `max_size` items, evicting the least recently used ones first.
+    """
+
+    def __init__(self, max_size):
+        # type: (int) -> None
+        self._max_size = max_size
+        self._items = OrderedDict()  # type: OrderedDict[Any, Any]
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        # type: (Any) -> Any
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return None
+            self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        # type: (Any, Any) -> None
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            if len(self._items) > self._max_size:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        # type: () -> int
+        return len(self._items)
+
+
+def get_mib_cache(mib_view_controller):
+    # type: (MibViewController) -> LRUCache
+    """
+    Return the cache of MIB resolutions for a MIB view controller, shared by all instances using it.
+    """
+    with _mib_caches_lock:
+        cache = _mib_caches.get(mib_view_controller)
+        if cache is None:
+            cache = _mib_caches[mib_view_controller] = LRUCache(MIB_CACHE_SIZE)
+        return cache
 
 
-class OIDTrie(object):
-    """A trie implementation to store OIDs and efficiently match prefixes.
+class OIDIndex(object):
+    """
+    An immutable index of OIDs, to efficiently match prefixes.
 
-    We use it to do basic MIB-like resolution.
+    OIDs are stored as a sorted list of int tuples, and looked up using binary search. This is much more compact
+    than a trie of Python objects, and can be shared by all the instances using the same profile.
     """
 
-    def __init__(self):
-        # type: () -> None
-        self._root = OIDTreeNode()
+    __slots__ = ('_oids', '_names', 'index_mappings')
+
+    def __init__(self, names, index_mappings=None):
+        # type: (Dict[Tuple[int, ...], str], Dict[str, Dict[int, Dict[int, str]]]) -> None
+        self._oids = sorted(names)
+        self._names = [names[oid] for oid in self._oids]
+        self.index_mappings = {} if index_mappings is None else index_mappings
 
-    def set(self, parts, name):
-        # type: (Tuple[int, ...], str) -> None
-        node = self._root
-        for part in parts:
-            node = node.children[part]
-        node.name = name
+    def __len__(self):
+        # type: () -> int
+        return len(self._oids)
 
     def match(self, parts):
         # type: (Tuple[int, ...]) -> Tuple[Tuple[int, ...], Optional[str]]
-        node = self._root
-        matched = []
-        name = None
+        """
+        Return the longest OID of the index that is a prefix of `parts`, and its name.
+        """
+        oids = self._oids
+        high = len(oids)
 
-        for part in parts:
-            child = node.children.get(part)
-            if child is None:
+        while high:
+            position = bisect.bisect_right(oids, parts, 0, high) - 1
+            if position < 0:
                 break
-            node = child
-            matched.append(part)
-            if node.name is not None:
-                name = node.name
 
-        return tuple(matched), name
+            oid = oids[position]
+            if parts[: len(oid)] == oid:
+                return oid, self._names[position]
+
+            # Any OID of the index that is a prefix of `parts` sorts before `oid`, and is also a prefix of
+            # the common prefix of `oid` and `parts`.
+            common = 0
+            for part, oid_part in zip(parts, oid):
+                if part != oid_part:
+                    break
+                common += 1
+            parts = parts[:common]
+            high = position
+
+        return (), None
+
+
+class OIDRegistry(object):
+    """
+    Collect the names and index mappings of OIDs, as defined in the configuration, to compile them into an `OIDIndex`.
+    """
+
+    def __init__(self):
+        # type: () -> None
+        self._names = {}  # type: Dict[Tuple[int, ...], str]
+        self._index_resolvers = defaultdict(dict)  # type: DefaultDict[str, Dict[int, Dict[int, str]]]
+
+    def register(self, oid, name):
+        # type: (OID, str) -> None
+        """Register a translation from a name to an OID.
+
+        Corresponds to XXX(1) and XXX(2) in the summary listing of `OIDResolver`.
+        """
+        self._names[oid.as_tuple()] = name
+
+    def register_index(self, tag, index, mapping):
+        # type: (str, int, Dict[int, str]) -> None
+        """Register a mapping for index-based tag translation.
+
+        Corresponds to XXX(3) in the summary listing of `OIDResolver`.
+        """
+        self._index_resolvers[tag][index] = mapping
 
+    def compile(self):
+        # type: () -> OIDIndex
+        return OIDIndex(self._names, {tag: dict(mappings) for tag, mappings in self._index_resolvers.items()})
 
-class OIDResolver(object):
+
+class OIDResolver(OIDRegistry):
     """
     Helper for performing resolution of OIDs when tagging table metrics.
 
@@ -87,29 +178,43 @@ class OIDResolver(object):
 
     def __init__(self, mib_view_controller, enforce_constraints):
         # type: (MibViewController, bool) -> None
+        super(OIDResolver, self).__init__()
         self._mib_view_controller = mib_view_controller
-        self._resolver = OIDTrie()
-        self._index_resolvers = defaultdict(dict)  # type: DefaultDict[str, Dict[int, Dict[int, str]]]
+        self._mib_cache = get_mib_cache(mib_view_controller)
+        self._shared_indexes = []  # type: List[OIDIndex]
+        self._indexes = None  # type: Optional[List[OIDIndex]]
         self._enforce_constraints = enforce_constraints
 
     def register(self, oid, name):
         # type: (OID, str) -> None
-        """Register a translation from a name to an OID.
+        super(OIDResolver, self).register(oid, name)
+        self._indexes = None
 
-        Corresponds to XXX(1) and XXX(2) in the summary listing.
-        """
-        self._resolver.set(oid.as_tuple(), name)
-
-    def register_index(self, tag, index, mapping):
-        # type: (str, int, Dict[int, str]) -> None
-        """Register a mapping for index-based tag translation.
+    def add_index(self, index):
+        # type: (OIDIndex) -> None
+        """Resolve the OIDs of a shared index, usually compiled from a profile.
 
-        Corresponds to XXX(3) in the summary listing.
+        OIDs registered in later indexes take precedence over the ones registered in this resolver.
         """
-        self._index_resolvers[tag][index] = mapping
+        self._shared_indexes.append(index)
+        for tag, mappings in index.index_mappings.items():
+            self._index_resolvers[tag].update(mappings)
+        self._indexes = None
+
+    def _get_indexes(self):
+        # type: () -> List[OIDIndex]
+        indexes = self._indexes
+        if indexes is None:
+            indexes = self._indexes = [self.compile()] + self._shared_indexes
+        return indexes
 
     def _resolve_from_mibs(self, oid):
         # type: (OID) -> OIDMatch
+        parts = oid.as_tuple()
+        match = self._mib_cache.get(parts)
+        if match is not None:
+            return match
+
         if not self._enforce_constraints:
             # if enforce_constraints is false, then MIB resolution has not been done yet
             # so we need to do it manually. We have to specify the mibs that we will need
@@ -118,7 +223,9 @@ class OIDResolver(object):
 
         mib_symbol = oid.get_mib_symbol()
 
-        return OIDMatch(name=mib_symbol.symbol, indexes=mib_symbol.prefix)
+        match = OIDMatch(name=mib_symbol.symbol, indexes=mib_symbol.prefix)
+        self._mib_cache.set(parts, match)
+        return match
 
     def _resolve_tag_index(self, tail, name):
         # type: (Tuple[int, ...], str) -> Tuple[str, ...]
@@ -147,7 +254,7 @@ class OIDResolver(object):
         """Resolve an OID to a name and its indexes.
 
         This will perform either:
-        1. MIB-based resolution, if `oid` doesn't match any registered OID.
+        1. MIB-based resolution, if `oid` doesn't match any registered OID. Results are cached.
         2. Manual resolution, if `oid` matched. In this case, indexes are resolved using any registered mappings.
 
         Returns
@@ -156,7 +263,13 @@ class OIDResolver(object):
         tag_index: a sequence of tag values. k-th item in the sequence corresponds to the k-th entry in `metric_tags`.
         """
         parts = oid.as_tuple()
-        prefix, name = self._resolver.match(parts)
+        prefix = ()  # type: Tuple[int, ...]
+        name = None  # type: Optional[str]
+
+        for index in self._get_indexes():
+            index_prefix, index_name = index.match(parts)
+            if index_name is not None and len(index_prefix) >= len(prefix):
+                prefix, name = index_prefix, index_name
 
         if name is None:
             return self._resolve_from_mibs(oid)
@@ -2,7 +2,6 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 import copy
-import fnmatch
 import functools
 import ipaddress
 import json
@@ -19,6 +18,7 @@ from six import iteritems
 from datadog_checks.base import AgentCheck, ConfigurationError, is_affirmative
 from datadog_checks.base.errors import CheckException
 
+from .async_engine import AsyncCollectionEngine
 from .commands import snmp_bulk, snmp_get, snmp_getnext
 from .compat import read_persistent_cache, write_persistent_cache
 from .config import InstanceConfig
@@ -28,14 +28,16 @@ from .metrics import as_metric_with_forced_type, as_metric_with_inferred_type, t
 from .mibs import MIBLoader
 from .models import OID
 from .parsing import ColumnTag, IndexTag, ParsedMetric, ParsedTableMetric, SymbolTag
-from .pysnmp_types import ObjectIdentity, ObjectType, noSuchInstance, noSuchObject
+from .pysnmp_types import ObjectIdentity, ObjectType
+from .tuning import BulkTuning
 from .utils import (
+    OIDPatternMatcher,
     OIDPrinter,
     batches,
     get_default_profiles,
-    get_profile_definition,
-    oid_pattern_specificity,
+    profile_definitions,
     recursively_expand_base_profiles,
+    reply_invalid,
     transform_index,
 )
 
@@ -44,17 +46,13 @@ DEFAULT_OID_BATCH_SIZE = 10
 _MAX_FETCH_NUMBER = 10 ** 6
 
 
-def reply_invalid(oid):
-    # type: (Any) -> bool
-    return noSuchInstance.isSameTypeWith(oid) or noSuchObject.isSameTypeWith(oid)
-
-
 class SnmpCheck(AgentCheck):
 
     SC_STATUS = 'snmp.can_check'
     _running = True
     _thread = None
     _executor = None
+    _async_engine = None  # type: Optional[AsyncCollectionEngine]
     _NON_REPEATERS = 0
     _MAX_REPETITIONS = 25
     _thread_factory = threading.Thread  # Store as an attribute for easier mocking.
@@ -78,6 +76,7 @@ class SnmpCheck(AgentCheck):
 
         self.profiles = self._load_profiles()
         self.profiles_by_oid = self._get_profiles_mapping()
+        self._profiles_matcher = OIDPatternMatcher(self.profiles_by_oid)
 
         self._config = self._build_config(self.instance)
 
@@ -85,6 +84,10 @@ class SnmpCheck(AgentCheck):
 
         self._submitted_metrics = 0
 
+        # GETBULK parameters learned for each device, see `adaptive_bulk`.
+        self._bulk_tunings = {}  # type: Dict[str, BulkTuning]
+        self._saved_bulk_tunings = None  # type: Optional[Dict[str, Dict[str, Any]]]
+
     def _get_next_fetch_id(self):
         # type: () -> str
         """
@@ -113,18 +116,24 @@ class SnmpCheck(AgentCheck):
         profiles = {}
 
         for name, profile in configured_profiles.items():
-            try:
-                definition = get_profile_definition(profile)
-            except Exception as exc:
-                raise ConfigurationError("Couldn't read profile '{}': {}".format(name, exc))
+            definition_file = profile.get('definition_file')
+            if definition_file is not None:
+                # Definition files are parsed and expanded once, and shared by all the instances.
+                try:
+                    definition = profile_definitions.get(definition_file)
+                except Exception as exc:
+                    raise ConfigurationError("Couldn't read profile '{}': {}".format(name, exc))
+            else:
+                definition = profile['definition']
 
-            try:
-                recursively_expand_base_profiles(definition)
-            except Exception as exc:
-                raise ConfigurationError("Failed to expand base profiles in profile '{}': {}".format(name, exc))
+                try:
+                    recursively_expand_base_profiles(definition)
+                except Exception as exc:
+                    raise ConfigurationError("Failed to expand base profiles in profile '{}': {}".format(name, exc))
 
             profiles[name] = {'definition': definition}
 
+        profile_definitions.save()
         return profiles
 
     def _get_profiles_mapping(self):
@@ -203,7 +212,6 @@ class SnmpCheck(AgentCheck):
         dict[oid/metric_name][row index] = value
         In case of scalar objects, the row index is just 0
         """
-        results = defaultdict(dict)  # type: DefaultDict[str, Dict[Tuple[str, ...], Any]]
         enforce_constraints = config.enforce_constraints
         fetch_id = self._get_next_fetch_id()
 
@@ -224,6 +232,7 @@ class SnmpCheck(AgentCheck):
                     self._MAX_REPETITIONS,
                     enforce_constraints,
                     self.ignore_nonincreasing_oid,
+                    tuning=self._get_bulk_tuning(config),
                 )
                 all_binds.extend(binds)
             except (PySnmpError, CheckException) as e:
@@ -232,6 +241,20 @@ class SnmpCheck(AgentCheck):
                     error = message
                 self.warning(message)
 
+        return self._build_results(config, all_binds, error, fetch_id)
+
+    def _build_results(
+        self,
+        config,  # type: InstanceConfig
+        all_binds,  # type: List[Any]
+        error,  # type: Optional[str]
+        fetch_id,  # type: str
+    ):
+        # type: (...) -> Tuple[Dict[str, Dict[Tuple[str, ...], Any]], List[OID], Optional[str]]
+        """
+        Index the var binds fetched from a device by metric name and row index.
+        """
+        results = defaultdict(dict)  # type: DefaultDict[str, Dict[Tuple[str, ...], Any]]
         scalar_oids = []
         for result_oid, value in all_binds:
             oid = OID(result_oid)
@@ -309,6 +332,66 @@ class SnmpCheck(AgentCheck):
 
         return all_binds, error
 
+    def _bulk_tunings_cache_key(self):
+        # type: () -> str
+        return '{}_bulk_tunings'.format(self.check_id)
+
+    def _load_bulk_tunings(self):
+        # type: () -> None
+        """
+        Load the GETBULK parameters learned for each device by previous runs.
+        """
+        if self._saved_bulk_tunings is not None:
+            return
+
+        self._saved_bulk_tunings = {}
+        cache = read_persistent_cache(self._bulk_tunings_cache_key())
+        if cache:
+            try:
+                self._saved_bulk_tunings = json.loads(cache)
+            except ValueError as e:
+                self.log.debug('Ignoring invalid GETBULK tunings cache: %s', e)
+
+    def _is_configured_host(self, ip):
+        # type: (str) -> bool
+        config = self._config
+        if config.ip_network is not None:
+            try:
+                return ipaddress.ip_address(ip) in config.ip_network
+            except ValueError:
+                return False
+        return config.device is not None and ip == config.device.ip
+
+    def _save_bulk_tunings(self):
+        # type: () -> None
+        saved = self._saved_bulk_tunings or {}
+        # Forget about the devices that aren't part of the configuration anymore.
+        tunings = {ip: tuning for ip, tuning in saved.items() if self._is_configured_host(ip)}
+        for ip, tuning in list(self._bulk_tunings.items()):
+            tunings[ip] = tuning.to_dict()
+
+        if tunings != saved:
+            write_persistent_cache(self._bulk_tunings_cache_key(), json.dumps(tunings))
+            self._saved_bulk_tunings = tunings
+
+    def _get_bulk_tuning(self, config):
+        # type: (InstanceConfig) -> Optional[BulkTuning]
+        if not config.adaptive_bulk or config.device is None:
+            return None
+
+        ip = config.device.ip
+        tuning = self._bulk_tunings.get(ip)
+        if tuning is None:
+            tuning = BulkTuning(self._MAX_REPETITIONS, config.timeout)
+            saved = (self._saved_bulk_tunings or {}).get(ip)
+            if saved is not None:
+                try:
+                    tuning = BulkTuning.from_dict(saved, config.timeout)
+                except (KeyError, TypeError, ValueError) as e:
+                    self.log.debug('Ignoring invalid GETBULK tuning for %s: %s', ip, e)
+            tuning = self._bulk_tunings.setdefault(ip, tuning)
+        return tuning
+
     def fetch_sysobject_oid(self, config):
         # type: (InstanceConfig) -> str
         """Return the sysObjectID of the instance."""
@@ -324,16 +407,12 @@ class SnmpCheck(AgentCheck):
         """
         Return the most specific profile that matches the given sysObjectID.
         """
-        matched_profiles_by_oid = {
-            oid: self.profiles_by_oid[oid] for oid in self.profiles_by_oid if fnmatch.fnmatch(sys_object_oid, oid)
-        }
+        profile = self._profiles_matcher.match(sys_object_oid)
 
-        if not matched_profiles_by_oid:
+        if profile is None:
             raise ConfigurationError('No profile matching sysObjectID {}'.format(sys_object_oid))
 
-        oid = max(matched_profiles_by_oid.keys(), key=lambda oid: oid_pattern_specificity(oid))
-
-        return matched_profiles_by_oid[oid]
+        return profile
 
     def _start_discovery(self):
         # type: () -> None
@@ -363,26 +442,40 @@ class SnmpCheck(AgentCheck):
         self._thread.start()
         self._executor = futures.ThreadPoolExecutor(max_workers=self._config.workers)
 
+    def cancel(self):
+        # type: () -> None
+        """Stop the discovery and close the dispatcher and socket of the asynchronous collection engine."""
+        self._running = False
+        if self._async_engine is not None:
+            self._async_engine.close()
+            self._async_engine = None
+
     def check(self, instance):
         # type: (Dict[str, Any]) -> None
         start_time = time.time()
         self._submitted_metrics = 0
         config = self._config
 
+        if config.adaptive_bulk:
+            self._load_bulk_tunings()
+
         if config.ip_network:
             if self._thread is None:
                 self._start_discovery()
 
-            executor = self._executor
-            if executor is None:
-                raise RuntimeError("Expected executor be set")
+            if config.async_collection:
+                self._check_devices_async(list(config.discovered_instances.items()))
+            else:
+                executor = self._executor
+                if executor is None:
+                    raise RuntimeError("Expected executor be set")
 
-            sent = []
-            for host, discovered in list(config.discovered_instances.items()):
-                future = executor.submit(self._check_device, discovered)
-                sent.append(future)
-                future.add_done_callback(functools.partial(self._on_check_device_done, host))
-            futures.wait(sent)
+                sent = []
+                for host, discovered in list(config.discovered_instances.items()):
+                    future = executor.submit(self._check_device, discovered)
+                    sent.append(future)
+                    future.add_done_callback(functools.partial(self._on_check_device_done, host))
+                futures.wait(sent)
 
             tags = ['network:{}'.format(config.ip_network)]
             tags.extend(config.tags)
@@ -390,6 +483,9 @@ class SnmpCheck(AgentCheck):
         else:
             _, tags = self._check_device(config)
 
+        if config.adaptive_bulk:
+            self._save_bulk_tunings()
+
         # Performance Metrics
         # - for single device, tags contain device specific tags
         # - for network, tags contain network tags, but won't contain individual device tags
@@ -400,8 +496,12 @@ class SnmpCheck(AgentCheck):
 
     def _on_check_device_done(self, host, future):
         # type: (str, futures.Future) -> None
-        config = self._config
         error, _ = future.result()
+        self._update_failing_instances(host, error)
+
+    def _update_failing_instances(self, host, error):
+        # type: (str, Optional[str]) -> None
+        config = self._config
         if error:
             config.failing_instances[host] += 1
             if config.failing_instances[host] >= config.allowed_failures:
@@ -413,8 +513,56 @@ class SnmpCheck(AgentCheck):
             # Reset the counter if not's failing
             config.failing_instances.pop(host, None)
 
-    def _check_device(self, config):
-        # type: (InstanceConfig) -> Tuple[Optional[str], List[str]]
+    def _check_devices_async(self, devices):
+        # type: (List[Tuple[str, InstanceConfig]]) -> None
+        """
+        Fetch the results of all devices at once with the asynchronous engine, then report them.
+
+        Devices that don't have OIDs yet are left to `_check_device`, which resolves their profile first.
+        """
+        if self._async_engine is None:
+            loader = MIBLoader.shared_instance() if self.optimize_mib_memory_usage else MIBLoader()
+            self._async_engine = AsyncCollectionEngine(loader, mibs_path=self.mibs_path, logger=self.log)
+
+        to_fetch = {}
+        for host, config in devices:
+            if config.oid_config.should_reset():
+                config.oid_config.reset()
+            if config.oid_config.has_oids():
+                config.add_uptime_metric()
+                to_fetch[host] = config
+
+        fetched = self._async_engine.fetch(
+            to_fetch,
+            self.oid_batch_size,
+            self.ignore_nonincreasing_oid,
+            self._NON_REPEATERS,
+            self._MAX_REPETITIONS,
+            bulk_tunings={host: self._get_bulk_tuning(config) for host, config in to_fetch.items()},
+        )
+
+        for host, config in devices:
+            device_fetch = None
+            if host in fetched:
+                all_binds, messages = fetched[host]
+                fetch_id = self._get_next_fetch_id()
+                error = None
+                for message in messages:
+                    message = '[{}] Failed to collect some metrics: {}'.format(fetch_id, message)
+                    if not error:
+                        error = message
+                    self.warning(message)
+                device_fetch = (all_binds, error, fetch_id)
+
+            error, _ = self._check_device(config, device_fetch)
+            self._update_failing_instances(host, error)
+
+    def _check_device(
+        self,
+        config,  # type: InstanceConfig
+        device_fetch=None,  # type: Optional[Tuple[List[Any], Optional[str], str]]
+    ):
+        # type: (...) -> Tuple[Optional[str], List[str]]
         # Reset errors
         if config.device is None:
             raise RuntimeError('No device set')  # pragma: no cover
@@ -434,7 +582,11 @@ class SnmpCheck(AgentCheck):
             if config.oid_config.has_oids():
                 self.log.debug('Querying %s', config.device)
                 config.add_uptime_metric()
-                results, scalar_oids, error = self.fetch_results(config)
+                if device_fetch is None:
+                    results, scalar_oids, error = self.fetch_results(config)
+                else:
+                    # Var binds were already fetched by the asynchronous engine.
+                    results, scalar_oids, error = self._build_results(config, *device_fetch)
                 config.oid_config.update_scalar_oids(scalar_oids)
                 tags = self.extract_metric_tags(config.parsed_metric_tags, results)
                 tags.extend(config.tags)
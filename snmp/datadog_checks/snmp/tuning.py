@@ -0,0 +1,91 @@
+# (C) Datadog, Inc. 2020-present
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+from typing import Any, Dict, Optional
+
+# See https://tools.ietf.org/html/rfc3416#section-3
+TOO_BIG = 1
+
+
+class BulkTuning(object):
+    """
+    Tune the `max-repetitions` of the GETBULK requests sent to a device, from the responses it sends back.
+
+    * `tooBig` errors mean the response didn't fit the maximum message size of the device: the number of rows
+      requested is halved, and it becomes the ceiling of the number of rows requested.
+    * When the device returns fewer rows than requested without reaching the end of its MIB view, it truncated
+      its response: we ask for that many rows next time.
+    * Timeouts and slow responses halve the number of rows requested, but don't change the ceiling.
+    * Otherwise, the number of rows requested doubles after each full and fast response, so that large tables
+      are walked in as few round trips as possible. After `CEILING_PROBE_RESPONSES` of those, the ceiling is
+      doubled too, so that a ceiling learned from a transient condition doesn't stick forever.
+    """
+
+    MIN_REPETITIONS = 1
+    MAX_REPETITIONS = 256
+    # Responses taking longer than this fraction of the timeout are considered slow.
+    SLOW_RESPONSE_RATIO = 0.5
+    # Number of full and fast responses after which the ceiling is raised.
+    CEILING_PROBE_RESPONSES = 32
+
+    def __init__(self, max_repetitions, timeout, ceiling=None):
+        # type: (int, float, Optional[int]) -> None
+        self.max_repetitions = self._bound(max_repetitions)
+        self.ceiling = ceiling
+        self._slow_response_time = timeout * self.SLOW_RESPONSE_RATIO
+        self._clean_responses = 0
+
+    def _bound(self, max_repetitions):
+        # type: (int) -> int
+        return min(max(int(max_repetitions), self.MIN_REPETITIONS), self.MAX_REPETITIONS)
+
+    def observe(self, requested, returned, latency, end_of_mib_view=False):
+        # type: (int, int, float, bool) -> None
+        """
+        Record a response containing `returned` rows, received `latency` seconds after asking for `requested` rows.
+
+        `end_of_mib_view` tells whether the last row is an `endOfMibView`: the device returns fewer rows than
+        requested when it reaches the end of its MIB view, without having truncated its response, so such
+        responses are ignored.
+        """
+        if latency > self._slow_response_time:
+            self.record_error()
+        elif returned < requested:
+            if not end_of_mib_view:
+                self._clean_responses = 0
+                self.max_repetitions = self._bound(returned)
+        elif requested >= self.max_repetitions:
+            self._clean_responses += 1
+            if self.ceiling is not None and self._clean_responses >= self.CEILING_PROBE_RESPONSES:
+                self._clean_responses = 0
+                self.ceiling = self._bound(self.ceiling * 2)
+
+            max_repetitions = self._bound(requested * 2)
+            if self.ceiling is not None:
+                max_repetitions = min(max_repetitions, self.ceiling)
+            self.max_repetitions = max_repetitions
+
+    def record_error(self):
+        # type: () -> None
+        """
+        Record a timeout or a slow response.
+        """
+        self._clean_responses = 0
+        self.max_repetitions = self._bound(self.max_repetitions // 2)
+
+    def record_too_big(self):
+        # type: () -> None
+        """
+        Record a `tooBig` error.
+        """
+        self.record_error()
+        self.ceiling = self.max_repetitions
+
+    def to_dict(self):
+        # type: () -> Dict[str, Any]
+        return {'max_repetitions': self.max_repetitions, 'ceiling': self.ceiling}
+
+    @classmethod
+    def from_dict(cls, data, timeout):
+        # type: (Dict[str, Any], float) -> BulkTuning
+        return cls(data['max_repetitions'], timeout, ceiling=data.get('ceiling'))
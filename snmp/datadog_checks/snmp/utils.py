@@ -1,13 +1,16 @@
 # (C) Datadog, Inc. 2020-present
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
+import fnmatch
+import json
 import logging
 import os
-from typing import Any, Dict, Iterator, List, Mapping, Sequence, Tuple, Union
+import threading
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
 
 import yaml
 
-from .compat import get_config
+from .compat import get_config, read_persistent_cache, write_persistent_cache
 from .exceptions import CouldNotDecodeOID, SmiError, UnresolvedOID
 from .pysnmp_types import (
     ContextData,
@@ -19,6 +22,7 @@ from .pysnmp_types import (
     endOfMibView,
     lcd,
     noSuchInstance,
+    noSuchObject,
 )
 from .types import T
 
@@ -81,6 +85,121 @@ def _read_profile_definition(definition_file):
         return yaml.safe_load(f)
 
 
+def _get_file_signature(path):
+    # type: (str) -> List[Any]
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return [path, None, None]
+    return [path, stat.st_mtime, stat.st_size]
+
+
+def _encode_mappings(value):
+    # type: (Any) -> Any
+    """
+    Prepare YAML data to be serialized to JSON, preserving the keys of mappings that aren't strings, e.g. in
+    index-based tags mappings.
+    """
+    if isinstance(value, dict):
+        if all(isinstance(key, str) for key in value):
+            return {key: _encode_mappings(item) for key, item in value.items()}
+        return {'__items__': [[key, _encode_mappings(item)] for key, item in value.items()]}
+    if isinstance(value, list):
+        return [_encode_mappings(item) for item in value]
+    return value
+
+
+def _decode_mapping(value):
+    # type: (Dict[str, Any]) -> Dict[Any, Any]
+    if len(value) == 1 and '__items__' in value:
+        return {key: item for key, item in value['__items__']}
+    return value
+
+
+class ProfileDefinitionCache(object):
+    """
+    A process-wide cache of profile definition files, parsed and with their base profiles expanded.
+
+    Entries are invalidated when the modification time or the size of the definition file, or of any base profile
+    it extends, changes. Entries are also kept in the Agent persistent cache, so that the profiles don't need to be
+    parsed again when the Agent restarts.
+
+    Cached definitions are shared by all the check instances, and must not be modified.
+    """
+
+    PERSISTENT_CACHE_KEY = 'snmp_profile_definitions'
+
+    def __init__(self):
+        # type: () -> None
+        # Definition file path -> {'files': signatures of the file and its base profiles, 'definition': ...}
+        self._entries = None  # type: Optional[Dict[str, Dict[str, Any]]]
+        self._modified = False
+        self._lock = threading.RLock()
+
+    def _load(self):
+        # type: () -> Dict[str, Dict[str, Any]]
+        if self._entries is None:
+            self._entries = {}
+            cache = read_persistent_cache(self.PERSISTENT_CACHE_KEY)
+            if cache:
+                try:
+                    self._entries = json.loads(cache, object_hook=_decode_mapping)
+                except ValueError as e:
+                    logger.debug("Ignoring invalid profile definitions cache: %s", e)
+        return self._entries
+
+    def _get_entry(self, path):
+        # type: (str) -> Dict[str, Any]
+        entries = self._load()
+        entry = entries.get(path)
+
+        if entry is not None and all(_get_file_signature(signature[0]) == signature for signature in entry['files']):
+            return entry
+
+        files = [_get_file_signature(path)]
+        with open(path) as f:
+            definition = yaml.safe_load(f)
+
+        extends = definition.get('extends', [])
+        if extends:
+            # Base profiles added to the configuration directory take precedence over built-in ones.
+            files.append(_get_file_signature(_get_profiles_confd_root()))
+
+        bases = [self._get_entry(_resolve_definition_file(filename)) for filename in extends]
+        for base in bases:
+            files.extend(base['files'])
+        _expand_base_profiles(definition, [base['definition'] for base in bases])
+
+        entry = entries[path] = {'files': files, 'definition': definition}
+        self._modified = True
+        return entry
+
+    def get(self, definition_file):
+        # type: (str) -> Dict[str, Any]
+        """
+        Return the definition read from `definition_file`, with its base profiles expanded.
+
+        Raises:
+        * Exception: if the definition file, or any of its base profiles, was not found or is malformed.
+        """
+        with self._lock:
+            return self._get_entry(_resolve_definition_file(definition_file))['definition']
+
+    def save(self):
+        # type: () -> None
+        """
+        Write the definitions parsed since the last call to the persistent cache.
+        """
+        with self._lock:
+            if not self._modified:
+                return
+            self._modified = False
+            write_persistent_cache(self.PERSISTENT_CACHE_KEY, json.dumps(_encode_mappings(self._entries)))
+
+
+profile_definitions = ProfileDefinitionCache()
+
+
 def recursively_expand_base_profiles(definition):
     # type: (Dict[str, Any]) -> None
     """
@@ -92,12 +211,13 @@ def recursively_expand_base_profiles(definition):
     Raises:
     * Exception: if any definition file referred in the 'extends' section was not found or is malformed.
     """
-    extends = definition.get('extends', [])
+    base_definitions = [profile_definitions.get(filename) for filename in definition.get('extends', [])]
+    _expand_base_profiles(definition, base_definitions)
 
-    for filename in extends:
-        base_definition = _read_profile_definition(filename)
-        recursively_expand_base_profiles(base_definition)
 
+def _expand_base_profiles(definition, base_definitions):
+    # type: (Dict[str, Any], List[Dict[str, Any]]) -> None
+    for base_definition in base_definitions:
         base_metrics = base_definition.get('metrics', [])
         existing_metrics = definition.get('metrics', [])
         definition['metrics'] = base_metrics + existing_metrics  # NOTE: base metrics must be added first.
@@ -142,14 +262,14 @@ def _load_default_profiles():
         if _is_abstract_profile(name):
             continue
 
-        definition = _read_profile_definition(path)
         try:
-            recursively_expand_base_profiles(definition)
+            definition = profile_definitions.get(path)
         except Exception:
-            logger.error("Could not expand base profile %s", path)
+            logger.error("Could not load profile %s", path)
             raise
         profiles[name] = {'definition': definition}
 
+    profile_definitions.save()
     return profiles
 
 
@@ -245,6 +365,61 @@ def oid_pattern_specificity(pattern):
     )
 
 
+class OIDPatternMatcher(object):
+    """
+    Find the most specific OID pattern matching an OID, e.g. to match sysObjectIDs with profiles.
+
+    Exact OIDs and patterns of the form `<prefix>.*` are looked up by walking up the prefixes of the OID, so that
+    matching doesn't depend on the number of patterns. Other patterns are matched one by one.
+    """
+
+    def __init__(self, patterns):
+        # type: (Dict[str, str]) -> None
+        self._exact = {}  # type: Dict[str, Tuple[str, str]]
+        self._prefixes = {}  # type: Dict[str, Tuple[str, str]]
+        self._others = []  # type: List[Tuple[str, str]]
+
+        for pattern, value in patterns.items():
+            if not _has_wildcards(pattern):
+                self._exact[pattern] = (pattern, value)
+            elif pattern.endswith('.*') and not _has_wildcards(pattern[:-2]):
+                self._prefixes[pattern[:-2]] = (pattern, value)
+            else:
+                self._others.append((pattern, value))
+
+    def match(self, oid):
+        # type: (str) -> Optional[str]
+        """
+        Return the value associated to the most specific pattern matching `oid`, if any.
+        """
+        matches = []  # type: List[Tuple[str, str]]
+
+        exact = self._exact.get(oid)
+        if exact is not None:
+            matches.append(exact)
+
+        position = oid.rfind('.')
+        while position > 0:
+            prefix = self._prefixes.get(oid[:position])
+            if prefix is not None:
+                matches.append(prefix)
+            position = oid.rfind('.', 0, position)
+
+        for pattern, value in self._others:
+            if fnmatch.fnmatch(oid, pattern):
+                matches.append((pattern, value))
+
+        if not matches:
+            return None
+
+        return max(matches, key=lambda match: oid_pattern_specificity(match[0]))[1]
+
+
+def _has_wildcards(pattern):
+    # type: (str) -> bool
+    return any(char in pattern for char in '*?[')
+
+
 class OIDPrinter(object):
     """Utility class to display OIDs efficiently.
 
@@ -335,6 +510,11 @@ class OIDPrinter(object):
             return '({})'.format(', '.join("'{}'".format(self.oid_str(oid)) for oid in self.oids))
 
 
+def reply_invalid(oid):
+    # type: (Any) -> bool
+    return noSuchInstance.isSameTypeWith(oid) or noSuchObject.isSameTypeWith(oid)
+
+
 def register_device_target(ip, port, timeout, retries, engine, auth_data, context_data):
     # type: (str, int, float, int, SnmpEngine, Any, ContextData) -> str
     """
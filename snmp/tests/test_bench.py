@@ -2,11 +2,15 @@
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
 
+import json
+import socket
+
+import mock
 import pytest
 
 from datadog_checks.snmp import SnmpCheck
 
-from .common import BULK_TABULAR_OBJECTS, TABULAR_OBJECTS, create_check, generate_instance_config
+from .common import BULK_TABULAR_OBJECTS, HOST, TABULAR_OBJECTS, create_check, generate_instance_config
 
 pytestmark = pytest.mark.usefixtures("dd_environment")
 
@@ -61,3 +65,21 @@ def test_oids_cache_bench(refresh_oids_cache_interval, oid_batch_size, benchmark
     check = SnmpCheck('snmp', {'oid_batch_size': oid_batch_size}, [instance])
 
     benchmark.pedantic(check.check, args=(instance,), iterations=1, rounds=5, warmup_rounds=1)
+
+
+@pytest.mark.parametrize('async_collection', [False, True])
+def test_network_collection(async_collection, benchmark):
+    instance = generate_instance_config(BULK_TABULAR_OBJECTS)
+    instance.pop('ip_address')
+    instance['network_address'] = '{}/32'.format(socket.gethostbyname(HOST))
+    instance['bulk_threshold'] = 5
+    instance['async_collection'] = async_collection
+
+    check = SnmpCheck('snmp', {}, [instance])
+    check._thread_factory = lambda **kwargs: mock.Mock()
+    with mock.patch(
+        'datadog_checks.snmp.snmp.read_persistent_cache', return_value=json.dumps([socket.gethostbyname(HOST)])
+    ):
+        check.check(instance)
+
+    benchmark(check.check, instance)
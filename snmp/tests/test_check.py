@@ -3,6 +3,7 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 import ipaddress
+import json
 import logging
 import os
 import socket
@@ -487,6 +488,28 @@ def test_bulk_table(aggregator):
     aggregator.all_metrics_asserted()
 
 
+@mock.patch("datadog_checks.snmp.snmp.write_persistent_cache")
+def test_bulk_table_adaptive(write_mock, aggregator):
+    instance = common.generate_instance_config(common.BULK_TABULAR_OBJECTS)
+    instance['bulk_threshold'] = 5
+    instance['adaptive_bulk'] = True
+    check = common.create_check(instance)
+
+    check.check(instance)
+
+    for symbol in common.BULK_TABULAR_OBJECTS[0]['symbols'] + common.BULK_TABULAR_OBJECTS[1]['symbols']:
+        metric_name = "snmp." + symbol
+        aggregator.assert_metric(metric_name, at_least=1)
+        aggregator.assert_metric_has_tag(metric_name, common.CHECK_TAGS[0], at_least=1)
+    aggregator.assert_metric('snmp.sysUpTimeInstance', count=1)
+    aggregator.assert_service_check("snmp.can_check", status=SnmpCheck.OK, tags=common.CHECK_TAGS, at_least=1)
+
+    # The number of rows requested grew from the default, and was saved for the next runs.
+    tuning = check._bulk_tunings[check._config.device.ip]
+    assert tuning.max_repetitions > SnmpCheck._MAX_REPETITIONS
+    write_mock.assert_called_once_with('_bulk_tunings', json.dumps({check._config.device.ip: tuning.to_dict()}))
+
+
 def test_invalid_metric(aggregator):
     """
     Invalid metrics raise a Warning and a critical service check
@@ -841,6 +864,54 @@ def test_discovery(aggregator):
     aggregator.assert_all_metrics_covered()
 
 
+def test_discovery_async_collection(aggregator):
+    host = socket.gethostbyname(common.HOST)
+    network = ipaddress.ip_network(u'{}/29'.format(host), strict=False).with_prefixlen
+    check_tags = [
+        'snmp_device:{}'.format(host),
+        'snmp_profile:profile1',
+        'autodiscovery_subnet:{}'.format(to_native_string(network)),
+    ]
+    network_tags = ['network:{}'.format(network)]
+
+    instance = {
+        'name': 'snmp_conf',
+        'network_address': to_native_string(network),
+        'port': common.PORT,
+        'community_string': 'public',
+        'retries': 0,
+        'discovery_interval': 0,
+        'async_collection': True,
+    }
+    init_config = {
+        'profiles': {
+            'profile1': {'definition': {'metrics': common.SUPPORTED_METRIC_TYPES, 'sysobjectid': '1.3.6.1.4.1.8072.*'}}
+        }
+    }
+    check = SnmpCheck('snmp', init_config, [instance])
+    try:
+        for _ in range(30):
+            check.check(instance)
+            if 'snmp.IAmAGauge32' in aggregator.metric_names:
+                break
+            time.sleep(1)
+            aggregator.reset()
+    finally:
+        check._running = False
+        del check
+
+    for metric in common.SUPPORTED_METRIC_TYPES:
+        metric_name = "snmp." + metric['name']
+        aggregator.assert_metric(metric_name, tags=check_tags, count=1)
+
+    aggregator.assert_metric('snmp.sysUpTimeInstance')
+    aggregator.assert_metric('snmp.discovered_devices_count', tags=network_tags)
+
+    aggregator.assert_metric('snmp.devices_monitored', metric_type=aggregator.GAUGE, tags=check_tags)
+    common.assert_common_check_run_metrics(aggregator, network_tags)
+    aggregator.assert_all_metrics_covered()
+
+
 @mock.patch("datadog_checks.snmp.snmp.read_persistent_cache")
 def test_discovery_devices_monitored_count(read_mock, aggregator):
     read_mock.return_value = '["192.168.0.1","192.168.0.2"]'
@@ -3,6 +3,7 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 import copy
+import json
 import logging
 import os
 import time
@@ -17,11 +18,17 @@ import yaml
 from datadog_checks.base import ConfigurationError
 from datadog_checks.dev import temp_dir
 from datadog_checks.snmp import SnmpCheck
+from datadog_checks.snmp.async_engine import HostTimings
 from datadog_checks.snmp.config import InstanceConfig
-from datadog_checks.snmp.discovery import discover_instances
+from datadog_checks.snmp.discovery import HostBackoff, RateLimiter, discover_instances
+from datadog_checks.snmp.mibs import MIBLoader
+from datadog_checks.snmp.models import OID
 from datadog_checks.snmp.parsing import ParsedSymbolMetric, ParsedTableMetric
-from datadog_checks.snmp.resolver import OIDTrie
+from datadog_checks.snmp.resolver import LRUCache, OIDIndex, OIDRegistry, OIDResolver, get_mib_cache
+from datadog_checks.snmp.tuning import BulkTuning
 from datadog_checks.snmp.utils import (
+    OIDPatternMatcher,
+    ProfileDefinitionCache,
     _load_default_profiles,
     batches,
     oid_pattern_specificity,
@@ -397,15 +404,59 @@ def test_cache_building(write_mock, read_mock):
     write_mock.assert_called_once_with('', '["192.168.0.1"]')
 
 
-def test_trie():
-    trie = OIDTrie()
-    trie.set((1, 2), 'bar')
-    trie.set((1, 2, 3), 'foo')
-    assert trie.match((1,)) == ((1,), None)
-    assert trie.match((1, 2)) == ((1, 2), 'bar')
-    assert trie.match((1, 2, 3)) == ((1, 2, 3), 'foo')
-    assert trie.match((1, 2, 3, 4)) == ((1, 2, 3), 'foo')
-    assert trie.match((2, 3, 4)) == ((), None)
+def test_oid_index():
+    index = OIDIndex({(1, 2): 'bar', (1, 2, 3): 'foo', (1, 2, 5, 1): 'baz', (1, 3): 'qux'})
+    assert len(index) == 4
+    assert index.match((1,)) == ((), None)
+    assert index.match((1, 2)) == ((1, 2), 'bar')
+    assert index.match((1, 2, 3)) == ((1, 2, 3), 'foo')
+    assert index.match((1, 2, 3, 4)) == ((1, 2, 3), 'foo')
+    assert index.match((1, 2, 4, 1)) == ((1, 2), 'bar')
+    assert index.match((1, 2, 5, 2, 1)) == ((1, 2), 'bar')
+    assert index.match((1, 2, 5, 1, 7)) == ((1, 2, 5, 1), 'baz')
+    assert index.match((1, 4)) == ((), None)
+    assert index.match((2, 3, 4)) == ((), None)
+    assert OIDIndex({}).match((1, 2)) == ((), None)
+
+
+def test_oid_resolver_shared_index():
+    registry = OIDRegistry()
+    registry.register(OID('1.3.6.1.2.1.2.2.1.10'), 'ifInOctets')
+    registry.register_index(tag='ipversion', index=1, mapping={1: 'ipv4', 2: 'ipv6'})
+    registry.register(OID('1.3.6.1.2.1.4.31.3.1.3'), 'ipversion')
+    index = registry.compile()
+
+    mib_view_controller = MIBLoader().get_mib_view_controller()
+    resolvers = [OIDResolver(mib_view_controller, enforce_constraints=False) for _ in range(2)]
+    for resolver in resolvers:
+        resolver.add_index(index)
+    resolvers[1].register(OID('1.3.6.1.2.1.2.2.1.10.1'), 'ifInOctetsFirst')
+
+    for resolver in resolvers:
+        assert resolver.resolve_oid(OID('1.3.6.1.2.1.2.2.1.10.2')) == ('ifInOctets', ('2',))
+        assert resolver.resolve_oid(OID('1.3.6.1.2.1.4.31.3.1.3.2.4')) == ('ipversion', ('ipv6', '4'))
+    assert resolvers[0].resolve_oid(OID('1.3.6.1.2.1.2.2.1.10.1')) == ('ifInOctets', ('1',))
+    assert resolvers[1].resolve_oid(OID('1.3.6.1.2.1.2.2.1.10.1')) == ('ifInOctetsFirst', ())
+
+    # OIDs that didn't match are resolved using MIBs, once for all the resolvers using the same MIBs.
+    mib_cache = get_mib_cache(mib_view_controller)
+    size = len(mib_cache)
+    match = resolvers[0].resolve_oid(OID('1.3.6.1.2.1.1.5.0'))
+    assert len(mib_cache) == size + 1
+    assert resolvers[1].resolve_oid(OID('1.3.6.1.2.1.1.5.0')) is match
+    assert len(mib_cache) == size + 1
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
 
 
 @pytest.mark.parametrize(
@@ -494,6 +545,73 @@ def test_profile_override():
             assert profiles['generic-router'] == {'definition': profile}
 
 
+def test_profile_definition_cache():
+    base = {'metrics': [{'MIB': 'IP-MIB', 'table': 'ipTable', 'symbols': ['ipIn'], 'metric_tags': []}]}
+    profile = {
+        'extends': ['base.yaml'],
+        'metrics': [
+            {
+                'MIB': 'IP-MIB',
+                'table': 'ipSystemStatsTable',
+                'symbols': ['ipSystemStatsHCInReceives'],
+                'metric_tags': [{'tag': 'ipversion', 'index': 1, 'mapping': {0: 'unknown', 1: 'ipv4'}}],
+            }
+        ],
+    }
+
+    with temp_dir() as tmp:
+        with mock_profiles_confd_root(tmp):
+            with open(os.path.join(tmp, 'base.yaml'), 'w') as f:
+                f.write(yaml.safe_dump(base))
+            with open(os.path.join(tmp, 'profile.yaml'), 'w') as f:
+                f.write(yaml.safe_dump(profile))
+
+            cache = ProfileDefinitionCache()
+            with mock.patch('datadog_checks.snmp.utils.read_persistent_cache', return_value=''), mock.patch(
+                'datadog_checks.snmp.utils.write_persistent_cache'
+            ) as write_mock:
+                definition = cache.get('profile.yaml')
+                assert definition['metrics'] == base['metrics'] + profile['metrics']
+                assert cache.get('profile.yaml') is definition
+
+                cache.save()
+                cache.save()
+                assert write_mock.call_count == 1
+                (_, persisted), _ = write_mock.call_args
+
+            # Definitions are read back from the persistent cache, with non-string keys preserved.
+            cache = ProfileDefinitionCache()
+            with mock.patch('datadog_checks.snmp.utils.read_persistent_cache', return_value=persisted), mock.patch(
+                'yaml.safe_load'
+            ) as load_mock:
+                assert cache.get('profile.yaml') == definition
+                load_mock.assert_not_called()
+
+            # Changes to base profiles invalidate the definitions extending them.
+            base['metrics'][0]['symbols'].append('ipOut')
+            with open(os.path.join(tmp, 'base.yaml'), 'w') as f:
+                f.write(yaml.safe_dump(base))
+            assert cache.get('profile.yaml')['metrics'] == base['metrics'] + profile['metrics']
+
+
+def test_oid_pattern_matcher():
+    patterns = {
+        '1.3.6.1.4.1.9.1.1745': 'exact',
+        '1.3.6.1.4.1.9.1.*': 'prefix',
+        '1.3.6.1.4.1.9.*': 'short-prefix',
+        '1.3.6.1.4.1.*.3.1': 'other',
+    }
+    matcher = OIDPatternMatcher(patterns)
+
+    assert matcher.match('1.3.6.1.4.1.9.1.1745') == 'exact'
+    assert matcher.match('1.3.6.1.4.1.9.1.1746') == 'prefix'
+    assert matcher.match('1.3.6.1.4.1.9.2.1') == 'short-prefix'
+    assert matcher.match('1.3.6.1.4.1.10.3.1') == 'other'
+    assert matcher.match('1.3.6.1.4.1.9.3.1') == 'other'
+    assert matcher.match('1.3.6.1.4.1.10.3.2') is None
+    assert matcher.match('1.3.6.1.4.1.9') is None
+
+
 def test_discovery_tags():
     """When specifying a tag on discovery, it doesn't make tags leaks between instances."""
     instance = common.generate_instance_config(common.SUPPORTED_METRIC_TYPES)
@@ -525,6 +643,198 @@ def test_discovery_tags():
     }
 
 
+@mock.patch("datadog_checks.snmp.discovery.write_persistent_cache")
+def test_discovery_concurrent_scan(write_mock):
+    instance = common.generate_instance_config(common.SUPPORTED_METRIC_TYPES)
+    instance.pop('ip_address')
+    instance['network_address'] = '192.168.0.0/29'
+    instance['discovery_workers'] = 3
+
+    check = SnmpCheck('snmp', {}, [instance])
+
+    probes = []
+
+    def mock_fetch(cfg):
+        probes.append(cfg.device.ip)
+        if cfg.device.ip in ('192.168.0.2', '192.168.0.4'):
+            return '1.3.6.1.4.5'
+        raise RuntimeError("Not snmp")
+
+    def mock_write(check_id, hosts):
+        if write_mock.call_count == 3:
+            check._running = False
+
+    check.fetch_sysobject_oid = mock_fetch
+    write_mock.side_effect = mock_write
+
+    discover_instances(check._config, 0, weakref.ref(check))
+
+    assert sorted(check._config.discovered_instances) == ['192.168.0.2', '192.168.0.4']
+    write_mock.assert_any_call('', '["192.168.0.2", "192.168.0.4"]')
+    # Discovered hosts aren't probed again, and failing hosts are skipped on the next pass.
+    failing_hosts = ['192.168.0.{}'.format(i) for i in (1, 3, 5, 6)]
+    assert sorted(probes) == sorted(['192.168.0.2', '192.168.0.4'] + failing_hosts * 2)
+
+
+def test_host_backoff():
+    backoff = HostBackoff(max_backoff=3600)
+    backoff.start_pass()
+    backoff.record_failure('host')
+
+    probed_passes = []
+    for pass_number in range(2, 20):
+        backoff.start_pass()
+        if backoff.should_probe('host'):
+            probed_passes.append(pass_number)
+            backoff.record_failure('host')
+    assert probed_passes == [3, 6, 11]
+
+    backoff.record_success('host')
+    backoff.start_pass()
+    assert backoff.should_probe('host')
+
+
+def test_host_backoff_max_backoff():
+    with mock.patch('datadog_checks.snmp.discovery.time') as time_mock:
+        time_mock.time.return_value = 0
+        backoff = HostBackoff(max_backoff=7200)
+        backoff.start_pass()
+        for _ in range(10):
+            backoff.record_failure('host')
+
+        # Passes every hour, the host is probed again after 2 hours instead of skipping 64 passes
+        probed_passes = []
+        for pass_number in range(1, 6):
+            time_mock.time.return_value = pass_number * 3600
+            backoff.start_pass()
+            if backoff.should_probe('host'):
+                probed_passes.append(pass_number)
+                backoff.record_failure('host')
+        assert probed_passes == [2, 4]
+
+
+def test_rate_limiter():
+    with mock.patch('datadog_checks.snmp.discovery.time') as time_mock:
+        time_mock.time.return_value = 100.0
+        rate_limiter = RateLimiter(rate=4)
+
+        rate_limiter.wait()
+        time_mock.sleep.assert_not_called()
+        rate_limiter.wait()
+        time_mock.sleep.assert_called_once_with(0.25)
+
+    with mock.patch('datadog_checks.snmp.discovery.time') as time_mock:
+        rate_limiter = RateLimiter(rate=0)
+        for _ in range(10):
+            rate_limiter.wait()
+        time_mock.sleep.assert_not_called()
+
+
+def test_bulk_tuning():
+    tuning = BulkTuning(25, timeout=5)
+
+    # Fast and full responses double the number of rows requested.
+    tuning.observe(25, 25, latency=0.1)
+    assert tuning.max_repetitions == 50
+
+    # Truncated responses set the number of rows requested, but responses ending the MIB view don't.
+    tuning.observe(50, 40, latency=0.1)
+    assert tuning.max_repetitions == 40
+    tuning.observe(40, 3, latency=0.1, end_of_mib_view=True)
+    assert tuning.max_repetitions == 40
+    assert tuning.ceiling is None
+
+    # Slow responses and timeouts halve the number of rows requested, without setting a ceiling.
+    tuning.observe(40, 40, latency=4)
+    assert tuning.max_repetitions == 20
+    tuning.record_error()
+    assert tuning.max_repetitions == 10
+    assert tuning.ceiling is None
+
+    for _ in range(10):
+        tuning.record_error()
+    assert tuning.max_repetitions == BulkTuning.MIN_REPETITIONS
+
+    assert BulkTuning(10000, timeout=5).max_repetitions == BulkTuning.MAX_REPETITIONS
+    assert BulkTuning.from_dict(tuning.to_dict(), timeout=5).to_dict() == tuning.to_dict()
+
+
+def test_bulk_tuning_ceiling():
+    tuning = BulkTuning(40, timeout=5)
+
+    # tooBig errors set the ceiling.
+    tuning.record_too_big()
+    assert tuning.max_repetitions == tuning.ceiling == 20
+    for _ in range(BulkTuning.CEILING_PROBE_RESPONSES - 1):
+        tuning.observe(tuning.max_repetitions, tuning.max_repetitions, latency=0.1)
+        assert tuning.max_repetitions == tuning.ceiling == 20
+
+    # The ceiling is raised again after enough full and fast responses.
+    tuning.observe(20, 20, latency=0.1)
+    assert tuning.max_repetitions == tuning.ceiling == 40
+
+    # Timeouts don't lower the ceiling.
+    tuning.record_error()
+    assert tuning.max_repetitions == 20
+    assert tuning.ceiling == 40
+    tuning.observe(20, 20, latency=0.1)
+    assert tuning.max_repetitions == 40
+
+
+@mock.patch("datadog_checks.snmp.snmp.write_persistent_cache")
+@mock.patch("datadog_checks.snmp.snmp.read_persistent_cache")
+def test_bulk_tunings_persistence(read_mock, write_mock):
+    instance = common.generate_instance_config(common.SUPPORTED_METRIC_TYPES)
+    instance['adaptive_bulk'] = True
+    read_mock.return_value = '{"127.0.0.2": {"max_repetitions": 80, "ceiling": 80}}'
+
+    check = SnmpCheck('snmp', {}, [instance])
+    check._load_bulk_tunings()
+    read_mock.assert_called_once_with('_bulk_tunings')
+
+    tuning = check._get_bulk_tuning(check._config)
+    assert tuning.max_repetitions == SnmpCheck._MAX_REPETITIONS
+    check._save_bulk_tunings()
+    # The tuning of the device that isn't configured anymore is dropped.
+    write_mock.assert_called_once_with(
+        '_bulk_tunings',
+        json.dumps({check._config.device.ip: {'max_repetitions': SnmpCheck._MAX_REPETITIONS, 'ceiling': None}}),
+    )
+
+    # Nothing changed since the last write.
+    check._save_bulk_tunings()
+    assert write_mock.call_count == 1
+
+    instance['adaptive_bulk'] = False
+    check = SnmpCheck('snmp', {}, [instance])
+    assert check._get_bulk_tuning(check._config) is None
+
+
+@mock.patch("datadog_checks.snmp.snmp.write_persistent_cache")
+@mock.patch("datadog_checks.snmp.snmp.read_persistent_cache")
+def test_bulk_tunings_persistence_network(read_mock, write_mock):
+    instance = common.generate_instance_config(common.SUPPORTED_METRIC_TYPES)
+    instance.pop('ip_address')
+    instance['network_address'] = '192.168.0.0/29'
+    instance['adaptive_bulk'] = True
+    read_mock.return_value = json.dumps(
+        {
+            '192.168.0.2': {'max_repetitions': 80, 'ceiling': 80},
+            '192.168.1.2': {'max_repetitions': 40, 'ceiling': None},
+            'foo': {'max_repetitions': 40, 'ceiling': None},
+        }
+    )
+
+    check = SnmpCheck('snmp', {}, [instance])
+    check._load_bulk_tunings()
+    check._save_bulk_tunings()
+
+    # Only the devices of the configured network are kept.
+    write_mock.assert_called_once_with(
+        '_bulk_tunings', json.dumps({'192.168.0.2': {'max_repetitions': 80, 'ceiling': 80}})
+    )
+
+
 @mock.patch("datadog_checks.snmp.snmp.read_persistent_cache")
 @mock.patch("threading.Thread")
 def test_cache_loading_tags(thread_mock, read_mock):
@@ -563,6 +873,69 @@ def test_failed_to_collect_metrics():
     assert 'Failed to collect metrics for 127.0.0.123' in check.warnings[0]
 
 
+@mock.patch("datadog_checks.snmp.snmp.read_persistent_cache")
+def test_async_collection_failing_device(read_mock):
+    instance = common.generate_instance_config(common.SUPPORTED_METRIC_TYPES)
+    instance.pop('ip_address')
+    instance['network_address'] = '192.168.0.0/29'
+    instance['async_collection'] = True
+    read_mock.return_value = '["192.168.0.1", "192.168.0.2"]'
+
+    check = SnmpCheck('snmp', {}, [instance])
+    check._thread_factory = lambda **kwargs: mock.Mock()
+
+    error = "No SNMP response received before timeout for device <Device ip='192.168.0.2', port=1161>"
+    with mock.patch(
+        'datadog_checks.snmp.async_engine.AsyncCollectionEngine.fetch',
+        return_value={'192.168.0.1': ([], []), '192.168.0.2': ([], [error])},
+    ) as fetch:
+        check.check(instance)
+
+    devices = fetch.call_args[0][0]
+    assert sorted(devices) == ['192.168.0.1', '192.168.0.2']
+    assert len(check.warnings) == 1
+    assert check.warnings[0].endswith('Failed to collect some metrics: {}'.format(error))
+    assert dict(check._config.failing_instances) == {'192.168.0.2': 1}
+
+    # Cancelling the check closes the engine and stops the discovery
+    engine = check._async_engine
+    with mock.patch.object(engine, 'close') as close:
+        check.cancel()
+    close.assert_called_once_with()
+    assert check._async_engine is None
+    assert not check._running
+
+
+def test_async_requests_per_host_must_be_strictly_positive():
+    instance = common.generate_instance_config(common.SUPPORTED_METRIC_TYPES)
+    instance['async_requests_per_host'] = 0
+    with pytest.raises(ConfigurationError):
+        SnmpCheck('snmp', {}, [instance])
+
+
+def test_host_timings():
+    timings = HostTimings(timeout=5, retries=3)
+    assert timings.timeout == 5
+    assert timings.retries == 3
+
+    for _ in range(10):
+        timings.observe(0.01, timeout=timings.timeout)
+    assert timings.timeout == HostTimings.MIN_TIMEOUT
+
+    timings.observe(1.8, timeout=timings.timeout)  # Ignored, as it was retransmitted.
+    assert timings.timeout == HostTimings.MIN_TIMEOUT
+
+    for _ in range(10):
+        timings.observe(0.9, timeout=timings.timeout)
+    assert HostTimings.MIN_TIMEOUT < timings.timeout <= 5
+
+    timings.record_failure()
+    assert timings.retries == 1
+
+    timings.observe(0.9, timeout=timings.timeout)
+    assert timings.retries == 3
+
+
 @pytest.mark.parametrize(
     "items, size, output",
     [
@@ -4,7 +4,7 @@
 import datetime as dt
 import functools
 import ssl
-from typing import Any, Callable, List, TypeVar, cast
+from typing import Any, Callable, Dict, Iterable, List, TypeVar, cast
 
 from pyVim import connect
 from pyVmomi import SoapAdapter, vim, vmodl
@@ -95,6 +95,12 @@ class VSphereAPI(object):
         self._conn = cast(vim.ServiceInstance, None)
         self.smart_connect()
 
+        # State of the incremental retrieval of the infrastructure, see `get_infrastructure_updates`.
+        self._update_collector = None  # type: Any
+        self._update_view = None  # type: Any
+        self._update_version = ''
+        self._infrastructure_data = {}  # type: Dict[Any, Dict[str, Any]]
+
     def smart_connect(self):
         # type: () -> None
         """
@@ -165,13 +171,9 @@ class VSphereAPI(object):
         """
         return self._conn.content.perfManager.QueryPerfCounterByLevel(collection_level)
 
-    @smart_retry
-    def _get_raw_infrastructure(self):
-        # type: () -> List[vmodl.query.PropertyCollector.ObjectContent]
-        """Traverse the whole vSphere infrastructure and returns the list of raw pyvmomi MOR objects with
-        the required pre-fetched attributes."""
-        content = self._conn.content  # vim.ServiceInstanceContent reference from the connection
-
+    def _build_infrastructure_filter_spec(self, view_ref):
+        # type: (vim.view.ContainerView) -> vmodl.query.PropertyCollector.FilterSpec
+        """Build the spec of the properties to retrieve for all the objects of a container view."""
         property_specs = []
         # Specify which attributes we want to retrieve per object
         for resource in ALL_RESOURCES:
@@ -192,24 +194,34 @@ class VSphereAPI(object):
         traversal_spec.skip = False
         traversal_spec.type = vim.view.ContainerView
 
-        retr_opts = vmodl.query.PropertyCollector.RetrieveOptions()
-        # To limit the number of objects retrieved per call.
-        # If batch_collector_size is 0, collect maximum number of objects.
-        retr_opts.maxObjects = self.config.batch_collector_size
-
         # Specify the root object from where we collect the rest of the objects
         obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
+        obj_spec.obj = view_ref
         obj_spec.skip = True
         obj_spec.selectSet = [traversal_spec]
 
         # Create our filter spec from the above specs
         filter_spec = vmodl.query.PropertyCollector.FilterSpec()
         filter_spec.propSet = property_specs
+        filter_spec.objectSet = [obj_spec]
+
+        return filter_spec
+
+    @smart_retry
+    def _get_raw_infrastructure(self):
+        # type: () -> List[vmodl.query.PropertyCollector.ObjectContent]
+        """Traverse the whole vSphere infrastructure and returns the list of raw pyvmomi MOR objects with
+        the required pre-fetched attributes."""
+        content = self._conn.content  # vim.ServiceInstanceContent reference from the connection
+
+        retr_opts = vmodl.query.PropertyCollector.RetrieveOptions()
+        # To limit the number of objects retrieved per call.
+        # If batch_collector_size is 0, collect maximum number of objects.
+        retr_opts.maxObjects = self.config.batch_collector_size
 
         view_ref = content.viewManager.CreateContainerView(content.rootFolder, ALL_RESOURCES, True)
         try:
-            obj_spec.obj = view_ref
-            filter_spec.objectSet = [obj_spec]
+            filter_spec = self._build_infrastructure_filter_spec(view_ref)
 
             # Collect the objects and their properties
             res = content.propertyCollector.RetrievePropertiesEx([filter_spec], retr_opts)
@@ -260,25 +272,119 @@ class VSphereAPI(object):
         infrastructure_data[root_folder] = {"name": root_folder.name, "parent": None}
 
         if self.config.should_collect_attributes:
-            # Clean up attributes in infrastructure_data,
-            # at this point they are custom pyvmomi objects and the attribute keys are not resolved.
+            self._format_attributes(itervalues(infrastructure_data))
+        return cast(InfrastructureData, infrastructure_data)
 
-            attribute_keys = {x.key: x.name for x in self._fetch_all_attributes()}
-            for props in itervalues(infrastructure_data):
-                mor_attributes = []
-                if 'customValue' not in props:
+    def _format_attributes(self, all_props):
+        # type: (Iterable[Dict[str, Any]]) -> None
+        """Clean up attributes in infrastructure data,
+        at this point they are custom pyvmomi objects and the attribute keys are not resolved."""
+        attribute_keys = {x.key: x.name for x in self._fetch_all_attributes()}
+        for props in all_props:
+            mor_attributes = []
+            if 'customValue' not in props:
+                continue
+            for attribute in props.pop('customValue'):
+                # The attribute key is always unique
+                attr_key_name = attribute_keys.get(attribute.key)
+                if attr_key_name is None:
+                    self.log.debug("Unable to resolve attribute key with ID: %s", attribute.key)
                     continue
-                for attribute in props.pop('customValue'):
-                    # The attribute key is always unique
-                    attr_key_name = attribute_keys.get(attribute.key)
-                    if attr_key_name is None:
-                        self.log.debug("Unable to resolve attribute key with ID: %s", attribute.key)
+                attr_value = attribute.value
+                mor_attributes.append("{}{}:{}".format(self.config.attr_prefix, attr_key_name, attr_value))
+
+            props['attributes'] = mor_attributes
+
+    def get_infrastructure_updates(self):
+        # type: () -> InfrastructureData
+        """Same as `get_infrastructure`, but only retrieves the changes made to the infrastructure since the last call.
+
+        A property collector filter is kept open on vCenter, and the version-based updates returned by
+        `WaitForUpdatesEx` are applied to the infrastructure data retrieved by previous calls. The first call
+        retrieves the whole infrastructure. If anything fails, the filter is recreated and the whole infrastructure
+        is retrieved again.
+        """
+        try:
+            return self._update_infrastructure()
+        except Exception as e:
+            self.log.warning("Cannot update the infrastructure incrementally, retrieving it entirely again: %s", e)
+            self._destroy_update_collector()
+            self.smart_connect()
+            return self._update_infrastructure()
+
+    def _create_update_collector(self):
+        # type: () -> None
+        content = self._conn.content
+        view_ref = content.viewManager.CreateContainerView(content.rootFolder, ALL_RESOURCES, True)
+        self._update_view = view_ref
+        # Use a dedicated property collector, so that its filter doesn't interfere with other requests.
+        self._update_collector = content.propertyCollector.CreatePropertyCollector()  # type: ignore
+        self._update_collector.CreateFilter(self._build_infrastructure_filter_spec(view_ref), partialUpdates=False)
+        self._update_version = ''
+
+        # Add the root folder entity as it can't be fetched from the property collector.
+        root_folder = content.rootFolder
+        self._infrastructure_data = {root_folder: {"name": root_folder.name, "parent": None}}
+
+    def _destroy_update_collector(self):
+        # type: () -> None
+        for managed_object in (self._update_collector, self._update_view):
+            if managed_object is None:
+                continue
+            try:
+                managed_object.Destroy()
+            except Exception as e:
+                self.log.debug("Unable to destroy %s: %s", managed_object, e)
+
+        self._update_collector = None
+        self._update_view = None
+        self._infrastructure_data = {}
+
+    def _update_infrastructure(self):
+        # type: () -> InfrastructureData
+        if self._update_collector is None:
+            self._create_update_collector()
+
+        wait_options = vmodl.query.PropertyCollector.WaitOptions()  # type: ignore
+        # Return immediately when there are no updates.
+        wait_options.maxWaitSeconds = 0
+        if self.config.batch_collector_size > 0:
+            wait_options.maxObjectUpdates = self.config.batch_collector_size
+
+        infrastructure_data = self._infrastructure_data
+        updated_attributes = []  # type: List[Dict[str, Any]]
+
+        while True:
+            update_set = self._update_collector.WaitForUpdatesEx(self._update_version, wait_options)
+            if update_set is None:
+                break
+
+            for filter_update in update_set.filterSet or []:
+                for object_update in filter_update.objectSet or []:
+                    mor = object_update.obj
+                    if object_update.kind == 'leave':
+                        infrastructure_data.pop(mor, None)
                         continue
-                    attr_value = attribute.value
-                    mor_attributes.append("{}{}:{}".format(self.config.attr_prefix, attr_key_name, attr_value))
 
-                props['attributes'] = mor_attributes
-        return cast(InfrastructureData, infrastructure_data)
+                    # Objects 'enter' the filter with all their properties set, and are 'modify'-ed afterwards.
+                    props = infrastructure_data.setdefault(mor, {})
+                    for change in object_update.changeSet or []:
+                        if change.op in ('remove', 'indirectRemove'):
+                            props.pop(change.name, None)
+                        else:
+                            props[change.name] = change.val
+                            if change.name == 'customValue':
+                                updated_attributes.append(props)
+
+            self._update_version = update_set.version
+            # Large update sets are split in multiple calls.
+            if not update_set.truncated:
+                break
+
+        if updated_attributes and self.config.should_collect_attributes:
+            self._format_attributes(updated_attributes)
+
+        return cast(InfrastructureData, dict(infrastructure_data))
 
     @smart_retry
     def query_metrics(self, query_specs):
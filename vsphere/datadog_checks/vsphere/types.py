@@ -35,6 +35,7 @@ InstanceConfig = TypedDict(
         'excluded_host_tags': List[str],
         'tags': List[str],
         'refresh_infrastructure_cache_interval': int,
+        'incremental_infrastructure_cache': bool,
         'refresh_metrics_metadata_cache_interval': int,
         'resource_filters': List[ResourceFilterConfig],
         'metric_filters': MetricFilterConfig,
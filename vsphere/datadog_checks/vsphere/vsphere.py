@@ -187,7 +187,10 @@ class VSphereCheck(AgentCheck):
         metrics for this mor."""
         self.log.debug("Refreshing the infrastructure cache...")
         t0 = Timer()
-        infrastructure_data = self.api.get_infrastructure()
+        if self.config.incremental_infrastructure_cache:
+            infrastructure_data = self.api.get_infrastructure_updates()
+        else:
+            infrastructure_data = self.api.get_infrastructure()
         self.gauge(
             "datadog.vsphere.refresh_infrastructure_cache.time",
             t0.total(),
@@ -7,7 +7,7 @@ import os
 import re
 
 from mock import MagicMock
-from pyVmomi import vim
+from pyVmomi import vim, vmodl
 from requests import Response
 from six import iteritems
 from tests.common import HERE
@@ -91,6 +91,9 @@ class MockedAPI(object):
 
         return self.infrastructure_data
 
+    def get_infrastructure_updates(self):
+        return self.get_infrastructure()
+
     def query_metrics(self, query_specs):
         if not self.metrics_data:
             metrics_filename = 'metrics_{}.json'.format(self.config.collection_type)
@@ -123,6 +126,72 @@ class MockedAPI(object):
         return self.mock_events
 
 
+class MockedPropertyCollector(object):
+    """A stand-in for a vCenter property collector, returning the given update sets from `WaitForUpdatesEx`.
+
+    Each update set is a list of `(kind, mor, {property: value})` object updates, None if there are no updates,
+    or an exception to raise.
+    Properties set to `REMOVED` are removed from the object.
+    Updates sets are returned one by one, and are truncated if they contain more objects than `maxObjectUpdates`.
+    """
+
+    REMOVED = object()
+
+    def __init__(self, update_sets):
+        self.update_sets = list(update_sets)
+        self.filter_specs = []
+        self.versions = []
+        self.destroyed = False
+
+    def CreateFilter(self, spec, partialUpdates):
+        self.filter_specs.append(spec)
+
+    def WaitForUpdatesEx(self, version, options):
+        self.versions.append(version)
+        if not self.update_sets:
+            return None
+
+        object_updates = self.update_sets[0]
+        if object_updates is None:
+            # No updates.
+            self.update_sets.pop(0)
+            return None
+        if isinstance(object_updates, Exception):
+            self.update_sets.pop(0)
+            raise object_updates
+
+        max_updates = options.maxObjectUpdates or len(object_updates)
+        returned, self.update_sets[0] = object_updates[:max_updates], object_updates[max_updates:]
+        if not self.update_sets[0]:
+            self.update_sets.pop(0)
+
+        property_collector = vmodl.query.PropertyCollector
+        return property_collector.UpdateSet(
+            version=str(len(self.versions)),
+            truncated=bool(object_updates[max_updates:]),
+            filterSet=[
+                property_collector.FilterUpdate(
+                    objectSet=[
+                        property_collector.ObjectUpdate(
+                            kind=kind,
+                            obj=mor,
+                            changeSet=[
+                                property_collector.Change(name=name, op='remove')
+                                if value is self.REMOVED
+                                else property_collector.Change(name=name, op='assign', val=value)
+                                for name, value in iteritems(props)
+                            ],
+                        )
+                        for kind, mor, props in returned
+                    ]
+                )
+            ],
+        )
+
+    def Destroy(self):
+        self.destroyed = True
+
+
 class MockResponse(Response):
     def __init__(self, json_data, status_code):
         super(MockResponse, self).__init__()
@@ -11,6 +11,8 @@ from pyVmomi import SoapAdapter, vim, vmodl
 from datadog_checks.vsphere.api import APIConnectionError, VSphereAPI
 from datadog_checks.vsphere.config import VSphereConfig
 
+from .mocked_api import MockedPropertyCollector
+
 
 def test_ssl_verify_false(realtime_instance):
     realtime_instance['ssl_verify'] = False
@@ -111,6 +113,73 @@ def test_get_infrastructure(realtime_instance):
         container_view.Destroy.assert_called_once()
 
 
+def test_get_infrastructure_updates(realtime_instance):
+    realtime_instance['batch_property_collector_size'] = 2
+    host = vim.HostSystem('host-1')
+    vm1 = vim.VirtualMachine('vm-1')
+    vm2 = vim.VirtualMachine('vm-2')
+    property_collector = MockedPropertyCollector(
+        [
+            [
+                ('enter', host, {'name': 'host1', 'parent': None}),
+                ('enter', vm1, {'name': 'vm1', 'parent': None, 'runtime.host': host}),
+                ('enter', vm2, {'name': 'vm2', 'parent': None, 'runtime.host': host}),
+            ],
+            None,
+            [
+                ('modify', vm1, {'name': 'vm1-renamed', 'runtime.host': MockedPropertyCollector.REMOVED}),
+                ('leave', vm2, {}),
+            ],
+            Exception('Session expired'),
+            [('enter', host, {'name': 'host1', 'parent': None})],
+        ]
+    )
+
+    with patch('datadog_checks.vsphere.api.connect') as connect:
+        config = VSphereConfig(realtime_instance, MagicMock())
+        api = VSphereAPI(config, MagicMock())
+        content = api._conn.content
+        content.propertyCollector.CreatePropertyCollector.return_value = property_collector
+        content.viewManager.CreateContainerView.return_value.__class__ = vim.ManagedObject
+        root_folder = content.rootFolder
+        root_folder.name = 'root-folder'
+
+        # The whole infrastructure is retrieved at first, in multiple calls if needed.
+        assert api.get_infrastructure_updates() == {
+            root_folder: {'name': 'root-folder', 'parent': None},
+            host: {'name': 'host1', 'parent': None},
+            vm1: {'name': 'vm1', 'parent': None, 'runtime.host': host},
+            vm2: {'name': 'vm2', 'parent': None, 'runtime.host': host},
+        }
+        assert property_collector.versions == ['', '1']
+        assert len(property_collector.filter_specs) == 1
+
+        # Only changes are retrieved then.
+        assert api.get_infrastructure_updates() == {
+            root_folder: {'name': 'root-folder', 'parent': None},
+            host: {'name': 'host1', 'parent': None},
+            vm1: {'name': 'vm1', 'parent': None, 'runtime.host': host},
+            vm2: {'name': 'vm2', 'parent': None, 'runtime.host': host},
+        }
+        assert api.get_infrastructure_updates() == {
+            root_folder: {'name': 'root-folder', 'parent': None},
+            host: {'name': 'host1', 'parent': None},
+            vm1: {'name': 'vm1-renamed', 'parent': None},
+        }
+        assert property_collector.versions == ['', '1', '2', '2']
+        content.viewManager.CreateContainerView.return_value.Destroy.assert_not_called()
+
+        # Errors lead to retrieving the whole infrastructure again.
+        assert api.get_infrastructure_updates() == {
+            root_folder: {'name': 'root-folder', 'parent': None},
+            host: {'name': 'host1', 'parent': None},
+        }
+        assert property_collector.versions[4:] == ['4', '']
+        assert property_collector.destroyed
+        assert len(property_collector.filter_specs) == 2
+        assert connect.SmartConnect.call_count == 2
+
+
 @pytest.mark.parametrize(
     'exception, expected_calls',
     [
@@ -21,8 +21,10 @@ from .mocked_api import MockedAPI
 
 
 @pytest.mark.usefixtures("mock_type", "mock_threadpool", "mock_api")
-def test_realtime_metrics(aggregator, dd_run_check, realtime_instance):
+@pytest.mark.parametrize('incremental_infrastructure_cache', [False, True])
+def test_realtime_metrics(aggregator, dd_run_check, realtime_instance, incremental_infrastructure_cache):
     """This test asserts that the same api content always produces the same metrics."""
+    realtime_instance['incremental_infrastructure_cache'] = incremental_infrastructure_cache
     check = VSphereCheck('vsphere', {}, [realtime_instance])
     dd_run_check(check)
 